@@ -28,7 +28,8 @@ import traceback
 import os
 import signal
 from dateutil.parser import parse
-from queue import Queue
+from queue import Queue, Empty
+from threading import Thread
 
 if sys.version_info < (3, 6):
     print("CRITICAL - radiosonde_auto_rx requires Python 3.6 or newer!")
@@ -60,6 +61,19 @@ from autorx.web import (
 )
 from autorx.gpsd import GPSDAdaptor
 from autorx.sdr_wrappers import shutdown_sdr
+from autorx.channelizer import start_channelizer, stop_channelizer
+from autorx.telemetry_bus import TelemetryBus
+from autorx.frequency_prior import FrequencyPrior
+from autorx.peak_cache import NoSondeCache
+from autorx.spectrum import SpectrumAccumulator
+from autorx.scheduler import (
+    record_decision,
+    sdr_score,
+    select_sdr,
+    select_preemption,
+    VALUE_STALE,
+    VALUE_LANDED,
+)
 
 
 # Logging level
@@ -88,12 +102,21 @@ exporter_functions = (
     []
 )  # This list will hold references to the exporter add functions, which will be passed onto the decoders.
 
+# Telemetry bus, which provides a bounded input queue for each exporter.
+telemetry_bus = TelemetryBus()
+
 # Separate reference to the e-mail exporter, as we may want to use this for error notifications.
 email_exporter = None
 
 # GPSDAdaptor Instance, if used.
 gpsd_adaptor = None
 
+# Scanner frequency prior (launch history)
+frequency_prior = None
+
+# Scanner no-sonde cache
+no_sonde_cache = None
+
 # Temporary frequency block list
 # This contains frequncies that should be blocked for a short amount of time.
 temporary_block_list = {}
@@ -101,6 +124,13 @@ temporary_block_list = {}
 # Configuration reload flag
 config_reload_requested = False
 
+# Time (unix timestamp) each frequency was first reported by the scanner, used to measure
+# how long it takes to get a decoder running on a new detection.
+detection_times = {}
+
+# Maximum time (seconds) the task manager will wait for an event before running its periodic checks.
+TASK_MANAGER_HOUSEKEEPING_INTERVAL = 10
+
 
 def signal_handler(signum, frame):
     """Handle system signals"""
@@ -109,6 +139,9 @@ def signal_handler(signum, frame):
     if signum == signal.SIGHUP:
         logging.info("Received SIGHUP signal - requesting configuration reload")
         config_reload_requested = True
+        # Wake up the task manager. This is done from a separate thread, as the main thread may be
+        # holding the event queue's lock when the signal handler runs.
+        Thread(target=autorx.task_events.put, args=(("config_reload", None),)).start()
     elif signum == signal.SIGTERM:
         logging.info("Received SIGTERM signal - shutting down gracefully")
         sys.exit(0)
@@ -138,34 +171,100 @@ def reload_configuration():
         return False
 
 
-def allocate_sdr(check_only=False, task_description=""):
-    """Allocate an un-used SDR for a task.
+def allocate_sdr(check_only=False, task_description="", freq=None):
+    """Allocate the most suitable un-used SDR for a task.
 
     Args:
         check_only (bool) : If True, don't set the free SDR as in-use. Used to check if there are any free SDRs.
+        task_description (str): Description of the task, for logging.
+        freq (float): Sonde frequency (Hz) for a decoder task. Only SDRs whose frequency range covers this
+            frequency will be allocated. Leave as None for the scanner.
 
     Returns:
         (str): The device index/serial number of the free/allocated SDR, if one is free, else None.
     """
 
-    for _idx in sorted(autorx.sdr_list.keys()):
-        if autorx.sdr_list[_idx]["in_use"] == False:
-            # Found a free SDR!
-            if check_only:
-                # If we are just checking to see if there are any SDRs free, we don't allocate it.
-                pass
-            else:
-                # Otherwise, set the SDR as in-use.
-                autorx.sdr_list[_idx]["in_use"] = True
-                logging.info(
-                    "Task Manager - SDR #%s has been allocated to %s."
-                    % (str(_idx), task_description)
-                )
+    (_idx, _score) = select_sdr(autorx.sdr_list, freq=freq)
+
+    if _idx is None:
+        # No suitable SDRs are free.
+        return None
+
+    if not check_only:
+        # Set the SDR as in-use.
+        autorx.sdr_list[_idx]["in_use"] = True
+        logging.info(
+            "Task Manager - SDR #%s has been allocated to %s."
+            % (str(_idx), task_description)
+        )
+        record_decision("allocate", task_description, _idx, "score %.1f" % _score)
+
+    return _idx
+
+
+def preempt_decoder(task_description, freq=None, max_value=VALUE_STALE):
+    """Stop the least valuable running decoder, to free up a SDR for a new task.
+
+    When pre-empting for a new detection, decoders which have landed, or are beyond max_radius_km have their
+    frequency temporarily blocked, so they are not immediately re-detected by the scanner. Frequencies are not
+    blocked when pre-empting to restart the scanner.
+
+    Args:
+        task_description (str): Description of the task the SDR is needed for, for logging.
+        freq (float): Sonde frequency (Hz) the SDR is needed for, or None for the scanner.
+        max_value (int): Only decoders with a value (see autorx.scheduler) at or below this will be pre-empted.
+
+    Returns:
+        (str): The device index/serial number of the freed SDR, or None if no decoder could be pre-empted.
+    """
+    if not config["sdr_preemption"]:
+        return None
+
+    _candidate = select_preemption(
+        autorx.task_list, autorx.sdr_list, config, freq=freq, max_value=max_value
+    )
+    if _candidate is None:
+        return None
+
+    (_key, _value, _reason) = _candidate
+    _task_sdr = autorx.task_list[_key]["device_idx"]
 
-            return _idx
+    logging.info(
+        "Task Manager - Pre-empting decoder on %.3f MHz (%s) to free SDR #%s for %s."
+        % (_key / 1e6, _reason, str(_task_sdr), task_description)
+    )
+    record_decision("preempt", task_description, _task_sdr, "Stopped decoder on %.3f MHz - %s" % (_key / 1e6, _reason))
+
+    autorx.task_list[_key]["task"].stop()
+
+    if (freq is not None) and (_value <= VALUE_LANDED):
+        temporary_block_list[_key] = time.time()
+        if "SCAN" in autorx.task_list:
+            autorx.task_list["SCAN"]["task"].add_temporary_block(_key)
+
+    # Release the decoder's SDR.
+    shutdown_sdr(config["sdr_type"], _task_sdr, sdr_hostname=config["sdr_hostname"], frequency=_key)
+    autorx.sdr_list[_task_sdr]["in_use"] = False
+    autorx.sdr_list[_task_sdr]["task"] = None
+    autorx.task_list.pop(_key)
+    flask_emit_event("task_event")
 
-    # Otherwise, no SDRs are free.
-    return None
+    return _task_sdr
+
+
+def handle_scanner_results(results):
+    """Scanner callback. Pass detections to the task manager, and note when each frequency was detected.
+
+    Args:
+        results (list): List of [frequency (Hz), sonde type] detections.
+    """
+    _now = time.time()
+    for _sonde in results:
+        if _sonde[0] not in detection_times:
+            detection_times[_sonde[0]] = _now
+
+    autorx.scan_results.put(results)
+    autorx.task_events.put(("scan_results", None))
 
 
 def start_scanner():
@@ -191,7 +290,7 @@ def start_scanner():
         # Init Scanner using settings from the global config.
         # TODO: Nicer way of passing in the huge list of args.
         autorx.task_list["SCAN"]["task"] = SondeScanner(
-            callback=autorx.scan_results.put,
+            callback=handle_scanner_results,
             auto_start=True,
             min_freq=config["min_freq"],
             max_freq=config["max_freq"],
@@ -221,13 +320,22 @@ def start_scanner():
             bias=autorx.sdr_list[_device_idx]["bias"],
             save_detection_audio=config["save_detection_audio"],
             wideband_sondes=config["wideband_sondes"],
+            wideband_detection=config["wideband_detection"],
             temporary_block_list=temporary_block_list,
             temporary_block_time=config["temporary_block_time"],
+            frequency_prior=frequency_prior,
+            prior_seeds=config["frequency_prior_seeds"],
+            no_sonde_cache=no_sonde_cache,
+            spectrum=autorx.spectrum_accumulator,
         )
 
         # Add a reference into the sdr_list entry
         autorx.sdr_list[_device_idx]["task"] = autorx.task_list["SCAN"]["task"]
 
+        if not autorx.task_list["SCAN"]["task"].running():
+            # The scanner failed to start, get the task manager to clean it up.
+            autorx.task_events.put(("task_exit", "SCAN"))
+
     # Indicate to the web client that the task list has been updated.
     flask_emit_event("task_event")
 
@@ -251,20 +359,23 @@ def stop_scanner():
         autorx.task_list.pop("SCAN")
 
 
-def start_decoder(freq, sonde_type, continuous=False):
+def start_decoder(freq, sonde_type, continuous=False, detect_time=None):
     """Attempt to start a decoder thread for a given sonde.
 
     Args:
         freq (float): Radiosonde frequency in Hz.
         sonde_type (str): The radiosonde type ('RS41', 'RS92', 'DFM', 'M10, 'iMet')
         continuous (bool): If true, don't use a decode timeout.
+        detect_time (float): Time (unix timestamp) the sonde was detected by the scanner, if known.
+            Used to log the time taken to start the decoder.
 
     """
     global config, RS_PATH, exporter_functions, rs92_ephemeris, temporary_block_list
 
     # Allocate a SDR.
     _device_idx = allocate_sdr(
-        task_description="Decoder (%s, %.3f MHz)" % (sonde_type, freq / 1e6)
+        task_description="Decoder (%s, %.3f MHz)" % (sonde_type, freq / 1e6),
+        freq=freq,
     )
 
     if _device_idx is None:
@@ -272,7 +383,7 @@ def start_decoder(freq, sonde_type, continuous=False):
         return
     else:
         # Add an entry to the task list
-        autorx.task_list[freq] = {"device_idx": _device_idx, "task": None}
+        autorx.task_list[freq] = {"device_idx": _device_idx, "task": None, "continuous": continuous}
 
         # Set the SDR to in-use
         autorx.sdr_list[_device_idx]["in_use"] = True
@@ -317,26 +428,56 @@ def start_decoder(freq, sonde_type, continuous=False):
         )
         autorx.sdr_list[_device_idx]["task"] = autorx.task_list[freq]["task"]
 
+        if not autorx.task_list[freq]["task"].running():
+            # The decoder failed to start, get the task manager to clean it up.
+            autorx.task_events.put(("task_exit", freq))
+
+        if detect_time is not None:
+            _latency = time.time() - detect_time
+            autorx.decoder_start_latency.append(
+                {"time": time.time(), "freq": freq, "type": sonde_type, "latency": _latency}
+            )
+            logging.info(
+                "Task Manager - Decoder (%s, %.3f MHz) started %.2f seconds after detection."
+                % (sonde_type, freq / 1e6, _latency)
+            )
+
     # Indicate to the web client that the task list has been updated.
     flask_emit_event("task_event")
 
 
+def log_decoder_start_latency():
+    """Log a summary of the recent detection to decoder-start latencies."""
+    _latencies = [_entry["latency"] for _entry in autorx.decoder_start_latency]
+
+    if len(_latencies) == 0:
+        return
+
+    _latencies.sort()
+    logging.info(
+        "Task Manager - Detection to decoder start latency over last %d decoders: median %.2f s, max %.2f s"
+        % (len(_latencies), _latencies[len(_latencies) // 2], _latencies[-1])
+    )
+
+
 def handle_scan_results():
     """Read in Scan results via the scan results Queue.
 
-    Depending on how many SDRs are available, two things can happen:
-    - If there is a free SDR, allocate it to a decoder.
+    Depending on how many SDRs are available, three things can happen:
+    - If there is a suitable free SDR, allocate it to a decoder.
     - If there is no free SDR, but a scanner is running, stop the scanner and start decoding.
+    - Otherwise, pre-empt a decoder which has landed, is out of range, or has stopped receiving telemetry.
     """
     global config, temporary_block_list
 
-    if autorx.scan_results.qsize() > 0:
+    while autorx.scan_results.qsize() > 0:
         # Grab the latest detections from the scan result queue.
         _scan_data = autorx.scan_results.get()
         for _sonde in _scan_data:
             # Extract frequency & type info
             _freq = _sonde[0]
             _type = _sonde[1]
+            _detect_time = detection_times.pop(_freq, None)
 
             if _freq in autorx.task_list:
                 # Already decoding this sonde, continue.
@@ -421,17 +562,29 @@ def handle_scan_results():
                         temporary_block_list.pop(_freq)
 
 
-                if allocate_sdr(check_only=True) is not None:
+                if allocate_sdr(check_only=True, freq=_freq) is not None:
                     # There is a SDR free! Start the decoder on that SDR
-                    start_decoder(_freq, _type)
+                    start_decoder(_freq, _type, detect_time=_detect_time)
 
-                elif (allocate_sdr(check_only=True) is None) and (
-                    "SCAN" in autorx.task_list
+                elif ("SCAN" in autorx.task_list) and (
+                    sdr_score(autorx.sdr_list[autorx.task_list["SCAN"]["device_idx"]], freq=_freq) is not None
                 ):
                     # We have run out of SDRs, but a scan thread is running.
                     # Stop the scan thread and take that receiver!
+                    record_decision(
+                        "take_scanner",
+                        "Decoder (%s, %.3f MHz)" % (_type, _freq / 1e6),
+                        autorx.task_list["SCAN"]["device_idx"],
+                        "No free SDRs",
+                    )
                     stop_scanner()
-                    start_decoder(_freq, _type)
+                    start_decoder(_freq, _type, detect_time=_detect_time)
+
+                elif preempt_decoder(
+                    "Decoder (%s, %.3f MHz)" % (_type, _freq / 1e6), freq=_freq
+                ) is not None:
+                    # We have freed up a SDR by stopping a less useful decoder.
+                    start_decoder(_freq, _type, detect_time=_detect_time)
                 else:
                     # We have no SDRs free.
                     # TODO: Alert the user that a sonde was detected, but no SDR was available,
@@ -528,13 +681,14 @@ def clean_task_list():
     # Check if there is a scanner thread still running.
     # If not, and if there is a SDR free, start one up again.
     # Also check for a global scan inhibit flag.
-    if (
-        ("SCAN" not in autorx.task_list)
-        and (not autorx.scan_inhibit)
-        and (allocate_sdr(check_only=True) is not None)
-    ):
-        # We have a SDR free, and we are not running a scan thread. Start one.
-        start_scanner()
+    if ("SCAN" not in autorx.task_list) and (not autorx.scan_inhibit):
+        if (allocate_sdr(check_only=True) is None) and config["sdr_preempt_for_scanner"]:
+            # No SDRs free. Free one up if a decoder is tracking a landed or out-of-range sonde.
+            preempt_decoder("Scanner", max_value=VALUE_LANDED)
+
+        if allocate_sdr(check_only=True) is not None:
+            # We have a SDR free, and we are not running a scan thread. Start one.
+            start_scanner()
 
     # Always-on decoders.
     if len(config["always_decode"]) > 0:
@@ -551,12 +705,44 @@ def clean_task_list():
                 continue
             else:
                 # Try and start up a decoder.
-                if (allocate_sdr(check_only=True) is not None):
+                if (allocate_sdr(check_only=True, freq=_freq_hz) is not None):
                     logging.info(f"Task Manager - Starting Always-On Decoder: {_type}, {_freq_hz/1e6:.3f} MHz")
                     start_decoder(_freq_hz, _type, continuous=True)
 
 
 
+def next_temporary_block_expiry():
+    """Get the number of seconds until the next temporary block list entry expires, or None if the list is empty."""
+    if len(temporary_block_list) == 0:
+        return None
+
+    return max(
+        0,
+        min(temporary_block_list.values()) + config["temporary_block_time"] * 60 - time.time(),
+    )
+
+
+def wait_for_task_events(timeout):
+    """Wait for task manager events, and return all that are pending.
+
+    Args:
+        timeout (float): Maximum time to wait for an event, in seconds.
+
+    Returns:
+        list: List of event types received (may be empty if the timeout was reached).
+    """
+    _events = []
+    try:
+        _events.append(autorx.task_events.get(timeout=timeout)[0])
+        # Drain anything else that has arrived, so a burst of events is handled in one pass.
+        while True:
+            _events.append(autorx.task_events.get_nowait()[0])
+    except Empty:
+        pass
+
+    return _events
+
+
 def stop_all():
     """Shut-down all decoders, scanners, and exporters."""
     global exporter_objects
@@ -582,6 +768,9 @@ def stop_all():
     if gpsd_adaptor != None:
         gpsd_adaptor.close()
 
+    # Stop the channelizer last, after all the tasks using it have been stopped.
+    stop_channelizer()
+
 
 def telemetry_filter(telemetry):
     """Filter incoming radiosonde telemetry based on various factors,
@@ -785,7 +974,7 @@ def email_error(message="foo"):
 
 def main():
     """Main Loop"""
-    global config, exporter_objects, exporter_functions, logging_level, rs92_ephemeris, gpsd_adaptor, email_exporter
+    global config, exporter_objects, exporter_functions, logging_level, rs92_ephemeris, gpsd_adaptor, email_exporter, frequency_prior, no_sonde_cache
 
     # Command line arguments.
     parser = argparse.ArgumentParser()
@@ -918,6 +1107,16 @@ def main():
         config = _temp_cfg
         autorx.sdr_list = config["sdr_settings"]
 
+    # If we are using a Channelizer, start it up now, as all the scan and decode tasks will rely on it.
+    if config["sdr_type"] == "Channelizer":
+        start_channelizer(
+            centre_freq=1e6 * (config["min_freq"] + config["max_freq"]) / 2.0,
+            sample_rate=config["channelizer_sample_rate"],
+            rtl_device_idx=config["channelizer_settings"]["device_idx"],
+            ppm=config["channelizer_settings"]["ppm"],
+            gain=config["channelizer_settings"]["gain"],
+            bias=config["channelizer_settings"]["bias"],
+        )
 
     # Apply any logging changes based on configuration file settings.
     if config["save_system_log"]:
@@ -976,15 +1175,35 @@ def main():
     if args.frequency != 0.0:
         config["only_scan"] = [args.frequency]
 
+    # Load the launch history used to prioritise scanner peaks.
+    if config["frequency_prior"]:
+        frequency_prior = FrequencyPrior(logging_path, quantization=config["quantization"])
+
+    # Scan spectrum integration, which persists across scanner restarts.
+    autorx.spectrum_accumulator = SpectrumAccumulator(alpha=config["spectrum_averaging"])
+
+    # Load the record of peaks which have recently been found not to contain a sonde.
+    if config["no_sonde_cache"]:
+        no_sonde_cache = NoSondeCache(
+            logging_path,
+            quantization=config["quantization"],
+            max_backoff=config["no_sonde_max_backoff"] * 60,
+        )
+
     # Start our exporter options
     # Telemetry Logger
     if config["per_sonde_log"]:
         _logger = TelemetryLogger(
             log_directory=logging_path,
-            save_cal_data=config["save_cal_data"]
+            save_cal_data=config["save_cal_data"],
+            save_sidecar=config["save_log_sidecar"]
         )
         exporter_objects.append(_logger)
-        exporter_functions.append(_logger.add)
+        # Give the logger a large buffer (over an hour of telemetry from several sondes), so a slow disk doesn't
+        # lose log entries. The decoders are never held up waiting for the logger.
+        exporter_functions.append(
+            telemetry_bus.subscribe(_logger, maxsize=20000)
+        )
 
     if config["email_enabled"]:
 
@@ -1012,7 +1231,11 @@ def main():
         email_exporter = _email_notification
 
         exporter_objects.append(_email_notification)
-        exporter_functions.append(_email_notification.add)
+        # If the SMTP server stalls, discard the oldest telemetry, so the first frames from any newly detected
+        # sonde (which trigger the launch notifications) are still in the queue when it recovers.
+        exporter_functions.append(
+            telemetry_bus.subscribe(_email_notification, maxsize=100)
+        )
 
     # APRS Uploader
     if config["aprs_enabled"]:
@@ -1046,7 +1269,8 @@ def main():
         )
 
         exporter_objects.append(_aprs)
-        exporter_functions.append(_aprs.add)
+        # The APRS uploader keeps only the latest telemetry per payload, so does not need a queue on the bus.
+        exporter_functions.append(telemetry_bus.subscribe(_aprs))
 
     # OziExplorer
     if config["ozi_enabled"] or config["payload_summary_enabled"]:
@@ -1080,7 +1304,7 @@ def main():
         )
 
         exporter_objects.append(_ozimux)
-        exporter_functions.append(_ozimux.add)
+        exporter_functions.append(telemetry_bus.subscribe(_ozimux, maxsize=100))
 
     # Rotator
     if config["rotator_enabled"]:
@@ -1104,7 +1328,7 @@ def main():
         )
 
         exporter_objects.append(_rotator)
-        exporter_functions.append(_rotator.add)
+        exporter_functions.append(telemetry_bus.subscribe(_rotator))
 
         autorx.rotator_object = _rotator
 
@@ -1125,14 +1349,17 @@ def main():
             user_antenna=config["habitat_uploader_antenna"],
             contact_email=config["sondehub_contact_email"],
             upload_rate=config["sondehub_upload_rate"],
+            max_batch_size=config["sondehub_max_batch_size"],
+            new_sonde_delay=config["sondehub_new_sonde_delay"],
+            spill_path=os.path.join(logging_path, "sondehub_spill.jsonl"),
         )
 
         exporter_objects.append(_sondehub)
-        exporter_functions.append(_sondehub.add)
+        exporter_functions.append(telemetry_bus.subscribe(_sondehub, maxsize=5000))
 
     _web_exporter = WebExporter(max_age=config["web_archive_age"])
     exporter_objects.append(_web_exporter)
-    exporter_functions.append(_web_exporter.add)
+    exporter_functions.append(telemetry_bus.subscribe(_web_exporter))
 
     # GPSD Startup
     if config["gpsd_enabled"]:
@@ -1146,6 +1373,7 @@ def main():
 
     # Note the start time.
     _start_time = time.time()
+    _last_bus_check = time.time()
 
     # If we have been asked to start decoding a specific radiosonde type, we need to start up
     # the decoder immediately, before a scanner thread is started.
@@ -1153,6 +1381,9 @@ def main():
         handle_scan_results()
 
     # Loop.
+    # The task manager is event driven - scan results, tasks exiting, and configuration reload requests are
+    # posted to autorx.task_events and handled as soon as they arrive. We also wake up when the next temporary
+    # block expires, and at least every TASK_MANAGER_HOUSEKEEPING_INTERVAL seconds for the periodic checks below.
     while True:
         # Check for configuration reload request
         global config_reload_requested
@@ -1164,8 +1395,12 @@ def main():
         clean_task_list()
         # Handle any new scan results.
         handle_scan_results()
-        # Sleep a little bit.
-        time.sleep(2)
+
+        # Check for any exporters falling behind.
+        if time.time() > (_last_bus_check + 60):
+            telemetry_bus.log_stats()
+            log_decoder_start_latency()
+            _last_bus_check = time.time()
 
         if len(autorx.sdr_list) == 0:
             # No Functioning SDRs!
@@ -1181,6 +1416,19 @@ def main():
             stop_all()
             sys.exit(2)
 
+        # Wait for something to happen.
+        _wait = TASK_MANAGER_HOUSEKEEPING_INTERVAL
+        _block_expiry = next_temporary_block_expiry()
+        if _block_expiry is not None:
+            # Wake up just after the next block expires, so the block is removed promptly.
+            _wait = min(_wait, _block_expiry + 0.1)
+        if _timeout > 0:
+            _wait = min(_wait, max(0.1, _start_time + _timeout - time.time() + 0.1))
+
+        _events = wait_for_task_events(_wait)
+        if len(_events) > 0:
+            logging.debug("Task Manager - Handling events: %s" % ", ".join(sorted(set(_events))))
+
 
 if __name__ == "__main__":
 
@@ -5,6 +5,7 @@
 #   Copyright (C) 2018  Mark Jessop <vk5qi@rfhead.net>
 #   Released under GNU GPL v3 or later
 #
+from collections import deque
 from queue import Queue
 
 # Now using Semantic Versioning (https://semver.org/)  MAJOR.MINOR.PATCH
@@ -41,11 +42,20 @@ task_list = {}
 
 # Scan result queue.
 scan_results = Queue()
+# Task manager event queue.
+#   Anything which needs the task manager to act (new scan results, a task exiting, a configuration reload request)
+#   puts an (event_type, data) tuple into this queue, which wakes up the task manager's main loop.
+task_events = Queue()
+# Recent detection to decoder-start latencies, as dicts of 'time', 'freq', 'type' and 'latency' (seconds).
+decoder_start_latency = deque(maxlen=100)
 # Global scan inhibit flag, used by web interface.
 scan_inhibit = False
 
 # Rotator object
 rotator_object = None
 
+# Scanner spectrum accumulator (integrated spectrum and waterfall history)
+spectrum_accumulator = None
+
 # Logging Directory
 logging_path = "./log/"
@@ -5,14 +5,14 @@
 #   Copyright (C) 2018  Mark Jessop <vk5qi@rfhead.net>
 #   Released under GNU GPL v3 or later
 #
+import asyncio
 import datetime
 import logging
 import random
 import time
 import traceback
-import socket
-from queue import Queue
-from threading import Thread, Lock
+from collections import OrderedDict
+from threading import Thread
 from . import __version__ as auto_rx_version
 from .utils import strip_sonde_serial
 
@@ -258,13 +258,15 @@ class APRSUploader(object):
     Queued APRS Telemetry Uploader class
     This performs uploads to an APRS-IS server.
 
-    Incoming telemetry packets are fed into queue, which is checked regularly.
-    At a regular interval, the most recent telemetry packet is extracted, and converted to an
-    APRS object format, and then uploaded into APRS-IS.
+    All network activity is handled by a single asyncio event loop, running in its own thread.
+    Incoming telemetry is passed to the event loop without blocking, and only the most recent telemetry
+    for each payload is kept. At a regular interval, the most recent telemetry for each payload is converted
+    to an APRS object format, and queued for upload into APRS-IS.
 
-    If an upload attempt times out, the packet is discarded.
-    If the queue fills up (probably indicating no network connection, and a fast packet downlink rate),
-    it is immediately emptied, to avoid upload of out-of-date packets.
+    A persistent connection to the APRS-IS server is maintained, with automatic reconnection (with backoff)
+    if the connection fails, or if nothing is heard from the server (which sends keepalive comments) for a while.
+    Packets which are waiting for upload are coalesced per object, so a newer position for an object replaces
+    any older position which has not yet been sent, and positions are never discarded just because the queue is long.
 
     Note that this uploader object is intended to handle telemetry from multiple sondes
     """
@@ -284,6 +286,22 @@ class APRSUploader(object):
         "datetime_dt",
     ]
 
+    # Delay before reconnecting after a failed connection attempt (seconds).
+    # This doubles after each consecutive failure, up to RECONNECT_MAX.
+    RECONNECT_MIN = 5
+    RECONNECT_MAX = 300
+
+    # If nothing is received from the server for this long (seconds), assume the connection is dead and reconnect.
+    # APRS-IS servers send a keepalive comment line every 20 seconds or so.
+    KEEPALIVE_TIMEOUT = 120
+
+    # Send a comment line to the server if we have not sent anything for this long (seconds),
+    # to keep the connection (and any NAT state along the way) alive.
+    KEEPALIVE_INTERVAL = 60
+
+    # Key used for the station beacon in the upload queue.
+    STATION_BEACON_KEY = "__station_beacon__"
+
     def __init__(
         self,
         aprs_callsign="N0CALL",
@@ -322,7 +340,7 @@ class APRSUploader(object):
 
             aprsis_host (str): APRS-IS Server to upload packets to.
             aprsis_port (int): APRS-IS TCP port number.
-            aprsis_reconnect (int): Reconnect to the APRS-IS server at least every X minutes. Reconnections will occur when telemetry needs to be sent.
+            aprsis_reconnect (int): Reconnect to the APRS-IS server at least every X minutes.
 
             station_beacon (bool): Enable beaconing of station position.
             station_beacon_rate (int): Time delay between beacon uploads (minutes)
@@ -334,9 +352,9 @@ class APRSUploader(object):
 
             callsign_validity_threshold (int): Only upload telemetry data if the callsign has been observed more than N times. Default = 5
 
-            upload_queue_size (int): Maximum number of sentences to keep in the upload queue. If the queue is filled,
-                it will be emptied (discarding the queue contents).
-            upload_timeout (int): Timeout (Seconds) when performing uploads to APRS-IS. Default: 10 seconds.
+            upload_queue_size (int): Maximum number of packets (one per object) waiting for upload. If this is exceeded,
+                the oldest waiting packet is discarded.
+            upload_timeout (int): Timeout (Seconds) when connecting or performing uploads to APRS-IS. Default: 5 seconds.
 
             inhibit (bool): Inhibit all uploads. Mainly intended for debugging.
 
@@ -372,53 +390,88 @@ class APRSUploader(object):
                 "Using APRS Object Name Override: %s" % self.object_name_override
             )
 
-        # Our two Queues - one to hold sentences to be upload, the other to temporarily hold
-        # input telemetry dictionaries before they are converted and processed.
-        self.aprs_upload_queue = Queue(upload_queue_size)
-        self.input_queue = Queue()
-
         # Dictionary where we store sorted telemetry data for upload when required.
         # Elements will be named after payload IDs, and will contain:
         #   'count' (int): Number of times this callsign has been observed. Uploads will only occur when
         #       this number rises above callsign_validity_threshold.
-        #   'data' (Queue): A queue of telemetry sentences to be uploaded. When the upload timer fires,
-        #       this queue will be dumped, and the most recent telemetry uploaded.
+        #   'latest' (dict): The most recent telemetry for this payload which has not yet been uploaded, or None.
+        # This is only accessed from within the event loop.
         self.observed_payloads = {}
 
+        # Packets waiting to be uploaded, keyed by payload ID (or STATION_BEACON_KEY), in order of queueing.
+        self.upload_queue = OrderedDict()
+
         # Record of when we last uploaded a user station position to Habitat.
         self.last_user_position_upload = 0
 
-        # APRS-IS Socket Object
-        self.aprsis_socket = None
+        # APRS-IS connection state
+        self.aprsis_reader = None
+        self.aprsis_writer = None
         self.aprsis_lastconnect = 0
-        self.aprsis_upload_lock = Lock()
-        # Attempt to connect to the APRS-IS server.
-        # If this fails, we will attempt to re-connect when a packet needs to be uploaded.
-        self.connect()
+        self.aprsis_last_rx = 0
+        self.aprsis_last_tx = 0
+
+        # Start the event loop thread. Everything else happens within the event loop.
+        self.loop = asyncio.new_event_loop()
+        self.stop_event = None
+        self.upload_event = None
 
-        # Start the uploader thread.
         self.upload_thread_running = True
         self.upload_thread = Thread(target=self.aprs_upload_thread)
         self.upload_thread.start()
 
-        # Start the input queue processing thread.
-        self.input_processing_running = True
-        self.input_thread = Thread(target=self.process_queue)
-        self.input_thread.start()
+        self.log_info("APRS Uploader Started.")
 
-        self.timer_thread_running = True
-        self.timer_thread = Thread(target=self.upload_timer)
-        self.timer_thread.start()
+    def aprs_upload_thread(self):
+        """ Run the uploader event loop until close() is called. """
+        self.log_debug("Started APRS Uploader Thread.")
 
-        self.log_info("APRS Uploader Started.")
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_until_complete(self.run())
+        except Exception as e:
+            traceback.print_exc()
+            self.log_error("Uploader event loop failed - %s" % str(e))
+        finally:
+            self.loop.close()
+
+        self.log_debug("Stopped APRS Uploader Thread.")
+
+    async def run(self):
+        """ Main uploader task, which runs the connection, upload and timer tasks until we are asked to stop. """
+        self.stop_event = asyncio.Event()
+        self.upload_event = asyncio.Event()
+
+        if not self.upload_thread_running:
+            # We were closed before the event loop started.
+            return
 
-    def connect(self):
-        """ Connect to an APRS-IS Server """
-        # create socket & connect to server
-        self.aprsis_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.aprsis_socket.settimeout(self.upload_timeout)
+        _tasks = [
+            asyncio.ensure_future(self.connection_task()),
+            asyncio.ensure_future(self.upload_task()),
+            asyncio.ensure_future(self.timer_task()),
+        ]
+
+        await self.stop_event.wait()
+
+        for _task in _tasks:
+            _task.cancel()
+        await asyncio.gather(*_tasks, return_exceptions=True)
+
+        await self.disconnect()
+
+    async def connect(self):
+        """ Connect and log in to an APRS-IS Server
+
+        Returns:
+            bool: True if the connection was successful.
+        """
         try:
-            self.aprsis_socket.connect((self.aprsis_host, self.aprsis_port))
+            (self.aprsis_reader, self.aprsis_writer) = await asyncio.wait_for(
+                asyncio.open_connection(self.aprsis_host, self.aprsis_port),
+                self.upload_timeout,
+            )
+
             # Send logon string
             # _logon = 'user %s pass %s vers VK5QI-AutoRX filter b/%s \r\n' % (self.aprs_callsign, self.aprs_passcode, self.aprs_callsign)
             _logon = "user %s pass %s vers VK5QI-AutoRX\r\n" % (
@@ -426,28 +479,20 @@ class APRSUploader(object):
                 self.aprs_passcode,
             )
             self.log_debug("Logging in: %s" % _logon)
-            self.aprsis_socket.sendall(_logon.encode("ascii"))
+            self.aprsis_writer.write(_logon.encode("ascii"))
 
             # Set packet filters to limit inbound bandwidth.
-            _filter = "#filter p/ZZ\r\n"
-            self.log_debug("Setting Filter: %s" % _filter)
-            self.aprsis_socket.sendall(_filter.encode("ascii"))
-            _filter = "#filter -t/po\r\n"
-            self.log_debug("Setting Filter: %s" % _filter)
-            self.aprsis_socket.sendall(_filter.encode("ascii"))
+            for _filter in ["#filter p/ZZ\r\n", "#filter -t/po\r\n"]:
+                self.log_debug("Setting Filter: %s" % _filter)
+                self.aprsis_writer.write(_filter.encode("ascii"))
 
-            # Wait for login to complete.
-            time.sleep(1)
+            await asyncio.wait_for(self.aprsis_writer.drain(), self.upload_timeout)
 
             # Check response
-            _resp = self.aprsis_socket.recv(1024)
+            _resp = await asyncio.wait_for(self.aprsis_reader.readline(), self.upload_timeout)
+            _resp = _resp.decode("ascii", errors="replace").strip()
 
-            try:
-                _resp = _resp.decode("ascii").strip()
-            except:
-                print(_resp)
-
-            if _resp[0] != "#":
+            if not _resp.startswith("#"):
                 raise IOError("Invalid response from APRS-IS Server: %s" % _resp)
             else:
                 self.log_debug("Server Logon Response: %s" % str(_resp))
@@ -457,48 +502,165 @@ class APRSUploader(object):
                 % (self.aprsis_host, self.aprsis_port)
             )
             self.aprsis_lastconnect = time.time()
+            self.aprsis_last_rx = time.time()
+            self.aprsis_last_tx = time.time()
             return True
 
         except Exception as e:
             self.log_error("Connection to APRS-IS Failed - %s" % str(e))
-            self.aprsis_socket = None
+            await self.disconnect()
             return False
 
-    def flush_rx(self):
-        """ Flush the APRS-IS RX buffer """
+    async def disconnect(self):
+        """ Close APRS-IS connection """
+        _writer = self.aprsis_writer
+        self.aprsis_reader = None
+        self.aprsis_writer = None
+
+        if _writer is None:
+            return
+
         try:
-            _start = time.time()
-            _data = self.aprsis_socket.recv(32768)
-            _dur = time.time() - _start
-            self.log_debug("Incoming data from APRS-IS: %s" % (_data.decode()))
-        except:
-            # Ignore any exceptions from attempting to read the buffer.
-            pass
+            _writer.close()
+            await asyncio.wait_for(_writer.wait_closed(), self.upload_timeout)
+        except Exception as e:
+            self.log_debug("Socket close failed - %s" % str(e))
 
-    def aprsis_upload(self, source, packet, igate=False, retries=5):
-        """ Upload a packet to APRS-IS
+    def connected(self):
+        """ Check if we are currently connected to the APRS-IS server. """
+        return self.aprsis_writer is not None
 
-        Args:
-            source (str): Callsign of the packet source.
-            packet (str): APRS packet to upload.
-            igate (boolean): If True, iGate the packet into APRS-IS
-                (i.e. use the original source call, but add SONDEGATE and our callsign to the path.)
-            retries (int): Number of times to retry uploading.
+    async def connection_task(self):
+        """ Maintain the connection to the APRS-IS server, reconnecting with an increasing delay on failures. """
+        if self.inhibit:
+            return
+
+        _failures = 0
+
+        while True:
+            if not await self.connect():
+                _failures += 1
+                _delay = min(self.RECONNECT_MAX, self.RECONNECT_MIN * 2 ** (_failures - 1))
+                # Add some jitter, so many stations don't all reconnect at once after a server restart.
+                _delay *= random.uniform(0.8, 1.2)
+                self.log_info("Reconnecting in %d seconds." % _delay)
+                await asyncio.sleep(_delay)
+                continue
+
+            _failures = 0
+
+            # Upload anything that was queued while we were disconnected.
+            self.upload_event.set()
+
+            await self.receive_loop()
+            await self.disconnect()
+
+    async def receive_loop(self):
+        """ Read (and discard) data from the APRS-IS server, sending keepalives as required.
+        Returns when the connection needs to be re-established. """
+        while self.connected():
+            try:
+                _line = await asyncio.wait_for(self.aprsis_reader.readline(), 5.0)
+
+                if _line == b"":
+                    self.log_error("Connection closed by server.")
+                    return
+
+                self.aprsis_last_rx = time.time()
+                self.log_debug("Incoming data from APRS-IS: %s" % _line.decode("ascii", errors="replace").strip())
+
+            except asyncio.TimeoutError:
+                pass
+            except Exception as e:
+                self.log_error("Error reading from server - %s" % str(e))
+                return
+
+            _now = time.time()
+
+            if (_now - self.aprsis_last_rx) > self.KEEPALIVE_TIMEOUT:
+                self.log_error(
+                    "Nothing received from server in %d seconds, reconnecting." % self.KEEPALIVE_TIMEOUT
+                )
+                return
+
+            if (_now - self.aprsis_lastconnect) > (self.aprsis_reconnect * 60):
+                self.log_debug("Periodic reconnection to server.")
+                return
+
+            if (_now - self.aprsis_last_tx) > self.KEEPALIVE_INTERVAL:
+                await self.send_line("#keepalive\r\n")
 
+    async def send_line(self, line):
+        """ Send a line to the APRS-IS server.
+
+        Returns:
+            bool: True if the line was sent, False if the connection failed (in which case it is closed).
         """
-        # If we are inhibited, just return immediately.
-        if self.inhibit:
-            self.log_info("Upload Inhibited: %s" % packet)
+        if not self.connected():
+            return False
+
+        try:
+            self.aprsis_writer.write(line.encode("ascii"))
+            await asyncio.wait_for(self.aprsis_writer.drain(), self.upload_timeout)
+            self.aprsis_last_tx = time.time()
             return True
 
-        self.aprsis_upload_lock.acquire()
+        except Exception as e:
+            self.log_error("Upload Error: %s" % str(e))
+            # Closing the connection causes the connection task to reconnect.
+            await self.disconnect()
+            return False
+
+    async def upload_task(self):
+        """ Upload queued packets whenever we are connected. """
+        while True:
+            await self.upload_event.wait()
+            self.upload_event.clear()
+
+            while len(self.upload_queue) > 0:
+                if self.inhibit:
+                    (_key, _packet) = self.upload_queue.popitem(last=False)
+                    self.log_info("Upload Inhibited: %s" % _packet.strip())
+                    continue
+
+                if not self.connected():
+                    # Packets will be uploaded once we reconnect.
+                    break
+
+                (_key, _packet) = self.upload_queue.popitem(last=False)
+
+                if await self.send_line(_packet):
+                    self.log_info("Uploaded to APRS-IS: %s" % _packet.strip())
+                elif _key not in self.upload_queue:
+                    # Put the packet back at the front of the queue, unless a newer one has been queued since.
+                    self.upload_queue[_key] = _packet
+                    self.upload_queue.move_to_end(_key, last=False)
+
+    async def timer_task(self):
+        """ Queue up the latest telemetry for upload, and the station beacon, when they are due. """
+        while True:
+            await asyncio.sleep(1)
+
+            if time.monotonic() > self.next_upload:
+                # Reset upload timer
+                self.next_upload = time.monotonic() + self.upload_time
+                self.queue_payloads()
+
+            if self.station_beacon["enabled"] and self.connected() and (
+                (time.time() - self.last_user_position_upload) > self.station_beacon["rate"] * 60
+            ):
+                self.beacon_station_position()
 
-        # If we have not connected in a long time, reset the APRS-IS connection.
-        if (time.time() - self.aprsis_lastconnect) > (self.aprsis_reconnect * 60):
-            self.disconnect()
-            time.sleep(1)
-            self.connect()
+    def queue_packet(self, key, source, packet, igate=False):
+        """ Queue a packet for upload to APRS-IS, replacing any packet for the same object which is still waiting.
 
+        Args:
+            key (str): Object identifier (i.e. the payload ID).
+            source (str): Callsign of the packet source.
+            packet (str): APRS packet to upload.
+            igate (boolean): If True, iGate the packet into APRS-IS
+                (i.e. use the original source call, but add SONDEGATE and our callsign to the path.)
+        """
         # Generate APRS packet
         if igate:
             # If we are emulating an IGATE, then we need to add in a path, a q-construct, and our own callsign.
@@ -513,52 +675,56 @@ class APRSUploader(object):
             # Otherwise, we are probably just placing an object, usually sourced by our own callsign
             _packet = "%s>APRS:%s\r\n" % (source, packet)
 
-        _attempts = 1
-        while _attempts < retries:
-            try:
-                # Immediately throw exception if we're not connected.
-                # This will trigger a reconnect.
-                if self.aprsis_socket is None:
-                    raise IOError("Socket not connected.")
+        if key in self.upload_queue:
+            self.log_debug("Replacing un-uploaded packet for %s with newer data." % key)
 
-                # Attempt to send the packet.
-                # This will timeout if the socket is locked up.
-                self.aprsis_socket.sendall(_packet.encode("ascii"))
+        self.upload_queue[key] = _packet
 
-                # If OK, return.
-                self.log_info("Uploaded to APRS-IS: %s" % str(_packet).strip())
-                self.aprsis_upload_lock.release()
-                return True
+        while len(self.upload_queue) > self.upload_queue_size:
+            (_old_key, _) = self.upload_queue.popitem(last=False)
+            self.log_warning(
+                "Upload queue full - possible connectivity issue. Discarded packet for %s." % _old_key
+            )
 
-            except Exception as e:
-                # If something broke, forcibly shutdown the socket, then reconnect.
-                self.log_error("Upload Error: %s" % str(e))
+        self.upload_event.set()
 
-                self.log_info("Attempting to reconnect...")
-                self.disconnect()
-                time.sleep(1)
-                self.connect()
+    def queue_payloads(self):
+        """ Convert the latest telemetry for each payload to an APRS packet, and queue it for upload. """
+        for _id in self.observed_payloads.keys():
+            _telem = self.observed_payloads[_id]["latest"]
+            # If no new data, continue...
+            if _telem is None:
+                continue
 
-                _attempts += 1
+            self.observed_payloads[_id]["latest"] = None
 
-        # If we end up here, something has really broken.
-        self.aprsis_upload_lock.release()
-        return False
+            # Convert to a packet.
+            try:
+                (_packet, _call) = telemetry_to_aprs_position(
+                    _telem,
+                    object_name=self.object_name_override,
+                    aprs_comment=self.object_comment,
+                    position_report=self.position_report,
+                )
+            except Exception as e:
+                self.log_error(
+                    "Error converting telemetry to APRS packet - %s" % str(e)
+                )
+                continue
 
-    def disconnect(self):
-        """ Close APRS-IS connection """
-        try:
-            self.aprsis_socket.shutdown(0)
-        except Exception as e:
-            self.log_debug("Socket shutdown failed - %s" % str(e))
+            if _packet is None:
+                continue
 
-        try:
-            self.aprsis_socket.close()
-        except Exception as e:
-            self.log_debug("Socket close failed - %s" % str(e))
+            # If we are uploading position reports, the source call is the generated callsign
+            # usually based on the sonde serial number, and we iGate the position report.
+            # Otherwise, we upload APRS Objects, sourced by our own callsign, but still iGated via us.
+            if self.position_report:
+                self.queue_packet(_id, _call, _packet, igate=True)
+            else:
+                self.queue_packet(_id, self.aprs_callsign, _packet, igate=True)
 
     def beacon_station_position(self):
-        """ Send a station position beacon into APRS-IS """
+        """ Queue a station position beacon for upload into APRS-IS """
         if self.station_beacon["enabled"]:
             if (self.station_beacon["position"][0] == 0.0) and (
                 self.station_beacon["position"][1] == 0.0
@@ -581,153 +747,49 @@ class APRSUploader(object):
             )
 
             # Send the packet as an iGated packet.
-            self.aprsis_upload(self.aprs_callsign, _packet, igate=True)
+            self.queue_packet(self.STATION_BEACON_KEY, self.aprs_callsign, _packet, igate=True)
             self.last_user_position_upload = time.time()
 
     def update_station_position(self, lat, lon, alt):
         """ Update the internal station position record. Used when determining the station position by GPSD """
         self.station_beacon["position"] = (lat, lon, alt)
 
-    def aprs_upload_thread(self):
-        """ Handle uploading of packets to APRS """
-
-        self.log_debug("Started APRS Uploader Thread.")
-
-        while self.upload_thread_running:
-
-            if self.aprs_upload_queue.qsize() > 0:
-                # If the queue is completely full, jump to the most recent telemetry sentence.
-                if self.aprs_upload_queue.qsize() == self.upload_queue_size:
-                    while not self.aprs_upload_queue.empty():
-                        _telem = self.aprs_upload_queue.get()
-
-                    self.log_warning(
-                        "Uploader queue was full - possible connectivity issue."
-                    )
-                else:
-                    # Otherwise, get the first item in the queue.
-                    _telem = self.aprs_upload_queue.get()
-
-                # Convert to a packet.
-                try:
-                    (_packet, _call) = telemetry_to_aprs_position(
-                        _telem,
-                        object_name=self.object_name_override,
-                        aprs_comment=self.object_comment,
-                        position_report=self.position_report,
-                    )
-                except Exception as e:
-                    self.log_error(
-                        "Error converting telemetry to APRS packet - %s" % str(e)
-                    )
-                    _packet = None
-
-                # Attempt to upload it.
-                if _packet is not None:
-
-                    # If we are uploading position reports, the source call is the generated callsign
-                    # usually based on the sonde serial number, and we iGate the position report.
-                    # Otherwise, we upload APRS Objects, sourced by our own callsign, but still iGated via us.
-                    if self.position_report:
-                        self.aprsis_upload(_call, _packet, igate=True)
-                    else:
-                        self.aprsis_upload(self.aprs_callsign, _packet, igate=True)
-
-            else:
-                # Wait for a short time before checking the queue again.
-                time.sleep(0.1)
-
-        self.log_debug("Stopped APRS Uploader Thread.")
+    def handle_telemetry(self, telemetry):
+        """ Handle a telemetry dictionary from the decoders. This is run from within the event loop.
 
-    def upload_timer(self):
-        """ Add packets to the aprs upload queue if it is time for us to upload. """
+        Telemetry is sorted by ID, and only the most recent telemetry for each payload is kept.
+        """
+        _id = telemetry["id"]
 
-        while self.timer_thread_running:
-            if time.monotonic() > self.next_upload:
-                # Time to upload!
-                for _id in self.observed_payloads.keys():
-                    # If no data, continue...
-                    if self.observed_payloads[_id]["data"].empty():
-                        continue
-                    else:
-                        # Otherwise, dump the queue and keep the latest telemetry.
-                        while not self.observed_payloads[_id]["data"].empty():
-                            _telem = self.observed_payloads[_id]["data"].get()
-
-                        # Attept to add it to the habitat uploader queue.
-                        try:
-                            self.aprs_upload_queue.put_nowait(_telem)
-                        except Exception as e:
-                            self.log_error(
-                                "Error adding sentence to queue: %s" % str(e)
-                            )
-
-                # Sleep a second so we don't hit the synchronous upload time again.
-                time.sleep(1)
-
-                # Flush APRS-IS RX buffer
-                self.flush_rx()
+        if _id not in self.observed_payloads:
+            # We haven't seen this ID before, so create a new dictionary entry for it.
+            self.observed_payloads[_id] = {"count": 1, "latest": None}
+            self.log_debug(
+                "New Payload %s. Not observed enough to allow upload." % _id
+            )
+            # However, we don't yet store this telemetry for upload...
+        else:
+            # We have seen this payload before!
+            # Increment the 'seen' counter.
+            self.observed_payloads[_id]["count"] += 1
+
+            # If we have seen this particular ID enough times, keep this telemetry for the next upload.
+            if (
+                self.observed_payloads[_id]["count"]
+                >= self.callsign_validity_threshold
+            ):
+                self.observed_payloads[_id]["latest"] = telemetry
 
-                # Reset upload timer
-                self.next_upload = time.monotonic() + self.upload_time
             else:
-                # Not yet time to upload, wait for a bit.
-                time.sleep(0.1)
-
-    def process_queue(self):
-        """ Process packets from the input queue.
-
-        This thread handles packets from the input queue (provided by the decoders)
-        Packets are sorted by ID, and a dictionary entry is created. 
-
-        """
-
-        while self.input_processing_running:
-            # Process everything in the queue.
-            while self.input_queue.qsize() > 0:
-                # Grab latest telem dictionary.
-                _telem = self.input_queue.get_nowait()
-
-                _id = _telem["id"]
-
-                if _id not in self.observed_payloads:
-                    # We haven't seen this ID before, so create a new dictionary entry for it.
-                    self.observed_payloads[_id] = {"count": 1, "data": Queue()}
-                    self.log_debug(
-                        "New Payload %s. Not observed enough to allow upload." % _id
-                    )
-                    # However, we don't yet add anything to the queue for this payload...
-                else:
-                    # We have seen this payload before!
-                    # Increment the 'seen' counter.
-                    self.observed_payloads[_id]["count"] += 1
-
-                    # If we have seen this particular ID enough times, add the data to the ID's queue.
-                    if (
-                        self.observed_payloads[_id]["count"]
-                        >= self.callsign_validity_threshold
-                    ):
-                        # Add the telemetry to the queue
-                        self.observed_payloads[_id]["data"].put(_telem)
-
-                    else:
-                        self.log_debug(
-                            "Payload ID %s not observed enough to allow upload." % _id
-                        )
-
-            if (time.time() - self.last_user_position_upload) > self.station_beacon[
-                "rate"
-            ] * 60:
-                if self.aprsis_socket != None:
-                    self.beacon_station_position()
-
-            time.sleep(0.1)
+                self.log_debug(
+                    "Payload ID %s not observed enough to allow upload." % _id
+                )
 
     def add(self, telemetry):
-        """ Add a dictionary of telemetry to the input queue. 
+        """ Pass a dictionary of telemetry to the uploader. This never blocks.
 
         Args:
-            telemetry (dict): Telemetry dictionary to add to the input queue.
+            telemetry (dict): Telemetry dictionary to upload.
 
         """
 
@@ -742,37 +804,39 @@ class APRSUploader(object):
                 self.log_error("JSON object missing required field %s" % _field)
                 return
 
-        # Add it to the queue if we are running.
-        if self.input_processing_running:
-            self.input_queue.put(telemetry)
-        else:
-            self.log_error("Processing not running, discarding.")
+        # Pass it to the event loop if we are running.
+        if self.upload_thread_running:
+            try:
+                self.loop.call_soon_threadsafe(self.handle_telemetry, telemetry)
+                return
+            except RuntimeError:
+                # Event loop has been closed.
+                pass
+
+        self.log_error("Processing not running, discarding.")
+
+    def stop_loop(self):
+        """ Ask the event loop to stop. This is run from within the event loop. """
+        if self.stop_event is not None:
+            self.stop_event.set()
 
     def close(self):
-        """ Shutdown uploader and processing threads. """
+        """ Shutdown uploader thread. """
         self.log_debug("Waiting for threads to close...")
-        self.input_processing_running = False
-        self.timer_thread_running = False
         self.upload_thread_running = False
 
-        self.disconnect()
+        try:
+            self.loop.call_soon_threadsafe(self.stop_loop)
+        except RuntimeError:
+            # Event loop has already stopped.
+            pass
 
-        # Wait for all threads to close.
+        # Wait for the thread to close.
         if self.upload_thread is not None:
             self.upload_thread.join(60)
             if self.upload_thread.is_alive():
                 self.log_error("aprs upload thread failed to join")
 
-        if self.timer_thread is not None:
-            self.timer_thread.join(60)
-            if self.timer_thread.is_alive():
-                self.log_error("aprs timer thread failed to join")
-
-        if self.input_thread is not None:
-            self.input_thread.join(60)
-            if self.input_thread.is_alive():
-                self.log_error("aprs input thread failed to join")
-
     def log_debug(self, line):
         """ Helper function to log a debug message with a descriptive heading. 
         Args:
@@ -905,9 +969,7 @@ if __name__ == "__main__":
     test = APRSUploader(
         aprs_callsign="VK5QI", aprs_passcode="23032", aprsis_host="radiosondy.info"
     )
-    test.connect()
 
     time.sleep(5)
-    test.disconnect()
 
     test.close()
@@ -0,0 +1,718 @@
+#!/usr/bin/env python
+#
+#   radiosonde_auto_rx - Telemetry Replay Benchmark
+#
+#   Replays sonde log files (or recorded decoder JSON output) through SondeDecoder.handle_decoder_line
+#   and the full exporter chain, either as fast as possible or at a multiple of real time, with local
+#   stand-in servers for SondeHub, APRS-IS and SMTP. Reports the frame rate, per-stage handling latency,
+#   exporter queue lag and memory usage.
+#
+#   Usage:
+#   python3 -m autorx.benchmark [-h] [-s SPEED] [-n COPIES] [--json] [--type TYPE] [--freq FREQ]
+#                               [--exporters EXPORTERS] [--sidecar] [--tracemalloc] [--output OUTPUT] [-v]
+#                               input [input ...]
+#
+#   e.g. Replay two flights, with 10 copies of each (20 simultaneous sondes), as fast as possible:
+#   python3 -m autorx.benchmark -n 10 log/20240101-000000_S1234567_RS41-SGP_401500_sonde.log log/20240101-010000_DFM-12345678_DFM17_402500_sonde.log
+#
+#   Released under GNU GPL v3 or later
+#
+import argparse
+import json
+import logging
+import os.path
+import resource
+import shutil
+import socketserver
+import tempfile
+import time
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+
+import numpy as np
+
+import autorx
+from autorx.aprs import APRSUploader
+from autorx.decode import SondeDecoder
+from autorx.email_notification import EmailNotification
+from autorx.logger import TelemetryLogger
+from autorx.ozimux import OziUploader
+from autorx.sondehub import SondehubUploader
+from autorx.telemetry_bus import RingBufferQueue, TelemetryBus
+from autorx.utils import parse_iso_datetime
+
+
+# Exporters which can be benchmarked. 'web' requires flask to be installed.
+EXPORTERS = ["logger", "sondehub", "aprs", "email", "ozi", "web"]
+
+# Percentiles to report for latency measurements.
+PERCENTILES = [50, 90, 99]
+
+
+#
+#   Input Data
+#
+
+
+def decoder_type(log_type):
+    """ Convert the sonde type used in a log file name (which is the sonde subtype where one is available,
+    e.g. RS41-SGP, DFM17, iMet-4) into the SondeDecoder sonde type.
+
+    Args:
+        log_type (str): Sonde type from a log file name.
+
+    Returns:
+        str: The decoder sonde type.
+    """
+    if log_type.startswith("RS41"):
+        return "RS41"
+    elif log_type.startswith("DFM") or log_type.startswith("PS"):
+        return "DFM"
+    elif log_type.startswith("iMet-"):
+        return "IMET"
+    elif log_type in ["iMS-100", "RS11G"]:
+        return "MEISEI"
+    else:
+        return log_type
+
+
+def read_log_file_lines(filename):
+    """ Convert a sonde log file into decoder-style JSON lines.
+
+    Args:
+        filename (str): Path to a sonde log file (new-style, with a 'pressure' column).
+
+    Returns:
+        tuple: (sonde_type, frequency_hz, events), where events is a list of (timestamp, line) tuples.
+    """
+    # Log file name format: 20210430-235413_IMET-89F2720A_iMet-4_401999_sonde.log
+    _fields = os.path.basename(filename).split("_")
+    _sonde_type = decoder_type(_fields[2])
+    _freq = float(_fields[3]) * 1e3
+
+    _events = []
+
+    with open(filename, "r") as _f:
+        _header = _f.readline().strip().split(",")
+
+        if "pressure" not in _header:
+            raise ValueError("%s is an old-style log file, which cannot be replayed." % filename)
+
+        _cols = {_name: _i for (_i, _name) in enumerate(_header)}
+
+        for _line in _f:
+            _row = _line.strip().split(",")
+            if len(_row) < len(_header):
+                continue
+
+            _telem = {
+                "frame": int(_row[_cols["frame"]]),
+                "id": _row[_cols["serial"]],
+                "datetime": _row[_cols["timestamp"]],
+                "lat": float(_row[_cols["lat"]]),
+                "lon": float(_row[_cols["lon"]]),
+                "alt": float(_row[_cols["alt"]]),
+                "vel_v": float(_row[_cols["vel_v"]]),
+                "vel_h": float(_row[_cols["vel_h"]]),
+                "heading": float(_row[_cols["heading"]]),
+                "temp": float(_row[_cols["temp"]]),
+                "humidity": float(_row[_cols["humidity"]]),
+                "pressure": float(_row[_cols["pressure"]]),
+                "sats": int(_row[_cols["sats"]]),
+                "batt": float(_row[_cols["batt_v"]]),
+                "version": autorx.__version__,
+            }
+
+            # Sub-types are provided by the RS41, DFM and Meisei decoders, and are logged in the type column.
+            _type = _row[_cols["type"]]
+            if _sonde_type in ["RS41", "MEISEI"]:
+                _telem["subtype"] = _type
+            elif _sonde_type == "DFM":
+                _telem["subtype"] = "0x0:" + _type
+
+            _events.append(
+                (parse_iso_datetime(_telem["datetime"]).timestamp(), json.dumps(_telem))
+            )
+
+    return (_sonde_type, _freq, _events)
+
+
+def read_decoder_json_lines(filename, sonde_type="RS41", freq=401.5e6):
+    """ Read in a file of recorded decoder JSON output (one telemetry frame per line).
+
+    Args:
+        filename (str): Path to the recorded decoder output.
+        sonde_type (str): Sonde type of the decoder which produced the output.
+        freq (float): Frequency of the sonde, in Hz.
+
+    Returns:
+        tuple: (sonde_type, frequency_hz, events), where events is a list of (timestamp, line) tuples.
+    """
+    _events = []
+
+    with open(filename, "r") as _f:
+        for _line in _f:
+            try:
+                _telem = json.loads(_line)
+                _time = parse_iso_datetime(_telem["datetime"]).timestamp()
+            except Exception:
+                continue
+
+            # Replayed data may be from an older decoder build.
+            _telem["version"] = autorx.__version__
+            _events.append((_time, json.dumps(_telem)))
+
+    return (sonde_type, freq, _events)
+
+
+def copy_events(events, copy):
+    """ Produce a copy of a set of replay events with a different sonde ID, to emulate additional simultaneous sondes. """
+    if copy == 0:
+        return events
+
+    _output = []
+    for (_time, _line) in events:
+        _telem = json.loads(_line)
+        _telem["id"] = "%s-%d" % (_telem["id"], copy)
+        _output.append((_time, json.dumps(_telem)))
+
+    return _output
+
+
+#
+#   Local stand-in servers
+#
+
+
+class LocalHTTPSink(object):
+    """ Local HTTP server standing in for the SondeHub API. Accepts (and counts) any PUT or POST request. """
+
+    def __init__(self):
+        self.lock = Lock()
+        self.requests = 0
+        self.bytes = 0
+
+        _sink = self
+
+        class _Handler(BaseHTTPRequestHandler):
+            def handle_upload(self):
+                _length = int(self.headers.get("Content-Length", 0))
+                self.rfile.read(_length)
+                with _sink.lock:
+                    _sink.requests += 1
+                    _sink.bytes += _length
+                self.send_response(200)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            do_PUT = handle_upload
+            do_POST = handle_upload
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def get_stats(self):
+        return {"requests": self.requests, "bytes": self.bytes}
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class LocalLineSink(object):
+    """ Local TCP server standing in for an APRS-IS or SMTP server.
+
+    In 'aprs' mode, a server banner is sent on connection and every received line is counted.
+    In 'smtp' mode, just enough of SMTP is implemented for smtplib to send a message.
+    """
+
+    def __init__(self, mode="aprs"):
+        self.lock = Lock()
+        self.lines = 0
+        self.messages = 0
+        self.connections = 0
+
+        _sink = self
+
+        class _Handler(socketserver.StreamRequestHandler):
+            def reply(self, line):
+                self.wfile.write(line.encode("ascii") + b"\r\n")
+
+            def handle(self):
+                with _sink.lock:
+                    _sink.connections += 1
+
+                if mode == "aprs":
+                    self.reply("# benchmark APRS-IS stand-in")
+                else:
+                    self.reply("220 localhost benchmark SMTP stand-in")
+
+                _in_data = False
+                for _line in self.rfile:
+                    with _sink.lock:
+                        _sink.lines += 1
+
+                    if mode == "aprs":
+                        continue
+
+                    _line = _line.strip()
+                    if _in_data:
+                        if _line == b".":
+                            _in_data = False
+                            with _sink.lock:
+                                _sink.messages += 1
+                            self.reply("250 OK")
+                        continue
+
+                    _command = _line[:4].upper()
+                    if _command == b"DATA":
+                        _in_data = True
+                        self.reply("354 End data with <CR><LF>.<CR><LF>")
+                    elif _command == b"QUIT":
+                        self.reply("221 Bye")
+                        return
+                    else:
+                        self.reply("250 OK")
+
+        self.server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), _Handler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def get_stats(self):
+        return {"connections": self.connections, "lines": self.lines, "messages": self.messages}
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+#
+#   Benchmark
+#
+
+
+def percentiles(values, scale=1.0):
+    """ Summarise a set of measurements.
+
+    Returns:
+        dict: Count, mean, percentiles (p50, p90 etc.) and max of the values, multiplied by scale.
+    """
+    if len(values) == 0:
+        return {"count": 0}
+
+    _values = np.asarray(values) * scale
+    _output = {"count": len(_values), "mean": float(np.mean(_values))}
+    for (_p, _v) in zip(PERCENTILES, np.percentile(_values, PERCENTILES)):
+        _output["p%d" % _p] = float(_v)
+    _output["max"] = float(np.max(_values))
+
+    return _output
+
+
+def current_rss():
+    """ Current resident set size of this process, in MB (Linux only). """
+    try:
+        with open("/proc/self/statm", "r") as _f:
+            return int(_f.read().split()[1]) * resource.getpagesize() / 1e6
+    except Exception:
+        return None
+
+
+def start_exporters(names, log_directory, sinks, station_position, save_sidecar=False):
+    """ Start the requested exporters, pointed at the local stand-in servers, and subscribe them to a telemetry bus.
+    Queue sizes and policies match those used by auto_rx.
+
+    Returns:
+        tuple: (TelemetryBus, list of exporter objects)
+    """
+    _bus = TelemetryBus()
+    _exporters = []
+
+    if "logger" in names:
+        _logger = TelemetryLogger(log_directory=log_directory, save_sidecar=save_sidecar)
+        _bus.subscribe(_logger, maxsize=20000)
+        _exporters.append(_logger)
+
+    if "email" in names:
+        _email = EmailNotification(
+            smtp_server="127.0.0.1",
+            smtp_port=str(sinks["smtp"].port),
+            mail_from="benchmark@localhost",
+            mail_to="benchmark@localhost",
+            mail_subject="<type> Sonde launch detected on <freq>: <id>",
+            mail_nearby_landing_subject="Nearby Radiosonde Landing Detected - <id>",
+            station_position=station_position,
+        )
+        _bus.subscribe(_email, maxsize=100)
+        _exporters.append(_email)
+
+    if "aprs" in names:
+        _aprs = APRSUploader(
+            aprs_callsign="N0CALL",
+            aprsis_host="127.0.0.1",
+            aprsis_port=sinks["aprs"].port,
+            upload_time=30,
+        )
+        _bus.subscribe(_aprs)
+        _exporters.append(_aprs)
+
+    if "ozi" in names:
+        # Send to a local port, which nothing needs to be listening on.
+        _ozi = OziUploader(
+            ozimux_host="127.0.0.1",
+            ozimux_port=55680,
+            payload_summary_host="127.0.0.1",
+            payload_summary_port=55681,
+        )
+        _bus.subscribe(_ozi, maxsize=100)
+        _exporters.append(_ozi)
+
+    if "sondehub" in names:
+        _sondehub = SondehubUploader(
+            upload_rate=15,
+            user_callsign="N0CALL",
+            spill_path=os.path.join(log_directory, "sondehub_spill.jsonl"),
+        )
+        _sondehub.SONDEHUB_URL = "http://127.0.0.1:%d/sondes/telemetry" % sinks["sondehub"].port
+        _sondehub.SONDEHUB_STATION_POSITION_URL = "http://127.0.0.1:%d/listeners" % sinks["sondehub"].port
+        _bus.subscribe(_sondehub, maxsize=5000)
+        _exporters.append(_sondehub)
+
+    if "web" in names:
+        try:
+            from autorx.web import WebExporter
+
+            _web = WebExporter(max_age=60)
+            _bus.subscribe(_web)
+            _exporters.append(_web)
+        except ImportError as e:
+            logging.warning("Benchmark - Could not start the web exporter (%s), skipping." % str(e))
+
+    return (_bus, _exporters)
+
+
+def stop_replay(decoders, exporters):
+    """ Stop the replay decoders and close the exporters. The lists are emptied, so this can safely be called again. """
+    while len(decoders) > 0:
+        try:
+            decoders.pop().stop()
+        except Exception as e:
+            logging.error("Benchmark - Error stopping decoder - %s" % str(e))
+
+    while len(exporters) > 0:
+        try:
+            exporters.pop(0).close()
+        except Exception as e:
+            logging.error("Benchmark - Error closing exporter - %s" % str(e))
+
+
+def wait_for_drain(bus, timeout=60):
+    """ Wait for all exporter queues on the bus to empty.
+
+    Returns:
+        float: Time taken for the queues to drain, in seconds, or None if they did not drain within the timeout.
+    """
+    _start = time.perf_counter()
+    while time.perf_counter() < (_start + timeout):
+        if all(_stats["depth"] == 0 for _stats in bus.get_stats().values()):
+            return time.perf_counter() - _start
+        time.sleep(0.01)
+
+    return None
+
+
+def run_benchmark(inputs, speed=0.0, copies=1, exporters=EXPORTERS, save_sidecar=False, use_tracemalloc=False, drain_timeout=60):
+    """ Replay a set of inputs through the decoder telemetry handling and exporter chain.
+
+    Args:
+        inputs (list): List of (sonde_type, frequency_hz, events) tuples, as produced by read_log_file_lines.
+        speed (float): Replay speed, as a multiple of real time. 0 replays as fast as possible.
+        copies (int): Number of copies of each input to replay simultaneously (each with a different sonde ID).
+        exporters (list): Names of exporters to run, from EXPORTERS.
+        save_sidecar (bool): Enable binary log sidecar files in the logger.
+        use_tracemalloc (bool): Track Python memory allocations (this slows down the benchmark considerably).
+        drain_timeout (float): Maximum time to wait for the exporters to finish processing, in seconds.
+
+    Returns:
+        dict: Benchmark results.
+    """
+    # Keep enough queue lag measurements to cover the whole run.
+    RingBufferQueue.LAG_SAMPLES = 1000000
+
+    _results = {"rss_start_mb": current_rss()}
+
+    if use_tracemalloc:
+        tracemalloc.start()
+
+    _log_directory = tempfile.mkdtemp(prefix="autorx_benchmark_")
+    _sinks = {
+        "sondehub": LocalHTTPSink(),
+        "aprs": LocalLineSink(mode="aprs"),
+        "smtp": LocalLineSink(mode="smtp"),
+    }
+
+    _decoder_objects = []
+    _exporter_objects = []
+
+    try:
+        # Create one replay decoder per input copy, and merge all the events into time order.
+        _events = []
+        _decoders = []
+        _stage_times = {"parse": [], "validate": [], "process": [], "export": []}
+
+        for (_sonde_type, _freq, _input_events) in inputs:
+            for _copy in range(copies):
+                _decoder_index = len(_decoders)
+                _events.extend(
+                    (_time, _decoder_index, _line.encode("ascii"))
+                    for (_time, _line) in copy_events(_input_events, _copy)
+                )
+                _decoders.append((_sonde_type, _freq + _copy * 10e3))
+
+        _events.sort(key=lambda _e: (_e[0], _e[1]))
+
+        if len(_events) == 0:
+            raise ValueError("No telemetry to replay.")
+
+        _first = json.loads(_events[0][2])
+        (_bus, _started) = start_exporters(
+            exporters, _log_directory, _sinks, (_first["lat"], _first["lon"], _first["alt"]), save_sidecar
+        )
+        _exporter_objects.extend(_started)
+
+        for (_sonde_type, _freq) in _decoders:
+            _decoder = SondeDecoder(
+                sonde_type=_sonde_type,
+                sonde_freq=_freq,
+                exporter=_bus.add_functions(),
+                replay=True,
+            )
+
+            if not _decoder.running():
+                raise ValueError("Could not start a replay decoder for sonde type %s." % _sonde_type)
+
+            # Record the time spent in each stage of handling every frame.
+            def _record_timing(parse, validate, process, export, _original=_decoder.update_timing_stats):
+                _stage_times["parse"].append(parse)
+                _stage_times["validate"].append(validate)
+                _stage_times["process"].append(process)
+                _stage_times["export"].append(export)
+                _original(parse, validate, process, export)
+
+            _decoder.update_timing_stats = _record_timing
+            _decoder_objects.append(_decoder)
+
+        logging.info(
+            "Benchmark - Replaying %d frames from %d sondes, exporters: %s"
+            % (len(_events), len(_decoder_objects), ", ".join(exporters))
+        )
+
+        # Replay!
+        _handle_times = []
+        _start = time.perf_counter()
+        _start_time = _events[0][0]
+
+        for (_time, _decoder_index, _line) in _events:
+            if speed > 0:
+                _wait = _start + (_time - _start_time) / speed - time.perf_counter()
+                if _wait > 0:
+                    time.sleep(_wait)
+
+            _t = time.perf_counter()
+            _decoder_objects[_decoder_index].handle_decoder_line(_line)
+            _handle_times.append(time.perf_counter() - _t)
+
+        _feed_time = time.perf_counter() - _start
+        _drain_time = wait_for_drain(_bus, timeout=drain_timeout)
+        _total_time = time.perf_counter() - _start
+
+        _results.update(
+            {
+                "frames": len(_events),
+                "sondes": len(_decoder_objects),
+                "exporters": exporters,
+                "speed": speed,
+                "feed_time": _feed_time,
+                "drain_time": _drain_time,
+                "frames_per_second": len(_events) / _feed_time,
+                "end_to_end_frames_per_second": len(_events) / _total_time,
+                "handle_line_us": percentiles(_handle_times, 1e6),
+                "stages_us": {
+                    _stage: percentiles(_times, 1e6) for (_stage, _times) in _stage_times.items()
+                },
+                "exporter_lag_ms": {},
+                "exporter_queues": _bus.get_stats(),
+            }
+        )
+
+        for (_name, _sub) in _bus.subscribers.items():
+            if _sub["queue"] is not None:
+                _results["exporter_lag_ms"][_name] = percentiles(_sub["queue"].get_lag_samples(), 1e3)
+
+        # Close the exporters before reading the server statistics, so anything they flush on close is counted.
+        stop_replay(_decoder_objects, _exporter_objects)
+
+        _results["servers"] = {_name: _sink.get_stats() for (_name, _sink) in _sinks.items()}
+
+    finally:
+        # Make sure the exporter threads are stopped even if the replay failed, or we won't exit.
+        stop_replay(_decoder_objects, _exporter_objects)
+
+        for _sink in _sinks.values():
+            _sink.stop()
+
+        shutil.rmtree(_log_directory, ignore_errors=True)
+
+    _results["rss_end_mb"] = current_rss()
+    # ru_maxrss is in kB on Linux.
+    _results["max_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024 / 1e6
+
+    if use_tracemalloc:
+        (_current, _peak) = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        _results["tracemalloc_current_mb"] = _current / 1e6
+        _results["tracemalloc_peak_mb"] = _peak / 1e6
+
+    return _results
+
+
+def format_stats(stats):
+    """ Format the output of percentiles() on one line. """
+    if stats.get("count", 0) == 0:
+        return "no data"
+
+    return ", ".join(
+        "%s %.1f" % (_key, stats[_key])
+        for _key in ["mean"] + ["p%d" % _p for _p in PERCENTILES] + ["max"]
+    )
+
+
+def print_results(results):
+    """ Print a human-readable summary of the benchmark results. """
+    print(
+        "Replayed %d frames from %d sondes in %.2f s: %.0f frames/s"
+        % (results["frames"], results["sondes"], results["feed_time"], results["frames_per_second"])
+    )
+    if results["drain_time"] is None:
+        print("Exporter queues did not drain within the timeout!")
+    else:
+        print(
+            "Exporter queues drained %.2f s later (end-to-end %.0f frames/s)"
+            % (results["drain_time"], results["end_to_end_frames_per_second"])
+        )
+
+    print("")
+    print("Decoder line handling (us): %s" % format_stats(results["handle_line_us"]))
+    for (_stage, _stats) in results["stages_us"].items():
+        print("  %-10s %s" % (_stage, format_stats(_stats)))
+
+    print("")
+    print("Exporter queue lag (ms):")
+    for (_name, _stats) in results["exporter_lag_ms"].items():
+        _queue = results["exporter_queues"][_name]
+        print(
+            "  %-20s %s (max depth %d, dropped %d)"
+            % (_name, format_stats(_stats), _queue["max_depth"], _queue["dropped"])
+        )
+
+    print("")
+    print("Stand-in servers:")
+    for (_name, _stats) in results["servers"].items():
+        print("  %-10s %s" % (_name, ", ".join("%s %d" % (_k, _v) for (_k, _v) in _stats.items())))
+
+    print("")
+    print(
+        "Memory: RSS %.1f MB -> %.1f MB, max RSS %.1f MB"
+        % (results["rss_start_mb"] or 0, results["rss_end_mb"] or 0, results["max_rss_mb"])
+    )
+    if "tracemalloc_peak_mb" in results:
+        print(
+            "Python allocations: current %.1f MB, peak %.1f MB"
+            % (results["tracemalloc_current_mb"], results["tracemalloc_peak_mb"])
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("input", nargs="+", help="Sonde log file(s), or recorded decoder JSON output (with --json).")
+    parser.add_argument(
+        "-s",
+        "--speed",
+        type=float,
+        default=0.0,
+        help="Replay speed, as a multiple of real time (Default: 0, as fast as possible)",
+    )
+    parser.add_argument(
+        "-n",
+        "--copies",
+        type=int,
+        default=1,
+        help="Replay N copies of each input simultaneously, with different sonde IDs (Default: 1)",
+    )
+    parser.add_argument(
+        "--json", action="store_true", default=False, help="Inputs are recorded decoder JSON output, rather than log files."
+    )
+    parser.add_argument("--type", default="RS41", help="Sonde type of recorded decoder JSON output (Default: RS41)")
+    parser.add_argument(
+        "--freq", type=float, default=401.5, help="Frequency of recorded decoder JSON output, in MHz (Default: 401.5)"
+    )
+    parser.add_argument(
+        "--exporters",
+        default=",".join(EXPORTERS),
+        help="Comma-separated list of exporters to run (Default: %s)" % ",".join(EXPORTERS),
+    )
+    parser.add_argument(
+        "--sidecar", action="store_true", default=False, help="Enable binary sidecar files in the logger."
+    )
+    parser.add_argument(
+        "--tracemalloc", action="store_true", default=False, help="Track Python memory allocations (slow)."
+    )
+    parser.add_argument(
+        "--drain-timeout", type=float, default=60, help="Time to wait for exporters to finish (Default: 60 s)"
+    )
+    parser.add_argument("--output", default=None, help="Also write the results to this file, as JSON.")
+    parser.add_argument("-v", "--verbose", help="Enable debug output.", action="store_true")
+    args = parser.parse_args()
+
+    # Most exporters log every upload at INFO level, which would swamp the output.
+    if args.verbose:
+        _log_level = logging.DEBUG
+    else:
+        _log_level = logging.WARNING
+
+    logging.basicConfig(format="%(asctime)s %(levelname)s:%(message)s", level=_log_level)
+
+    _exporters = [_e.strip() for _e in args.exporters.split(",") if _e.strip() != ""]
+    for _exporter in _exporters:
+        if _exporter not in EXPORTERS:
+            parser.error("Unknown exporter %s" % _exporter)
+
+    _inputs = []
+    for _filename in args.input:
+        if args.json:
+            _inputs.append(read_decoder_json_lines(_filename, sonde_type=args.type, freq=args.freq * 1e6))
+        else:
+            _inputs.append(read_log_file_lines(_filename))
+
+    _results = run_benchmark(
+        _inputs,
+        speed=args.speed,
+        copies=args.copies,
+        exporters=_exporters,
+        save_sidecar=args.sidecar,
+        use_tracemalloc=args.tracemalloc,
+        drain_timeout=args.drain_timeout,
+    )
+
+    print_results(_results)
+
+    if args.output:
+        with open(args.output, "w") as _f:
+            json.dump(_results, _f, indent=2)
@@ -0,0 +1,590 @@
+#!/usr/bin/env python
+#
+#   radiosonde_auto_rx - SDR Abstraction - Wideband Channelizer
+#
+#   Copyright (C) 2025  Mark Jessop <vk5qi@rfhead.net>
+#   Released under GNU GPL v3 or later
+#
+#   Streams wideband IQ from a single RTLSDR (using rtl_sdr), and splits it into
+#   narrowband channels using a FFT filterbank. Each channel is written out to a named pipe (FIFO),
+#   which a decoder or detector chain reads from in place of rtl_fm. This allows a single
+#   RTLSDR to feed many decoders at once, and also provide spectrum data for the scanner.
+#
+import errno
+import logging
+import os
+import os.path
+import shutil
+import signal
+import subprocess
+import tempfile
+import time
+import numpy as np
+from threading import Thread, Lock
+
+
+class WidebandChannelizer(object):
+    """ Wideband Channelizer
+
+    Captures wideband IQ from a RTLSDR, and produces narrowband IQ or FM-demodulated channels on request.
+
+    Channelization is performed using 50% overlapped FFTs. For each channel, the FFT bins around the channel
+    frequency are extracted, tapered, and inverse-FFT'd, which shifts the channel to baseband and decimates
+    it to the channel sample rate in one step. The centre half of each inverse-FFT is kept (overlap-save).
+    """
+
+    # Length of each FFT block, in seconds. Channel sample rates should be a multiple of 2/BLOCK_TIME (40 Hz).
+    BLOCK_TIME = 0.05
+    # Fraction of each channel's bandwidth that is tapered at each edge, to limit ringing.
+    CHANNEL_TAPER = 0.1
+    # Maximum amount of data (seconds) to buffer for a channel whose reader is falling behind.
+    # Beyond this, the oldest samples are discarded.
+    MAX_CHANNEL_BACKLOG = 2.0
+    # Fraction of the capture bandwidth which is usable. The band edges are attenuated by the SDR's anti-aliasing filters.
+    USABLE_BANDWIDTH = 0.9
+    # Wait this many seconds before restarting the SDR if it stops producing samples.
+    RESTART_DELAY = 5
+
+    def __init__(
+        self,
+        centre_freq,
+        sample_rate=2400000,
+        rtl_device_idx="0",
+        ppm=0,
+        gain=-1,
+        bias=False,
+        rtl_sdr_path="rtl_sdr"
+    ):
+        """ Initialise and start a Wideband Channelizer.
+
+        Args:
+            centre_freq (int): Centre frequency of the wideband capture, in Hz.
+            sample_rate (int): Sample rate of the wideband capture, in Hz.
+            rtl_device_idx (int or str): Device index or serial number of the RTLSDR.
+            ppm (int): SDR Frequency accuracy correction, in ppm.
+            gain (float): SDR Gain setting, in dB. A gain setting of -1 enables the RTLSDR AGC.
+            bias (bool): If True, enable the bias tee on the SDR.
+            rtl_sdr_path (str): Path to the rtl_sdr utility.
+        """
+
+        self.centre_freq = int(centre_freq)
+        self.sample_rate = int(sample_rate)
+        self.rtl_device_idx = rtl_device_idx
+        self.ppm = ppm
+        self.gain = gain
+        self.bias = bias
+        self.rtl_sdr_path = rtl_sdr_path
+
+        # FFT block length (must be even, as we hop by half a block), and the resultant bin width.
+        self.block_len = int(round(self.sample_rate * self.BLOCK_TIME / 2)) * 2
+        self.hop_len = self.block_len // 2
+        self.bin_width = self.sample_rate / self.block_len
+
+        # Channels, keyed by (frequency, scan)
+        self.channels = {}
+        self.channels_lock = Lock()
+
+        # Named pipes for each channel are created within this directory.
+        self.fifo_dir = tempfile.mkdtemp(prefix="autorx_channelizer_")
+
+        # Power spectrum accumulator, used when the scanner requests spectrum data.
+        self.spectrum_lock = Lock()
+        self.spectrum_sum = None
+        self.spectrum_count = 0
+
+        # Number of FFT blocks processed - used to keep the phase of each channel consistent between blocks.
+        self.block_count = 0
+
+        # Statistics
+        self.samples_processed = 0
+        self.restarts = 0
+
+        self.sdr_process = None
+        self.channelizer_running = True
+        self.channelizer_thread = Thread(target=self.channelizer_loop)
+        self.channelizer_thread.start()
+
+    def frequency_range(self):
+        """ Get the range of frequencies which can be channelized.
+
+        Returns:
+            tuple: (lower, upper) frequency limits, in Hz.
+        """
+        _half_bw = self.USABLE_BANDWIDTH * self.sample_rate / 2.0
+        return (self.centre_freq - _half_bw, self.centre_freq + _half_bw)
+
+    def start_sdr(self):
+        """ Start up the rtl_sdr process """
+
+        _gain = ""
+        if self.gain and (self.gain >= 0):
+            _gain = f"-g {self.gain:.1f} "
+
+        _cmd = (
+            f"{self.rtl_sdr_path} "
+            f"{'-T ' if self.bias else ''}"
+            f"-p {int(self.ppm)} "
+            f"-d {str(self.rtl_device_idx)} "
+            f"{_gain}"
+            f"-s {self.sample_rate} "
+            f"-f {self.centre_freq} "
+            f"- 2>/dev/null"
+        )
+
+        self.log_debug(f"Starting SDR with command: {_cmd}")
+
+        self.sdr_process = subprocess.Popen(
+            _cmd,
+            shell=True,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            preexec_fn=os.setsid,
+        )
+
+    def stop_sdr(self):
+        """ Kill the rtl_sdr process, if it is running """
+        if self.sdr_process is None:
+            return
+
+        try:
+            os.killpg(os.getpgid(self.sdr_process.pid), signal.SIGKILL)
+        except Exception as e:
+            self.log_debug(f"SIGKILL via os.killpg failed. - {str(e)}")
+
+        self.sdr_process.wait()
+        self.sdr_process = None
+
+    def add_channel(self, frequency, sample_rate, mode="iq", scan=False):
+        """ Add a new channel to the channelizer.
+
+        Args:
+            frequency (int): Channel centre frequency, in Hz.
+            sample_rate (int): Channel sample rate, in Hz.
+            mode (str): 'iq' to output complex signed 16-bit samples, or 'fm' to output FM-demodulated signed 16-bit samples.
+            scan (bool): Set if this channel is used by the scanner, so it doesn't clash with a decoder channel.
+
+        Returns:
+            str/None: The path to a named pipe from which the channel samples can be read, or None if the channel could not be created.
+        """
+
+        (_lower, _upper) = self.frequency_range()
+        _half_bw = sample_rate / 2.0
+        if ((frequency - _half_bw) < _lower) or ((frequency + _half_bw) > _upper):
+            self.log_error(
+                f"Channel at {frequency/1e6:.3f} MHz is outside of the channelizer range ({_lower/1e6:.3f} - {_upper/1e6:.3f} MHz)."
+            )
+            return None
+
+        # Close any existing channel on this frequency.
+        self.remove_channel(frequency, scan)
+
+        # Number of FFT bins (and hence output samples per block) in this channel.
+        _n_bins = int(round(sample_rate * self.BLOCK_TIME / 2)) * 2
+        _offset_bins = int(round((frequency - self.centre_freq) / self.bin_width))
+
+        # Bins making up this channel, in inverse-FFT order.
+        _bins = (_offset_bins + np.fft.fftfreq(_n_bins, 1.0 / _n_bins).astype(int)) % self.block_len
+
+        # Raised-cosine taper on the channel edges.
+        _taper = np.ones(_n_bins, dtype=np.float32)
+        _taper_len = max(1, int(_n_bins * self.CHANNEL_TAPER))
+        _ramp = 0.5 - 0.5 * np.cos(np.pi * (np.arange(_taper_len) + 0.5) / _taper_len)
+        _taper[:_taper_len] = _ramp
+        _taper[-_taper_len:] = _ramp[::-1]
+        _taper = np.fft.ifftshift(_taper)
+
+        _fifo_path = os.path.join(
+            self.fifo_dir, f"{int(frequency)}_{'scan' if scan else 'rx'}_{mode}.fifo"
+        )
+        try:
+            os.mkfifo(_fifo_path)
+        except Exception as e:
+            self.log_error(f"Could not create named pipe {_fifo_path} - {str(e)}")
+            return None
+
+        _bytes_per_sample = 4 if mode == "iq" else 2
+
+        with self.channels_lock:
+            self.channels[(int(frequency), scan)] = {
+                "frequency": frequency,
+                "sample_rate": _n_bins / self.BLOCK_TIME,
+                "mode": mode,
+                "bins": _bins,
+                "taper": _taper,
+                # If the channel is offset by an odd number of bins, every second (half-overlapped) block
+                # will be inverted, which we need to correct.
+                "odd_offset": (_offset_bins % 2) == 1,
+                "scale": _n_bins / self.block_len,
+                "fifo": _fifo_path,
+                "fd": None,
+                "backlog": bytearray(),
+                "max_backlog": int(self.MAX_CHANNEL_BACKLOG * sample_rate) * _bytes_per_sample,
+                "bytes_per_sample": _bytes_per_sample,
+                "last_sample": np.complex64(1.0),
+                "dropped": 0,
+            }
+
+        self.log_debug(
+            f"Added {mode.upper()} channel at {frequency/1e6:.3f} MHz ({sample_rate} Hz), reading from {_fifo_path}"
+        )
+
+        return _fifo_path
+
+    def remove_channel(self, frequency, scan=False):
+        """ Remove a channel from the channelizer.
+
+        Args:
+            frequency (int): Channel centre frequency, in Hz.
+            scan (bool): Set if this channel was created by the scanner.
+        """
+        with self.channels_lock:
+            _channel = self.channels.pop((int(frequency), scan), None)
+
+        if _channel:
+            self.close_channel(_channel)
+            self.log_debug(f"Removed channel at {frequency/1e6:.3f} MHz.")
+
+    def close_channel(self, channel):
+        """ Close the named pipe associated with a channel """
+        if channel["fd"] is not None:
+            try:
+                os.close(channel["fd"])
+            except OSError:
+                pass
+            channel["fd"] = None
+
+        if channel["dropped"] > 0:
+            self.log_debug(
+                f"Channel at {channel['frequency']/1e6:.3f} MHz discarded {channel['dropped']} bytes due to a slow reader."
+            )
+
+        try:
+            os.unlink(channel["fifo"])
+        except OSError:
+            pass
+
+    def write_channel(self, channel, data):
+        """ Write data to a channel's named pipe, without blocking.
+
+        Args:
+            channel (dict): Channel to write to.
+            data (bytes): Data to write.
+
+        Returns:
+            bool: False if the reader has closed the pipe, and the channel should be removed.
+        """
+
+        if channel["fd"] is None:
+            # Try and open the pipe. This will fail until a reader has opened it, in which case we discard the data.
+            try:
+                channel["fd"] = os.open(channel["fifo"], os.O_WRONLY | os.O_NONBLOCK)
+            except OSError as e:
+                if e.errno == errno.ENXIO:
+                    return True
+                self.log_error(f"Could not open named pipe {channel['fifo']} - {str(e)}")
+                return False
+
+        channel["backlog"] += data
+
+        # If the reader is not keeping up, discard the oldest samples (keeping sample alignment).
+        _excess = len(channel["backlog"]) - channel["max_backlog"]
+        if _excess > 0:
+            _excess += (-_excess) % channel["bytes_per_sample"]
+            del channel["backlog"][:_excess]
+            channel["dropped"] += _excess
+
+        try:
+            while len(channel["backlog"]) > 0:
+                _written = os.write(channel["fd"], channel["backlog"])
+                del channel["backlog"][:_written]
+        except BlockingIOError:
+            # Pipe is full, we'll try again with the next block.
+            pass
+        except (BrokenPipeError, OSError):
+            # Reader has exited.
+            return False
+
+        return True
+
+    def process_block(self, block):
+        """ Channelize one (half-overlapped) block of wideband IQ.
+
+        Args:
+            block (np.ndarray): Complex wideband samples, of length block_len.
+        """
+
+        _spectrum = np.fft.fft(block)
+        # Remove the SDR's DC spike.
+        _spectrum[0] = 0
+
+        # Update the power spectrum accumulator, if the scanner has requested it.
+        with self.spectrum_lock:
+            if self.spectrum_sum is not None:
+                self.spectrum_sum += np.abs(_spectrum) ** 2
+                self.spectrum_count += 1
+
+        _invert = (self.block_count % 2) == 1
+        self.block_count += 1
+
+        with self.channels_lock:
+            _channels = list(self.channels.items())
+
+        for (_key, _channel) in _channels:
+            _samples = np.fft.ifft(_spectrum[_channel["bins"]] * _channel["taper"]) * _channel["scale"]
+
+            # Keep the centre half of the block (overlap-save)
+            _n = len(_samples)
+            _samples = _samples[_n // 4 : 3 * _n // 4].astype(np.complex64)
+
+            if _invert and _channel["odd_offset"]:
+                _samples = -_samples
+
+            if _channel["mode"] == "fm":
+                # Polar discriminator, scaled the same as rtl_fm
+                _prev = np.concatenate(([_channel["last_sample"]], _samples[:-1]))
+                _channel["last_sample"] = _samples[-1]
+                _output = np.angle(_samples * np.conj(_prev)) * (16384.0 / np.pi)
+                _data = _output.astype(np.int16).tobytes()
+            else:
+                _data = (
+                    np.clip(_samples.view(np.float32), -32768, 32767).astype(np.int16).tobytes()
+                )
+
+            if not self.write_channel(_channel, _data):
+                self.log_debug(
+                    f"Reader for channel at {_channel['frequency']/1e6:.3f} MHz has closed."
+                )
+                with self.channels_lock:
+                    if self.channels.get(_key) is _channel:
+                        self.channels.pop(_key)
+                self.close_channel(_channel)
+
+    def channelizer_loop(self):
+        """ Read wideband IQ from the SDR and channelize it. """
+
+        self.log_info(
+            f"Started Channelizer Thread. Centre: {self.centre_freq/1e6:.3f} MHz, Sample Rate: {self.sample_rate/1e3:.0f} kHz"
+        )
+
+        _hop_bytes = self.hop_len * 2
+        _previous = np.zeros(self.hop_len, dtype=np.complex64)
+
+        while self.channelizer_running:
+
+            if self.sdr_process is None:
+                self.start_sdr()
+
+            _data = self.sdr_process.stdout.read(_hop_bytes)
+
+            if len(_data) < _hop_bytes:
+                if not self.channelizer_running:
+                    break
+
+                # The SDR has stopped producing samples. Restart it after a short delay.
+                self.log_error("SDR stopped producing samples, restarting.")
+                self.stop_sdr()
+                self.restarts += 1
+                for _ in range(self.RESTART_DELAY):
+                    if not self.channelizer_running:
+                        break
+                    time.sleep(1)
+                continue
+
+            # Convert unsigned 8-bit IQ into complex samples, scaled to a similar level as rtl_fm's output.
+            _current = (
+                (np.frombuffer(_data, dtype=np.uint8).astype(np.float32) - 127.5) * 128.0
+            ).view(np.complex64)
+
+            try:
+                self.process_block(np.concatenate((_previous, _current)))
+            except Exception as e:
+                self.log_error(f"Error channelizing samples - {str(e)}")
+
+            _previous = _current
+            self.samples_processed += self.hop_len
+
+        self.stop_sdr()
+        self.log_info("Stopped Channelizer Thread.")
+
+    def get_power_spectrum(self, frequency_start, frequency_stop, step, integration_time):
+        """ Integrate the power spectrum of the wideband capture.
+
+        Args:
+            frequency_start (int): Start frequency for the PSD, Hz
+            frequency_stop (int): Stop frequency for the PSD, Hz
+            step (int): Requested frequency step for the PSD, Hz. This will be rounded to a multiple of the FFT bin width.
+            integration_time (int): Integration time in seconds.
+
+        Returns:
+            tuple: (freq, power, step), or (None, None, None) if no data was available.
+        """
+
+        with self.spectrum_lock:
+            self.spectrum_sum = np.zeros(self.block_len)
+            self.spectrum_count = 0
+
+        _start = time.time()
+        while (time.time() - _start) < integration_time and self.channelizer_running:
+            time.sleep(0.5)
+
+        with self.spectrum_lock:
+            _sum = self.spectrum_sum
+            _count = self.spectrum_count
+            self.spectrum_sum = None
+            self.spectrum_count = 0
+
+        if _count == 0:
+            self.log_error("No spectrum data available.")
+            return (None, None, None)
+
+        _power = np.fft.fftshift(_sum / _count)
+        _freq = self.centre_freq + np.fft.fftshift(np.fft.fftfreq(self.block_len, 1.0 / self.sample_rate))
+
+        # Average adjacent bins together to get close to the requested step size.
+        _decimation = max(1, int(round(step / self.bin_width)))
+        _n = (len(_power) // _decimation) * _decimation
+        _power = _power[:_n].reshape(-1, _decimation).mean(axis=1)
+        _freq = _freq[:_n].reshape(-1, _decimation).mean(axis=1)
+
+        # Clip to the requested (and usable) frequency range.
+        (_lower, _upper) = self.frequency_range()
+        _mask = (
+            (_freq >= max(frequency_start, _lower)) & (_freq <= min(frequency_stop, _upper))
+        )
+
+        _power = 10 * np.log10(_power[_mask] + 1e-12)
+
+        return (_freq[_mask], _power, _decimation * self.bin_width)
+
+    def close(self):
+        """ Stop the channelizer, and remove all channels """
+        self.channelizer_running = False
+        self.stop_sdr()
+        self.channelizer_thread.join(10)
+
+        with self.channels_lock:
+            _channels = list(self.channels.values())
+            self.channels = {}
+
+        for _channel in _channels:
+            self.close_channel(_channel)
+
+        shutil.rmtree(self.fifo_dir, ignore_errors=True)
+
+    def running(self):
+        """ Check if the channelizer is running.
+
+        Returns:
+            bool: True if the channelizer thread is running.
+        """
+        return self.channelizer_running
+
+    def log_debug(self, line):
+        """ Helper function to log a debug message with a descriptive heading.
+        Args:
+            line (str): Message to be logged.
+        """
+        logging.debug(f"Channelizer (RTLSDR {self.rtl_device_idx}) - {line}")
+
+    def log_info(self, line):
+        """ Helper function to log an informational message with a descriptive heading.
+        Args:
+            line (str): Message to be logged.
+        """
+        logging.info(f"Channelizer (RTLSDR {self.rtl_device_idx}) - {line}")
+
+    def log_error(self, line):
+        """ Helper function to log an error message with a descriptive heading.
+        Args:
+            line (str): Message to be logged.
+        """
+        logging.error(f"Channelizer (RTLSDR {self.rtl_device_idx}) - {line}")
+
+
+# Global channelizer instance, shared between all scan and decode tasks.
+_channelizer = None
+
+
+def start_channelizer(
+    centre_freq,
+    sample_rate=2400000,
+    rtl_device_idx="0",
+    ppm=0,
+    gain=-1,
+    bias=False,
+    rtl_sdr_path="rtl_sdr"
+):
+    """ Start up the global channelizer instance. See WidebandChannelizer for argument details. """
+    global _channelizer
+
+    if _channelizer is not None:
+        _channelizer.close()
+
+    _channelizer = WidebandChannelizer(
+        centre_freq,
+        sample_rate=sample_rate,
+        rtl_device_idx=rtl_device_idx,
+        ppm=ppm,
+        gain=gain,
+        bias=bias,
+        rtl_sdr_path=rtl_sdr_path
+    )
+
+    return _channelizer
+
+
+def stop_channelizer():
+    """ Stop the global channelizer instance, if it is running. """
+    global _channelizer
+
+    if _channelizer is not None:
+        _channelizer.close()
+        _channelizer = None
+
+
+def channelizer_running():
+    """ Check if the global channelizer instance is running. """
+    return (_channelizer is not None) and _channelizer.running()
+
+
+def channelizer_get_iq_cmd(frequency, sample_rate, scan=False):
+    """ Create a channel, and get a command which outputs its IQ (signed 16-bit) samples """
+    if _channelizer is None:
+        logging.critical("Channelizer - Channelizer not running!")
+        return "false |"
+
+    _fifo = _channelizer.add_channel(frequency, sample_rate, mode="iq", scan=scan)
+
+    if _fifo is None:
+        return "false |"
+
+    return f"cat {_fifo} | "
+
+
+def channelizer_get_fm_cmd(frequency, filter_bandwidth, scan=False):
+    """ Create a channel, and get a command which outputs FM-demodulated (signed 16-bit) samples at filter_bandwidth """
+    if _channelizer is None:
+        logging.critical("Channelizer - Channelizer not running!")
+        return "false |"
+
+    _fifo = _channelizer.add_channel(frequency, filter_bandwidth, mode="fm", scan=scan)
+
+    if _fifo is None:
+        return "false |"
+
+    return f"cat {_fifo} | "
+
+
+def channelizer_close_channel(frequency, scan=False):
+    """ Remove a channel from the global channelizer """
+    if _channelizer is not None:
+        _channelizer.remove_channel(frequency, scan)
+
+
+def channelizer_get_power_spectrum(frequency_start, frequency_stop, step, integration_time):
+    """ Get power spectrum data from the global channelizer """
+    if _channelizer is None:
+        logging.critical("Channelizer - Channelizer not running!")
+        return (None, None, None)
+
+    return _channelizer.get_power_spectrum(frequency_start, frequency_stop, step, integration_time)
@@ -73,6 +73,7 @@ def read_auto_rx_config(filename, no_sdr_test=False):
         "ss_iq_path": "./ss_iq",
         "ss_power_path": "./ss_power",
         "sdr_quantity": 1,
+        "channelizer_sample_rate": 2400000,
         # Search Parameters
         "min_freq": 400.4,
         "max_freq": 404.0,
@@ -129,6 +130,14 @@ def read_auto_rx_config(filename, no_sdr_test=False):
         "max_peaks": 10,
         "quantization": 10000,
         "decoder_spacing_limit": 15000,
+        "sdr_preemption": True,
+        "sdr_preempt_stale_time": 60,
+        "sdr_preempt_for_scanner": False,
+        "frequency_prior": True,
+        "frequency_prior_seeds": 2,
+        "no_sonde_cache": True,
+        "no_sonde_max_backoff": 30,
+        "spectrum_averaging": 0.5,
         "synchronous_upload": False,
         "scan_dwell_time": 20,
         "detect_dwell_time": 5,
@@ -165,11 +174,15 @@ def read_auto_rx_config(filename, no_sdr_test=False):
         "save_system_log": False,
         "enable_debug_logging": False,
         "save_cal_data": False,
+        "save_log_sidecar": False,
         # New Sondehub DB Settings
         "sondehub_enabled": True,
         "sondehub_upload_rate": 30,
+        "sondehub_max_batch_size": 200,
+        "sondehub_new_sonde_delay": 5,
         # "sondehub_contact_email": "none@none.com" # Commented out to ensure a warning message is shown on startup
         "wideband_sondes": False, # Wideband sonde detection / decoding
+        "wideband_detection": False,
     }
 
     try:
@@ -784,6 +797,130 @@ def read_auto_rx_config(filename, no_sdr_test=False):
             auto_rx_config["ozi_host"] = "<broadcast>"
             auto_rx_config["payload_summary_host"] = "<broadcast>"
             
+        # 1.8.2 - Concurrent detection of all scan peaks
+        try:
+            auto_rx_config["wideband_detection"] = config.getboolean(
+                "advanced", "wideband_detection"
+            )
+        except:
+            logging.warning(
+                "Config - Missing wideband_detection option (new in v1.8.2), using default (False)"
+            )
+            auto_rx_config["wideband_detection"] = False
+
+        # 1.8.2 - Wideband Channelizer
+        try:
+            auto_rx_config["channelizer_sample_rate"] = config.getint(
+                "sdr", "channelizer_sample_rate"
+            )
+        except:
+            logging.debug(
+                "Config - Missing channelizer_sample_rate option (new in v1.8.2), using default (2400000)"
+            )
+            auto_rx_config["channelizer_sample_rate"] = 2400000
+
+        # 1.8.2 - Adaptive SondeHub upload scheduling
+        try:
+            auto_rx_config["sondehub_max_batch_size"] = config.getint(
+                "sondehub", "sondehub_max_batch_size"
+            )
+            auto_rx_config["sondehub_new_sonde_delay"] = config.getint(
+                "sondehub", "sondehub_new_sonde_delay"
+            )
+            if auto_rx_config["sondehub_max_batch_size"] < 1:
+                logging.warning(
+                    "Config - sondehub_max_batch_size must be at least 1, using 1."
+                )
+                auto_rx_config["sondehub_max_batch_size"] = 1
+        except:
+            logging.warning(
+                "Config - Missing sondehub_max_batch_size or sondehub_new_sonde_delay options (new in v1.8.2), using defaults (200 packets, 5 seconds)"
+            )
+            auto_rx_config["sondehub_max_batch_size"] = 200
+            auto_rx_config["sondehub_new_sonde_delay"] = 5
+
+        # 1.8.2 - Binary log file sidecars
+        try:
+            auto_rx_config["save_log_sidecar"] = config.getboolean(
+                "logging", "save_log_sidecar"
+            )
+        except:
+            logging.warning(
+                "Config - Missing save_log_sidecar option (new in v1.8.2), using default (False)"
+            )
+            auto_rx_config["save_log_sidecar"] = False
+
+        # 1.8.2 - SDR pre-emption
+        try:
+            auto_rx_config["sdr_preemption"] = config.getboolean(
+                "advanced", "sdr_preemption"
+            )
+            auto_rx_config["sdr_preempt_stale_time"] = config.getint(
+                "advanced", "sdr_preempt_stale_time"
+            )
+        except:
+            logging.warning(
+                "Config - Missing sdr_preemption or sdr_preempt_stale_time options (new in v1.8.2), using defaults (True, 60 seconds)"
+            )
+            auto_rx_config["sdr_preemption"] = True
+            auto_rx_config["sdr_preempt_stale_time"] = 60
+
+        try:
+            auto_rx_config["sdr_preempt_for_scanner"] = config.getboolean(
+                "advanced", "sdr_preempt_for_scanner"
+            )
+        except:
+            logging.warning(
+                "Config - Missing sdr_preempt_for_scanner option (new in v1.8.2), using default (False)"
+            )
+            auto_rx_config["sdr_preempt_for_scanner"] = False
+
+        # 1.8.2 - Scanner frequency prior
+        try:
+            auto_rx_config["frequency_prior"] = config.getboolean(
+                "advanced", "frequency_prior"
+            )
+            auto_rx_config["frequency_prior_seeds"] = config.getint(
+                "advanced", "frequency_prior_seeds"
+            )
+        except:
+            logging.warning(
+                "Config - Missing frequency_prior or frequency_prior_seeds options (new in v1.8.2), using defaults (True, 2)"
+            )
+            auto_rx_config["frequency_prior"] = True
+            auto_rx_config["frequency_prior_seeds"] = 2
+
+        # 1.8.2 - Scanner no-sonde cache
+        try:
+            auto_rx_config["no_sonde_cache"] = config.getboolean(
+                "advanced", "no_sonde_cache"
+            )
+            auto_rx_config["no_sonde_max_backoff"] = config.getint(
+                "advanced", "no_sonde_max_backoff"
+            )
+        except:
+            logging.warning(
+                "Config - Missing no_sonde_cache or no_sonde_max_backoff options (new in v1.8.2), using defaults (True, 30 minutes)"
+            )
+            auto_rx_config["no_sonde_cache"] = True
+            auto_rx_config["no_sonde_max_backoff"] = 30
+
+        # 1.8.2 - Scanner spectrum integration
+        try:
+            auto_rx_config["spectrum_averaging"] = config.getfloat(
+                "advanced", "spectrum_averaging"
+            )
+            if not (0.0 < auto_rx_config["spectrum_averaging"] <= 1.0):
+                logging.warning(
+                    "Config - spectrum_averaging must be between 0 and 1, using default (0.5)"
+                )
+                auto_rx_config["spectrum_averaging"] = 0.5
+        except:
+            logging.warning(
+                "Config - Missing spectrum_averaging option (new in v1.8.2), using default (0.5)"
+            )
+            auto_rx_config["spectrum_averaging"] = 0.5
+
         # If we are being called as part of a unit test, just return the config now.
         if no_sdr_test:
             return auto_rx_config
@@ -807,6 +944,14 @@ def read_auto_rx_config(filename, no_sdr_test=False):
                         )
                         return None
 
+                    # Optional frequency range (MHz) this SDR can be used for, i.e. if it has a band-pass filter fitted.
+                    _min_freq = None
+                    _max_freq = None
+                    if config.has_option(_section, "min_freq"):
+                        _min_freq = config.getfloat(_section, "min_freq")
+                    if config.has_option(_section, "max_freq"):
+                        _max_freq = config.getfloat(_section, "max_freq")
+
                     # See if the SDR exists.
                     _sdr_valid = test_sdr(sdr_type = "RTLSDR", rtl_device_idx = _device_idx)
                     if _sdr_valid:
@@ -814,6 +959,8 @@ def read_auto_rx_config(filename, no_sdr_test=False):
                             "ppm": _ppm,
                             "gain": _gain,
                             "bias": _bias,
+                            "min_freq": _min_freq,
+                            "max_freq": _max_freq,
                             "in_use": False,
                             "task": None,
                         }
@@ -876,6 +1023,44 @@ def read_auto_rx_config(filename, no_sdr_test=False):
                 }
             
         
+        elif auto_rx_config["sdr_type"] == "Channelizer":
+            # A single RTLSDR, defined in the [sdr_1] section, is shared between all tasks.
+            try:
+                _device_idx = config.get("sdr_1", "device_idx")
+                _ppm = round(config.getfloat("sdr_1", "ppm"))
+                _gain = config.getfloat("sdr_1", "gain")
+                _bias = config.getboolean("sdr_1", "bias")
+            except Exception as e:
+                logging.critical(f"Config - Error parsing RTLSDR settings for Channelizer - {str(e)}")
+                return None
+
+            if not test_sdr(sdr_type = "RTLSDR", rtl_device_idx = _device_idx):
+                logging.critical(f"Config - RTLSDR #{_device_idx} for Channelizer invalid. Exiting.")
+                return None
+
+            auto_rx_config["channelizer_settings"] = {
+                "device_idx": _device_idx,
+                "ppm": _ppm,
+                "gain": _gain,
+                "bias": _bias,
+            }
+
+            _capture_bw = auto_rx_config["channelizer_sample_rate"] * 0.9
+            if (auto_rx_config["max_freq"] - auto_rx_config["min_freq"]) * 1e6 > _capture_bw:
+                logging.warning(
+                    f"Config - Search range is wider than the Channelizer bandwidth ({_capture_bw/1e6:.2f} MHz), only the centre of the range will be scanned."
+                )
+
+            for _n in range(1, auto_rx_config["sdr_quantity"] + 1):
+                _sdr_name = f"CHAN-{_n:02d}"
+                auto_rx_config["sdr_settings"][_sdr_name] = {
+                    "ppm": 0,
+                    "gain": 0,
+                    "bias": 0,
+                    "in_use": False,
+                    "task": None,
+                }
+
         else:
             logging.critical(f"Config - Unknown SDR Type {auto_rx_config['sdr_type']} - exiting.")
             return None
@@ -15,15 +15,24 @@ import signal
 import subprocess
 import time
 import traceback
-from dateutil.parser import parse
-from threading import Thread
+from collections import deque
+from threading import Thread, Event
 from types import FunctionType, MethodType
-from .utils import AsynchronousFileReader, rtlsdr_test, position_info, generate_aprs_id
+from .utils import rtlsdr_test, position_info, generate_aprs_id, parse_iso_datetime
 from .gps import get_ephemeris, get_almanac
 from .sonde_specific import fix_datetime, imet_unique_id
 from .fsk_demod import FSKDemodStats
 from .sdr_wrappers import test_sdr, get_sdr_iq_cmd, get_sdr_fm_cmd, get_sdr_name
 from .email_notification import EmailNotification
+from .supervisor import get_pipe_supervisor
+
+# Use orjson for decoding telemetry if it is available, as it is significantly faster than the json module.
+try:
+    import orjson
+
+    json_loads = orjson.loads
+except ImportError:
+    json_loads = json.loads
 
 # Global valid sonde types list.
 VALID_SONDE_TYPES = [
@@ -103,11 +112,19 @@ class SondeDecoder(object):
         "vel_v": -9999.0,
         "heading": -9999.0,
     }
+    DECODER_REQUIRED_FIELDS_SET = frozenset(DECODER_REQUIRED_FIELDS)
     # Note: The decoders may also supply other fields, such as:
     # 'batt' - Battery voltage, in volts.
     # 'pressure' - Pressure, in hPa
     # 'bt' - RS41 burst timer data.
 
+    # Report per-stage telemetry handling times every X seconds (debug logging only).
+    TIMING_REPORT_INTERVAL = 600
+
+    # Maximum number of decoder output lines waiting to be handled by the decoder thread.
+    # If the decoder thread falls this far behind, the oldest lines are discarded.
+    DECODER_LINE_QUEUE_SIZE = 1000
+
     # TODO: Use the global valid sonde type list.
     VALID_SONDE_TYPES = [
         "RS92",
@@ -152,7 +169,8 @@ class SondeDecoder(object):
         rs41_drift_tweak=False,
         experimental_decoder=False,
         save_raw_hex=False,
-        wideband_sondes=False
+        wideband_sondes=False,
+        replay=False
     ):
         """ Initialise and start a Sonde Decoder.
 
@@ -160,7 +178,7 @@ class SondeDecoder(object):
             sonde_type (str): The radiosonde type, as returned by SondeScanner. Valid types listed in VALID_SONDE_TYPES
             sonde_freq (int/float): The radiosonde frequency, in Hz.
 
-            sdr_type (str): 'RTLSDR', 'Spyserver' or 'KA9Q'
+            sdr_type (str): 'RTLSDR', 'Spyserver', 'KA9Q' or 'Channelizer'
 
             Arguments for KA9Q SDR Server / SpyServer:
             sdr_hostname (str): Hostname of KA9Q Server
@@ -192,6 +210,8 @@ class SondeDecoder(object):
             experimental_decoder (bool): If True, use the experimental fsk_demod-based decode chain.
             save_raw_hex (bool): If True, save the raw hex output from the decoder to a file.
             wideband_sondes (bool): If True, use a wider bandwidth for iMet sondes. Does not affect settings for any other radiosonde types.
+            replay (bool): If True, don't use an SDR or start a decoder. Decoder output lines are instead passed in by the caller
+                via handle_decoder_line (e.g. when benchmarking the telemetry handling and exporter chain).
         """
         # Thread running flag
         self.decoder_running = True
@@ -262,6 +282,21 @@ class SondeDecoder(object):
         # This will become our decoder thread.
         self.decoder = None
 
+        # Accumulated time spent (in seconds) in each stage of telemetry handling.
+        self.timing_stats = {"parse": 0.0, "validate": 0.0, "process": 0.0, "export": 0.0}
+        self.timing_frames = 0
+        self.timing_last_report = time.time()
+
+        # Flight state, used by the task manager to decide which decoders can be pre-empted.
+        self.start_time = time.time()
+        # Time (unix timestamp) of the last telemetry which passed the telemetry filter.
+        self.last_good_telemetry_time = None
+        # Most recent telemetry from the sonde, whether or not it passed the telemetry filter.
+        self.latest_telemetry = None
+        # Recent (time, altitude) pairs, and the maximum altitude seen.
+        self.altitude_history = deque(maxlen=30)
+        self.max_altitude = None
+
         self.exit_state = "OK"
 
         # UDP Mode - Accepts incoming data via UDP.
@@ -282,14 +317,17 @@ class SondeDecoder(object):
             return
 
         # Test if the supplied SDR is working.
-        _sdr_ok = test_sdr(
-            self.sdr_type, 
-            rtl_device_idx = self.rtl_device_idx, 
-            sdr_hostname = self.sdr_hostname, 
-            sdr_port = self.sdr_port,
-            ss_iq_path = self.ss_iq_path,
-            check_freq = self.sonde_freq
-            )
+        if replay:
+            _sdr_ok = True
+        else:
+            _sdr_ok = test_sdr(
+                self.sdr_type, 
+                rtl_device_idx = self.rtl_device_idx, 
+                sdr_hostname = self.sdr_hostname, 
+                sdr_port = self.sdr_port,
+                ss_iq_path = self.ss_iq_path,
+                check_freq = self.sonde_freq
+                )
 
         if not _sdr_ok:
             # test_sdr will provide an error message
@@ -332,6 +370,11 @@ class SondeDecoder(object):
             None  # FSKDemodStats object, used to parse demodulator statistics.
         )
 
+        if replay:
+            # Nothing to start - telemetry will be passed in via handle_decoder_line.
+            self.rx_frequency = self.sonde_freq
+            return
+
         # Generate the decoder command.
         if self.experimental_decoder:
             # Create a copy of the RX frequency, which will be updated when generating the decoder command.
@@ -359,7 +402,15 @@ class SondeDecoder(object):
 
             # Start up the decoder thread.
             self.decode_process = None
-            self.async_reader = None
+            self.demod_process = None
+            # Set when there are new decoder output lines to handle, the decoder output reaches EOF,
+            # or we are asked to stop.
+            self.decoder_event = Event()
+            self.decoder_eof = False
+            # Decoder output lines, passed from the pipe supervisor to the decoder thread.
+            self.decoder_lines = deque(maxlen=self.DECODER_LINE_QUEUE_SIZE)
+            self.dropped_lines = 0
+            self.last_packet_time = time.time()
 
             self.decoder_running = True
             self.decoder = Thread(target=self.decoder_thread)
@@ -1468,22 +1519,55 @@ class SondeDecoder(object):
 
         return (demod_cmd, decode_cmd, demod_stats)
 
-    def stats_thread(self, asyncreader):
-        """ Process demodulator statistics from a supplied AsynchronousFileReader object (which will be hooked into stderr from fsk_demod) """
-        while (not asyncreader.eof()) and self.decoder_running:
-            for _line in asyncreader.readlines():
-                self.demod_stats.update(_line)
-            # Avoid spinlocking..
-            # Probably about time we looked at using async for this stuff...
-            time.sleep(0.2)
+    def handle_demod_stats_line(self, data):
+        """ Handle a line of output from the demodulator stderr (i.e. fsk_demod statistics) """
+        if self.demod_stats is not None:
+            self.demod_stats.update(data)
+
+    def handle_decoder_output(self, data):
+        """ Queue a line of output from the decoder stdout, as passed to us by the pipe supervisor.
+
+        This runs on the pipe supervisor thread, which reads the output of every decoder, so it must not block.
+        The line is handled (and passed on to the exporters) by this decoder's own thread.
+        """
+        if not self.decoder_running:
+            return
+
+        if len(self.decoder_lines) == self.DECODER_LINE_QUEUE_SIZE:
+            # The deque discards the oldest line when we append to it.
+            self.dropped_lines += 1
+            if (self.dropped_lines % 100) == 1:
+                self.log_error(
+                    "Decoder thread is falling behind, %d lines of output discarded so far."
+                    % self.dropped_lines
+                )
+
+        self.decoder_lines.append(data)
+        self.decoder_event.set()
+
+    def handle_decoder_eof(self):
+        """ Called by the pipe supervisor once the decoder stdout reaches EOF. """
+        self.decoder_eof = True
+        self.decoder_event.set()
+
+    def process_decoder_lines(self):
+        """ Handle all the queued decoder output lines. Runs on the decoder thread. """
+        while len(self.decoder_lines) > 0 and self.decoder_running:
+            # Pass the line into the handler, and see if it is OK.
+            _ok = self.handle_decoder_line(self.decoder_lines.popleft())
 
-        asyncreader.stop()
+            # If we decoded a valid JSON blob, update our last-packet time.
+            if _ok:
+                self.last_packet_time = time.time()
 
     def decoder_thread(self):
         """ Runs the supplied decoder command(s) as a subprocess, and passes returned lines to handle_decoder_line. """
 
         # Timeout Counter.
-        _last_packet = time.time()
+        self.last_packet_time = time.time()
+
+        # All decoder output is read by the shared pipe supervisor, which passes lines to our handlers as they arrive.
+        _supervisor = get_pipe_supervisor()
 
         if self.decoder_command_2 is None:
             # No second decoder command, so we only need to process stdout from the one process.
@@ -1521,52 +1605,45 @@ class SondeDecoder(object):
                 preexec_fn=os.setsid,
             )
 
-            self.demod_reader = AsynchronousFileReader(
-                self.demod_process.stderr, autostart=True
-            )
-
-            # Start thread to process demodulator stats.
-            self.demod_stats_thread = Thread(
-                target=self.stats_thread, args=(self.demod_reader,)
-            )
-            self.demod_stats_thread.start()
+            # Process demodulator stats from stderr.
+            _supervisor.register(self.demod_process.stderr, self.handle_demod_stats_line)
 
-        self.async_reader = AsynchronousFileReader(
-            self.decode_process.stdout, autostart=True
+        _supervisor.register(
+            self.decode_process.stdout,
+            self.handle_decoder_output,
+            self.handle_decoder_eof
         )
 
         self.log_info("Starting decoder subprocess.")
 
-        while (not self.async_reader.eof()) and self.decoder_running:
-            # Read in any lines available in the async reader queue.
-            for _line in self.async_reader.readlines():
-                if (_line != None) and (_line != ""):
-                    # Pass the line into the handler, and see if it is OK.
-                    _ok = self.handle_decoder_line(_line)
+        while self.decoder_running:
+            # Wait for decoder output, until the decoder exits, or we are asked to stop, checking the timeout counter
+            # periodically. The handler may also decide to stop this decoder (e.g. due to a lockout).
+            self.decoder_event.wait(1.0)
+            self.decoder_event.clear()
+
+            self.process_decoder_lines()
 
-                    # If we decoded a valid JSON blob, update our last-packet time.
-                    if _ok:
-                        _last_packet = time.time()
+            if self.decoder_eof:
+                break
 
-            # Check timeout counter.
             if (
                 (self.timeout > 0)
-                and (time.time() > (_last_packet + self.timeout))
+                and (time.time() > (self.last_packet_time + self.timeout))
                 and (not self.udp_mode)
             ):
                 # If we have not seen data for a while, break.
                 self.log_error("RX Timed out.")
                 self.exit_state = "Timeout"
                 break
-            else:
-                # Otherwise, sleep for a short time.
-                time.sleep(0.1)
 
         # Either our subprocess has exited, or the user has asked to close the process.
         # Try many things to kill off the subprocess.
         try:
-            # Stop the async reader
-            self.async_reader.stop()
+            # Stop handling output from the subprocesses.
+            _supervisor.unregister(self.decode_process.stdout)
+            if self.demod_process is not None:
+                _supervisor.unregister(self.demod_process.stderr)
             # Send a SIGKILL to the subprocess PID via OS.
             try:
                 os.killpg(os.getpgid(self.decode_process.pid), signal.SIGKILL)
@@ -1582,37 +1659,36 @@ class SondeDecoder(object):
                     self.demod_process.kill()
             except Exception as e:
                 self.log_debug("SIGKILL via subprocess.kill failed - %s" % str(e))
-            # Finally, join the async reader.
-            self.async_reader.join()
 
         except Exception as e:
             traceback.print_exc()
             self.log_error("Error while killing subprocess - %s" % str(e))
 
         self.log_info("Closed decoder subprocess.")
+        self.log_modem_stats()
         self.decoder_running = False
+        # Let the task manager know it can release our SDR.
+        autorx.task_events.put(("task_exit", self.sonde_freq))
 
     def handle_decoder_line(self, data):
         """ Handle a line of output from the decoder subprocess, and pass it onto all of the telemetry
             exporters.
 
         Args:
-            data (str, bytearray): One line of text output from the decoder subprocess.
+            data (bytes): One line of text output from the decoder subprocess.
 
         Returns:
             bool:   True if the line was decoded to a JSON object correctly, False otherwise.
         """
 
-        # Catch 'bad' first characters.
-        try:
-            _first_char = data.decode("ascii")[0]
-        except UnicodeDecodeError:
+        # Catch 'bad' characters.
+        if (len(data) == 0) or (not data.isascii()):
             return
 
         # Don't even try and decode lines which don't start with a '{'
         # These may be other output from the decoder, which we shouldn't try to parse.
         # If we have raw logging enabled, log these lines to disk.
-        if data.decode("ascii")[0] != "{":
+        if data[:1] != b"{":
 
             # Save the line verbatim to the raw data file, if we have that enabled
             if self.raw_file:
@@ -1621,8 +1697,10 @@ class SondeDecoder(object):
                 return
 
         else:
+            _t_start = time.perf_counter()
+
             try:
-                _telemetry = json.loads(data.decode("ascii"))
+                _telemetry = json_loads(data)
             except Exception as e:
                 self.log_debug("Line could not be parsed as JSON - %s" % str(e))
                 return False
@@ -1632,14 +1710,17 @@ class SondeDecoder(object):
                 self.log_error("Parsed JSON object is not a dictionary!")
                 return False
 
+            _t_parsed = time.perf_counter()
+
             # Check that the required fields are in the telemetry blob
-            for _field in self.DECODER_REQUIRED_FIELDS:
-                if _field not in _telemetry:
-                    self.log_error(
-                        "JSON object missing required field %s. Have you re-built the decoders? (./build.sh)"
-                        % _field
-                    )
-                    return False
+            if not self.DECODER_REQUIRED_FIELDS_SET.issubset(_telemetry.keys()):
+                for _field in self.DECODER_REQUIRED_FIELDS:
+                    if _field not in _telemetry:
+                        self.log_error(
+                            "JSON object missing required field %s. Have you re-built the decoders? (./build.sh)"
+                            % _field
+                        )
+                        return False
 
             # Check the decoder version matches our current version.
             # Note that we allow any version in UDP mode, as this is commonly used for experimentation work.
@@ -1655,9 +1736,8 @@ class SondeDecoder(object):
             # Check for fields which we need for logging purposes, but may not always be provided
             # in the incoming JSON object.
             # These get added in with dummy values.
-            for _field in self.DECODER_OPTIONAL_FIELDS.keys():
-                if _field not in _telemetry:
-                    _telemetry[_field] = self.DECODER_OPTIONAL_FIELDS[_field]
+            for _field in self.DECODER_OPTIONAL_FIELDS.keys() - _telemetry.keys():
+                _telemetry[_field] = self.DECODER_OPTIONAL_FIELDS[_field]
 
             # Check for an encrypted flag, and check if it is set.
             # Currently encrypted == true indicates an encrypted RS41-SGM. There's no point
@@ -1688,7 +1768,7 @@ class SondeDecoder(object):
 
             # Check the datetime field is parseable.
             try:
-                _telemetry["datetime_dt"] = parse(_telemetry["datetime"])
+                _telemetry["datetime_dt"] = parse_iso_datetime(_telemetry["datetime"])
             except Exception as e:
                 self.log_error(
                     "Invalid date/time in telemetry dict - %s (Sonde may not have GPS lock)"
@@ -1696,6 +1776,8 @@ class SondeDecoder(object):
                 )
                 return False
 
+            _t_validated = time.perf_counter()
+
             if self.udp_mode or (self.sonde_type == "RD94RD41"):
                 # Cases where we need to accept a type field from the decoder
                 # - UDP mode, where we could be getting packets from multiple decoders.
@@ -1934,6 +2016,10 @@ class SondeDecoder(object):
                 return False
 
 
+            _t_processed = time.perf_counter()
+
+            self.update_flight_state(_telemetry, _telem_ok == "OK")
+
             # If the telemetry is OK, send to the exporter functions (if we have any).
             if self.exporters is None:
                 return
@@ -1945,8 +2031,134 @@ class SondeDecoder(object):
                         except Exception as e:
                             self.log_error("Exporter Error %s" % str(e))
 
+            self.update_timing_stats(
+                _t_parsed - _t_start,
+                _t_validated - _t_parsed,
+                _t_processed - _t_validated,
+                time.perf_counter() - _t_processed
+            )
+
             return _telem_ok
 
+    def update_flight_state(self, telemetry, telemetry_ok):
+        """ Update the flight state of the sonde being decoded.
+
+        Args:
+            telemetry (dict): Telemetry dictionary.
+            telemetry_ok (bool): True if the telemetry passed the telemetry filter.
+        """
+        _now = time.time()
+        self.latest_telemetry = telemetry
+
+        if telemetry_ok:
+            self.last_good_telemetry_time = _now
+
+        # Ignore positions without GPS lock.
+        if (telemetry["lat"] == 0.0) and (telemetry["lon"] == 0.0):
+            return
+
+        self.altitude_history.append((_now, telemetry["alt"]))
+        if (self.max_altitude is None) or (telemetry["alt"] > self.max_altitude):
+            self.max_altitude = telemetry["alt"]
+
+    def ascent_rate(self, min_span=10.0):
+        """ Estimate the ascent rate of the sonde from the recent altitude history.
+
+        Args:
+            min_span (float): Minimum time span (seconds) of altitude history required.
+
+        Returns:
+            float/None: Ascent rate in m/s, or None if there is not enough history.
+        """
+        if len(self.altitude_history) < 2:
+            return None
+
+        (_t0, _alt0) = self.altitude_history[0]
+        (_t1, _alt1) = self.altitude_history[-1]
+
+        if (_t1 - _t0) < min_span:
+            return None
+
+        return (_alt1 - _alt0) / (_t1 - _t0)
+
+    def update_timing_stats(self, parse_time, validate_time, process_time, export_time):
+        """ Accumulate the time taken by each stage of handling a telemetry frame, and
+        periodically report the average per-frame times.
+
+        Args:
+            parse_time (float): Time spent parsing the JSON line, in seconds.
+            validate_time (float): Time spent checking fields and parsing the timestamp, in seconds.
+            process_time (float): Time spent on sonde-specific processing and filtering, in seconds.
+            export_time (float): Time spent passing the telemetry to the exporters, in seconds.
+        """
+        self.timing_stats["parse"] += parse_time
+        self.timing_stats["validate"] += validate_time
+        self.timing_stats["process"] += process_time
+        self.timing_stats["export"] += export_time
+        self.timing_frames += 1
+
+        if time.time() > (self.timing_last_report + self.TIMING_REPORT_INTERVAL):
+            self.log_debug(
+                "Telemetry handling time per frame (%d frames): %s"
+                % (
+                    self.timing_frames,
+                    ", ".join(
+                        "%s %.1f us" % (_stage, 1e6 * _time / self.timing_frames)
+                        for (_stage, _time) in self.timing_stats.items()
+                    ),
+                )
+            )
+            self.timing_last_report = time.time()
+
+    def get_timing_stats(self):
+        """ Get the average time spent in each stage of telemetry handling.
+
+        Returns:
+            dict: Average time per frame (in seconds) for each stage, along with the number of frames handled.
+        """
+        _stats = {"frames": self.timing_frames}
+        for (_stage, _time) in self.timing_stats.items():
+            _stats[_stage] = _time / self.timing_frames if self.timing_frames > 0 else 0.0
+
+        return _stats
+
+    def get_modem_stats(self):
+        """ Get the current modem statistics, and the SNR/PPM history over this decode, if available.
+
+        Returns:
+            dict: Latest 'snr', 'ppm' and 'fest' values, and the 'history' (see FSKDemodStats.get_history),
+                or None if this decoder does not produce modem statistics.
+        """
+        if self.demod_stats is None:
+            return None
+
+        return {
+            "snr": self.demod_stats.snr,
+            "ppm": self.demod_stats.ppm,
+            "fest": list(self.demod_stats.fest),
+            "history": self.demod_stats.get_history(),
+        }
+
+    def log_modem_stats(self):
+        """ Log a summary of the modem statistics over this decode. """
+        if (self.demod_stats is None) or (not self.demod_stats.keep_history):
+            return
+
+        _history = self.demod_stats.get_history()
+        if len(_history["snr"]) == 0:
+            return
+
+        self.log_info(
+            "Modem statistics over %d seconds: SNR min %.1f dB, mean %.1f dB, max %.1f dB, mean PPM %.1f"
+            % (
+                _history["time"][-1] - _history["time"][0] + _history["interval"],
+                min(_history["snr"]),
+                sum(_history["snr"]) / len(_history["snr"]),
+                max(_history["snr"]),
+                sum(_history["ppm"]) / len(_history["ppm"]),
+            )
+        )
+
     def log_debug(self, line):
         """ Helper function to log a debug message with a descriptive heading. 
         Args:
@@ -2015,6 +2227,10 @@ class SondeDecoder(object):
         
         self.decoder_running = False
 
+        # Wake up the decoder thread so it exits immediately.
+        if self.decoder is not None:
+            self.decoder_event.set()
+
         if self.decoder is not None and (not nowait):
             self.decoder.join()
         
@@ -0,0 +1,242 @@
+#!/usr/bin/env python
+#
+#   radiosonde_auto_rx - Scanner Frequency Prior
+#
+#   Released under GNU GPL v3 or later
+#
+#   Keeps a persistent history of the frequencies (and times) sondes have been received on by this station,
+#   built from the sonde log file names and from scanner detections. The scanner uses this to test
+#   frequencies which have been used before ahead of other peaks, and to test frequencies which are
+#   regularly used at this time of day even if no peak has been seen on them.
+#
+import datetime
+import glob
+import json
+import logging
+import os
+import time
+from threading import Lock
+
+import numpy as np
+
+
+class FrequencyPrior(object):
+    """ Scanner Frequency Prior
+
+    Each sonde reception is stored as a (timestamp, frequency) event. Frequencies are scored by summing a weight
+    for each event on that frequency, where the weight decays with the age of the event (with a half-life of
+    HALF_LIFE_DAYS), and with the difference between the time-of-day of the event and the current time-of-day.
+    As most stations see launches at the same times each day (i.e. the synoptic launch times), this favours the
+    frequencies in use by nearby launch sites at this time of day.
+
+    The history is saved as a JSON file within the log directory.
+    """
+
+    HISTORY_FILENAME = ".frequency_history.json"
+    HISTORY_VERSION = 1
+
+    # Events older than this are discarded.
+    MAX_AGE_DAYS = 365
+    # Event weights halve every HALF_LIFE_DAYS.
+    HALF_LIFE_DAYS = 30
+    # Width (standard deviation, hours) of the time-of-day weighting.
+    TIME_OF_DAY_SIGMA = 1.0
+    # Weight given to events at any other time of day, when ranking peaks.
+    TIME_OF_DAY_FLOOR = 0.1
+    # Receptions on the same frequency within this many seconds are treated as the same flight.
+    DUPLICATE_WINDOW = 3600
+
+    # Minimum time-of-day score (roughly, the number of recent flights around this time of day) for a frequency to
+    # be tested when no peak has been seen on it.
+    SEED_MIN_SCORE = 1.0
+
+    def __init__(self, log_directory, quantization=10000):
+        """ Initialise the frequency prior, loading any existing history, and adding in any sonde log files.
+
+        Args:
+            log_directory (str): Directory containing the sonde log files, where the history will be saved.
+            quantization (float): Frequency quantization (Hz), as used by the scanner.
+        """
+        self.log_directory = log_directory
+        self.history_path = os.path.join(log_directory, self.HISTORY_FILENAME)
+        self.quantization = quantization
+
+        self.lock = Lock()
+        # Event timestamps, keyed by quantized frequency (Hz).
+        self.events = {}
+
+        self.load()
+        self.add_log_files()
+        self.save()
+
+    def quantize(self, frequency):
+        """ Quantize a frequency (Hz) to the scanner quantization. """
+        return round(frequency / self.quantization) * self.quantization
+
+    def load(self):
+        """ Load the history from disk, if it exists. """
+        if not os.path.exists(self.history_path):
+            return
+
+        try:
+            with open(self.history_path, "r") as _f:
+                _history = json.load(_f)
+
+            if _history.get("version") == self.HISTORY_VERSION:
+                # Drop any events which are now too old.
+                _cutoff = time.time() - self.MAX_AGE_DAYS * 86400
+                for (_freq, _times) in _history["events"].items():
+                    _times = sorted([_time for _time in _times if _time > _cutoff])
+                    if len(_times) > 0:
+                        self.events[float(_freq)] = _times
+            else:
+                logging.info("Frequency Prior - History file version mismatch, rebuilding.")
+
+        except Exception as e:
+            logging.error("Frequency Prior - Could not read history file, rebuilding - %s" % str(e))
+            self.events = {}
+
+    def save(self):
+        """ Save the history to disk. The history is written to a temporary file and then moved into place. """
+        with self.lock:
+            _history = {
+                "version": self.HISTORY_VERSION,
+                "events": {str(_freq): _times for (_freq, _times) in self.events.items()},
+            }
+
+        _temp_path = self.history_path + ".tmp"
+        try:
+            with open(_temp_path, "w") as _f:
+                json.dump(_history, _f)
+            os.replace(_temp_path, self.history_path)
+        except Exception as e:
+            logging.error("Frequency Prior - Could not write history file - %s" % str(e))
+
+    def add_event(self, frequency, timestamp):
+        """ Add a sonde reception to the history, unless it is a repeat of a recent reception.
+
+        Args:
+            frequency (float): Sonde frequency, in Hz.
+            timestamp (float): Time of the reception (unix timestamp).
+
+        Returns:
+            bool: True if the event was added.
+        """
+        if timestamp < (time.time() - self.MAX_AGE_DAYS * 86400):
+            return False
+
+        _freq = self.quantize(frequency)
+
+        with self.lock:
+            _times = self.events.setdefault(_freq, [])
+
+            for _time in _times:
+                if abs(_time - timestamp) < self.DUPLICATE_WINDOW:
+                    return False
+
+            _times.append(timestamp)
+            _times.sort()
+
+        return True
+
+    def add_log_files(self):
+        """ Add the receptions recorded in the sonde log file names within the log directory. """
+        _count = 0
+
+        # Example log file name: ./log/20200320-063233_R2230624_RS41_402500_sonde.log
+        for _filename in glob.glob(os.path.join(self.log_directory, "*_sonde.log")):
+            try:
+                _fields = os.path.basename(_filename).split("_")
+                _time = datetime.datetime.strptime(_fields[0], "%Y%m%d-%H%M%S").replace(
+                    tzinfo=datetime.timezone.utc
+                )
+                _freq = float(_fields[3]) * 1e3
+            except Exception as e:
+                logging.debug(
+                    "Frequency Prior - Could not parse log file name %s - %s" % (_filename, str(e))
+                )
+                continue
+
+            if self.add_event(_freq, _time.timestamp()):
+                _count += 1
+
+        if _count > 0:
+            logging.info("Frequency Prior - Added %d receptions from sonde log files." % _count)
+
+    def add_detection(self, frequency):
+        """ Add a sonde detection from the scanner, and save the history if it was a new reception.
+
+        Args:
+            frequency (float): Sonde frequency, in Hz.
+        """
+        if self.add_event(frequency, time.time()):
+            self.save()
+
+    def score(self, frequency, now=None, floor=TIME_OF_DAY_FLOOR):
+        """ Score a frequency, based on how often, how recently, and at what times of day sondes have been received on it.
+
+        Args:
+            frequency (float): Frequency, in Hz.
+            now (float): Time to score for (unix timestamp). Defaults to the current time.
+            floor (float): Time-of-day weight given to events at a completely different time of day.
+
+        Returns:
+            float: The frequency score. Each reception contributes at most 1.0.
+        """
+        if now is None:
+            now = time.time()
+
+        with self.lock:
+            _times = self.events.get(self.quantize(frequency))
+            if not _times:
+                return 0.0
+            _times = np.array(_times)
+
+        _age_days = np.maximum(now - _times, 0) / 86400.0
+        _weights = 0.5 ** (_age_days / self.HALF_LIFE_DAYS)
+
+        # Difference in time-of-day, in hours, wrapping around midnight.
+        _hour_diff = np.abs(((now - _times) / 3600.0 + 12) % 24 - 12)
+        _weights *= floor + (1 - floor) * np.exp(-0.5 * (_hour_diff / self.TIME_OF_DAY_SIGMA) ** 2)
+
+        return float(np.sum(_weights))
+
+    def rank(self, frequencies, now=None):
+        """ Re-order a list of frequencies, moving frequencies that sondes have been received on to the front.
+
+        Frequencies with a history are ordered by score, and the remaining frequencies keep their existing order.
+
+        Args:
+            frequencies (np.ndarray): Frequencies, in Hz.
+            now (float): Time to rank for (unix timestamp). Defaults to the current time.
+
+        Returns:
+            np.ndarray: The re-ordered frequencies.
+        """
+        _scores = np.array([self.score(_freq, now=now) for _freq in frequencies])
+        # Stable sort, so frequencies without any history remain in order.
+        return np.asarray(frequencies)[np.argsort(-_scores, kind="stable")]
+
+    def suggest(self, min_freq, max_freq, count, now=None):
+        """ Suggest frequencies which are regularly used around this time of day.
+
+        Args:
+            min_freq (float): Minimum frequency, in Hz.
+            max_freq (float): Maximum frequency, in Hz.
+            count (int): Maximum number of frequencies to return.
+            now (float): Time to suggest for (unix timestamp). Defaults to the current time.
+
+        Returns:
+            list: Up to count frequencies (Hz), with a time-of-day score above SEED_MIN_SCORE, highest score first.
+        """
+        with self.lock:
+            _freqs = [_freq for _freq in self.events.keys() if min_freq <= _freq <= max_freq]
+
+        _scored = []
+        for _freq in _freqs:
+            _score = self.score(_freq, now=now, floor=0.0)
+            if _score >= self.SEED_MIN_SCORE:
+                _scored.append((_score, _freq))
+
+        _scored.sort(reverse=True)
+        return [_freq for (_score, _freq) in _scored[:count]]
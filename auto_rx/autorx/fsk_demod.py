@@ -8,7 +8,7 @@
 import json
 import logging
 import time
-import numpy as np
+from collections import deque
 
 
 class FSKDemodStats(object):
@@ -16,30 +16,55 @@ class FSKDemodStats(object):
     Process modem statistics produced by fsk_demod and provide access to
     filtered or instantaneous modem data.
 
+    Statistics within the averaging window are held in a fixed-size circular buffer, with a running sum (for the mean)
+    and a monotonic queue (for the peak), so each update takes constant time and memory.
+    Optionally, a decimated history of the SNR and PPM over the whole decode is also kept, again in constant memory.
+
     This class expects the JSON output from fsk_demod to be arriving in *realtime*.
     The test script below will emulate relatime input based on a file.
     """
 
     FSK_STATS_FIELDS = ["EbNodB", "ppm", "f1_est", "f2_est", "samp_fft"]
 
-    def __init__(self, averaging_time=5.0, peak_hold=False, decoder_id=""):
+    # Maximum number of statistics lines held within the averaging window.
+    # fsk_demod produces a few tens of lines per second, so this is well above what we need.
+    MAX_WINDOW_SAMPLES = 512
+
+    # Initial time resolution of the history (seconds), and the maximum number of history points.
+    # When the history is full, adjacent points are merged and the resolution halved.
+    HISTORY_INTERVAL = 1.0
+    HISTORY_LENGTH = 1024
+
+    def __init__(self, averaging_time=5.0, peak_hold=False, decoder_id="", keep_history=True):
         """
 
         Required Fields:
             averaging_time (float): Use the last X seconds of data in calculations.
             peak_hold (bool): If true, use a peak-hold SNR metric instead of a mean.
             decoder_id (str): A unique ID for this object (suggest use of the SDR device ID)
+            keep_history (bool): If true, keep a decimated history of the SNR and PPM, available via get_history.
             
         """
 
         self.averaging_time = float(averaging_time)
         self.peak_hold = peak_hold
         self.decoder_id = str(decoder_id)
-
-        # Input data stores.
-        self.in_times = np.array([])
-        self.in_snr = np.array([])
-        self.in_ppm = np.array([])
+        self.keep_history = keep_history
+
+        # Input data stores - (sequence number, time, snr, ppm) tuples within the averaging window.
+        self.window = deque()
+        self.window_seq = 0
+        self.snr_sum = 0.0
+        self.ppm_sum = 0.0
+        # Candidates for the peak SNR within the window, as (sequence number, snr), with decreasing SNR.
+        self.snr_peaks = deque()
+
+        # History store, and the accumulator for the current history point.
+        self.history_interval = self.HISTORY_INTERVAL
+        self.history_time = []
+        self.history_snr = []
+        self.history_ppm = []
+        self.history_bin = None
 
         # Output State variables.
         self.snr = -999.0
@@ -84,25 +109,100 @@ class FSKDemodStats(object):
         self.fest[0] = _data["f1_est"]
         self.fest[1] = _data["f2_est"]
 
-        # Time-series data
-        self.in_times = np.append(self.in_times, _time)
-        self.in_snr = np.append(self.in_snr, _data["EbNodB"])
-        self.in_ppm = np.append(self.in_ppm, _data["ppm"])
+        _snr = float(_data["EbNodB"])
+        _ppm = float(_data["ppm"])
 
-        # Calculate SNR / PPM
-        _time_range = self.in_times > (_time - self.averaging_time)
-        # Clip arrays to just the values we want
-        self.in_ppm = self.in_ppm[_time_range]
-        self.in_snr = self.in_snr[_time_range]
-        self.in_times = self.in_times[_time_range]
+        # Add the new values to the window.
+        self.window_seq += 1
+        self.window.append((self.window_seq, _time, _snr, _ppm))
+        self.snr_sum += _snr
+        self.ppm_sum += _ppm
+
+        while self.snr_peaks and self.snr_peaks[-1][1] <= _snr:
+            self.snr_peaks.pop()
+        self.snr_peaks.append((self.window_seq, _snr))
+
+        # Remove values which have fallen out of the averaging window.
+        _oldest = _time - self.averaging_time
+        while (len(self.window) > self.MAX_WINDOW_SAMPLES) or (self.window[0][1] <= _oldest):
+            (_, _, _old_snr, _old_ppm) = self.window.popleft()
+            self.snr_sum -= _old_snr
+            self.ppm_sum -= _old_ppm
+
+        while self.snr_peaks[0][0] < self.window[0][0]:
+            self.snr_peaks.popleft()
 
         # Always just take a mean of the PPM values.
-        self.ppm = np.mean(self.in_ppm)
+        self.ppm = self.ppm_sum / len(self.window)
+
+        if self.peak_hold:
+            self.snr = self.snr_peaks[0][1]
+        else:
+            self.snr = self.snr_sum / len(self.window)
+
+        if self.keep_history:
+            self.update_history(_time, _snr, _ppm)
+
+    def update_history(self, timestamp, snr, ppm):
+        """ Add a set of values to the history, closing off the current history point if its interval has passed. """
+        if (self.history_bin is not None) and (timestamp >= self.history_bin["time"] + self.history_interval):
+            self.add_history_point()
 
+        if self.history_bin is None:
+            self.history_bin = {"time": timestamp, "snr_sum": 0.0, "snr_max": snr, "ppm_sum": 0.0, "count": 0}
+
+        self.history_bin["snr_sum"] += snr
+        self.history_bin["snr_max"] = max(self.history_bin["snr_max"], snr)
+        self.history_bin["ppm_sum"] += ppm
+        self.history_bin["count"] += 1
+
+    def add_history_point(self):
+        """ Move the current history accumulator into the history, decimating the history if it is full. """
+        _bin = self.history_bin
+        self.history_bin = None
+
+        self.history_time.append(_bin["time"])
         if self.peak_hold:
-            self.snr = np.max(self.in_snr)
+            self.history_snr.append(_bin["snr_max"])
         else:
-            self.snr = np.mean(self.in_snr)
+            self.history_snr.append(_bin["snr_sum"] / _bin["count"])
+        self.history_ppm.append(_bin["ppm_sum"] / _bin["count"])
+
+        if len(self.history_time) >= self.HISTORY_LENGTH:
+            # Merge pairs of points, halving the time resolution. (HISTORY_LENGTH is even, so there are no left-over points.)
+            _snr_pairs = zip(self.history_snr[0::2], self.history_snr[1::2])
+            _ppm_pairs = zip(self.history_ppm[0::2], self.history_ppm[1::2])
+
+            self.history_time = self.history_time[0::2]
+            if self.peak_hold:
+                self.history_snr = [max(_a, _b) for (_a, _b) in _snr_pairs]
+            else:
+                self.history_snr = [(_a + _b) / 2.0 for (_a, _b) in _snr_pairs]
+            self.history_ppm = [(_a + _b) / 2.0 for (_a, _b) in _ppm_pairs]
+            self.history_interval *= 2
+
+    def get_history(self):
+        """ Get the SNR and PPM history.
+
+        Returns:
+            dict: 'interval' (time resolution of the history, seconds), and lists of 'time' (unix timestamp of the start
+                of each point), 'snr' and 'ppm'. The SNR values are peak or mean values, depending on peak_hold.
+        """
+        _output = {
+            "interval": self.history_interval,
+            "time": list(self.history_time),
+            "snr": list(self.history_snr),
+            "ppm": list(self.history_ppm),
+        }
+
+        # Include the point currently being accumulated.
+        if self.history_bin is not None:
+            _bin = self.history_bin
+            _output["time"].append(_bin["time"])
+            _output["snr"].append(_bin["snr_max"] if self.peak_hold else _bin["snr_sum"] / _bin["count"])
+            _output["ppm"].append(_bin["ppm_sum"] / _bin["count"])
+
+        return _output
 
     def log_debug(self, line):
         """ Helper function to log a debug message with a descriptive heading. 
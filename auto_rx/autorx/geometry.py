@@ -5,10 +5,12 @@
 #   Copyright (C) 2018  Mark Jessop <vk5qi@rfhead.net>
 #   Released under GNU GPL v3 or later
 #
+import datetime
 import math
 import traceback
 import logging
 import numpy as np
+from collections import deque
 from .utils import position_info
 
 
@@ -83,6 +85,56 @@ def getDensity(altitude, get_pressure=False):
     return density
 
 
+def getPressureArray(altitude):
+    """
+    Calculate the ISA atmospheric pressure (in Pa) for an array of altitudes in metres.
+    This is a vectorised version of getDensity(altitude, get_pressure=True).
+    """
+
+    # Constants
+    airMolWeight = 28.9644  # Molecular weight of air
+    pressureSL = 101325  # Pressure at sea level [Pa]
+    gravity = 9.80665  # Acceleration of gravity [m/s2]
+    RGas = 8.31432  # Gas constant [kg/Mol/K]
+
+    # Lookup Tables
+    altitudes = np.array([0, 11000, 20000, 32000, 47000, 51000, 71000, 84852])
+    pressureRels = np.array([
+        1,
+        2.23361105092158e-1,
+        5.403295010784876e-2,
+        8.566678359291667e-3,
+        1.0945601337771144e-3,
+        6.606353132858367e-4,
+        3.904683373343926e-5,
+        3.6850095235747942e-6,
+    ])
+    temperatures = np.array([288.15, 216.65, 216.65, 228.65, 270.65, 270.65, 214.65, 186.946])
+    tempGrads = np.array([-6.5, 0, 1, 2.8, 0, -2.8, -2, 0]) / 1000.0
+    gMR = gravity * airMolWeight / RGas
+
+    altitude = np.asarray(altitude, dtype=np.float64)
+
+    # Pick a region to work in for each altitude
+    i = np.clip(np.searchsorted(altitudes, altitude, side="left") - 1, 0, len(altitudes) - 1)
+
+    baseTemp = temperatures[i]
+    tempGrad = tempGrads[i]
+    deltaAltitude = altitude - altitudes[i]
+    temperature = baseTemp + tempGrad * deltaAltitude
+
+    # Calculate relative pressure, using the isothermal formula where there is no temperature gradient.
+    _isothermal = np.abs(tempGrad) < 1e-10
+    _safe_grad = np.where(_isothermal, 1.0, tempGrad)
+    pressureRel = pressureRels[i] * np.where(
+        _isothermal,
+        np.exp(-1 * gMR * deltaAltitude / 1000.0 / baseTemp),
+        np.power(baseTemp / temperature, gMR / _safe_grad / 1000.0),
+    )
+
+    return pressureRel * pressureSL
+
+
 def seaLevelDescentRate(descent_rate, altitude):
     """ Calculate the descent rate at sea level, for a given descent rate at altitude """
 
@@ -125,9 +177,15 @@ class GenericTrack(object):
     Telemetry is added using the add_telemetry method, which takes a dictionary with time/lat/lon/alt keys (at minimum).
     This object performs a running average of the ascent/descent rate, and calculates the predicted landing rate if the payload
     is in descent.
-    The track history can be exported to a LineString using the to_line_string method.
+    The track history can be exported to a Leaflet-compatible polyline using the to_polyline method.
+
+    Positions are stored in preallocated numpy arrays. If max_elements is set, the track is a fixed-size ring buffer
+    holding the most recent max_elements positions, otherwise the arrays grow as required.
     """
 
+    # Initial capacity of tracks without a maximum size. This is doubled each time the track fills up.
+    INITIAL_CAPACITY = 256
+
     def __init__(self, ascent_averaging=6, landing_rate=5.0, max_elements=None):
         """ Create a GenericTrack Object. """
 
@@ -142,8 +200,69 @@ class GenericTrack(object):
         self.is_descending = False
 
         # Internal store of track history data.
-        # Data is stored as a list-of-lists, with elements of [datetime, lat, lon, alt, comment]
-        self.track_history = []
+        # Positions are stored as rows of [lat, lon, alt], with times stored separately as seconds since time_origin
+        # (the time of the first entry).
+        # With a maximum size set, each entry is written twice (at slot i and i + max_elements), so the
+        # current contents of the ring buffer are always available as a contiguous slice.
+        if self.max_elements:
+            self.capacity = self.max_elements
+            _rows = 2 * self.capacity
+        else:
+            self.capacity = self.INITIAL_CAPACITY
+            _rows = self.capacity
+
+        self.positions = np.zeros((_rows, 3))
+        self.times = np.zeros(_rows)
+        self.comments = [""] * self.capacity
+        # Start of the data within the arrays, and number of entries.
+        self.start = 0
+        self.length = 0
+        # Datetimes of the first and most recent entries.
+        self.time_origin = None
+        self.latest_time = None
+
+        # Ascent rates between the most recent positions, and their sum, for the running average.
+        self.ascent_rates = deque()
+        self.ascent_rate_sum = 0.0
+
+    def __len__(self):
+        return self.length
+
+    def index(self, position):
+        """ Convert a position within the track (negative values count back from the latest entry) to an array index. """
+        if position < 0:
+            position += self.length
+        return self.start + position
+
+    def append(self, timestamp, lat, lon, alt, comment):
+        """ Add an entry to the track history, discarding the oldest entry if the track is full. """
+        if self.max_elements:
+            if self.length < self.capacity:
+                _slot = self.start + self.length
+                self.length += 1
+            else:
+                # Overwrite the oldest entry.
+                _slot = self.start
+                self.start = (self.start + 1) % self.capacity
+
+            _slot = _slot % self.capacity
+            for _row in (_slot, _slot + self.capacity):
+                self.positions[_row] = (lat, lon, alt)
+                self.times[_row] = timestamp
+
+        else:
+            if self.length == self.capacity:
+                self.capacity *= 2
+                self.positions = np.resize(self.positions, (self.capacity, 3))
+                self.times = np.resize(self.times, self.capacity)
+                self.comments.extend([""] * (self.capacity - len(self.comments)))
+
+            _slot = self.length
+            self.length += 1
+            self.positions[_slot] = (lat, lon, alt)
+            self.times[_slot] = timestamp
+
+        self.comments[_slot] = comment
 
     def add_telemetry(self, data_dict):
         """ 
@@ -161,12 +280,13 @@ class GenericTrack(object):
             else:
                 _comment = ""
 
-            self.track_history.append([_datetime, _lat, _lon, _alt, _comment])
+            if self.time_origin is None:
+                self.time_origin = _datetime
 
-            # Clip size of track history if a maximum number of elements is set.
-            if self.max_elements:
-                if len(self.track_history) > self.max_elements:
-                    self.track_history = self.track_history[1:]
+            self.append(
+                (_datetime - self.time_origin).total_seconds(), _lat, _lon, _alt, _comment
+            )
+            self.latest_time = _datetime
 
             self.update_states()
             return self.get_latest_state()
@@ -180,18 +300,32 @@ class GenericTrack(object):
                 "Track - Error adding new telemetry to GenericTrack %s" % str(e)
             )
 
+    @property
+    def track_history(self):
+        """ The track history as a list-of-lists, with elements of [datetime, lat, lon, alt, comment].
+        This creates a new list each time, so to_polyline should be used where possible. """
+        _history = []
+        for _i in range(self.length):
+            _index = self.index(_i)
+            _time = self.time_origin + datetime.timedelta(seconds=float(self.times[_index]))
+            _history.append(
+                [_time] + self.positions[_index].tolist() + [self.comments[_index % self.capacity]]
+            )
+
+        return _history
+
     def get_latest_state(self):
         """ Get the latest position of the payload """
 
-        if len(self.track_history) == 0:
+        if self.length == 0:
             return None
         else:
-            _latest_position = self.track_history[-1]
+            (_lat, _lon, _alt) = self.positions[self.index(-1)].tolist()
             _state = {
-                "time": _latest_position[0],
-                "lat": _latest_position[1],
-                "lon": _latest_position[2],
-                "alt": _latest_position[3],
+                "time": self.latest_time,
+                "lat": _lat,
+                "lon": _lon,
+                "alt": _alt,
                 "ascent_rate": self.ascent_rate,
                 "is_descending": self.is_descending,
                 "landing_rate": self.landing_rate,
@@ -201,91 +335,75 @@ class GenericTrack(object):
             return _state
 
     def calculate_ascent_rate(self):
-        """ Calculate the ascent/descent rate of the payload based on the available data """
-        if len(self.track_history) <= 1:
+        """ Calculate the ascent/descent rate of the payload, averaged over the last ASCENT_AVERAGING positions.
+        The rate between the two latest positions is added to a running sum, so this must be called once per new position. """
+        if self.length <= 1:
             return 0.0
-        elif len(self.track_history) == 2:
-            # Basic ascent rate case - only 2 samples.
-            _time_delta = (
-                self.track_history[-1][0] - self.track_history[-2][0]
-            ).total_seconds()
-            _altitude_delta = self.track_history[-1][3] - self.track_history[-2][3]
 
-            return _altitude_delta / _time_delta
+        _time_delta = float(self.times[self.index(-1)] - self.times[self.index(-2)])
+        _altitude_delta = float(
+            self.positions[self.index(-1), 2] - self.positions[self.index(-2), 2]
+        )
+        # Raises ZeroDivisionError for positions with the same timestamp, which are then left out of the average.
+        _rate = _altitude_delta / _time_delta
 
-        else:
-            _num_samples = min(len(self.track_history), self.ASCENT_AVERAGING)
-            _asc_rates = []
+        self.ascent_rates.append(_rate)
+        self.ascent_rate_sum += _rate
+        # Average over the rates between the last ASCENT_AVERAGING positions held in the track.
+        _num_samples = self.ASCENT_AVERAGING
+        if self.max_elements:
+            _num_samples = min(_num_samples, self.max_elements)
 
-            for _i in range(-1 * (_num_samples - 1), 0):
-                _time_delta = (
-                    self.track_history[_i][0] - self.track_history[_i - 1][0]
-                ).total_seconds()
-                _altitude_delta = (
-                    self.track_history[_i][3] - self.track_history[_i - 1][3]
-                )
-                _asc_rates.append(_altitude_delta / _time_delta)
+        while len(self.ascent_rates) > max(1, _num_samples - 1):
+            self.ascent_rate_sum -= self.ascent_rates.popleft()
 
-            return np.mean(_asc_rates)
+        return self.ascent_rate_sum / len(self.ascent_rates)
 
-    def calculate_heading(self):
-        """ Calculate the heading of the payload """
-        if len(self.track_history) <= 1:
-            return 0.0
+    def calculate_heading_speed(self):
+        """ Calculate the heading (degrees) and speed (metres per second) of the payload, from the last two positions """
+        if self.length <= 1:
+            return (0.0, 0.0)
         else:
-            _pos_1 = self.track_history[-2]
-            _pos_2 = self.track_history[-1]
+            _time_delta = float(self.times[self.index(-1)] - self.times[self.index(-2)])
+            _pos_1 = self.positions[self.index(-2)].tolist()
+            _pos_2 = self.positions[self.index(-1)].tolist()
 
-            _pos_info = position_info(
-                (_pos_1[1], _pos_1[2], _pos_1[3]), (_pos_2[1], _pos_2[2], _pos_2[3])
-            )
+            _pos_info = position_info(_pos_1, _pos_2)
 
-            return _pos_info["bearing"]
+            _speed = _pos_info["great_circle_distance"] / _time_delta
 
-    def calculate_speed(self):
-        """ Calculate Payload Speed in metres per second """
-        if len(self.track_history) <= 1:
-            return 0.0
-        else:
-            _time_delta = (
-                self.track_history[-1][0] - self.track_history[-2][0]
-            ).total_seconds()
-            _pos_1 = self.track_history[-2]
-            _pos_2 = self.track_history[-1]
-
-            _pos_info = position_info(
-                (_pos_1[1], _pos_1[2], _pos_1[3]), (_pos_2[1], _pos_2[2], _pos_2[3])
-            )
+            return (_pos_info["bearing"], _speed)
 
-            _speed = _pos_info["great_circle_distance"] / _time_delta
+    def calculate_heading(self):
+        """ Calculate the heading of the payload """
+        return self.calculate_heading_speed()[0]
 
-            return _speed
+    def calculate_speed(self):
+        """ Calculate Payload Speed in metres per second """
+        return self.calculate_heading_speed()[1]
 
     def update_states(self):
         """ Update internal states based on the current data """
         self.ascent_rate = self.calculate_ascent_rate()
-        self.heading = self.calculate_heading()
-        self.speed = self.calculate_speed()
+        (self.heading, self.speed) = self.calculate_heading_speed()
         self.is_descending = self.ascent_rate < 0.0
 
         if self.is_descending:
-            _current_alt = self.track_history[-1][3]
+            _current_alt = self.positions[self.index(-1), 2]
             self.landing_rate = seaLevelDescentRate(self.ascent_rate, _current_alt)
 
     def to_polyline(self):
-        """ Generate and return a Leaflet PolyLine compatible array """
-        # Copy array into a numpy representation for easier slicing.
-        if len(self.track_history) == 0:
-            return []
-        elif len(self.track_history) == 1:
+        """ Generate and return a Leaflet PolyLine compatible array of [lat, lon, alt] rows.
+        This is a read-only view of the track data, which is only valid until more telemetry is added
+        (use .tolist() to get a copy). """
+        if self.length == 0:
+            return np.empty((0, 3))
+        elif self.length == 1:
             # LineStrings need at least 2 points. If we only have a single point,
             # fudge it by duplicating the single point.
-            _track_data_np = np.array([self.track_history[0], self.track_history[0]])
-        else:
-            _track_data_np = np.array(self.track_history)
-        # Produce new array
-        _track_points = np.column_stack(
-            (_track_data_np[:, 1], _track_data_np[:, 2], _track_data_np[:, 3])
-        )
+            return np.repeat(self.positions[self.index(0) : self.index(1)], 2, axis=0)
+
+        _track_points = self.positions[self.index(0) : self.index(0) + self.length]
+        _track_points.flags.writeable = False
 
-        return _track_points.tolist()
+        return _track_points
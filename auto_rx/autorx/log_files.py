@@ -14,6 +14,8 @@ import logging
 import os.path
 import time
 import zipfile
+from collections import OrderedDict
+from threading import Lock
 import xml.etree.ElementTree as ET
 
 import numpy as np
@@ -24,8 +26,17 @@ from autorx.utils import (
     short_short_type_lookup,
     strip_sonde_serial,
     position_info,
+    position_info_array,
 )
-from autorx.geometry import GenericTrack, getDensity
+from autorx.geometry import GenericTrack, getPressureArray
+from autorx.log_index import get_log_index
+from autorx.log_sidecar import read_sidecar
+
+
+# Cache of recently calculated Skew-T datasets, keyed by log filename, modification time, size and decimation.
+SKEWT_CACHE_SIZE = 32
+skewt_cache = OrderedDict()
+skewt_cache_lock = Lock()
 
 
 def log_filename_to_stats(filename, quicklook=False, stats_fields=False):
@@ -109,99 +120,38 @@ def log_filename_to_stats(filename, quicklook=False, stats_fields=False):
 
 
 def log_quick_look(filename, stats_fields=False):
-    """ Attempt to read in the first and last line in a log file, and return the first/last position observed. """
+    """ Attempt to read in the first and last line in a log file, and return the first/last position observed.
+    The positions are taken from the log file index, so the log file is only read if it has changed. """
 
-    _filesize = os.path.getsize(filename)
-
-    # Open the file and get the header line
-    _file = open(filename, "r")
-    _header = _file.readline()
+    _endpoints = get_log_index(os.path.dirname(filename)).get_endpoints(filename)
 
-    # Discard anything
-    if "timestamp,serial,frame,lat,lon,alt" not in _header:
+    if _endpoints is None:
         return None
 
-    _output = {}
+    _output = {"has_snr": _endpoints["has_snr"]}
 
-    if "snr" in _header:
-        _output["has_snr"] = True
-    else:
-        _output["has_snr"] = False
-
-    try:
-        # Naeive read of the first data line
-        _first = _file.readline()
-        _fields = _first.split(",")
-        _first_datetime = _fields[0]
-        _serial = _fields[1]
-        _first_lat = float(_fields[3])
-        _first_lon = float(_fields[4])
-        _first_alt = float(_fields[5])
+    for _point in ["first", "last"]:
+        _pos = _endpoints[_point]
         _pos_info = position_info(
             (
                 autorx.config.global_config["station_lat"],
                 autorx.config.global_config["station_lon"],
                 autorx.config.global_config["station_alt"],
             ),
-            (_first_lat, _first_lon, _first_alt),
+            (_pos["lat"], _pos["lon"], _pos["alt"]),
         )
-        _output["first"] = {
-            "datetime": _first_datetime,
-            "lat": _first_lat,
-            "lon": _first_lon,
-            "alt": _first_alt,
+        _output[_point] = {
+            "datetime": _pos["datetime"],
+            "lat": _pos["lat"],
+            "lon": _pos["lon"],
+            "alt": _pos["alt"],
             "range_km": round(_pos_info["straight_distance"] / 1000.0, 1),
             "bearing": round(_pos_info["bearing"], 1),
         }
         if stats_fields:
-            _output["first"]["elevation"] = _pos_info["elevation"]
-    except Exception as e:
-        # Couldn't read the first line, so likely no data.
-        return None
+            _output[_point]["elevation"] = _pos_info["elevation"]
 
-    # Now we try and seek to near the end of the file.
-    _seek_point = _filesize - 300
-    if _seek_point < 0:
-        # Don't bother trying to read the last line, it'll be the same as the first line.
-        _output["last"] = _output["first"]
-        return _output
-
-    # Read in the rest of the file
-    try:
-        _file.seek(_seek_point)
-        _remainder = _file.read()
-        # Get the last line
-        _last_line = _remainder.split("\n")[-2]
-        _fields = _last_line.split(",")
-        _last_datetime = _fields[0]
-        _last_lat = float(_fields[3])
-        _last_lon = float(_fields[4])
-        _last_alt = float(_fields[5])
-        _pos_info = position_info(
-            (
-                autorx.config.global_config["station_lat"],
-                autorx.config.global_config["station_lon"],
-                autorx.config.global_config["station_alt"],
-            ),
-            (_last_lat, _last_lon, _last_alt),
-        )
-        _output["last"] = {
-            "datetime": _last_datetime,
-            "lat": _last_lat,
-            "lon": _last_lon,
-            "alt": _last_alt,
-            "range_km": round(_pos_info["straight_distance"] / 1000.0, 1),
-            "bearing": round(_pos_info["bearing"], 1),
-        }
-        if stats_fields:
-            _output["last"]["elevation"] = _pos_info["elevation"]
-        return _output
-    except Exception as e:
-        # Couldn't read in the last line for some reason.
-        # Return what we have
-        logging.error(f"Error reading last line of {filename}: {str(e)}")
-        _output["last"] = _output["first"]
-        return _output
+    return _output
 
 
 def list_log_files(quicklook=False, stats_fields=False, custom_log_dir=None):
@@ -231,12 +181,22 @@ def list_log_files(quicklook=False, stats_fields=False, custom_log_dir=None):
         if _entry:
             _output.append(_entry)
 
+    if quicklook:
+        # Drop index entries for deleted log files, and save out anything we had to read in.
+        _index = get_log_index(os.path.dirname(_log_mask))
+        _index.prune(_log_files)
+        _index.save(force=True)
+
     return _output
 
 
-def read_log_file(filename, skewt_decimation=10):
-    """ Read in a log file """
-    logging.debug(f"Attempting to read file: {filename}")
+def read_log_csv(filename):
+    """ Read in the telemetry data from a CSV log file.
+
+    Returns:
+        tuple: (data, fields), where data is a structured array of log data, and fields maps
+            field names to columns within data.
+    """
 
     # Open the file and get the header line
     _file = open(filename, "r")
@@ -302,6 +262,43 @@ def read_log_file(filename, skewt_decimation=10):
         # Deal with log files with only one entry cleanly.
         _data = np.array([_data])
 
+    return (_data, fields)
+
+
+def read_log_data(filename):
+    """ Read in the telemetry data from a log file, using the binary sidecar file if one is available
+    and up to date, and otherwise parsing the CSV log file.
+
+    Returns:
+        tuple: (data, fields), where data can be indexed by the column names in fields.
+    """
+    _data = None
+
+    try:
+        _endpoints = get_log_index(os.path.dirname(filename)).get_endpoints(filename)
+        if _endpoints:
+            _data = read_sidecar(
+                filename,
+                first_datetime=_endpoints["first"]["datetime"],
+                last_datetime=_endpoints["last"]["datetime"],
+            )
+    except Exception as e:
+        logging.error(f"Error reading log sidecar for {filename}: {str(e)}")
+        _data = None
+
+    if _data is not None:
+        logging.debug(f"Using binary sidecar for {filename}")
+        return (_data, {_field: _field for _field in _data})
+
+    return read_log_csv(filename)
+
+
+def read_log_file(filename, skewt_decimation=10):
+    """ Read in a log file """
+    logging.debug(f"Attempting to read file: {filename}")
+
+    (_data, fields) = read_log_data(filename)
+
     # Now we need to rearrange some data for easier use in the client
     _output = {"serial": strip_sonde_serial(_data[fields["serial"]][0])}
 
@@ -354,20 +351,51 @@ def read_log_file(filename, skewt_decimation=10):
     if "snr" in fields:
         _output["snr"] = _data[fields["snr"]].tolist()
 
-    _output["skewt"] = calculate_skewt_data(
-        _data[fields["datetime"]],
-        _data[fields["latitude"]],
-        _data[fields["longitude"]],
-        _data[fields["altitude"]],
-        _data[fields["temp"]],
-        _data[fields["humidity"]],
-        _press,
-        decimation=skewt_decimation,
-    )
+    # Skew-T data only changes if the log file changes, so we can re-use previous results.
+    _stat = os.stat(filename)
+    _cache_key = (filename, _stat.st_mtime, _stat.st_size, skewt_decimation)
+
+    with skewt_cache_lock:
+        _skewt = skewt_cache.get(_cache_key)
+        if _skewt is not None:
+            skewt_cache.move_to_end(_cache_key)
+
+    if _skewt is None:
+        _skewt = calculate_skewt_data(
+            _data[fields["datetime"]],
+            _data[fields["latitude"]],
+            _data[fields["longitude"]],
+            _data[fields["altitude"]],
+            _data[fields["temp"]],
+            _data[fields["humidity"]],
+            _press,
+            decimation=skewt_decimation,
+        )
+
+        with skewt_cache_lock:
+            skewt_cache[_cache_key] = _skewt
+            while len(skewt_cache) > SKEWT_CACHE_SIZE:
+                skewt_cache.popitem(last=False)
+
+    _output["skewt"] = _skewt
 
     return _output
 
 
+def _timestamps_to_seconds(datetime):
+    """ Convert an array of ISO8601 timestamp strings to seconds (as floats) relative to an arbitrary epoch. """
+    _datetime = np.asarray(datetime).astype(str)
+
+    try:
+        # Fast path for the timestamps written by the decoders (YYYY-MM-DDTHH:MM:SS.sssZ)
+        _dt64 = np.char.rstrip(_datetime, "Z").astype("datetime64[us]")
+        return (_dt64 - _dt64[0]).astype(np.float64) / 1e6
+    except ValueError:
+        # Something unusual in the timestamps, so fall back to parsing them one at a time.
+        _start = parse(_datetime[0])
+        return np.array([(parse(_dt) - _start).total_seconds() for _dt in _datetime])
+
+
 def calculate_skewt_data(
     datetime,
     latitude,
@@ -378,7 +406,8 @@ def calculate_skewt_data(
     pressure=None,
     decimation=5,
 ):
-    """ Work through a set of sonde data, and produce a dataset suitable for plotting in skewt-js """
+    """ Work through a set of sonde data, and produce a dataset suitable for plotting in skewt-js.
+    All calculations are performed on whole columns at once. """
 
     # A few basic checks initially
 
@@ -386,6 +415,10 @@ def calculate_skewt_data(
     if len(datetime) < 10:
         return []
 
+    altitude = np.asarray(altitude, dtype=np.float64)
+    temperature = np.asarray(temperature, dtype=np.float64)
+    humidity = np.asarray(humidity, dtype=np.float64)
+
     # Figure out if we have any ascent data at all.
     _burst_idx = np.argmax(altitude)
 
@@ -397,82 +430,87 @@ def calculate_skewt_data(
         # No point plotting SkewT plots for data only gathered above 10km altitude...
         return []
 
-    _skewt = []
+    # Points to use, starting on index one, up to the first point after burst.
+    _idx = np.arange(1, min(len(datetime), _burst_idx + decimation), decimation)
 
-    # Make sure we start on index one.
-    i = -1*decimation + 1
+    # If we don't have any valid temp data, skip the point.
+    _idx = _idx[temperature[_idx] >= -260.0]
 
-    while i < _burst_idx:
-        i += decimation
+    # Time between each point and its predecessor.
+    _seconds = _timestamps_to_seconds(datetime)
+    _time_delta = _seconds[_idx] - _seconds[_idx - 1]
+    _idx = _idx[_time_delta != 0]
+    _time_delta = _time_delta[_time_delta != 0]
 
-        # If we've hit the end of our data, break.
-        if i > (len(datetime) - 1):
-            break
+    if len(_idx) == 0:
+        return []
 
-        try:
-            if temperature[i] < -260.0:
-                # If we don't have any valid temp data, just skip this point
-                # to avoid doing un-necessary calculations
-                continue
-
-            _time_delta = (parse(datetime[i]) - parse(datetime[i - 1])).total_seconds()
-            if _time_delta == 0:
-                continue
-
-            _old_pos = (latitude[i - 1], longitude[i - 1], altitude[i - 1])
-            _new_pos = (latitude[i], longitude[i], altitude[i])
-
-            _pos_delta = position_info(_old_pos, _new_pos)
-
-            _speed = _pos_delta["great_circle_distance"] / _time_delta
-            _bearing = (_pos_delta["bearing"] + 180.0) % 360.0
-
-            if pressure is None:
-                _pressure = getDensity(altitude[i], get_pressure=True) / 100.0
-            elif pressure[i] < 0.0:
-                _pressure = getDensity(altitude[i], get_pressure=True) / 100.0
-            else:
-                _pressure = pressure[i]
-
-            _temp = temperature[i]
-
-            if humidity[i] > 0.0:
-                _rh = humidity[i]
-
-                _dp = (
-                    243.04
-                    * (np.log(_rh / 100) + ((17.625 * _temp) / (243.04 + _temp)))
-                    / (
-                        17.625
-                        - np.log(_rh / 100)
-                        - ((17.625 * _temp) / (243.04 + _temp))
-                    )
-                )
-            else:
-                _dp = -999.0
-
-            if np.isnan(_dp):
-                continue
-
-            _skewt.append(
-                {
-                    "press": _pressure,
-                    "hght": altitude[i],
-                    "temp": _temp,
-                    "dwpt": _dp,
-                    "wdir": _bearing,
-                    "wspd": _speed,
-                }
+    latitude = np.asarray(latitude, dtype=np.float64)
+    longitude = np.asarray(longitude, dtype=np.float64)
+    _pos_delta = position_info_array(
+        (latitude[_idx - 1], longitude[_idx - 1], altitude[_idx - 1]),
+        (latitude[_idx], longitude[_idx], altitude[_idx]),
+    )
+    _speed = _pos_delta["great_circle_distance"] / _time_delta
+    _bearing = (_pos_delta["bearing"] + 180.0) % 360.0
+
+    # Use the ISA pressure where we don't have pressure data from the sonde.
+    _pressure = getPressureArray(altitude[_idx]) / 100.0
+    if pressure is not None:
+        _sonde_pressure = np.asarray(pressure, dtype=np.float64)[_idx]
+        _pressure = np.where(_sonde_pressure < 0.0, _pressure, _sonde_pressure)
+
+    _temp = temperature[_idx]
+    _rh = humidity[_idx]
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        _log_rh = np.log(_rh / 100)
+        _dp = (
+            243.04
+            * (_log_rh + ((17.625 * _temp) / (243.04 + _temp)))
+            / (
+                17.625
+                - _log_rh
+                - ((17.625 * _temp) / (243.04 + _temp))
             )
+        )
+    _dp = np.where(_rh > 0.0, _dp, -999.0)
+
+    _valid = ~np.isnan(_dp)
+    _idx = _idx[_valid]
+    _speed = _speed[_valid]
+    _bearing = _bearing[_valid]
+    _pressure = _pressure[_valid]
+    _temp = _temp[_valid]
+    _dp = _dp[_valid]
+
+    # Only produce data up to 50hPa (~20km alt), which is the top of the skewt plot.
+    # We *could* go above this, but the data becomes less useful at those altitudes.
+    _top = np.nonzero(_pressure < 50.0)[0]
+    if len(_top) > 0:
+        _end = _top[0] + 1
+    else:
+        _end = len(_idx)
 
-            # Only produce data up to 50hPa (~20km alt), which is the top of the skewt plot.
-            # We *could* go above this, but the data becomes less useful at those altitudes.
-            if _pressure < 50.0:
-                break
-
-        except Exception as e:
-            logging.exception(f"Exception {str(e)} in calculate_skewt_data")
-            raise
+    _skewt = []
+    for (_p, _h, _t, _d, _wdir, _wspd) in zip(
+        _pressure[:_end].tolist(),
+        altitude[_idx[:_end]].tolist(),
+        _temp[:_end].tolist(),
+        _dp[:_end].tolist(),
+        _bearing[:_end].tolist(),
+        _speed[:_end].tolist(),
+    ):
+        _skewt.append(
+            {
+                "press": _p,
+                "hght": _h,
+                "temp": _t,
+                "dwpt": _d,
+                "wdir": _wdir,
+                "wspd": _wspd,
+            }
+        )
 
     return _skewt
 
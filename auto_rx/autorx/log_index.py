@@ -0,0 +1,253 @@
+#!/usr/bin/env python
+#
+#   radiosonde_auto_rx - Log File Catalogue Index
+#
+#   Released under GNU GPL v3 or later
+#
+#   Keeps a persistent record of the first and last positions within each sonde log file,
+#   keyed by filename, size and modification time, so the historical log list can be produced
+#   without opening every log file.
+#
+import json
+import logging
+import os
+import time
+from threading import Lock
+
+
+class LogFileIndex(object):
+    """ Log File Catalogue Index
+
+    Stores the first/last position of each log file in a directory, along with the file size and modification
+    time at which they were read. Entries are re-read from the log file only if the file has changed,
+    and can be updated incrementally as new telemetry is written to a log.
+
+    The index is saved as a JSON file within the log directory.
+    """
+
+    INDEX_FILENAME = ".log_index.json"
+    INDEX_VERSION = 1
+
+    # Minimum time between saves of the index to disk, when not forced.
+    SAVE_INTERVAL = 60
+
+    def __init__(self, log_directory):
+        """ Initialise the index, loading any existing index file.
+
+        Args:
+            log_directory (str): Directory containing the log files.
+        """
+        self.log_directory = log_directory
+        self.index_path = os.path.join(log_directory, self.INDEX_FILENAME)
+
+        self.lock = Lock()
+        # Index entries, keyed by log file basename.
+        self.entries = {}
+        self.dirty = False
+        self.last_save = 0
+
+        self.load()
+
+    def load(self):
+        """ Load the index from disk, if it exists. """
+        if not os.path.exists(self.index_path):
+            return
+
+        try:
+            with open(self.index_path, "r") as _f:
+                _index = json.load(_f)
+
+            if _index.get("version") == self.INDEX_VERSION:
+                self.entries = _index["entries"]
+            else:
+                logging.info("Log Index - Index file version mismatch, rebuilding.")
+
+        except Exception as e:
+            logging.error("Log Index - Could not read index file, rebuilding - %s" % str(e))
+            self.entries = {}
+
+    def save(self, force=False):
+        """ Save the index to disk, if it has changed. The index is written to a temporary file and then moved into place.
+
+        Args:
+            force (bool): Save now, even if we have saved recently.
+        """
+        with self.lock:
+            if not self.dirty:
+                return
+
+            if (not force) and (time.time() < (self.last_save + self.SAVE_INTERVAL)):
+                return
+
+            _temp_path = self.index_path + ".tmp"
+            try:
+                with open(_temp_path, "w") as _f:
+                    json.dump({"version": self.INDEX_VERSION, "entries": self.entries}, _f)
+                os.replace(_temp_path, self.index_path)
+                self.dirty = False
+            except Exception as e:
+                logging.error("Log Index - Could not write index file - %s" % str(e))
+
+            self.last_save = time.time()
+
+    def get_endpoints(self, filename):
+        """ Get the first/last positions within a log file, reading the file only if it has changed since it was indexed.
+
+        Args:
+            filename (str): Path to the log file.
+
+        Returns:
+            dict: Dictionary containing 'has_snr', 'first' and 'last' fields, or None if the file contains no valid data.
+        """
+        _stat = os.stat(filename)
+        _key = os.path.basename(filename)
+
+        with self.lock:
+            _entry = self.entries.get(_key)
+            if (
+                (_entry is not None)
+                and (_entry["size"] == _stat.st_size)
+                and (_entry["mtime"] == _stat.st_mtime)
+            ):
+                return _entry["endpoints"]
+
+        _endpoints = read_log_endpoints(filename)
+
+        with self.lock:
+            self.entries[_key] = {
+                "size": _stat.st_size,
+                "mtime": _stat.st_mtime,
+                "endpoints": _endpoints,
+            }
+            self.dirty = True
+
+        return _endpoints
+
+    def add_position(self, filename, datetime_str, lat, lon, alt):
+        """ Update the index with a position which has just been written to the end of a log file.
+
+        Args:
+            filename (str): Path to the log file.
+            datetime_str (str): Timestamp of the position.
+            lat (float): Latitude
+            lon (float): Longitude
+            alt (float): Altitude
+        """
+        _key = os.path.basename(filename)
+
+        with self.lock:
+            _entry = self.entries.get(_key)
+
+        if (_entry is None) or (_entry["endpoints"] is None):
+            # We don't know about this file yet, so read it in (which will include this position).
+            self.get_endpoints(filename)
+            return
+
+        _stat = os.stat(filename)
+
+        with self.lock:
+            _entry["endpoints"]["last"] = {
+                "datetime": datetime_str,
+                "lat": lat,
+                "lon": lon,
+                "alt": alt,
+            }
+            _entry["size"] = _stat.st_size
+            _entry["mtime"] = _stat.st_mtime
+            self.dirty = True
+
+    def prune(self, filenames):
+        """ Remove entries for log files which no longer exist.
+
+        Args:
+            filenames (list): List of paths of all the current log files.
+        """
+        _current = set(os.path.basename(_f) for _f in filenames)
+
+        with self.lock:
+            for _key in list(self.entries.keys()):
+                if _key not in _current:
+                    self.entries.pop(_key)
+                    self.dirty = True
+
+
+def parse_log_position(line):
+    """ Extract the timestamp and position from a log file line. """
+    _fields = line.split(",")
+    return {
+        "datetime": _fields[0],
+        "lat": float(_fields[3]),
+        "lon": float(_fields[4]),
+        "alt": float(_fields[5]),
+    }
+
+
+def read_log_endpoints(filename):
+    """ Read in the first and last lines of a log file, and return the first/last position observed.
+
+    Args:
+        filename (str): Path to the log file.
+
+    Returns:
+        dict: Dictionary containing 'has_snr', 'first' and 'last' fields, or None if the file contains no valid data.
+    """
+    _filesize = os.path.getsize(filename)
+
+    with open(filename, "r") as _file:
+        _header = _file.readline()
+
+        # Discard anything that doesn't look like a log file.
+        if "timestamp,serial,frame,lat,lon,alt" not in _header:
+            return None
+
+        _output = {"has_snr": "snr" in _header}
+
+        try:
+            # Naeive read of the first data line
+            _output["first"] = parse_log_position(_file.readline())
+        except Exception:
+            # Couldn't read the first line, so likely no data.
+            return None
+
+        # Now we try and seek to near the end of the file.
+        _seek_point = _filesize - 300
+        if _seek_point < 0:
+            # Don't bother trying to read the last line, it'll be the same as the first line.
+            _output["last"] = _output["first"]
+            return _output
+
+        try:
+            _file.seek(_seek_point)
+            _remainder = _file.read()
+            # Get the last line
+            _output["last"] = parse_log_position(_remainder.split("\n")[-2])
+        except Exception as e:
+            # Couldn't read in the last line for some reason.
+            # Return what we have
+            logging.error(f"Error reading last line of {filename}: {str(e)}")
+            _output["last"] = _output["first"]
+
+        return _output
+
+
+# Index objects, one per log directory.
+_indexes = {}
+_indexes_lock = Lock()
+
+
+def get_log_index(log_directory):
+    """ Get the log file index for a directory, creating it if required.
+
+    Args:
+        log_directory (str): Directory containing the log files.
+
+    Returns:
+        LogFileIndex: The index for this directory.
+    """
+    _key = os.path.abspath(log_directory)
+
+    with _indexes_lock:
+        if _key not in _indexes:
+            _indexes[_key] = LogFileIndex(log_directory)
+
+        return _indexes[_key]
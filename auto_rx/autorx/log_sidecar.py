@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+#
+#   radiosonde_auto_rx - Binary Log File Sidecar
+#
+#   Released under GNU GPL v3 or later
+#
+#   Optionally, each sonde log file can have a binary 'sidecar' file written alongside it,
+#   containing the same telemetry as fixed-size numpy records. This can be memory-mapped and
+#   loaded much faster than parsing the CSV log file.
+#
+import logging
+import os
+
+import numpy as np
+
+
+# Sidecar file suffix, appended to the CSV log filename.
+SIDECAR_SUFFIX = ".rec"
+
+# Record format. Column names match the field names used by read_log_file.
+LOG_RECORD_DTYPE = np.dtype(
+    [
+        ("datetime", "S32"),
+        ("serial", "S32"),
+        ("frame", "<i8"),
+        ("latitude", "<f8"),
+        ("longitude", "<f8"),
+        ("altitude", "<f8"),
+        ("vel_v", "<f8"),
+        ("vel_h", "<f8"),
+        ("heading", "<f8"),
+        ("temp", "<f8"),
+        ("humidity", "<f8"),
+        ("pressure", "<f8"),
+        ("type", "S16"),
+        ("frequency", "<f8"),
+        ("snr", "<f8"),
+        ("f_error", "<f8"),
+        ("sats", "<i4"),
+        ("batt", "<f8"),
+    ]
+)
+
+
+def sidecar_filename(log_filename):
+    """ Get the sidecar filename for a log file """
+    return log_filename + SIDECAR_SUFFIX
+
+
+def telemetry_to_record(telemetry):
+    """ Convert a telemetry dictionary to a sidecar record. Values are rounded in the same way as the CSV log.
+
+    Args:
+        telemetry (dict): Telemetry dictionary, as passed to TelemetryLogger.
+
+    Returns:
+        np.ndarray: Single-element array of LOG_RECORD_DTYPE.
+    """
+    if "subtype" in telemetry:
+        _type = telemetry["subtype"]
+    else:
+        _type = telemetry["type"]
+
+    return np.array(
+        [
+            (
+                telemetry["datetime"].encode("ascii"),
+                telemetry["id"].encode("ascii"),
+                telemetry["frame"],
+                round(telemetry["lat"], 5),
+                round(telemetry["lon"], 5),
+                round(telemetry["alt"], 1),
+                round(telemetry["vel_v"], 1),
+                round(telemetry["vel_h"], 1),
+                round(telemetry["heading"], 1),
+                round(telemetry["temp"], 1),
+                round(telemetry["humidity"], 1),
+                round(telemetry["pressure"], 1),
+                _type.encode("ascii"),
+                round(telemetry["freq_float"], 3),
+                round(telemetry.get("snr", -99.0), 1),
+                int(telemetry.get("f_error", 0)),
+                telemetry.get("sats", -1),
+                round(telemetry.get("batt", -1), 1),
+            )
+        ],
+        dtype=LOG_RECORD_DTYPE,
+    )
+
+
+def read_sidecar(log_filename, first_datetime=None, last_datetime=None):
+    """ Read in the sidecar for a log file, if it exists and is consistent with the log file.
+
+    Args:
+        log_filename (str): Path to the CSV log file.
+        first_datetime (str): Timestamp of the first entry in the CSV log file, used to check the sidecar is complete.
+        last_datetime (str): Timestamp of the last entry in the CSV log file, used to check the sidecar is up to date.
+
+    Returns:
+        dict: Dictionary of column arrays (with string columns decoded), or None if no usable sidecar is available.
+    """
+    _filename = sidecar_filename(log_filename)
+
+    if not os.path.exists(_filename):
+        return None
+
+    _records = os.path.getsize(_filename) // LOG_RECORD_DTYPE.itemsize
+    if _records == 0:
+        return None
+
+    try:
+        # Only map whole records, in case the last write was interrupted.
+        _data = np.memmap(_filename, dtype=LOG_RECORD_DTYPE, mode="r", shape=(_records,))
+    except Exception as e:
+        logging.error(f"Could not read log sidecar {_filename}: {str(e)}")
+        return None
+
+    # Check the sidecar covers the same data as the CSV log.
+    if (first_datetime is not None) and (_data["datetime"][0].decode("ascii") != first_datetime):
+        return None
+
+    if (last_datetime is not None) and (_data["datetime"][-1].decode("ascii") != last_datetime):
+        return None
+
+    _output = {}
+    for _field in LOG_RECORD_DTYPE.names:
+        if LOG_RECORD_DTYPE[_field].kind == "S":
+            _output[_field] = _data[_field].astype(str)
+        else:
+            _output[_field] = np.array(_data[_field])
+
+    return _output
@@ -13,6 +13,8 @@ import os
 import time
 from queue import Queue
 from threading import Thread
+from .log_index import get_log_index
+from .log_sidecar import sidecar_filename, telemetry_to_record
 
 
 class TelemetryLogger(object):
@@ -53,16 +55,22 @@ class TelemetryLogger(object):
 
     def __init__(self, 
                  log_directory="./log",
-                 save_cal_data=False):
+                 save_cal_data=False,
+                 save_sidecar=False):
         """ Initialise and start a sonde logger.
         
         Args:
             log_directory (str): Directory in which to save log files.
+            save_sidecar (bool): Also write telemetry to a binary sidecar file alongside each log, for faster reading.
 
         """
 
         self.log_directory = log_directory
         self.save_cal_data = save_cal_data
+        self.save_sidecar = save_sidecar
+
+        # Log file catalogue index, which we keep updated as we write telemetry.
+        self.log_index = get_log_index(log_directory)
 
         # Dictionary to contain file handles.
         # Each sonde id is added as a unique key. Under each key are the contents:
@@ -116,9 +124,14 @@ class TelemetryLogger(object):
             # Close any un-needed log handlers.
             self.cleanup_logs()
 
+            # Periodically save the log file index.
+            self.log_index.save()
+
             # Sleep while waiting for some new data.
             time.sleep(0.5)
 
+        self.log_index.save(force=True)
+
         self.log_info("Stopped Telemetry Logger Thread.")
 
     def telemetry_to_string(self, telemetry):
@@ -217,9 +230,15 @@ class TelemetryLogger(object):
                 # Create entry in open logs dictionary
                 self.open_logs[_id] = {
                     "log": open(_log_file_name, "a"),
+                    "filename": _log_file_name,
+                    "sidecar": None,
                     "last_time": time.time(),
                     "subframe_saved": False
                 }
+
+                # Only continue an existing sidecar file, as a new one wouldn't contain the existing log data.
+                if self.save_sidecar and os.path.exists(sidecar_filename(_log_file_name)):
+                    self.open_logs[_id]["sidecar"] = open(sidecar_filename(_log_file_name), "ab")
             else:
                 # Create a new log file.
                 _log_suffix = "%s_%s_%s_%d_sonde.log" % (
@@ -233,10 +252,15 @@ class TelemetryLogger(object):
                 # Create entry in open logs dictionary
                 self.open_logs[_id] = {
                     "log": open(_log_file_name, "a"),
+                    "filename": _log_file_name,
+                    "sidecar": None,
                     "last_time": time.time(),
                     "subframe_saved": False
                 }
 
+                if self.save_sidecar:
+                    self.open_logs[_id]["sidecar"] = open(sidecar_filename(_log_file_name), "ab")
+
                 # Write in a header line.
                 self.open_logs[_id]["log"].write(self.LOG_HEADER)
 
@@ -246,10 +270,30 @@ class TelemetryLogger(object):
         # Write out to log.
         self.open_logs[_id]["log"].write(_log_line)
         self.open_logs[_id]["log"].flush()
+
+        # Write out to the sidecar file.
+        if self.open_logs[_id]["sidecar"]:
+            try:
+                telemetry_to_record(telemetry).tofile(self.open_logs[_id]["sidecar"])
+                self.open_logs[_id]["sidecar"].flush()
+            except Exception as e:
+                self.log_error("Error writing to sidecar file - %s" % str(e))
         # Update the last_time field.
         self.open_logs[_id]["last_time"] = time.time()
         self.log_debug("Wrote line: %s" % _log_line.strip())
 
+        # Update the log file index with the latest position.
+        try:
+            self.log_index.add_position(
+                self.open_logs[_id]["filename"],
+                telemetry["datetime"],
+                telemetry["lat"],
+                telemetry["lon"],
+                telemetry["alt"],
+            )
+        except Exception as e:
+            self.log_error("Error updating log index - %s" % str(e))
+
         # Save out RS41 subframe data once, if we have it.
         if ('rs41_subframe' in telemetry) and self.save_cal_data:
             if self.open_logs[_id]['subframe_saved'] == False:
@@ -272,6 +316,8 @@ class TelemetryLogger(object):
                     # Flush and close the log file, and pop this element from the dictionary.
                     self.open_logs[_id]["log"].flush()
                     self.open_logs[_id]["log"].close()
+                    if self.open_logs[_id]["sidecar"]:
+                        self.open_logs[_id]["sidecar"].close()
                     self.open_logs.pop(_id, None)
                     self.log_info("Closed log file for %s" % _id)
             except Exception as e:
@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+#
+#   radiosonde_auto_rx - Scanner No-Sonde Cache
+#
+#   Released under GNU GPL v3 or later
+#
+#   Remembers spectrum peaks which were tested for a sonde and found to contain something else
+#   (constant carriers, SDR birdies, other services), so the scanner doesn't spend detect_dwell_time
+#   on them every scan. Peaks are skipped for an exponentially increasing time after each failed
+#   detection, and are forgotten about gradually once they stop failing.
+#
+import json
+import logging
+import os
+import time
+from threading import Lock
+
+
+class NoSondeCache(object):
+    """ Scanner No-Sonde Cache
+
+    Each entry is keyed by the (quantized) peak frequency, and holds the number of consecutive failed
+    detections, the time of the last failure, the peak level at the last failure, and the time until
+    which the peak should be skipped. After N failures a peak is skipped for BASE_BACKOFF * 2^(N-1) seconds,
+    up to max_backoff. The failure count decays by one for every DECAY_INTERVAL without a failure.
+
+    The cache is saved as a JSON file within the log directory, so it persists across restarts.
+    """
+
+    CACHE_FILENAME = ".no_sonde_cache.json"
+    CACHE_VERSION = 1
+
+    # Skip time after the first failed detection (seconds). This is about one scan cycle.
+    BASE_BACKOFF = 60
+    # Failure count limit, so a long-running interferer that goes away is forgotten about in reasonable time.
+    MAX_FAILURES = 10
+    # Remove one failure from an entry for every DECAY_INTERVAL seconds since its last failure.
+    DECAY_INTERVAL = 3600
+    # Re-test a cached peak straight away if its level has increased by this much (dB) since it last failed,
+    # as it may be a sonde that has started transmitting on top of the interferer.
+    LEVEL_INCREASE = 6.0
+
+    # Minimum time between saves of the cache to disk, when not forced.
+    SAVE_INTERVAL = 60
+
+    def __init__(self, log_directory, quantization=10000, max_backoff=1800):
+        """ Initialise the cache, loading any existing cache file.
+
+        Args:
+            log_directory (str): Directory to save the cache file in.
+            quantization (float): Frequency quantization (Hz), as used by the scanner.
+            max_backoff (float): Maximum time (seconds) a peak will be skipped for.
+        """
+        self.cache_path = os.path.join(log_directory, self.CACHE_FILENAME)
+        self.quantization = quantization
+        self.max_backoff = max_backoff
+
+        self.lock = Lock()
+        # Cache entries, keyed by quantized frequency (Hz).
+        self.entries = {}
+        self.dirty = False
+        self.last_save = 0
+
+        self.load()
+
+    def quantize(self, frequency):
+        """ Quantize a frequency (Hz) to the scanner quantization. """
+        return round(frequency / self.quantization) * self.quantization
+
+    def load(self):
+        """ Load the cache from disk, if it exists. """
+        if not os.path.exists(self.cache_path):
+            return
+
+        try:
+            with open(self.cache_path, "r") as _f:
+                _cache = json.load(_f)
+
+            if _cache.get("version") == self.CACHE_VERSION:
+                for (_freq, _entry) in _cache["entries"].items():
+                    self.entries[float(_freq)] = _entry
+                self.decay()
+                logging.debug("No-Sonde Cache - Loaded %d entries." % len(self.entries))
+            else:
+                logging.info("No-Sonde Cache - Cache file version mismatch, starting a new cache.")
+
+        except Exception as e:
+            logging.error("No-Sonde Cache - Could not read cache file, starting a new cache - %s" % str(e))
+            self.entries = {}
+
+    def save(self, force=False):
+        """ Save the cache to disk, if it has changed. The cache is written to a temporary file and then moved into place.
+
+        Args:
+            force (bool): Save now, even if we have saved recently.
+        """
+        with self.lock:
+            if not self.dirty:
+                return
+
+            if (not force) and (time.time() < (self.last_save + self.SAVE_INTERVAL)):
+                return
+
+            _temp_path = self.cache_path + ".tmp"
+            try:
+                with open(_temp_path, "w") as _f:
+                    json.dump(
+                        {
+                            "version": self.CACHE_VERSION,
+                            "entries": {str(_freq): _entry for (_freq, _entry) in self.entries.items()},
+                        },
+                        _f,
+                    )
+                os.replace(_temp_path, self.cache_path)
+                self.dirty = False
+            except Exception as e:
+                logging.error("No-Sonde Cache - Could not write cache file - %s" % str(e))
+
+            self.last_save = time.time()
+
+    def decay(self):
+        """ Reduce the failure count of entries which have not failed recently, and remove entries with no failures left. """
+        _now = time.time()
+
+        with self.lock:
+            for _freq in list(self.entries.keys()):
+                _entry = self.entries[_freq]
+                _periods = int((_now - _entry["last_failure"]) // self.DECAY_INTERVAL)
+                if _periods <= 0:
+                    continue
+
+                _entry["failures"] = max(0, _entry["failures"] - _periods)
+                _entry["last_failure"] += _periods * self.DECAY_INTERVAL
+                self.dirty = True
+
+                if (_entry["failures"] <= 0) and (_entry["skip_until"] < _now):
+                    self.entries.pop(_freq)
+
+    def should_skip(self, frequency, level=None):
+        """ Check if a peak should be skipped.
+
+        Args:
+            frequency (float): Peak frequency, in Hz.
+            level (float): Current peak level (dB), if known.
+
+        Returns:
+            bool: True if the peak recently failed detection, and should not be tested yet.
+        """
+        with self.lock:
+            _entry = self.entries.get(self.quantize(frequency))
+
+            if (_entry is None) or (_entry["skip_until"] < time.time()):
+                return False
+
+            if (
+                (level is not None)
+                and (_entry["level"] is not None)
+                and (level > (_entry["level"] + self.LEVEL_INCREASE))
+            ):
+                return False
+
+            return True
+
+    def record_failure(self, frequency, level=None):
+        """ Record a failed detection on a peak, and increase the time it will be skipped for.
+
+        Args:
+            frequency (float): Peak frequency, in Hz.
+            level (float): Peak level (dB), if known.
+        """
+        _now = time.time()
+        _freq = self.quantize(frequency)
+
+        with self.lock:
+            _entry = self.entries.setdefault(
+                _freq, {"failures": 0, "last_failure": _now, "level": None, "skip_until": 0}
+            )
+            _entry["failures"] = min(_entry["failures"] + 1, self.MAX_FAILURES)
+            _entry["last_failure"] = _now
+            _entry["level"] = level
+            _backoff = min(self.BASE_BACKOFF * 2 ** (_entry["failures"] - 1), self.max_backoff)
+            _entry["skip_until"] = _now + _backoff
+            self.dirty = True
+
+        self.save()
+
+    def record_success(self, frequency):
+        """ Record a sonde detection on a peak, removing it from the cache.
+
+        Args:
+            frequency (float): Peak frequency, in Hz.
+        """
+        with self.lock:
+            if self.entries.pop(self.quantize(frequency), None) is not None:
+                self.dirty = True
+
+        self.save()
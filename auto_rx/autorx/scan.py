@@ -13,17 +13,17 @@ import numpy as np
 import os
 import sys
 import platform
+import signal
 import subprocess
 import time
 import traceback
-from io import StringIO
 from threading import Thread, Lock
 from types import FunctionType, MethodType
 from .utils import (
     detect_peaks,
     timeout_cmd
 )
-from .sdr_wrappers import test_sdr, reset_sdr, get_sdr_name, get_sdr_iq_cmd, get_sdr_fm_cmd, get_power_spectrum, shutdown_sdr
+from .sdr_wrappers import test_sdr, reset_sdr, get_sdr_name, get_sdr_iq_cmd, get_sdr_fm_cmd, get_power_spectrum, shutdown_sdr, read_rtl_power_log
 
 
 try:
@@ -46,6 +46,77 @@ scan_result = {
 }
 
 
+# dft_detect settings for each of the detection modes used by detect_sonde.
+#   mode: 'IQ' to run dft_detect on IQ samples, or 'FM' to run it on FM-demodulated audio.
+#   sample_rate: Sample rate of the IQ or audio provided to dft_detect, in Hz.
+#   if_bw: dft_detect IQ filter bandwidth, in kHz (IQ mode only).
+#   rx_bw: FM demodulator filter bandwidth, in Hz (FM mode only).
+DETECT_MODES = {
+    # 400-406 MHz sondes
+    "iq": {"mode": "IQ", "sample_rate": 48000, "if_bw": 15},
+    # 400-406 MHz sondes, with wideband_sondes enabled (Weathex and wideband iMet sondes)
+    "iq_wideband": {"mode": "IQ", "sample_rate": 96000, "if_bw": 64},
+    # 1680 MHz sondes, with ngp_tweak enabled (RS92-NGP only)
+    "iq_ngp": {"mode": "IQ", "sample_rate": 48000, "if_bw": 32},
+    # 1680 MHz sondes (LMS6-1680 and RS92-NGP)
+    # Both the RS92-NGP and 1680 MHz LMS6 have a much wider bandwidth than their 400 MHz counterparts.
+    # The RS92-NGP is maybe 25 kHz wide, and the LMS6 is 175 kHz (!!) wide, so we use a very wide FM bandwidth.
+    # Expanded to 250 kHz 2021-07-17. Results in better off-freq detection.
+    "fm_1680": {"mode": "FM", "sample_rate": 48000, "rx_bw": 250000},
+}
+
+
+def get_detect_mode(frequency, ngp_tweak=False, wideband_sondes=False):
+    """Select the detection mode (from DETECT_MODES) used by detect_sonde for a frequency.
+
+    Args:
+        frequency (int): Frequency to perform the detection on, in Hz.
+        ngp_tweak (bool): When scanning in the 1680 MHz sonde band, use a narrower IQ filter for better RS92-NGP detection.
+        wideband_sondes (bool): Use a wider detection filter to allow detection of Weathex and wideband iMet sondes.
+
+    Returns:
+        str: A key into DETECT_MODES.
+    """
+    if frequency < 1000e6:
+        # 400-406 MHz sondes
+        if wideband_sondes:
+            return "iq_wideband"
+        else:
+            return "iq"
+    else:
+        # 1680 MHz sondes
+        if ngp_tweak:
+            return "iq_ngp"
+        else:
+            return "fm_1680"
+
+
+def get_dft_detect_command(detect_mode, rs_path="./", dwell_time=10):
+    """Generate the dft_detect command for a detection mode. dft_detect reads samples from stdin.
+
+    Args:
+        detect_mode (str): A key into DETECT_MODES.
+        rs_path (str): Path to the RS binaries (i.e dft_detect).
+        dwell_time (int): Number of seconds of samples to process before giving up on detection.
+
+    Returns:
+        str: dft_detect command.
+    """
+    _settings = DETECT_MODES[detect_mode]
+
+    if _settings["mode"] == "IQ":
+        return os.path.join(
+            rs_path, "dft_detect"
+        ) + " -t %d --iq --bw %d --dc - %d 16 2>/dev/null" % (
+            dwell_time,
+            _settings["if_bw"],
+            _settings["sample_rate"],
+        )
+    else:
+        # Audio (with a wav header) is provided via stdin.
+        return os.path.join(rs_path, "dft_detect") + " -t %d 2>/dev/null" % dwell_time
+
+
 def run_rtl_power(
     start,
     stop,
@@ -169,51 +240,7 @@ def read_rtl_power(filename):
 
     """
 
-    # Output buffers.
-    freq = np.array([])
-    power = np.array([])
-
-    freq_step = 0
-
-    # Open file.
-    f = open(filename, "r")
-
-    # rtl_power log files are csv's, with the first 6 fields in each line describing the time and frequency scan parameters
-    # for the remaining fields, which contain the power samples.
-
-    for line in f:
-        # Split line into fields.
-        fields = line.split(",")
-
-        if len(fields) < 6:
-            logging.error(
-                "Scanner - Invalid number of samples in input file - corrupt?"
-            )
-            raise Exception(
-                "Scanner - Invalid number of samples in input file - corrupt?"
-            )
-
-        start_date = fields[0]
-        start_time = fields[1]
-        start_freq = float(fields[2])
-        stop_freq = float(fields[3])
-        freq_step = float(fields[4])
-        n_samples = int(fields[5])
-
-        # freq_range = np.arange(start_freq,stop_freq,freq_step)
-        samples = np.loadtxt(StringIO(",".join(fields[6:])), delimiter=",")
-        freq_range = np.linspace(start_freq, stop_freq, len(samples))
-
-        # Add frequency range and samples to output buffers.
-        freq = np.append(freq, freq_range)
-        power = np.append(power, samples)
-
-    f.close()
-
-    # Sanitize power values, to remove the nan's that rtl_power puts in there occasionally.
-    power = np.nan_to_num(power)
-
-    return (freq, power, freq_step)
+    return read_rtl_power_log(filename, "SDR")
 
 
 def detect_sonde(
@@ -280,31 +307,9 @@ def detect_sonde(
         gain_param = ""
 
     # Adjust the detection bandwidth based on the band the scanning is occuring in.
-    if frequency < 1000e6:
-        # 400-406 MHz sondes
-        _mode = "IQ"
-        if wideband_sondes:
-            _iq_bw = 96000
-            _if_bw = 64
-        else:
-            _iq_bw = 48000
-            _if_bw = 15
-        
-    else:
-        # 1680 MHz sondes
-        # Both the RS92-NGP and 1680 MHz LMS6 have a much wider bandwidth than their 400 MHz counterparts.
-        # The RS92-NGP is maybe 25 kHz wide, and the LMS6 is 175 kHz (!!) wide.
-        # Given the huge difference between these two, we default to using a very wide FM bandwidth, but allow the user
-        # to narrow this if only RS92-NGPs are expected.
-        if ngp_tweak:
-            # RS92-NGP detection
-            _mode = "IQ"
-            _iq_bw = 48000
-            _if_bw = 32
-        else:
-            # LMS6-1680 Detection
-            _mode = "FM"
-            _rx_bw = 250000 # Expanded to 250 kHz 2021-07-17. Results in better off-freq detection.
+    _detect_mode = get_detect_mode(frequency, ngp_tweak=ngp_tweak, wideband_sondes=wideband_sondes)
+    _mode = DETECT_MODES[_detect_mode]["mode"]
+    _iq_bw = DETECT_MODES[_detect_mode]["sample_rate"]
 
     if _mode == "IQ":
         # IQ decoding
@@ -349,13 +354,7 @@ def detect_sonde(
             detect_iq_path = os.path.join(logging_path, f"detect_IQ_{frequency}_{_iq_bw}_{str(rtl_device_idx)}.raw")
             rx_test_command += f" tee {detect_iq_path} |"
 
-        rx_test_command += os.path.join(
-            rs_path, "dft_detect"
-        ) + " -t %d --iq --bw %d --dc - %d 16 2>/dev/null" % (
-            dwell_time,
-            _if_bw,
-            _iq_bw,
-        )
+        rx_test_command += get_dft_detect_command(_detect_mode, rs_path=rs_path, dwell_time=dwell_time)
 
     elif _mode == "FM":
         # FM decoding
@@ -367,7 +366,7 @@ def detect_sonde(
         rx_test_command += get_sdr_fm_cmd(
             sdr_type=sdr_type,
             frequency=frequency,
-            filter_bandwidth=_rx_bw,
+            filter_bandwidth=DETECT_MODES[_detect_mode]["rx_bw"],
             sample_rate=48000,
             highpass = 20,
             lowpass = None,
@@ -412,9 +411,7 @@ def detect_sonde(
 
         # Sample decoding / detection
         # Note that we detect for dwell_time seconds, and timeout after dwell_time*2, to catch if no samples are being passed through.
-        rx_test_command += (
-            os.path.join(rs_path, "dft_detect") + " -t %d 2>/dev/null" % dwell_time
-        )
+        rx_test_command += get_dft_detect_command(_detect_mode, rs_path=rs_path, dwell_time=dwell_time)
 
     _sdr_name = get_sdr_name(
         sdr_type, 
@@ -467,6 +464,21 @@ def detect_sonde(
         "Scanner - dft_detect exited in %.1f seconds with return code 1." % _runtime
     )
 
+    return parse_dft_detect_output(ret_output, _sdr_name)
+
+
+def parse_dft_detect_output(ret_output, sdr_name="SDR"):
+    """Parse the output of dft_detect into a sonde type and frequency offset estimate.
+
+    Args:
+        ret_output (str): Output line from dft_detect, i.e. "RS41: 0.95, +1234.5 Hz"
+        sdr_name (str): Name of the SDR the detection was performed on, for logging purposes.
+
+    Returns:
+        tuple: (sonde_type, offset_est), where sonde_type is None if no sonde was detected.
+            See detect_sonde for the list of sonde types.
+    """
+
     # Check for no output from dft_detect.
     if ret_output is None or ret_output == "":
         # logging.error("Scanner - dft_detect returned no output?")
@@ -505,75 +517,75 @@ def detect_sonde(
     if "RS41" in _type:
         logging.debug(
             "Scanner (%s) - Detected a RS41! (Score: %.2f, Offset: %.1f Hz)"
-            % (_sdr_name, _score, _offset_est)
+            % (sdr_name, _score, _offset_est)
         )
         _sonde_type = "RS41"
     elif "RS92" in _type:
         logging.debug(
             "Scanner (%s) - Detected a RS92! (Score: %.2f, Offset: %.1f Hz)"
-            % (_sdr_name, _score, _offset_est)
+            % (sdr_name, _score, _offset_est)
         )
         _sonde_type = "RS92"
     elif "DFM" in _type:
         logging.debug(
             "Scanner (%s) - Detected a DFM Sonde! (Score: %.2f, Offset: %.1f Hz)"
-            % (_sdr_name, _score, _offset_est)
+            % (sdr_name, _score, _offset_est)
         )
         _sonde_type = "DFM"
     elif "M10" in _type:
         logging.debug(
             "Scanner (%s) - Detected a M10 Sonde! (Score: %.2f, Offset: %.1f Hz)"
-            % (_sdr_name, _score, _offset_est)
+            % (sdr_name, _score, _offset_est)
         )
         _sonde_type = "M10"
     elif "M20" in _type:
         logging.debug(
             "Scanner (%s) - Detected a M20 Sonde! (Score: %.2f, Offset: %.1f Hz)"
-            % (_sdr_name, _score, _offset_est)
+            % (sdr_name, _score, _offset_est)
         )
         _sonde_type = "M20"
     elif "IMET4" in _type:
         logging.debug(
             "Scanner (%s) - Detected a iMet-4 Sonde! (Score: %.2f, Offset: %.1f Hz)"
-            % (_sdr_name, _score, _offset_est)
+            % (sdr_name, _score, _offset_est)
         )
         _sonde_type = "IMET"
     elif "IMET1" in _type:
         # This could actually be a wideband iMet sonde. We treat this as a IMET4.
         logging.debug(
             "Scanner (%s) - Possible detection of a Wideband iMet Sonde! (Type %s) (Score: %.2f)"
-            % (_sdr_name, _type, _score)
+            % (sdr_name, _type, _score)
         )
         # Override the type to IMET4.
         _sonde_type = "IMET"
     elif "IMETafsk" in _type:
         logging.debug(
             "Scanner (%s) - Detected a iMet Sonde! (Type %s - Unsupported) (Score: %.2f)"
-            % (_sdr_name, _type, _score)
+            % (sdr_name, _type, _score)
         )
         _sonde_type = "IMET1"
     elif "IMET5" in _type:
         logging.debug(
             "Scanner (%s) - Detected a iMet-54 Sonde! (Score: %.2f)"
-            % (_sdr_name, _score)
+            % (sdr_name, _score)
         )
         _sonde_type = "IMET5"
     elif "LMS6" in _type:
         logging.debug(
             "Scanner (%s) - Detected a LMS6 Sonde! (Score: %.2f, Offset: %.1f Hz)"
-            % (_sdr_name, _score, _offset_est)
+            % (sdr_name, _score, _offset_est)
         )
         _sonde_type = "LMS6"
     elif "C34" in _type:
         logging.debug(
             "Scanner (%s) - Detected a Meteolabor C34/C50 Sonde! (Not yet supported...) (Score: %.2f)"
-            % (_sdr_name, _score)
+            % (sdr_name, _score)
         )
         _sonde_type = "C34C50"
     elif "MRZ" in _type:
         logging.debug(
             "Scanner (%s) - Detected a Meteo-Radiy MRZ Sonde! (Score: %.2f)"
-            % (_sdr_name, _score)
+            % (sdr_name, _score)
         )
         if _score < 0:
             _sonde_type = "-MRZ"
@@ -583,7 +595,7 @@ def detect_sonde(
     elif "MK2LMS" in _type:
         logging.debug(
             "Scanner (%s) - Detected a 1680 MHz LMS6 Sonde (MK2A Telemetry)! (Score: %.2f, Offset: %.1f Hz)"
-            % (_sdr_name, _score, _offset_est)
+            % (sdr_name, _score, _offset_est)
         )
         if _score < 0:
             _sonde_type = "-MK2LMS"
@@ -593,7 +605,7 @@ def detect_sonde(
     elif "MEISEI" in _type:
         logging.debug(
             "Scanner (%s) - Detected a Meisei Sonde! (Score: %.2f, Offset: %.1f Hz)"
-            % (_sdr_name, _score, _offset_est)
+            % (sdr_name, _score, _offset_est)
         )
         # Not currently sure if we expect to see inverted Meisei sondes.
         if _score < 0:
@@ -604,7 +616,7 @@ def detect_sonde(
     elif "MTS01" in _type:
         logging.debug(
             "Scanner (%s) - Detected a Meteosis MTS01 Sonde! (Score: %.2f, Offset: %.1f Hz)"
-            % (_sdr_name, _score, _offset_est)
+            % (sdr_name, _score, _offset_est)
         )
         # Not currently sure if we expect to see inverted Meteosis sondes.
         if _score < 0:
@@ -615,7 +627,7 @@ def detect_sonde(
     elif "WXR301" in _type:
         logging.debug(
             "Scanner (%s) - Detected a Weathex WxR-301D Sonde! (Score: %.2f, Offset: %.1f Hz)"
-            % (_sdr_name, _score, _offset_est)
+            % (sdr_name, _score, _offset_est)
         )
         _sonde_type = "WXR301"
         # Clear out the offset estimate for WxR-301's as it's not accurate
@@ -625,14 +637,14 @@ def detect_sonde(
     elif "WXRPN9" in _type:
         logging.debug(
             "Scanner (%s) - Detected a Weathex WxR-301D Sonde (PN9 Variant)! (Score: %.2f, Offset: %.1f Hz)"
-            % (_sdr_name, _score, _offset_est)
+            % (sdr_name, _score, _offset_est)
         )
         _sonde_type = "WXRPN9"
     
     elif "RD94RD41" in _type:
         logging.debug(
             "Scanner (%s) - Detected a RD94 or RD41 Dropsonde! (Score: %.2f, Offset: %.1f Hz)"
-            % (_sdr_name, _score, _offset_est)
+            % (sdr_name, _score, _offset_est)
         )
         _sonde_type = "RD94RD41"
 
@@ -642,6 +654,276 @@ def detect_sonde(
     return (_sonde_type, _offset_est)
 
 
+# Wideband detection settings.
+# Maximum IQ capture bandwidth to use when detecting on multiple peaks at once.
+# 2.4 MHz is about the limit of what a RTLSDR can deliver without dropping samples.
+WIDEBAND_DETECT_MAX_RATE = 2400000
+# Number of channel samples produced by each block of the FFT channelizer.
+WIDEBAND_DETECT_BLOCK_SIZE = 8192
+
+
+def group_wideband_peaks(frequencies, channel_rate=48000, max_rate=WIDEBAND_DETECT_MAX_RATE):
+    """Split a list of peak frequencies into groups which can each be covered by a single wideband IQ capture.
+
+    Args:
+        frequencies (list): List of peak frequencies, in Hz.
+        channel_rate (int): Sample rate of each detection channel, in Hz.
+        max_rate (int): Maximum capture sample rate, in Hz.
+
+    Returns:
+        list: A list of lists of frequencies. Each group spans no more than max_rate, less a channel's bandwidth at each edge.
+    """
+    _max_span = max_rate - 2 * channel_rate
+
+    _groups = []
+    for _freq in sorted(frequencies):
+        if len(_groups) > 0 and (_freq - _groups[-1][0]) <= _max_span:
+            _groups[-1].append(_freq)
+        else:
+            _groups.append([_freq])
+
+    return _groups
+
+
+def detect_sonde_wideband(
+    frequencies,
+    rs_path="./",
+    dwell_time=10,
+    sdr_type="RTLSDR",
+    sdr_hostname="localhost",
+    sdr_port=5555,
+    ss_iq_path = "./ss_iq",
+    rtl_fm_path="rtl_fm",
+    rtl_device_idx=0,
+    ppm=0,
+    gain=-1,
+    bias=False,
+    save_detection_audio=False,
+    wideband_sondes=False
+):
+    """Capture a single block of wideband IQ covering a set of peaks, and attempt to detect a radiosonde on all of them at once.
+
+    The wideband IQ is split into a narrowband channel for each peak using a FFT channelizer,
+    and each channel is fed into its own dft_detect instance, so that all peaks are tested concurrently.
+    This only supports the 400-406 MHz band (IQ detection mode).
+
+    Args:
+        frequencies (list): Frequencies to perform the detection on, in Hz. These must all fit within WIDEBAND_DETECT_MAX_RATE.
+        rs_path (str): Path to the RS binaries (i.e rs_detect). Defaults to ./
+        dwell_time (int): Timeout before giving up detection.
+        rtl_fm_path (str): Path to rtl_fm, or drop-in equivalent. Defaults to 'rtl_fm'
+        rtl_device_idx (int or str): Device index or serial number of the RTLSDR. Defaults to 0 (the first SDR found).
+        ppm (int): SDR Frequency accuracy correction, in ppm.
+        gain (int): SDR Gain setting, in dB. A gain setting of -1 enables the RTLSDR AGC.
+        bias (bool): If True, enable the bias tee on the SDR.
+        save_detection_audio (bool): Save the channelized IQ used in detection to a file.
+        wideband_sondes (bool): Use a wider detection filter to allow detection of Weathex and wideband iMet sondes.
+
+    Returns:
+        dict: A dictionary with an entry for each supplied frequency, containing a tuple of (sonde_type, offset_est),
+            as returned by detect_sonde.
+    """
+
+    if wideband_sondes:
+        _channel_rate = 96000
+        _if_bw = 64
+    else:
+        _channel_rate = 48000
+        _if_bw = 15
+
+    # Tune to the middle of the group of peaks, and pick a capture rate which is an
+    # integer multiple of the channel rate and covers all the peaks.
+    _centre = int((min(frequencies) + max(frequencies)) / 2)
+    _span = (max(frequencies) - min(frequencies)) + 2 * _channel_rate
+    _decimation = max(1, math.ceil(_span / _channel_rate))
+    _capture_rate = _channel_rate * _decimation
+
+    # RTLSDRs cannot operate at sample rates between 300 kHz and 900 kHz.
+    if (_capture_rate > 300000) and (_capture_rate <= 900000):
+        _decimation = math.ceil(960000 / _channel_rate)
+        _capture_rate = _channel_rate * _decimation
+
+    if _capture_rate > WIDEBAND_DETECT_MAX_RATE:
+        raise ValueError("Peaks do not fit within a single wideband capture.")
+
+    _block_len = WIDEBAND_DETECT_BLOCK_SIZE * _decimation
+    _bin_width = _capture_rate / _block_len
+    # Bin indices (in ifft order) making up a single channel, relative to the channel centre.
+    _channel_bins = np.fft.fftfreq(WIDEBAND_DETECT_BLOCK_SIZE, 1.0 / WIDEBAND_DETECT_BLOCK_SIZE).astype(int)
+
+    _sdr_name = get_sdr_name(
+        sdr_type, 
+        rtl_device_idx = rtl_device_idx, 
+        sdr_hostname = sdr_hostname, 
+        sdr_port = sdr_port
+    )
+
+    _capture_command = f"{timeout_cmd()} {dwell_time * 2} "
+    _capture_command += get_sdr_iq_cmd(
+        sdr_type=sdr_type,
+        frequency=_centre,
+        sample_rate=_capture_rate,
+        rtl_device_idx = rtl_device_idx,
+        rtl_fm_path = rtl_fm_path,
+        fast_filter = True,
+        ppm = ppm,
+        gain = gain,
+        bias = bias,
+        sdr_hostname = sdr_hostname,
+        sdr_port = sdr_port,
+        ss_iq_path = ss_iq_path,
+        scan = True
+    )
+    # get_sdr_iq_cmd returns a command ending in a pipe, which we are reading directly.
+    _capture_command = _capture_command.rstrip().rstrip("|")
+
+    logging.debug(
+        f"Scanner ({_sdr_name}) - Using wideband detection command: {_capture_command}"
+    )
+    logging.debug(
+        f"Scanner ({_sdr_name}) - Attempting wideband sonde detection on {len(frequencies)} peaks, centred on {_centre/1e6:.3f} MHz ({_capture_rate/1e3:.0f} kHz capture)"
+    )
+
+    if save_detection_audio:
+        # Use autorx.logging_path if available, otherwise fall back to default
+        try:
+            logging_path = autorx.logging_path
+        except (NameError, AttributeError):
+            logging_path = './log/'
+
+    # Start up a dft_detect instance for each peak.
+    _detectors = {}
+    for _freq in frequencies:
+        _detect_command = os.path.join(
+            rs_path, "dft_detect"
+        ) + " -t %d --iq --bw %d --dc - %d 16 2>/dev/null" % (
+            dwell_time,
+            _if_bw,
+            _channel_rate,
+        )
+
+        _detectors[_freq] = {
+            "process": subprocess.Popen(
+                _detect_command,
+                shell=True,
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+            ),
+            # Bin offset of this peak from the capture centre frequency.
+            "bins": (int(round((_freq - _centre) / _bin_width)) + _channel_bins) % _block_len,
+            "active": True,
+            "audio": None,
+        }
+
+        if save_detection_audio:
+            detect_iq_path = os.path.join(logging_path, f"detect_IQ_{int(_freq)}_{_channel_rate}_{str(rtl_device_idx)}.raw")
+            _detectors[_freq]["audio"] = open(detect_iq_path, "wb")
+
+    _start = time.time()
+    _capture = subprocess.Popen(
+        _capture_command,
+        shell=True,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        preexec_fn=os.setsid,
+    )
+
+    # Read in blocks of wideband IQ, and fan them out to each detector.
+    _samples_required = dwell_time * _capture_rate
+    _samples_read = 0
+    _block_bytes = _block_len * 4
+    try:
+        while _samples_read < _samples_required:
+            _data = _capture.stdout.read(_block_bytes)
+            if len(_data) < _block_bytes:
+                # Capture process exited (or timed out).
+                break
+
+            _samples_read += _block_len
+
+            # Convert signed 16-bit IQ to complex, and FFT the entire block once.
+            _iq = np.frombuffer(_data, dtype=np.int16).astype(np.float32).view(np.complex64)
+            _spectrum = np.fft.fft(_iq)
+
+            _active = 0
+            for _freq in _detectors:
+                _detector = _detectors[_freq]
+                if not _detector["active"]:
+                    continue
+
+                # Extract this channel's bins and inverse-FFT, which both shifts the channel
+                # to baseband and decimates it to the channel rate.
+                _channel = np.fft.ifft(_spectrum[_detector["bins"]]) / _decimation
+                _channel_data = (
+                    np.clip(_channel.astype(np.complex64).view(np.float32), -32768, 32767).astype(np.int16).tobytes()
+                )
+
+                if _detector["audio"]:
+                    _detector["audio"].write(_channel_data)
+
+                try:
+                    _detector["process"].stdin.write(_channel_data)
+                    _active += 1
+                except (BrokenPipeError, OSError):
+                    # dft_detect has exited, most likely because it has detected something.
+                    _detector["active"] = False
+
+            if _active == 0:
+                break
+
+    finally:
+        # Kill the entire process group, so the SDR is released.
+        try:
+            os.killpg(os.getpgid(_capture.pid), signal.SIGKILL)
+        except Exception as e:
+            logging.debug(f"Scanner ({_sdr_name}) - SIGKILL via os.killpg failed. - {str(e)}")
+        _capture.wait()
+
+        # Release the SDR channel if necessary
+        shutdown_sdr(sdr_type, rtl_device_idx, sdr_hostname, _centre, scan=True)
+
+    # Close off the detector inputs, and collect the results.
+    _results = {}
+    for _freq in _detectors:
+        _detector = _detectors[_freq]
+        if _detector["audio"]:
+            _detector["audio"].close()
+
+        try:
+            _detector["process"].stdin.close()
+        except (BrokenPipeError, OSError):
+            pass
+
+        try:
+            ret_output = _detector["process"].stdout.read().decode("utf8")
+            _detector["process"].wait(timeout=dwell_time)
+        except Exception as e:
+            logging.error(
+                f"Scanner ({_sdr_name}) - Error when running dft_detect - {str(e)}"
+            )
+            _detector["process"].kill()
+            _results[_freq] = (None, 0.0)
+            continue
+
+        # dft_detect returns a code of 1 if no sonde is detected.
+        if _detector["process"].returncode == 1:
+            _results[_freq] = (None, 0.0)
+        else:
+            _results[_freq] = parse_dft_detect_output(ret_output, _sdr_name)
+
+    _runtime = time.time() - _start
+    logging.debug(
+        f"Scanner ({_sdr_name}) - Wideband detection on {len(frequencies)} peaks completed in {_runtime:.1f} seconds."
+    )
+
+    if _samples_read == 0:
+        logging.error(f"Scanner ({_sdr_name}) - No samples received during wideband detection.")
+        raise IOError("Possible SDR lockup.")
+
+    return _results
+
+
 #
 # Radiosonde Scanner Class
 #
@@ -690,7 +972,12 @@ class SondeScanner(object):
         temporary_block_list={},
         temporary_block_time=60,
         ngp_tweak=False,
-        wideband_sondes=False
+        wideband_sondes=False,
+        wideband_detection=False,
+        frequency_prior=None,
+        prior_seeds=0,
+        no_sonde_cache=None,
+        spectrum=None
     ):
         """Initialise a Sonde Scanner Object.
 
@@ -717,7 +1004,7 @@ class SondeScanner(object):
             scan_check_interval (int): If we are using a only_scan list, re-check the RTLSDR works every X scan runs.
             rs_path (str): Path to the RS binaries (i.e rs_detect). Defaults to ./
 
-            sdr_type (str): 'RTLSDR', 'Spyserver' or 'KA9Q'
+            sdr_type (str): 'RTLSDR', 'Spyserver', 'KA9Q' or 'Channelizer'
 
             Arguments for KA9Q SDR Server / SpyServer:
             sdr_hostname (str): Hostname of KA9Q Server
@@ -741,6 +1028,16 @@ class SondeScanner(object):
             temporary_block_time (int): How long (minutes) frequencies in the temporary block list should remain blocked for.
             ngp_tweak (bool): Narrow the detection filter when searching for 1680 MHz sondes, to enhance detection of RS92-NGPs.
             wideband_sondes (bool): Use a wider detection filter to allow detection of Weathex and wideband iMet sondes.
+            wideband_detection (bool): Test all peaks for sondes at once, rather than one peak at a time.
+                RTLSDRs capture a single wideband block of IQ covering all peaks, KA9Q servers run a channel per peak.
+            frequency_prior (FrequencyPrior): If provided, test peaks on frequencies sondes have previously been received on first,
+                and record new detections.
+            prior_seeds (int): Maximum number of frequencies regularly used at this time of day to test each scan,
+                even if no peak is seen on them. Requires a frequency_prior.
+            no_sonde_cache (NoSondeCache): If provided, skip peaks which have recently been tested and found not to
+                contain a sonde, and record the results of each detection.
+            spectrum (SpectrumAccumulator): If provided, integrate each scan into this accumulator, search for peaks in the
+                integrated spectrum, and also test any signals which have just appeared above the noise floor.
         """
 
         # Thread flag. This is set to True when a scan is running.
@@ -780,6 +1077,11 @@ class SondeScanner(object):
         self.callback = callback
         self.save_detection_audio = save_detection_audio
         self.wideband_sondes = wideband_sondes
+        self.wideband_detection = wideband_detection
+        self.frequency_prior = frequency_prior
+        self.prior_seeds = prior_seeds
+        self.no_sonde_cache = no_sonde_cache
+        self.spectrum = spectrum
 
         # Temporary block list.
         self.temporary_block_list = temporary_block_list.copy()
@@ -927,7 +1229,11 @@ class SondeScanner(object):
 
         self.log_info("Scanner Thread Closed.")
         self.sonde_scanner_running = False
+        if self.no_sonde_cache is not None:
+            self.no_sonde_cache.save(force=True)
         self.sonde_scanner_thread = None
+        # Let the task manager know it can release our SDR.
+        autorx.task_events.put(("task_exit", "SCAN"))
 
     def sonde_search(self, first_only=False):
         """Perform a frequency scan across a defined frequency range, and test each detected peak for the presence of a radiosonde.
@@ -952,6 +1258,9 @@ class SondeScanner(object):
 
         _search_results = []
 
+        # Levels of the peaks which the no-sonde cache applies to, keyed by peak frequency.
+        _peak_levels = {}
+
         if len(self.only_scan) == 0:
             # No only_scan frequencies provided - perform a scan.
 
@@ -981,6 +1290,21 @@ class SondeScanner(object):
                 # an issue with the RTLSDR. Sometimes these issues can be resolved by issuing a usb reset to the RTLSDR.
                 raise ValueError("Error getting PSD")
 
+            # Integrate this scan with the previous scans, and look for any signals which have just appeared.
+            # The peak search below then runs on the integrated spectrum.
+            _new_emitter_indices = []
+            if self.spectrum is not None:
+                _new = self.spectrum.update(freq, power)
+                _new_emitter_indices = self.spectrum.new_emitter_peaks(
+                    _new, power, min_distance=(self.min_distance / step)
+                )
+                if len(_new_emitter_indices) > 0:
+                    self.log_debug(
+                        "New signals above the noise floor on (MHz): %s"
+                        % str(freq[_new_emitter_indices] / 1e6)
+                    )
+                power = self.spectrum.get_average()
+
             # Update the global scan result
             scan_result["freq"] = [round(x,6) for x in list(freq/1e6)]
             scan_result["power"] = [round(x,2) for x in list(power)]
@@ -1003,8 +1327,21 @@ class SondeScanner(object):
                 show=False,
             )
 
-            # If we have found no peaks, and no always_scan list has been provided, re-scan.
-            if (len(peak_indices) == 0) and (len(self.always_scan) == 0):
+            # Frequencies that sondes are regularly received on at this time of day, which we will test even if
+            # there is no peak on them.
+            _seeds = []
+            if (self.frequency_prior is not None) and (self.prior_seeds > 0):
+                _seeds = self.frequency_prior.suggest(
+                    self.min_freq * 1e6, self.max_freq * 1e6, self.prior_seeds
+                )
+
+            # If we have found no peaks or new signals, and no always_scan list or launch history has been provided, re-scan.
+            if (
+                (len(peak_indices) == 0)
+                and (len(_new_emitter_indices) == 0)
+                and (len(self.always_scan) == 0)
+                and (len(_seeds) == 0)
+            ):
                 self.log_debug("No peaks found.")
                 # Emit a notification to the client that a scan is complete.
                 flask_emit_event("scan_event")
@@ -1015,6 +1352,19 @@ class SondeScanner(object):
             peak_freqs = freq[peak_indices]
             peak_frequencies = peak_freqs[np.argsort(peak_powers)][::-1]
 
+            # Signals which have just appeared go first, as they are the most likely to be a newly launched sonde.
+            if len(_new_emitter_indices) > 0:
+                peak_frequencies = np.append(freq[_new_emitter_indices], peak_frequencies)
+
+            # Add in the frequencies from the launch history. These are placed after the detected peaks, and
+            # are moved forward by their prior score below.
+            if len(_seeds) > 0:
+                self.log_debug(
+                    "Adding frequencies from launch history (MHz): %s"
+                    % str(np.array(_seeds) / 1e6)
+                )
+                peak_frequencies = np.append(peak_frequencies, _seeds)
+
             # Quantize to nearest x Hz
             peak_frequencies = (
                 np.round(peak_frequencies / self.quantization) * self.quantization
@@ -1042,6 +1392,40 @@ class SondeScanner(object):
                 )
                 peak_frequencies = np.delete(peak_frequencies, _index)
 
+            # Move frequencies that sondes have been received on before to the front, so they are
+            # not lost when limiting the number of peaks.
+            if self.frequency_prior is not None:
+                peak_frequencies = self.frequency_prior.rank(peak_frequencies)
+
+            # Skip any peaks which have recently been tested and found not to contain a sonde, so they don't
+            # take up detection time, or one of the max_peaks slots.
+            if self.no_sonde_cache is not None:
+                self.no_sonde_cache.decay()
+                _level_radius = math.ceil((self.quantization / 2) / step)
+                _keep = []
+                _skipped = []
+                for _peak in peak_frequencies:
+                    if _peak in _seeds:
+                        # Always test frequencies from the launch history.
+                        _keep.append(_peak)
+                        continue
+
+                    _idx = np.argmin(np.abs(freq - _peak))
+                    _level = float(np.max(power[max(0, _idx - _level_radius) : _idx + _level_radius + 1]))
+                    _peak_levels[float(_peak)] = _level
+
+                    if self.no_sonde_cache.should_skip(_peak, level=_level):
+                        _skipped.append(_peak)
+                    else:
+                        _keep.append(_peak)
+
+                if len(_skipped) > 0:
+                    self.log_debug(
+                        "Skipping peaks with no sonde detected on recent scans (MHz): %s"
+                        % str(np.array(_skipped) / 1e6)
+                    )
+                peak_frequencies = np.array(_keep)
+
             # Limit to the user-defined number of peaks to search over.
             if len(peak_frequencies) > self.max_peaks:
                 peak_frequencies = peak_frequencies[: self.max_peaks]
@@ -1123,10 +1507,18 @@ class SondeScanner(object):
         else:
             # We have been provided a only_scan list - scan through the supplied frequencies.
             peak_frequencies = np.array(self.only_scan) * 1e6
+            if self.frequency_prior is not None:
+                peak_frequencies = self.frequency_prior.rank(peak_frequencies)
             self.log_info(
                 "Scanning only frequencies (MHz): %s" % str(peak_frequencies / 1e6)
             )
 
+        # If enabled, test all the peaks at once.
+        if self.wideband_detection:
+            _wideband_results = self.detect_all_peaks(peak_frequencies)
+        else:
+            _wideband_results = {}
+
         # Run rs_detect on each peak frequency, to determine if there is a sonde there.
         for freq in peak_frequencies:
 
@@ -1136,21 +1528,31 @@ class SondeScanner(object):
             if self.sonde_scanner_running == False:
                 return []
 
-            (detected, offset_est) = detect_sonde(
-                _freq,
-                sdr_type=self.sdr_type,
-                sdr_hostname=self.sdr_hostname,
-                sdr_port=self.sdr_port,
-                ss_iq_path = self.ss_iq_path,
-                rtl_fm_path=self.rtl_fm_path,
-                rtl_device_idx=self.rtl_device_idx,
-                ppm=self.ppm,
-                gain=self.gain,
-                bias=self.bias,
-                dwell_time=self.detect_dwell_time,
-                save_detection_audio=self.save_detection_audio,
-                wideband_sondes=self.wideband_sondes
-            )
+            if _freq in _wideband_results:
+                (detected, offset_est) = _wideband_results[_freq]
+            else:
+                (detected, offset_est) = detect_sonde(
+                    _freq,
+                    sdr_type=self.sdr_type,
+                    sdr_hostname=self.sdr_hostname,
+                    sdr_port=self.sdr_port,
+                    ss_iq_path = self.ss_iq_path,
+                    rtl_fm_path=self.rtl_fm_path,
+                    rtl_device_idx=self.rtl_device_idx,
+                    ppm=self.ppm,
+                    gain=self.gain,
+                    bias=self.bias,
+                    dwell_time=self.detect_dwell_time,
+                    save_detection_audio=self.save_detection_audio,
+                    wideband_sondes=self.wideband_sondes
+                )
+
+            # Update the no-sonde cache, unless the detection was cut short by the scanner being stopped.
+            if (_freq in _peak_levels) and self.sonde_scanner_running:
+                if detected is None:
+                    self.no_sonde_cache.record_failure(_freq, level=_peak_levels[_freq])
+                else:
+                    self.no_sonde_cache.record_success(_freq)
 
             if detected != None:
                 # Quantize the detected frequency (with offset) to 1 kHz
@@ -1159,6 +1561,9 @@ class SondeScanner(object):
                 # Add a detected sonde to the output array
                 _search_results.append([_freq, detected])
 
+                if self.frequency_prior is not None:
+                    self.frequency_prior.add_detection(_freq)
+
                 # Immediately send this result to the callback.
                 self.send_to_callback([[_freq, detected]])
                 # If we only want the first detected sonde, then return now.
@@ -1174,6 +1579,91 @@ class SondeScanner(object):
 
         return _search_results
 
+    def detect_all_peaks(self, peak_frequencies):
+        """Attempt sonde detection on a set of peaks concurrently.
+
+        RTLSDRs capture one block of wideband IQ per group of peaks (see detect_sonde_wideband).
+        KA9Q servers and the Channelizer can provide many channels at once, so a detect_sonde instance is run per peak.
+        Peaks that cannot be handled here (i.e. 1680 MHz peaks, or SpyServer SDRs) are left out of the results,
+        and will be tested one at a time.
+
+        Args:
+            peak_frequencies (list): List of peak frequencies, in Hz.
+
+        Returns:
+            dict: A dictionary with an entry for each peak frequency that was tested, containing a tuple of (sonde_type, offset_est)
+        """
+        _results = {}
+
+        # Only the 400 MHz band uses IQ detection.
+        _frequencies = [float(_f) for _f in peak_frequencies if _f < 1000e6]
+
+        if len(_frequencies) == 0:
+            return _results
+
+        if self.sdr_type == "RTLSDR":
+            _groups = group_wideband_peaks(
+                _frequencies,
+                channel_rate = 96000 if self.wideband_sondes else 48000
+            )
+
+            for _group in _groups:
+                # Exit opportunity.
+                if self.sonde_scanner_running == False:
+                    break
+
+                _results.update(
+                    detect_sonde_wideband(
+                        _group,
+                        rs_path=self.rs_path,
+                        sdr_type=self.sdr_type,
+                        sdr_hostname=self.sdr_hostname,
+                        sdr_port=self.sdr_port,
+                        ss_iq_path = self.ss_iq_path,
+                        rtl_fm_path=self.rtl_fm_path,
+                        rtl_device_idx=self.rtl_device_idx,
+                        ppm=self.ppm,
+                        gain=self.gain,
+                        bias=self.bias,
+                        dwell_time=self.detect_dwell_time,
+                        save_detection_audio=self.save_detection_audio,
+                        wideband_sondes=self.wideband_sondes
+                    )
+                )
+
+        elif self.sdr_type in ["KA9Q", "Channelizer"]:
+            _errors = []
+
+            def _detect(frequency):
+                try:
+                    _results[frequency] = detect_sonde(
+                        frequency,
+                        rs_path=self.rs_path,
+                        sdr_type=self.sdr_type,
+                        sdr_hostname=self.sdr_hostname,
+                        sdr_port=self.sdr_port,
+                        rtl_device_idx=self.rtl_device_idx,
+                        dwell_time=self.detect_dwell_time,
+                        save_detection_audio=self.save_detection_audio,
+                        wideband_sondes=self.wideband_sondes
+                    )
+                except Exception as e:
+                    _errors.append(e)
+
+            _threads = [Thread(target=_detect, args=(_f,)) for _f in _frequencies]
+            for _thread in _threads:
+                _thread.start()
+            for _thread in _threads:
+                _thread.join()
+
+            if len(_errors) > 0:
+                raise _errors[0]
+
+        else:
+            self.log_debug(f"Wideband detection not supported for SDR type {self.sdr_type}, testing peaks one at a time.")
+
+        return _results
+
     def oneshot(self, first_only=False):
         """Perform a once-off scan attempt
 
@@ -0,0 +1,235 @@
+#!/usr/bin/env python
+#
+#   radiosonde_auto_rx - SDR Scheduler
+#
+#   Decides which SDR a new scanner or decoder task should use, and which running decoder (if any)
+#   should be pre-empted when a SDR is needed and none are free.
+#
+#   Copyright (C) 2018  Mark Jessop <vk5qi@rfhead.net>
+#   Released under GNU GPL v3 or later
+#
+import time
+from collections import deque
+from .utils import position_info
+
+
+# Decoder values, used to rank decoders for pre-emption. Higher values are more worth keeping.
+# Always-on decoders, and decoders which have not had a chance to receive telemetry yet.
+VALUE_PROTECTED = 100
+VALUE_ASCENDING = 50
+VALUE_DESCENDING = 40
+# Not moving, and has not been any higher (i.e. waiting for launch), or no ascent rate available yet.
+VALUE_GROUND = 30
+# No telemetry passing the telemetry filter for a while. These may be pre-empted for a new detection.
+VALUE_STALE = 20
+# Landed, or beyond max_radius_km. These may also be pre-empted to restart the scanner (if sdr_preempt_for_scanner
+# is enabled). When pre-empted for a new detection, their frequency is temporarily blocked.
+VALUE_LANDED = 10
+VALUE_FAR = 10
+
+# A sonde is considered landed once it is this far (metres) below its maximum altitude...
+LANDED_ALTITUDE_DROP = 1000
+# ... and its altitude is changing by less than this rate (m/s).
+LANDED_ASCENT_RATE = 1.0
+
+# Recent allocation decisions, as dicts of 'time', 'action', 'task', 'sdr' and 'reason'.
+decisions = deque(maxlen=100)
+
+
+def record_decision(action, task, sdr, reason=""):
+    """Record an allocation decision.
+
+    Args:
+        action (str): 'allocate', 'take_scanner' or 'preempt'.
+        task (str): Description of the task the decision was made for.
+        sdr (str): The SDR device index / ID.
+        reason (str): Why the decision was made.
+    """
+    decisions.append(
+        {
+            "time": time.time(),
+            "action": action,
+            "task": task,
+            "sdr": str(sdr),
+            "reason": reason,
+        }
+    )
+
+
+def sdr_score(sdr, freq=None):
+    """Score how suitable a SDR is for a task. Higher scores are better.
+
+    Args:
+        sdr (dict): Entry from the SDR list, containing 'ppm', 'gain', and optionally 'min_freq' and 'max_freq' (MHz).
+        freq (float): Sonde frequency (Hz) for a decoder task, or None for the scanner.
+
+    Returns:
+        float/None: The SDR's score, or None if the SDR cannot be used for this task.
+    """
+    _min_freq = sdr.get("min_freq", None)
+    _max_freq = sdr.get("max_freq", None)
+    _band_limited = (_min_freq is not None) or (_max_freq is not None)
+
+    _score = 0.0
+
+    if freq is None:
+        # The scanner covers the whole search range, so prefer SDRs without a band limit, leaving
+        # band-specific SDRs free for decoders.
+        if not _band_limited:
+            _score += 10
+        return _score
+
+    if _band_limited:
+        if (_min_freq is not None) and (freq < _min_freq * 1e6):
+            return None
+        if (_max_freq is not None) and (freq > _max_freq * 1e6):
+            return None
+        # This SDR has been set up (filters, LNA, antenna) for this band.
+        _score += 10
+
+    # A large ppm correction usually indicates a SDR without a TCXO, which will also drift with temperature.
+    _score -= min(abs(sdr.get("ppm", 0)), 100) / 10.0
+
+    # Prefer a fixed gain over AGC, which can be pumped around by strong nearby signals.
+    if sdr.get("gain", -1) != -1:
+        _score += 1
+
+    return _score
+
+
+def select_sdr(sdr_list, freq=None):
+    """Select the best free SDR for a task.
+
+    Args:
+        sdr_list (dict): The SDR list (autorx.sdr_list).
+        freq (float): Sonde frequency (Hz) for a decoder task, or None for the scanner.
+
+    Returns:
+        tuple: (device_idx, score) of the best free SDR, or (None, None) if no suitable SDRs are free.
+            Ties are broken by device index order.
+    """
+    _best = (None, None)
+
+    for _idx in sorted(sdr_list.keys()):
+        if sdr_list[_idx]["in_use"]:
+            continue
+
+        _score = sdr_score(sdr_list[_idx], freq=freq)
+        if _score is None:
+            continue
+
+        if (_best[1] is None) or (_score > _best[1]):
+            _best = (_idx, _score)
+
+    return _best
+
+
+def decoder_value(task_entry, config, now=None):
+    """Estimate how valuable a running decoder is.
+
+    Args:
+        task_entry (dict): Entry from the task list, containing the 'task' (SondeDecoder) and 'continuous' flag.
+        config (dict): The auto_rx configuration.
+        now (float): Current time (unix timestamp).
+
+    Returns:
+        tuple: (value, reason) - One of the VALUE_* constants, and a description of the decoder state.
+    """
+    if now is None:
+        now = time.time()
+
+    _decoder = task_entry["task"]
+
+    if task_entry.get("continuous", False):
+        return (VALUE_PROTECTED, "always-on decoder")
+
+    _last_good = getattr(_decoder, "last_good_telemetry_time", None)
+    if _last_good is None:
+        _last_good = getattr(_decoder, "start_time", now)
+
+    _telemetry = getattr(_decoder, "latest_telemetry", None)
+
+    # Check the distance first, as sondes beyond max_radius_km will also have stale telemetry.
+    if (
+        (_telemetry is not None)
+        and (config["station_lat"] != 0.0)
+        and (config["station_lon"] != 0.0)
+        and (_telemetry["lat"] != 0.0)
+        and (_telemetry["lon"] != 0.0)
+    ):
+        _info = position_info(
+            (config["station_lat"], config["station_lon"], config["station_alt"]),
+            (_telemetry["lat"], _telemetry["lon"], _telemetry["alt"]),
+        )
+        if _info["straight_distance"] > config["max_radius_km"] * 1000:
+            return (
+                VALUE_FAR,
+                "%.1f km away, beyond max_radius_km" % (_info["straight_distance"] / 1000.0),
+            )
+
+    if (now - _last_good) > config["sdr_preempt_stale_time"]:
+        return (VALUE_STALE, "no valid telemetry for %d seconds" % (now - _last_good))
+
+    if _telemetry is None:
+        return (VALUE_PROTECTED, "starting up")
+
+    _ascent_rate = _decoder.ascent_rate()
+    if _ascent_rate is None:
+        return (VALUE_GROUND, "no ascent rate yet")
+
+    if abs(_ascent_rate) < LANDED_ASCENT_RATE:
+        if (_decoder.max_altitude - _telemetry["alt"]) > LANDED_ALTITUDE_DROP:
+            return (
+                VALUE_LANDED,
+                "landed (%d m below maximum altitude)" % (_decoder.max_altitude - _telemetry["alt"]),
+            )
+        else:
+            return (VALUE_GROUND, "on the ground")
+
+    if _ascent_rate > 0:
+        return (VALUE_ASCENDING, "ascending at %.1f m/s" % _ascent_rate)
+    else:
+        return (VALUE_DESCENDING, "descending at %.1f m/s" % abs(_ascent_rate))
+
+
+def select_preemption(task_list, sdr_list, config, freq=None, max_value=VALUE_STALE):
+    """Select a running decoder to pre-empt, to free up a SDR for a new task.
+
+    Args:
+        task_list (dict): The task list (autorx.task_list).
+        sdr_list (dict): The SDR list (autorx.sdr_list).
+        config (dict): The auto_rx configuration.
+        freq (float): Sonde frequency (Hz) the SDR is needed for, or None for the scanner.
+        max_value (int): Only decoders with a value at or below this will be pre-empted.
+
+    Returns:
+        tuple/None: (task key, value, reason) of the least valuable decoder, or None if no decoders can be pre-empted.
+    """
+    _now = time.time()
+    _best = None
+
+    for _key in list(task_list.keys()):
+        # Only decoder tasks (keyed by frequency) can be pre-empted.
+        if not isinstance(_key, (int, float)):
+            continue
+
+        try:
+            _entry = task_list[_key]
+            if (_entry["task"] is None) or (not _entry["task"].running()):
+                continue
+
+            if sdr_score(sdr_list[_entry["device_idx"]], freq=freq) is None:
+                continue
+
+            (_value, _reason) = decoder_value(_entry, config, now=_now)
+        except KeyError:
+            # The task was removed while we were looking at it.
+            continue
+
+        if _value > max_value:
+            continue
+
+        if (_best is None) or (_value < _best[1]):
+            _best = (_key, _value, _reason)
+
+    return _best
@@ -11,9 +11,11 @@ import os.path
 import platform
 import subprocess
 import numpy as np
+from threading import Thread
 
 from .utils import rtlsdr_test, reset_rtlsdr_by_serial, reset_all_rtlsdrs, timeout_cmd
 from .ka9q import *
+from .channelizer import *
 
 
 def test_sdr(
@@ -29,7 +31,7 @@ def test_sdr(
     """
     Test the prescence / functionality of a SDR.
 
-    sdr_type (str): 'RTLSDR', 'SpyServer' or 'KA9Q'
+    sdr_type (str): 'RTLSDR', 'SpyServer', 'KA9Q' or 'Channelizer'
 
     Arguments for RTLSDRs:
     rtl_device_id (str) - Device ID for a RTLSDR
@@ -52,6 +54,14 @@ def test_sdr(
 
         return _ok
 
+
+    elif sdr_type == "Channelizer":
+        # The channelizer owns the RTLSDR, so we can only check that it is still running.
+        _ok = channelizer_running()
+        if not _ok:
+            logging.error(f"Channelizer ({rtl_device_idx}) not running.")
+
+        return _ok
     
     elif sdr_type == "KA9Q":
         # Test that a KA9Q server is working by attempting to start up a new narrowband channel on it.
@@ -186,7 +196,7 @@ def reset_sdr(
     """
     Attempt to reset a SDR. Only used for RTLSDRs.
 
-    sdr_type (str): 'RTLSDR', 'Spyserver' or 'KA9Q'
+    sdr_type (str): 'RTLSDR', 'Spyserver', 'KA9Q' or 'Channelizer'
 
     Arguments for RTLSDRs:
     rtl_device_id (str) - Device ID for a RTLSDR
@@ -218,7 +228,7 @@ def get_sdr_name(
     """
     Get a human-readable name of the currenrt SDR
 
-    sdr_type (str): 'RTLSDR', 'Spyserver' or 'KA9Q'
+    sdr_type (str): 'RTLSDR', 'Spyserver', 'KA9Q' or 'Channelizer'
 
     Arguments for RTLSDRs:
     rtl_device_id (str) - Device ID for a RTLSDR
@@ -233,6 +243,9 @@ def get_sdr_name(
 
     elif sdr_type == "KA9Q":
         return f"KA9Q {sdr_hostname}"
+
+    elif sdr_type == "Channelizer":
+        return f"Channelizer {rtl_device_idx}"
     
     elif sdr_type == "SpyServer":
         return f"SpyServer {sdr_hostname}:{sdr_port}"
@@ -250,9 +263,9 @@ def shutdown_sdr(
     ):
     """
     Function to trigger shutdown/cleanup of some SDR types.
-    Currently only required for the KA9Q server.
+    Currently only required for the KA9Q server and the Channelizer.
 
-    sdr_type (str): 'RTLSDR', 'Spyserver' or 'KA9Q'
+    sdr_type (str): 'RTLSDR', 'Spyserver', 'KA9Q' or 'Channelizer'
     sdr_id (str): The global ID of the SDR to be shut down.
     """
 
@@ -260,6 +273,9 @@ def shutdown_sdr(
         logging.debug(f"KA9Q - Closing Channel for {sdr_hostname} @ {frequency} Hz.")
         ka9q_close_channel(sdr_hostname, frequency, scan)
         pass
+    elif sdr_type == "Channelizer":
+        logging.debug(f"Channelizer - Closing Channel for {sdr_id} @ {frequency} Hz.")
+        channelizer_close_channel(frequency, scan)
     else:
         logging.debug(f"No shutdown action required for SDR type {sdr_type}")
 
@@ -288,7 +304,7 @@ def get_sdr_iq_cmd(
     Get a command-line argument to get IQ (signed 16-bit) from a SDR
     for a given frequency and bandwidth.
 
-    sdr_type (str): 'RTLSDR', 'Spyserver' or 'KA9Q'
+    sdr_type (str): 'RTLSDR', 'Spyserver', 'KA9Q' or 'Channelizer'
     frequency (int): Centre frequency in Hz
     sample_rate (int): Sample rate in Hz
 
@@ -362,6 +378,14 @@ def get_sdr_iq_cmd(
 
         return _cmd
     
+    if sdr_type == "Channelizer":
+        _cmd = channelizer_get_iq_cmd(frequency, sample_rate, scan)
+
+        if dc_block:
+            _cmd += _dc_remove
+
+        return _cmd
+
     if sdr_type == "KA9Q":
         _cmd = ka9q_get_iq_cmd(sdr_hostname, frequency, sample_rate, scan, channel_filter)
 
@@ -395,7 +419,7 @@ def get_sdr_fm_cmd(
     Get a command-line argument to get FM demodulated audio (signed 16-bit) from a SDR
     for a given frequency and bandwidth.
 
-    sdr_type (str): 'RTLSDR', 'Spyserver' or 'KA9Q'
+    sdr_type (str): 'RTLSDR', 'Spyserver', 'KA9Q' or 'Channelizer'
     frequency (int): Centre frequency in Hz
     filter_bandwidth (int): FM Demodulator filter bandwidth in Hz
     sample_rate (int): Output sample rate in Hz
@@ -418,22 +442,27 @@ def get_sdr_fm_cmd(
     """
 
 
-    if sdr_type == "RTLSDR":
-        _gain = ""
-        if gain:
-            if gain >= 0:
-                _gain = f"-g {gain:.1f} "
+    if sdr_type in ["RTLSDR", "Channelizer"]:
+        if sdr_type == "Channelizer":
+            # The channelizer performs the FM demodulation itself.
+            _cmd = channelizer_get_fm_cmd(frequency, filter_bandwidth)
 
-        _cmd = (
-            f"{rtl_fm_path} -M fm -F9 "
-            f"{'-T ' if bias else ''}"
-            f"-p {int(ppm)} "
-            f"-d {str(rtl_device_idx)} "
-            f"{_gain}"
-            f"-s {int(filter_bandwidth)} "
-            f"-f {int(frequency)} "
-            f"2>/dev/null | "
-        )
+        else:
+            _gain = ""
+            if gain:
+                if gain >= 0:
+                    _gain = f"-g {gain:.1f} "
+
+            _cmd = (
+                f"{rtl_fm_path} -M fm -F9 "
+                f"{'-T ' if bias else ''}"
+                f"-p {int(ppm)} "
+                f"-d {str(rtl_device_idx)} "
+                f"{_gain}"
+                f"-s {int(filter_bandwidth)} "
+                f"-f {int(frequency)} "
+                f"2>/dev/null | "
+            )
 
         # Add in resampling / convertion to wav using sox.
         _cmd += f"sox -t raw -r {int(filter_bandwidth)} -e s -b 16 -c 1 - -r {int(sample_rate)} -b 16 -t wav - "
@@ -453,119 +482,264 @@ def get_sdr_fm_cmd(
         return "false |"
 
 
-def read_rtl_power_log(log_filename, sdr_name):
+class PowerLogParser(object):
     """
-    Read in a rtl_power compatible log output file.
+    Parser for rtl_power compatible (and ka9q powers) spectrum logs.
+
+    Each line of a log contains a number of header fields describing the time and frequency range of the line,
+    followed by the power samples. Output arrays are preallocated (from the expected frequency range if known),
+    and lines can either be added all at once (parsed in a single vectorised pass), or one at a time
+    as they are produced by a running rtl_power process.
 
     Arguments:
-    log_filename (str): Filename to read
     sdr_name (str): SDR name used for logging errors.
+    header_fields (int): Number of header fields at the start of each line. 6 for rtl_power, 5 for ka9q powers.
+    skip_lines (int): Number of lines to discard at the start of the log.
+    frequency_start (int): Expected start frequency of the log, in Hz. Used to preallocate the output arrays.
+    frequency_stop (int): Expected stop frequency of the log, in Hz.
+    step (int): Expected frequency step of the log, in Hz.
     """
 
-    # OK, now try to read in the saved data.
-    # Output buffers.
-    freq = np.array([])
-    power = np.array([])
-
-    freq_step = 0
+    def __init__(
+        self,
+        sdr_name,
+        header_fields = 6,
+        skip_lines = 0,
+        frequency_start = None,
+        frequency_stop = None,
+        step = None
+    ):
+        self.sdr_name = sdr_name
+        self.header_fields = header_fields
+        self.skip_lines = skip_lines
 
-    # Open file.
-    f = open(log_filename, "r")
+        if (frequency_start is not None) and (frequency_stop is not None) and step:
+            _size = int((frequency_stop - frequency_start) / step) + 1
+        else:
+            _size = 4096
 
-    # rtl_power log files are csv's, with the first 6 fields in each line describing the time and frequency scan parameters
-    # for the remaining fields, which contain the power samples.
+        self.freq = np.empty(_size)
+        self.power = np.empty(_size)
+        self.length = 0
+        self.freq_step = 0
+        self.lines = 0
 
-    for line in f:
-        # Split line into fields.
-        fields = line.split(",", 6)
+    def parse_header(self, line):
+        """ Split a line into its header fields and sample string """
+        fields = line.rstrip().split(",", self.header_fields)
 
-        if len(fields) < 6:
+        if len(fields) < self.header_fields:
             logging.error(
-                f"Scanner ({sdr_name}) - Invalid number of samples in input file - corrupt?"
+                f"Scanner ({self.sdr_name}) - Invalid number of samples in input file - corrupt?"
             )
             raise Exception(
-                f"Scanner ({sdr_name}) - Invalid number of samples in input file - corrupt?"
+                f"Scanner ({self.sdr_name}) - Invalid number of samples in input file - corrupt?"
             )
 
-        start_date = fields[0]
-        start_time = fields[1]
-        start_freq = float(fields[2])
-        stop_freq = float(fields[3])
-        freq_step = float(fields[4])
-        n_samples = int(fields[5])
-        # freq_range = np.arange(start_freq,stop_freq,freq_step)
-        samples = np.fromstring(fields[6], sep=",")
-        freq_range = np.linspace(start_freq, stop_freq, len(samples))
+        # The frequency fields are just after the date/time field(s).
+        _offset = self.header_fields - 4
+        start_freq = float(fields[_offset])
+        stop_freq = float(fields[_offset + 1])
+        self.freq_step = float(fields[_offset + 2])
+
+        if len(fields) > self.header_fields:
+            _samples = fields[self.header_fields]
+        else:
+            _samples = ""
 
-        # Add frequency range and samples to output buffers.
-        freq = np.append(freq, freq_range)
-        power = np.append(power, samples)
+        return (start_freq, stop_freq, _samples)
 
-    f.close()
+    def reserve(self, length):
+        """ Grow the output buffers (if required) so they can hold at least length samples. """
+        if length <= len(self.freq):
+            return
 
-    # Sanitize power values, to remove the nan's that rtl_power puts in there occasionally.
-    power = np.nan_to_num(power)
+        _size = max(length, 2 * len(self.freq))
+        _freq = np.empty(_size)
+        _power = np.empty(_size)
+        _freq[: self.length] = self.freq[: self.length]
+        _power[: self.length] = self.power[: self.length]
+        self.freq = _freq
+        self.power = _power
 
-    return (freq, power, freq_step)
+    def add_line(self, line):
+        """ Parse a single line of a log, i.e. as soon as it is produced by rtl_power.
 
-def read_ka9q_power_log(log_filename, sdr_name):
+        Returns:
+        bool: True if the line contained samples.
+        """
+        return self.add_lines([line]) > 0
+
+    def add_lines(self, lines):
+        """ Parse a set of lines from a log. All the samples are converted in one pass.
+
+        Returns:
+        int: The number of samples added.
+        """
+        _headers = []
+        _sample_strings = []
+
+        for line in lines:
+            if self.skip_lines > 0:
+                self.skip_lines -= 1
+                continue
+
+            if line.strip() == "":
+                continue
+
+            (start_freq, stop_freq, _samples) = self.parse_header(line)
+            if _samples == "":
+                continue
+
+            _headers.append((start_freq, stop_freq, _samples.count(",") + 1))
+            _sample_strings.append(_samples)
+
+        if len(_headers) == 0:
+            return 0
+
+        try:
+            samples = np.array(",".join(_sample_strings).split(","), dtype=np.float64)
+        except ValueError:
+            # At least one line has an empty or invalid sample field (e.g. a trailing comma).
+            (_headers, samples) = self.parse_lines_individually(_headers, _sample_strings)
+
+        self.reserve(self.length + len(samples))
+        self.power[self.length : self.length + len(samples)] = samples
+
+        _idx = self.length
+        for (start_freq, stop_freq, _n) in _headers:
+            self.freq[_idx : _idx + _n] = np.linspace(start_freq, stop_freq, _n)
+            _idx += _n
+
+        self.length += len(samples)
+        self.lines += len(_headers)
+
+        return len(samples)
+
+    def parse_lines_individually(self, headers, sample_strings):
+        """ Slow path for add_lines - convert the samples of each line separately, ignoring empty sample fields,
+        and skipping any lines which still can't be converted, so one malformed line doesn't lose the whole scan.
+
+        Returns:
+        (headers, samples) Tuple, containing only the lines which could be converted.
+        """
+        _headers = []
+        _samples = []
+
+        for ((start_freq, stop_freq, _n), _sample_string) in zip(headers, sample_strings):
+            _fields = [_field for _field in _sample_string.split(",") if _field.strip() != ""]
+            try:
+                _line_samples = np.array(_fields, dtype=np.float64)
+            except ValueError:
+                logging.warning(
+                    f"Scanner ({self.sdr_name}) - Skipping line with invalid samples in power log."
+                )
+                continue
+
+            if len(_line_samples) == 0:
+                continue
+
+            _headers.append((start_freq, stop_freq, len(_line_samples)))
+            _samples.append(_line_samples)
+
+        if len(_samples) == 0:
+            return ([], np.array([]))
+
+        return (_headers, np.concatenate(_samples))
+
+    def result(self):
+        """ Get the parsed spectrum data.
+
+        Returns:
+        (freq, power, step) Tuple, as returned by get_power_spectrum.
+        """
+        freq = self.freq[: self.length].copy()
+        # Sanitize power values, to remove the nan's that rtl_power puts in there occasionally.
+        power = np.nan_to_num(self.power[: self.length])
+
+        return (freq, power, self.freq_step)
+
+
+def read_rtl_power_log(log_filename, sdr_name):
     """
-    Read in a ka9q log output file.
+    Read in a rtl_power compatible log output file.
 
     Arguments:
     log_filename (str): Filename to read
     sdr_name (str): SDR name used for logging errors.
     """
 
-    # OK, now try to read in the saved data.
-    # Output buffers.
-    freq = np.array([])
-    power = np.array([])
+    _parser = PowerLogParser(sdr_name, header_fields=6)
 
-    freq_step = 0
+    with open(log_filename, "r") as f:
+        _parser.add_lines(f.read().splitlines())
+
+    return _parser.result()
+
+def read_ka9q_power_log(log_filename, sdr_name):
+    """
+    Read in a ka9q log output file.
 
-    # Open file.
-    f = open(log_filename, "r")
+    Arguments:
+    log_filename (str): Filename to read
+    sdr_name (str): SDR name used for logging errors.
+    """
 
     # ka9q powers log files are csv's, with the first 5 fields in each line describing the time and frequency scan parameters
     # for the remaining fields, which contain the power samples.
+    # The first line is discarded, as it is produced without any dwelling.
+    _parser = PowerLogParser(sdr_name, header_fields=5, skip_lines=1)
 
-    burn_line = True
+    with open(log_filename, "r") as f:
+        _parser.add_lines(f.read().splitlines())
 
-    for line in f:
-        if burn_line:
-            burn_line = False
-            continue
+    return _parser.result()
 
-        # Split line into fields.
-        fields = line.rstrip().split(",", 5)
 
-        if len(fields) < 5:
-            logging.error(
-                f"Scanner ({sdr_name}) - Invalid number of samples in input file - corrupt?"
-            )
-            raise Exception(
-                f"Scanner ({sdr_name}) - Invalid number of samples in input file - corrupt?"
-            )
+def stream_power_log(command, log_filename, parser):
+    """
+    Run a spectrum logging command which writes its log to stdout, parsing each line as soon as it is produced.
+    A copy of the log is also written to log_filename.
 
-        start_datetime = fields[0]
-        start_freq = float(fields[1])
-        stop_freq = float(fields[2])
-        freq_step = float(fields[3])
-        n_samples = int(fields[4])
-        # freq_range = np.arange(start_freq,stop_freq,freq_step)
-        samples = np.fromstring(fields[5], sep=",")
-        freq_range = np.linspace(start_freq, stop_freq, len(samples))
+    Arguments:
+    command (str): Command to run.
+    log_filename (str): Filename to save the log to.
+    parser (PowerLogParser): Parser to pass each line to.
 
-        # Add frequency range and samples to output buffers.
-        freq = np.append(freq, freq_range)
-        power = np.append(power, samples)
+    Returns:
+    (returncode, output) Tuple, where output is the stderr output of the command.
+    """
 
-    f.close()
+    _process = subprocess.Popen(
+        command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+    )
+
+    # Read stderr in a separate thread, so the process can't block on a full stderr pipe.
+    _stderr = []
+    _stderr_thread = Thread(target=lambda: _stderr.append(_process.stderr.read()))
+    _stderr_thread.start()
+
+    _error = None
+    with open(log_filename, "w") as _log:
+        for _line in _process.stdout:
+            _line = _line.decode("ascii", errors="ignore")
+            _log.write(_line)
+            if _error is None:
+                try:
+                    parser.add_line(_line)
+                except Exception as e:
+                    # Keep reading to let the process exit cleanly, and raise the error afterwards.
+                    _error = e
 
-    power = np.nan_to_num(power)
+    _process.wait()
+    _stderr_thread.join()
 
-    return (freq, power, freq_step)
+    if _error is not None:
+        raise _error
+
+    _output = b"".join(_stderr).decode("ascii", errors="ignore")
+
+    return (_process.returncode, _output)
 
 
 def get_power_spectrum(
@@ -589,7 +763,7 @@ def get_power_spectrum(
 
     Arguments:
 
-    sdr_type (str): 'RTLSDR', 'Spyserver' or 'KA9Q' 
+    sdr_type (str): 'RTLSDR', 'Spyserver', 'KA9Q' or 'Channelizer' 
 
     frequency_start (int): Start frequency for the PSD, Hz
     frequency_stop (int): Stop frequency for the PSD, Hz
@@ -658,7 +832,7 @@ def get_power_spectrum(
             f"{_gain}"
             f"-f {frequency_start}:{frequency_stop}:{step} "
             f"-i {integration_time} -1 -c 25% "
-            f"{_log_filename}"
+            f"-"
         )
 
         _sdr_name = get_sdr_name(
@@ -673,17 +847,23 @@ def get_power_spectrum(
             f"Scanner ({_sdr_name}) - Running command: {_rtl_power_cmd}"
         )
 
-        try:
-            _output = subprocess.check_output(
-                _rtl_power_cmd, shell=True, stderr=subprocess.STDOUT
-            )
-        except subprocess.CalledProcessError as e:
+        # Parse the spectrum data as rtl_power produces it.
+        _parser = PowerLogParser(
+            _sdr_name,
+            header_fields=6,
+            frequency_start=frequency_start,
+            frequency_stop=frequency_stop,
+            step=step
+        )
+
+        (_returncode, _output) = stream_power_log(_rtl_power_cmd, _log_filename, _parser)
+
+        if _returncode != 0:
             # Something went wrong...
             logging.critical(
-                f"Scanner ({_sdr_name}) - rtl_power call failed with return code {e.returncode}."
+                f"Scanner ({_sdr_name}) - rtl_power call failed with return code {_returncode}."
             )
             # Look at the error output in a bit more details.
-            _output = e.output.decode("ascii")
             if "No supported devices found" in _output:
                 logging.critical(
                     f"Scanner ({_sdr_name}) - rtl_power could not find device with ID {rtl_device_idx}, is your configuration correct?"
@@ -705,7 +885,7 @@ def get_power_spectrum(
 
             return (None, None, None)
 
-        return read_rtl_power_log(_log_filename, _sdr_name)
+        return _parser.result()
 
     elif sdr_type == "SpyServer":
         # Use a spyserver to obtain power spectral density data
@@ -801,7 +981,6 @@ def get_power_spectrum(
             f"-i {integration_time} "
             f"-s {_ssrc} "
             f"-c 2 " # burn the first scan result due to no dwelling
-            f"> {_log_filename}"
         )
 
         _sdr_name = get_sdr_name(
@@ -816,17 +995,24 @@ def get_power_spectrum(
             f"Scanner ({_sdr_name}) - Running command: {_powers_cmd}"
         )
 
-        try:
-            _output = subprocess.check_output(
-                _powers_cmd, shell=True, stderr=subprocess.STDOUT
-            )
-        except subprocess.CalledProcessError as e:
+        # Parse the spectrum data as powers produces it. The first line is discarded.
+        _parser = PowerLogParser(
+            _sdr_name,
+            header_fields=5,
+            skip_lines=1,
+            frequency_start=frequency_start,
+            frequency_stop=frequency_stop,
+            step=step
+        )
+
+        (_returncode, _output) = stream_power_log(_powers_cmd, _log_filename, _parser)
+
+        if _returncode != 0:
             # Something went wrong...
             logging.critical(
-                f"Scanner ({_sdr_name}) - ka9q powers call failed with return code {e.returncode}."
+                f"Scanner ({_sdr_name}) - ka9q powers call failed with return code {_returncode}."
             )
             # Look at the error output in a bit more details.
-            _output = e.output.decode("ascii")
             # Something else odd happened, dump the entire error output to the log for further analysis.
             logging.critical(
                 f"Scanner ({_sdr_name}) - ka9q powers reported error: {_output}"
@@ -834,7 +1020,20 @@ def get_power_spectrum(
 
             return (None, None, None)
 
-        return read_ka9q_power_log(_log_filename, _sdr_name)
+        return _parser.result()
+
+    elif sdr_type == "Channelizer":
+        # Integrate spectrum data from the wideband channelizer.
+        _sdr_name = get_sdr_name(
+            sdr_type=sdr_type,
+            rtl_device_idx=rtl_device_idx,
+            sdr_hostname=sdr_hostname,
+            sdr_port=sdr_port
+            )
+
+        logging.info(f"Scanner ({_sdr_name}) - Running frequency scan.")
+
+        return channelizer_get_power_spectrum(frequency_start, frequency_stop, step, integration_time)
 
     else:
         # Unsupported SDR Type
@@ -19,8 +19,9 @@ import json
 import logging
 import os
 import requests
+import shutil
 import time
-from queue import Queue
+from queue import Queue, Empty
 from threading import Thread
 from email.utils import formatdate
 
@@ -37,6 +38,18 @@ class SondehubUploader(object):
     SONDEHUB_URL = "https://api.v2.sondehub.org/sondes/telemetry"
     SONDEHUB_STATION_POSITION_URL = "https://api.v2.sondehub.org/listeners"
 
+    # Forget about a sonde (for the purposes of detecting new sondes) if we haven't heard it for this long, in seconds.
+    SONDE_TIMEOUT = 600
+
+    # Maximum number of spilled telemetry packets to upload in a single replay batch.
+    SPILL_BATCH_SIZE = 500
+    # Maximum number of replay batches to upload per upload cycle, so replaying doesn't hold up live data.
+    SPILL_BATCHES_PER_CYCLE = 4
+    # Minimum time between replay attempts while uploads are failing, in seconds.
+    SPILL_RETRY_INTERVAL = 60
+    # Maximum size of the spill file, in bytes. Failed uploads are discarded beyond this.
+    SPILL_MAX_SIZE = 50 * 1024 * 1024
+
     def __init__(
         self,
         upload_rate=30,
@@ -47,12 +60,19 @@ class SondehubUploader(object):
         user_antenna="",
         contact_email="",
         user_position_update_rate=6,
+        spill_path=None,
+        max_batch_size=200,
+        new_sonde_delay=5,
     ):
         """ Initialise and start a Sondehub uploader
         
         Args:
             upload_rate (int): How often to upload batches of data.
             upload_timeout (int): Upload timeout.
+            spill_path (str): Optional file in which to store telemetry from failed uploads, for later replay.
+            max_batch_size (int): Upload as soon as this many telemetry packets are waiting, regardless of upload_rate.
+            new_sonde_delay (int): Upload within this many seconds of first hearing a new sonde, to get the first
+                position out quickly.
 
         """
 
@@ -65,9 +85,22 @@ class SondehubUploader(object):
         self.user_antenna = user_antenna
         self.contact_email = contact_email
         self.user_position_update_rate = user_position_update_rate
+        self.spill_path = spill_path
+        self.max_batch_size = max_batch_size
+        self.new_sonde_delay = new_sonde_delay
+
+        # Time we last heard from each sonde serial, used to detect new sondes.
+        self.sonde_last_heard = {}
 
         self.slower_uploads = False
 
+        # Persistent HTTP session, so we can re-use connections between uploads.
+        self.session = requests.Session()
+        self.session.headers.update({"User-Agent": "autorx-" + autorx.__version__})
+
+        # Record of when we last attempted to replay spilled telemetry.
+        self.last_spill_attempt = 0
+
         if self.user_position is None:
             self.inhibit_upload = True
         else:
@@ -358,25 +391,130 @@ class SondehubUploader(object):
 
         return _output
 
+    def coalesce_telemetry(self, telem_list):
+        """ Remove duplicate frames (e.g. the same sonde received by multiple decoders), and group frames by sonde.
+        Grouping like frames together also improves the gzip compression of the upload.
+
+        Args:
+            telem_list (list): List of telemetry dictionaries, in the universal format.
+
+        Returns:
+            list: Coalesced list of telemetry dictionaries.
+        """
+        _sondes = {}
+        _seen_frames = set()
+
+        for _telem in telem_list:
+            _key = (_telem["serial"], _telem["frame"], _telem["datetime"])
+            if _key in _seen_frames:
+                continue
+
+            _seen_frames.add(_key)
+            _sondes.setdefault(_telem["serial"], []).append(_telem)
+
+        _output = []
+        for _serial in _sondes:
+            _output.extend(_sondes[_serial])
+
+        if len(_output) != len(telem_list):
+            self.log_debug(
+                "Coalesced %d telemetry packets into %d." % (len(telem_list), len(_output))
+            )
+
+        return _output
+
+    def check_new_sonde(self, telemetry):
+        """ Record that we have heard a sonde, and check if it is a sonde we haven't heard from recently.
+
+        Returns:
+            bool: True if this is a new sonde which we should upload quickly.
+        """
+        _now = time.time()
+        _serial = telemetry["serial"]
+
+        _new = (_serial not in self.sonde_last_heard) or (
+            _now > (self.sonde_last_heard[_serial] + self.SONDE_TIMEOUT)
+        )
+        self.sonde_last_heard[_serial] = _now
+
+        # Clean out sondes we haven't heard from in a while.
+        for _sonde in list(self.sonde_last_heard.keys()):
+            if _now > (self.sonde_last_heard[_sonde] + self.SONDE_TIMEOUT):
+                self.sonde_last_heard.pop(_sonde)
+
+        # DFM uploads need a few packets to pass the SondeHub z-check, so we don't rush these out.
+        if telemetry["type"] in ["DFM", "PS-15"]:
+            return False
+
+        return _new
+
     def process_queue(self):
-        """ Process data from the input queue, and write telemetry to log files.
+        """ Process data from the input queue, and upload it to SondeHub.
+
+        Telemetry is uploaded when the oldest waiting packet has been waiting for the upload rate,
+        when max_batch_size packets are waiting, or shortly after we start receiving a new sonde,
+        whichever comes first.
         """
         self.log_info("Started Sondehub Uploader Thread.")
 
+        _to_upload = []
+        _upload_deadline = None
+
         while self.input_processing_running:
 
-            # Process everything in the queue.
-            _to_upload = []
+            # Wait for new telemetry to arrive, then grab everything in the queue (up to a batch at a time).
+            try:
+                if hasattr(self.input_queue, "get_batch"):
+                    # Telemetry bus ring buffer - take the batch in one go.
+                    _new_telem = self.input_queue.get_batch(
+                        max_items=self.max_batch_size, timeout=1
+                    )
+                else:
+                    _new_telem = [self.input_queue.get(timeout=1)]
+                    while self.input_queue.qsize() > 0:
+                        _new_telem.append(self.input_queue.get_nowait())
+            except Empty:
+                _new_telem = []
+            except Exception as e:
+                self.log_error("Error grabbing telemetry from queue - %s" % str(e))
+                _new_telem = []
 
-            while self.input_queue.qsize() > 0:
-                try:
-                    _to_upload.append(self.input_queue.get_nowait())
-                except Exception as e:
-                    self.log_error("Error grabbing telemetry from queue - %s" % str(e))
+            # If we are encounting DFM packets we need to upload at a slower rate so 
+            # that we have enough uploaded packets to pass z-check.
+            if self.slower_uploads:
+                self.actual_upload_rate = min(30,int(self.upload_rate*1.5))
+
+            for _telem in _new_telem:
+                if _upload_deadline is None:
+                    _upload_deadline = time.time() + self.actual_upload_rate
+
+                if self.check_new_sonde(_telem):
+                    self.log_debug("New sonde %s, uploading shortly." % _telem["serial"])
+                    _upload_deadline = min(_upload_deadline, time.time() + self.new_sonde_delay)
+
+                _to_upload.append(_telem)
 
             # Upload data!
-            if len(_to_upload) > 0:
-                self.upload_telemetry(_to_upload)
+            if (len(_to_upload) > 0) and (
+                (len(_to_upload) >= self.max_batch_size)
+                or (time.time() >= _upload_deadline)
+            ):
+                _to_upload = self.coalesce_telemetry(_to_upload)
+
+                # Split up very large bursts of telemetry into multiple uploads.
+                for i in range(0, len(_to_upload), self.max_batch_size):
+                    _batch = _to_upload[i : i + self.max_batch_size]
+                    if self.upload_telemetry(_batch):
+                        # We have connectivity, so try and upload anything left over from previous failures.
+                        self.replay_spilled_telemetry(force=True)
+                    else:
+                        self.spill_telemetry(_batch)
+
+                _to_upload = []
+                _upload_deadline = None
+
+            elif len(_to_upload) == 0:
+                self.replay_spilled_telemetry()
 
             # If we haven't uploaded our station position recently, re-upload it.
             if (
@@ -384,21 +522,177 @@ class SondehubUploader(object):
             ) > self.user_position_update_rate * 3600:
                 self.station_position_upload()
 
-            # If we are encounting DFM packets we need to upload at a slower rate so 
-            # that we have enough uploaded packets to pass z-check.
-            if self.slower_uploads:
-                self.actual_upload_rate = min(30,int(self.upload_rate*1.5))
-            
-            # Sleep while waiting for some new data.
-            for i in range(self.actual_upload_rate):
-                time.sleep(1)
-                if self.input_processing_running == False:
-                    break
+        # Try not to lose any telemetry we were about to upload.
+        if len(_to_upload) > 0:
+            self.spill_telemetry(self.coalesce_telemetry(_to_upload))
 
         self.log_info("Stopped Sondehub Uploader Thread.")
 
+    def spill_telemetry(self, telem_list):
+        """ Append a list of telemetry which failed to upload to the spill file, for later replay.
+        The telemetry is written as one JSON line per replay batch, and flushed to disk before returning. """
+
+        if self.spill_path is None:
+            self.log_error("Discarding %d telemetry packets." % len(telem_list))
+            return
+
+        try:
+            if os.path.exists(self.spill_path):
+                _size = os.path.getsize(self.spill_path)
+
+                if (_size - self.read_spill_offset()) > self.SPILL_MAX_SIZE:
+                    self.log_error(
+                        "Spill file full, discarding %d telemetry packets."
+                        % len(telem_list)
+                    )
+                    return
+
+                # If we crashed part way through writing a line, terminate it so the new data starts on a line of its own.
+                if _size > 0:
+                    with open(self.spill_path, "rb") as _f:
+                        _f.seek(-1, os.SEEK_END)
+                        _partial_line = _f.read(1) != b"\n"
+                else:
+                    _partial_line = False
+            else:
+                _partial_line = False
+
+            with open(self.spill_path, "a") as _f:
+                if _partial_line:
+                    _f.write("\n")
+                for i in range(0, len(telem_list), self.SPILL_BATCH_SIZE):
+                    _f.write(json.dumps(telem_list[i : i + self.SPILL_BATCH_SIZE]) + "\n")
+                _f.flush()
+                os.fsync(_f.fileno())
+
+            self.log_info(
+                "Saved %d telemetry packets for upload later." % len(telem_list)
+            )
+
+        except Exception as e:
+            self.log_error("Error writing to spill file - %s" % str(e))
+
+    def read_spill_offset(self):
+        """ Read the offset (in bytes) into the spill file up to which telemetry has already been replayed.
+
+        Returns:
+            int: Offset into the spill file, or 0 if nothing has been replayed yet.
+        """
+        try:
+            with open(self.spill_path + ".offset", "r") as _f:
+                return int(_f.read().strip())
+        except Exception:
+            return 0
+
+    def write_spill_offset(self, offset):
+        """ Persist the replay offset into the spill file. This is written to a temporary file and moved into
+        place, so a crash leaves either the old or the new offset. """
+        _offset_path = self.spill_path + ".offset"
+        _temp_path = _offset_path + ".tmp"
+        with open(_temp_path, "w") as _f:
+            _f.write("%d\n" % offset)
+            _f.flush()
+            os.fsync(_f.fileno())
+        os.replace(_temp_path, _offset_path)
+
+    def remove_spill_file(self):
+        """ Remove the spill file and its replay offset, once everything in it has been replayed. """
+        for _path in [self.spill_path, self.spill_path + ".offset"]:
+            if os.path.exists(_path):
+                os.remove(_path)
+
+    def compact_spill_file(self, offset):
+        """ Drop the already-replayed start of the spill file. This copies the remainder to a temporary file,
+        so is only done occasionally, once the replayed part has grown large. """
+        _temp_path = self.spill_path + ".tmp"
+        with open(self.spill_path, "rb") as _in, open(_temp_path, "wb") as _out:
+            _in.seek(offset)
+            shutil.copyfileobj(_in, _out)
+            _out.flush()
+            os.fsync(_out.fileno())
+        # Reset the offset first - if we crash between these two steps some telemetry will be uploaded twice,
+        # rather than the remainder of the file being skipped.
+        self.write_spill_offset(0)
+        os.replace(_temp_path, self.spill_path)
+
+    def replay_spilled_telemetry(self, force=False):
+        """ Upload telemetry from the spill file, in size-capped batches.
+
+        Only the next few lines of the spill file are read each cycle, starting from a persisted offset, which
+        is advanced as each batch is uploaded. The file is removed once it has been completely replayed.
+
+        Args:
+            force (bool): Attempt a replay even if the last attempt was recent (i.e. because an upload just succeeded).
+        """
+
+        if (self.spill_path is None) or (not os.path.exists(self.spill_path)):
+            return
+
+        if (not force) and (
+            time.time() < (self.last_spill_attempt + self.SPILL_RETRY_INTERVAL)
+        ):
+            return
+
+        self.last_spill_attempt = time.time()
+
+        try:
+            _offset = self.read_spill_offset()
+            _batches = 0
+            _uploaded = 0
+            _failed = False
+
+            with open(self.spill_path, "rb") as _f:
+                _f.seek(_offset)
+
+                while (_batches < self.SPILL_BATCHES_PER_CYCLE) and self.input_processing_running:
+                    _line = _f.readline()
+
+                    if len(_line) == 0:
+                        break
+
+                    # Only this thread writes to the spill file, so a partially written last line can only be left
+                    # over from a crash, and is skipped like any other corrupt line.
+                    try:
+                        _telem = json.loads(_line)
+                    except Exception:
+                        self.log_debug("Skipping corrupt line in spill file.")
+                        _telem = []
+
+                    if len(_telem) > 0:
+                        _batches += 1
+                        if not self.upload_telemetry(_telem):
+                            _failed = True
+                            break
+                        _uploaded += len(_telem)
+
+                    _offset = _f.tell()
+                    self.write_spill_offset(_offset)
+
+                _remaining = os.fstat(_f.fileno()).st_size - _offset
+
+            if _uploaded > 0:
+                self.log_info("Replayed %d saved telemetry packets." % _uploaded)
+
+            if _remaining == 0:
+                self.remove_spill_file()
+            elif _offset > self.SPILL_MAX_SIZE:
+                self.compact_spill_file(_offset)
+
+            if (_remaining > 0) and (not _failed):
+                # There's more to replay, so try again next cycle.
+                self.last_spill_attempt = 0
+
+        except Exception as e:
+            self.log_error("Error replaying spill file - %s" % str(e))
+
     def upload_telemetry(self, telem_list):
-        """ Upload an list of telemetry data to Sondehub """
+        """ Upload an list of telemetry data to Sondehub
+
+        Returns:
+            bool: True if the telemetry was delivered (2xx), or was rejected by Sondehub (4xx, except 429) and should
+                be discarded. False if it should be kept and uploaded later (network issues, or server errors / rate
+                limiting which persisted through all the retries).
+        """
 
         _data_len = len(telem_list)
 
@@ -411,7 +705,7 @@ class SondehubUploader(object):
                 "Error serialising and compressing telemetry list for upload - %s"
                 % str(e)
             )
-            return
+            return True
 
         _compression_time = time.time() - _start_time
         self.log_debug(
@@ -433,12 +727,11 @@ class SondehubUploader(object):
             # Run the request.
             try:
                 headers = {
-                    "User-Agent": "autorx-" + autorx.__version__,
                     "Content-Encoding": "gzip",
                     "Content-Type": "application/json",
                     "Date": formatdate(timeval=None, localtime=False, usegmt=True),
                 }
-                _req = requests.put(
+                _req = self.session.put(
                     self.SONDEHUB_URL,
                     _compressed_payload,
                     # TODO: Revisit this second timeout value.
@@ -447,10 +740,10 @@ class SondehubUploader(object):
                 )
             except Exception as e:
                 self.log_error("Upload Failed: %s" % str(e))
-                return
+                return False
 
             if _req.status_code == 200:
-                # 200 is the only status code that we accept.
+                # Success.
                 _upload_time = time.time() - _start_time
                 self.log_info(
                     "Uploaded %d telemetry packets to Sondehub in %.1f seconds."
@@ -459,8 +752,11 @@ class SondehubUploader(object):
                 _upload_success = True
                 break
 
-            elif _req.status_code == 500:
-                # Server Error, Retry.
+            elif (_req.status_code >= 500) or (_req.status_code == 429):
+                # Server Error, Gateway Error, or Too Many Requests. Retry.
+                self.log_debug(
+                    "Sondehub returned status code %d, retrying." % _req.status_code
+                )
                 _retries += 1
                 continue
 
@@ -490,15 +786,37 @@ class SondehubUploader(object):
                 _upload_success = True
                 break
 
-            else:
+            elif 200 <= _req.status_code < 300:
+                # Some other success code - the data was delivered.
+                self.log_debug(
+                    "Uploaded %d telemetry packets to Sondehub (Status Code: %d)."
+                    % (_data_len, _req.status_code)
+                )
+                _upload_success = True
+                break
+
+            elif 400 <= _req.status_code < 500:
+                # The data was rejected, so there is no point trying to upload it again.
                 self.log_error(
                     "Error uploading to Sondehub. Status Code: %d %s."
                     % (_req.status_code, _req.text)
                 )
-                break
+                return True
+
+            else:
+                # Anything else (e.g. a redirect from a captive portal) means the data hasn't been delivered.
+                self.log_error(
+                    "Unexpected response from Sondehub. Status Code: %d %s."
+                    % (_req.status_code, _req.text)
+                )
+                return False
 
         if not _upload_success:
+            # We have run out of retries on server errors, so keep the data to upload later.
             self.log_error("Upload failed after %d retries" % (_retries))
+            return False
+
+        return True
 
     def station_position_upload(self):
         """ 
@@ -533,11 +851,10 @@ class SondehubUploader(object):
             # Run the request.
             try:
                 headers = {
-                    "User-Agent": "autorx-" + autorx.__version__,
                     "Content-Type": "application/json",
                     "Date": formatdate(timeval=None, localtime=False, usegmt=True),
                 }
-                _req = requests.put(
+                _req = self.session.put(
                     self.SONDEHUB_STATION_POSITION_URL,
                     json=_position,
                     # TODO: Revisit this second timeout value.
@@ -555,8 +872,11 @@ class SondehubUploader(object):
                 _upload_success = True
                 break
 
-            elif _req.status_code == 500:
-                # Server Error, Retry.
+            elif (_req.status_code >= 500) or (_req.status_code == 429):
+                # Server Error, Gateway Error, or Too Many Requests. Retry.
+                self.log_debug(
+                    "Sondehub returned status code %d, retrying." % _req.status_code
+                )
                 _retries += 1
                 continue
 
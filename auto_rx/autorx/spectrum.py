@@ -0,0 +1,234 @@
+#!/usr/bin/env python
+#
+#   radiosonde_auto_rx - Spectrum Accumulator
+#
+#   Released under GNU GPL v3 or later
+#
+#   Integrates the power spectra from successive scans, tracks the noise floor (and its variance)
+#   in each frequency bin, flags signals which have newly appeared above the noise floor, and keeps
+#   a history of recent scans for the web interface waterfall.
+#
+import logging
+import time
+from collections import deque
+from threading import Lock
+
+import numpy as np
+
+from .utils import detect_peaks
+
+
+class SpectrumAccumulator(object):
+    """ Spectrum Accumulator
+
+    Each scan is averaged into the integrated spectrum with an exponential moving average (in linear power),
+    so the integrated spectrum is equivalent to a longer integration time than a single scan.
+
+    The noise floor (background level) and its variance are tracked for each bin, from the difference between each
+    scan and the noise floor. Signals which are constantly present (carriers, birdies) become part of the noise floor.
+
+    A bin is flagged as a new emitter when the latest scan is above its noise floor by more than NEW_EMITTER_SIGMA
+    times the larger of the bin's standard deviation and the scan-wide (robust) standard deviation. This catches signals
+    as soon as they appear, even if they are too weak to stand out above the overall threshold in a single scan.
+    Flagged bins are only slowly absorbed into the noise floor, so a new signal remains flagged for a number of scans.
+    Change detection is disabled when alpha is 1 (no integration).
+
+    The accumulator is reset if there is a long gap between scans (e.g. while the SDR is being used by a decoder),
+    as the old spectrum and noise floor no longer describe the current band.
+    """
+
+    # Rate at which the noise floor and variance of each bin follow the scans.
+    FLOOR_RATE = 0.1
+    # Rate at which the noise floor follows a bin flagged as a new emitter.
+    FLOOR_RISE_RATE = 0.02
+    # Number of standard deviations above the noise floor for a new emitter.
+    NEW_EMITTER_SIGMA = 4.5
+    # Bins with a standard deviation this many times the scan-wide standard deviation use their own standard deviation
+    # for change detection.
+    NOISY_BIN_FACTOR = 1.5
+    # Number of scans required before new emitters are flagged.
+    MIN_SCANS = 3
+    # Reset the accumulator if no scan has been added for this many (of the longest) scan intervals...
+    STALE_SCANS = 5
+    # ... or for this long (seconds), whichever is shorter.
+    STALE_TIME = 600
+
+    def __init__(self, alpha=0.5, history_length=60, waterfall_bins=512):
+        """ Initialise the spectrum accumulator.
+
+        Args:
+            alpha (float): Weight given to each new scan in the integrated spectrum, from 0 (exclusive) to 1.
+                A value of 1 disables integration and change detection, and the integrated spectrum is just the
+                latest scan.
+            history_length (int): Number of scans to keep for the waterfall.
+            waterfall_bins (int): Maximum number of frequency bins in each waterfall row.
+        """
+        self.alpha = min(max(alpha, 0.01), 1.0)
+        self.history_length = history_length
+        self.waterfall_bins = waterfall_bins
+
+        self.lock = Lock()
+        self.reset()
+
+    def reset(self):
+        """ Clear all accumulated data. """
+        self.freq = None
+        # Integrated spectrum, in linear power units.
+        self.average_linear = None
+        # Per-bin noise floor (dB) and variance (dB^2)
+        self.floor = None
+        self.variance = None
+        self.scans = 0
+        # Time of the last scan, and the longest interval between scans (which varies with the number of peaks tested).
+        self.last_update = None
+        self.scan_interval = None
+        # Waterfall history - (timestamp, row) pairs, where each row is the maximum power (dB) in each group of bins.
+        self.history = deque(maxlen=self.history_length)
+
+    def update(self, freq, power, timestamp=None):
+        """ Add a scan to the accumulator.
+
+        If the frequency bins differ from the previous scan (i.e. the scan range has changed), or the previous scan
+        is too old, the accumulator is reset first.
+
+        Args:
+            freq (np.ndarray): Bin frequencies (Hz).
+            power (np.ndarray): Bin power (dB).
+            timestamp (float): Time of the scan (unix timestamp). Defaults to the current time.
+
+        Returns:
+            np.ndarray: Boolean array, True for bins which contain a new emitter in this scan.
+        """
+        if timestamp is None:
+            timestamp = time.time()
+
+        power = np.asarray(power, dtype=np.float64)
+
+        with self.lock:
+            if self.is_stale(timestamp):
+                logging.debug(
+                    "Spectrum Accumulator - No scans for %d seconds, resetting."
+                    % (timestamp - self.last_update)
+                )
+                self.freq = None
+            elif self.last_update is not None:
+                self.scan_interval = max(self.scan_interval or 0, timestamp - self.last_update)
+
+            if (
+                (self.freq is None)
+                or (len(freq) != len(self.freq))
+                or (freq[0] != self.freq[0])
+                or (freq[-1] != self.freq[-1])
+            ):
+                self.reset()
+                self.freq = np.array(freq, dtype=np.float64)
+                self.average_linear = 10 ** (power / 10.0)
+                self.floor = power.copy()
+                self.variance = np.zeros(len(power))
+                self.scans = 1
+                self.last_update = timestamp
+                self.history.append((timestamp, self.decimate(power)))
+                return np.zeros(len(power), dtype=bool)
+
+            self.average_linear = self.alpha * 10 ** (power / 10.0) + (1 - self.alpha) * self.average_linear
+            self.scans += 1
+            self.last_update = timestamp
+
+            # Change detection, against the noise floor from the previous scans.
+            _residual = power - self.floor
+            # Robust estimate of the scan-wide standard deviation, which isn't affected by the signals present.
+            _sigma = 1.4826 * np.median(np.abs(_residual))
+            if self.scans > (1.0 / self.FLOOR_RATE):
+                # The per-bin variance has settled, so bins which are noisier than the rest (e.g. intermittent signals)
+                # need a larger change to be flagged.
+                _bin_sigma = np.sqrt(self.variance)
+                _sigma = np.where(_bin_sigma > self.NOISY_BIN_FACTOR * _sigma, _bin_sigma, _sigma)
+            _threshold = self.NEW_EMITTER_SIGMA * _sigma
+
+            if (self.scans > self.MIN_SCANS) and (self.alpha < 1.0):
+                _new = _residual > _threshold
+            else:
+                _new = np.zeros(len(power), dtype=bool)
+
+            # Update the noise floor and variance. Bins with a new emitter are only slowly absorbed into the noise floor.
+            # Until we have enough scans, use a cumulative average, so the first scan doesn't bias the noise floor.
+            _rate = max(self.FLOOR_RATE, 1.0 / self.scans)
+            self.floor += np.where(_new, self.FLOOR_RISE_RATE, _rate) * _residual
+            self.variance = np.where(
+                _new,
+                self.variance,
+                self.variance + _rate * (_residual ** 2 - self.variance),
+            )
+
+            self.history.append((timestamp, self.decimate(power)))
+
+            return _new
+
+    def is_stale(self, timestamp):
+        """ Check if the last scan is too old to be integrated with a scan at the supplied time. Must be called with
+        the lock held. """
+        if self.last_update is None:
+            return False
+
+        _max_gap = self.STALE_TIME
+        if self.scan_interval is not None:
+            _max_gap = min(_max_gap, self.STALE_SCANS * self.scan_interval)
+
+        return (timestamp - self.last_update) > _max_gap
+
+    def decimate(self, power):
+        """ Reduce a scan to at most waterfall_bins bins, taking the maximum power in each group of bins. """
+        _factor = int(np.ceil(len(power) / self.waterfall_bins))
+        if _factor <= 1:
+            return power.copy()
+
+        _padded = np.pad(power, (0, (-len(power)) % _factor), mode="edge")
+        return _padded.reshape(-1, _factor).max(axis=1)
+
+    def get_average(self):
+        """ Get the integrated spectrum, in dB. """
+        with self.lock:
+            return 10 * np.log10(self.average_linear)
+
+    def get_noise_floor(self):
+        """ Get the overall noise floor estimate (dB), as the median of the per-bin noise floor. """
+        with self.lock:
+            return float(np.median(self.floor))
+
+    def new_emitter_peaks(self, new, power, min_distance=1):
+        """ Find the peaks within the bins flagged as new emitters.
+
+        Args:
+            new (np.ndarray): New emitter flags, as returned by update().
+            power (np.ndarray): Latest scan power (dB).
+            min_distance (int): Minimum distance between peaks, in bins.
+
+        Returns:
+            np.ndarray: Indices of the new emitter peaks, strongest first.
+        """
+        if not np.any(new):
+            return np.array([], dtype=int)
+
+        with self.lock:
+            _excess = np.where(new, power - self.floor, 0.0)
+
+        _peaks = detect_peaks(_excess, mph=1e-6, mpd=max(1, int(min_distance)))
+        return _peaks[np.argsort(_excess[_peaks])[::-1]]
+
+    def get_waterfall(self):
+        """ Get the waterfall history.
+
+        Returns:
+            dict: {'freq_start', 'freq_stop' (MHz), 'timestamps': [unix timestamps], 'rows': [[power (dB), ...], ...]},
+                oldest row first.
+        """
+        with self.lock:
+            if self.freq is None:
+                return {"freq_start": 0, "freq_stop": 0, "timestamps": [], "rows": []}
+
+            return {
+                "freq_start": self.freq[0] / 1e6,
+                "freq_stop": self.freq[-1] / 1e6,
+                "timestamps": [_row[0] for _row in self.history],
+                "rows": [np.round(_row[1], 1).tolist() for _row in self.history],
+            }
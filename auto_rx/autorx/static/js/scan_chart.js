@@ -124,4 +124,54 @@ function redraw_scan_chart(){
 		var date_converted = scan_chart_latest_timestamp.slice(0, 19).replace("T", " ") + ' UTC'
 	}
 	$('#scan_results').html('<b>Latest Scan:</b> ' + date_converted);
+
+	update_scan_waterfall();
+}
+
+function waterfall_colour(level){
+	// Map a level between 0 and 1 onto a dark blue -> cyan -> yellow -> red colour scale.
+	level = Math.min(Math.max(level, 0), 1);
+	var stops = [[0, 0, 64], [0, 192, 255], [255, 255, 0], [255, 0, 0]];
+	var pos = level * (stops.length - 1);
+	var idx = Math.min(Math.floor(pos), stops.length - 2);
+	var frac = pos - idx;
+	return [0, 1, 2].map(function(i){
+		return Math.round(stops[idx][i] + frac * (stops[idx + 1][i] - stops[idx][i]));
+	});
+}
+
+function update_scan_waterfall(){
+	// Draw the recent scan history, newest scan at the top.
+	$.getJSON("get_waterfall", function(data){
+		if (data.rows.length == 0) {
+			return;
+		}
+
+		var canvas = document.getElementById("scan_waterfall");
+		var width = data.rows[0].length;
+		var height = data.rows.length;
+		canvas.width = width;
+		canvas.height = height;
+
+		// Scale the colours between a low percentile (roughly the noise floor) and the maximum level.
+		var levels = [].concat.apply([], data.rows).sort(function(a, b){ return a - b; });
+		var min_level = levels[Math.floor(levels.length * 0.1)];
+		var max_level = levels[levels.length - 1];
+		var range = Math.max(max_level - min_level, 1);
+
+		var ctx = canvas.getContext("2d");
+		var image = ctx.createImageData(width, height);
+		for (var row = 0; row < height; row++) {
+			var values = data.rows[height - 1 - row];
+			for (var col = 0; col < width; col++) {
+				var colour = waterfall_colour((values[col] - min_level) / range);
+				var offset = (row * width + col) * 4;
+				image.data[offset] = colour[0];
+				image.data[offset + 1] = colour[1];
+				image.data[offset + 2] = colour[2];
+				image.data[offset + 3] = 255;
+			}
+		}
+		ctx.putImageData(image, 0, 0);
+	});
 }
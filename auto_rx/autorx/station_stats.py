@@ -0,0 +1,531 @@
+#!/usr/bin/env python
+#
+#   radiosonde_auto_rx - Station Statistics Engine
+#
+#   Released under GNU GPL v3 or later
+#
+#   Builds up the bearing/elevation SNR map and radio horizon data for a station from its
+#   sonde log files. Log files are read in parallel (using a process pool), and only the columns
+#   needed are loaded. The aggregated statistics are saved to the log directory, so each log file
+#   only ever needs to be processed once.
+#
+import concurrent.futures
+import glob
+import json
+import logging
+import multiprocessing
+import os
+import time
+from threading import Lock, Thread
+
+import numpy as np
+
+from autorx.log_index import get_log_index
+from autorx.log_sidecar import read_sidecar
+from autorx.utils import position_info_array
+
+
+# SNR map dimensions - 1 degree bins, bearing 0-359, elevation 0-89
+MAP_SHAPE = (360, 90)
+
+# Value used for SNR map bins with no data.
+MAP_NO_DATA = -100.0
+
+# SNR values outside this range are considered suspect, and discarded.
+SNR_MIN = 5.0
+SNR_MAX = 40.0
+
+
+def read_log_path_snr(filename, first_datetime=None, last_datetime=None):
+    """ Read in only the position and SNR columns from a log file, using the binary sidecar if available.
+
+    Args:
+        filename (str): Path to the log file.
+        first_datetime (str): Timestamp of the first entry in the log file, used to validate the sidecar.
+        last_datetime (str): Timestamp of the last entry in the log file, used to validate the sidecar.
+
+    Returns:
+        tuple: (lat, lon, alt, snr) arrays, or None if the log file has no SNR data.
+    """
+    _sidecar = read_sidecar(filename, first_datetime=first_datetime, last_datetime=last_datetime)
+
+    if _sidecar is not None:
+        return (
+            _sidecar["latitude"],
+            _sidecar["longitude"],
+            _sidecar["altitude"],
+            _sidecar["snr"],
+        )
+
+    with open(filename, "r") as _file:
+        _header = _file.readline()
+
+        # Older log files (with an 'other' column) do not have a SNR column.
+        if ("snr" not in _header) or ("other" in _header):
+            return None
+
+        # timestamp,serial,frame,lat,lon,alt,...,freq_mhz,snr
+        _data = np.genfromtxt(
+            _file,
+            dtype=np.float64,
+            delimiter=",",
+            usecols=(3, 4, 5, 14),
+            ndmin=2,
+        )
+
+    return (_data[:, 0], _data[:, 1], _data[:, 2], _data[:, 3])
+
+
+def process_log_file(filename, station, min_range_km, max_range_km, first_datetime=None, last_datetime=None):
+    """ Extract the SNR map contributions from a single log file.
+    This is run within the worker processes, so only takes and returns simple types.
+
+    Args:
+        filename (str): Path to the log file.
+        station (tuple): Station (lat, lon, alt)
+        min_range_km (float): Discard points closer than this range.
+        max_range_km (float): Discard points further away than this range.
+        first_datetime (str): Timestamp of the first entry in the log file.
+        last_datetime (str): Timestamp of the last entry in the log file.
+
+    Returns:
+        dict: 'bins' (flattened SNR map indexes), 'snr' and 'range_km' arrays, or None if the log contains no usable data.
+    """
+    try:
+        _columns = read_log_path_snr(filename, first_datetime=first_datetime, last_datetime=last_datetime)
+    except Exception as e:
+        logging.error(f"Station Stats - Could not read {filename}: {str(e)}")
+        return None
+
+    if _columns is None:
+        return None
+
+    (_lat, _lon, _alt, _snr) = _columns
+
+    # Discard obviously sus SNR values
+    _valid = (_snr <= SNR_MAX) & (_snr >= SNR_MIN)
+    if not np.any(_valid):
+        return None
+
+    _pos_info = position_info_array(station, (_lat[_valid], _lon[_valid], _alt[_valid]))
+
+    _ranges = _pos_info["straight_distance"] / 1000.0
+    _in_range = (_ranges >= min_range_km) & (_ranges <= max_range_km)
+
+    _bearings = np.floor(_pos_info["bearing"][_in_range]).astype(int) % MAP_SHAPE[0]
+    # Limit elevation data to 0-89
+    _elevations = np.clip(
+        np.floor(_pos_info["elevation"][_in_range]).astype(int), 0, MAP_SHAPE[1] - 1
+    )
+
+    return {
+        "bins": np.ravel_multi_index((_bearings, _elevations), MAP_SHAPE).astype(np.int32),
+        "snr": _snr[_valid][_in_range],
+        "range_km": _ranges[_in_range],
+    }
+
+
+class StationStats(object):
+    """ Station Statistics
+
+    Accumulates per-bin SNR statistics (count, sum and maximum of both the raw SNR, and SNR normalised to 1 km range)
+    over a 1-degree bearing/elevation grid, and the last observed position of each flight for the radio horizon plot.
+
+    Log files are only processed once they have stopped being written to, and each log file is only processed once.
+    The aggregates are saved to the log directory after each update.
+    """
+
+    STATS_FILENAME = ".station_stats.npz"
+    STATS_VERSION = 1
+
+    # Only process log files which have not been modified for this long (seconds), i.e. the flight is over.
+    SETTLE_TIME = 900
+
+    AGGREGATES = ["count", "snr_sum", "snr_max", "norm_sum", "norm_max"]
+
+    def __init__(self, log_directory, station, min_range_km=10, max_range_km=1000):
+        """ Initialise the station statistics, loading any saved aggregates.
+
+        Args:
+            log_directory (str): Directory containing the log files.
+            station (tuple): Station (lat, lon, alt)
+            min_range_km (float): Discard points closer than this range.
+            max_range_km (float): Discard points further away than this range.
+        """
+        self.log_directory = log_directory
+        self.stats_path = os.path.join(log_directory, self.STATS_FILENAME)
+        self.station = tuple(float(_x) for _x in station)
+        self.min_range_km = float(min_range_km)
+        self.max_range_km = float(max_range_km)
+
+        self.lock = Lock()
+        self.update_lock = Lock()
+        self.updating = False
+        self.last_update = None
+
+        self.reset()
+        self.load()
+
+    def reset(self):
+        """ Clear all accumulated statistics. """
+        self.count = np.zeros(MAP_SHAPE, dtype=np.int64)
+        self.snr_sum = np.zeros(MAP_SHAPE)
+        self.snr_max = np.full(MAP_SHAPE, MAP_NO_DATA)
+        self.norm_sum = np.zeros(MAP_SHAPE)
+        self.norm_max = np.full(MAP_SHAPE, MAP_NO_DATA)
+
+        # Last position of each flight, keyed by log file basename.
+        self.horizon = {}
+        # Basenames of log files which have been added to the SNR map.
+        self.processed = set()
+
+    def settings(self):
+        """ Settings which the saved aggregates depend upon. """
+        return {
+            "version": self.STATS_VERSION,
+            "station": list(self.station),
+            "min_range_km": self.min_range_km,
+            "max_range_km": self.max_range_km,
+        }
+
+    def load(self):
+        """ Load saved aggregates, if they exist and were generated with the same settings. """
+        if not os.path.exists(self.stats_path):
+            return
+
+        try:
+            with np.load(self.stats_path, allow_pickle=False) as _npz:
+                _meta = json.loads(str(_npz["meta"]))
+
+                if _meta["settings"] != self.settings():
+                    logging.info("Station Stats - Station position or settings have changed, rebuilding statistics.")
+                    return
+
+                for _name in self.AGGREGATES:
+                    setattr(self, _name, np.array(_npz[_name]))
+
+            self.horizon = _meta["horizon"]
+            self.processed = set(_meta["processed"])
+
+        except Exception as e:
+            logging.error("Station Stats - Could not read saved statistics, rebuilding - %s" % str(e))
+            self.reset()
+
+    def save(self):
+        """ Save the aggregates to disk. The file is written to a temporary file and then moved into place. """
+        _meta = {
+            "settings": self.settings(),
+            "horizon": self.horizon,
+            "processed": sorted(self.processed),
+        }
+
+        _temp_path = self.stats_path + ".tmp"
+        try:
+            with self.lock:
+                with open(_temp_path, "wb") as _f:
+                    np.savez(
+                        _f,
+                        meta=np.array(json.dumps(_meta)),
+                        **{_name: getattr(self, _name) for _name in self.AGGREGATES},
+                    )
+            os.replace(_temp_path, self.stats_path)
+        except Exception as e:
+            logging.error("Station Stats - Could not write statistics file - %s" % str(e))
+
+    def add_flight(self, name, result):
+        """ Add the output of process_log_file to the aggregates.
+
+        Args:
+            name (str): Log file basename.
+            result (dict): Output from process_log_file, or None.
+        """
+        with self.lock:
+            self.processed.add(name)
+
+            if (result is None) or (len(result["bins"]) == 0):
+                return
+
+            _bins = result["bins"]
+            _snr = result["snr"]
+            # SNR normalised to 1 km range. This can be converted to any other normalisation range
+            # by subtracting 20*log10(range).
+            _norm = _snr + 20 * np.log10(result["range_km"])
+
+            np.add.at(self.count.reshape(-1), _bins, 1)
+            np.add.at(self.snr_sum.reshape(-1), _bins, _snr)
+            np.maximum.at(self.snr_max.reshape(-1), _bins, _snr)
+            np.add.at(self.norm_sum.reshape(-1), _bins, _norm)
+            np.maximum.at(self.norm_max.reshape(-1), _bins, _norm)
+
+    def update_horizon(self, log_files):
+        """ Update the radio horizon data with the last position of each flight, taken from the log file index.
+
+        Args:
+            log_files (list): Paths of all the current log files.
+        """
+        _index = get_log_index(self.log_directory)
+
+        _names = []
+        _positions = []
+        for _file in log_files:
+            _name = os.path.basename(_file)
+            try:
+                _endpoints = _index.get_endpoints(_file)
+            except Exception as e:
+                logging.error(f"Station Stats - Could not read {_file}: {str(e)}")
+                continue
+
+            if _endpoints is None:
+                continue
+
+            _last = _endpoints["last"]
+            _cached = self.horizon.get(_name)
+            if (_cached is not None) and (_cached["datetime"] == _last["datetime"]):
+                continue
+
+            _names.append((_name, _last["datetime"]))
+            _positions.append((_last["lat"], _last["lon"], _last["alt"]))
+
+        if len(_positions) == 0:
+            return
+
+        _positions = np.array(_positions, dtype=np.float64)
+        _pos_info = position_info_array(
+            self.station, (_positions[:, 0], _positions[:, 1], _positions[:, 2])
+        )
+
+        with self.lock:
+            for (_i, (_name, _datetime)) in enumerate(_names):
+                self.horizon[_name] = {
+                    "datetime": _datetime,
+                    "bearing": round(float(_pos_info["bearing"][_i]), 1),
+                    "elevation": round(float(_pos_info["elevation"][_i]), 2),
+                    "range_km": round(float(_pos_info["straight_distance"][_i]) / 1000.0, 1),
+                }
+
+    def update(self, workers=None, rebuild=False):
+        """ Process any new log files, and save the updated aggregates.
+
+        Args:
+            workers (int): Number of worker processes to use. Defaults to the number of CPUs (up to 4).
+            rebuild (bool): Discard the existing aggregates, and re-process every log file.
+
+        Returns:
+            int: Number of log files processed.
+        """
+        with self.update_lock:
+            self.updating = True
+            try:
+                return self._update(workers=workers, rebuild=rebuild)
+            finally:
+                self.updating = False
+                self.last_update = time.time()
+
+    def _update(self, workers=None, rebuild=False):
+        if rebuild:
+            with self.lock:
+                self.reset()
+
+        _log_files = sorted(glob.glob(os.path.join(self.log_directory, "*_sonde.log")))
+
+        self.update_horizon(_log_files)
+
+        # Work out which log files are new, and finished with.
+        _index = get_log_index(self.log_directory)
+        _settled = time.time() - self.SETTLE_TIME
+        _jobs = []
+        for _file in _log_files:
+            _name = os.path.basename(_file)
+            if _name in self.processed:
+                continue
+
+            try:
+                if os.path.getmtime(_file) > _settled:
+                    continue
+
+                _endpoints = _index.get_endpoints(_file)
+            except Exception as e:
+                logging.error(f"Station Stats - Could not read {_file}: {str(e)}")
+                continue
+
+            if (_endpoints is None) or (not _endpoints["has_snr"]):
+                # Nothing to add to the SNR map from this file.
+                with self.lock:
+                    self.processed.add(_name)
+                continue
+
+            _jobs.append((_file, _endpoints["first"]["datetime"], _endpoints["last"]["datetime"]))
+
+        if len(_jobs) > 0:
+            if workers is None:
+                workers = min(4, os.cpu_count() or 1)
+
+            logging.info(
+                "Station Stats - Processing %d new log files using %d workers."
+                % (len(_jobs), workers)
+            )
+            _start = time.time()
+            self.process_jobs(_jobs, workers)
+            logging.info(
+                "Station Stats - Processed %d log files in %.1f seconds."
+                % (len(_jobs), time.time() - _start)
+            )
+
+        _index.save()
+        self.save()
+
+        return len(_jobs)
+
+    def process_jobs(self, jobs, workers):
+        """ Process a list of (filename, first_datetime, last_datetime) jobs, using a process pool if possible. """
+        if workers > 1 and len(jobs) > 1:
+            try:
+                # Use fresh interpreters for the workers, rather than forking a process with many threads.
+                with concurrent.futures.ProcessPoolExecutor(
+                    max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+                ) as _executor:
+                    _futures = {
+                        _executor.submit(
+                            process_log_file,
+                            _file,
+                            self.station,
+                            self.min_range_km,
+                            self.max_range_km,
+                            _first,
+                            _last,
+                        ): _file
+                        for (_file, _first, _last) in jobs
+                    }
+                    for _future in concurrent.futures.as_completed(_futures):
+                        self.add_flight(os.path.basename(_futures[_future]), _future.result())
+                return
+
+            except Exception as e:
+                logging.error(
+                    "Station Stats - Could not use worker processes, processing log files serially - %s"
+                    % str(e)
+                )
+
+        for (_file, _first, _last) in jobs:
+            _name = os.path.basename(_file)
+            if _name in self.processed:
+                continue
+            self.add_flight(
+                _name,
+                process_log_file(
+                    _file, self.station, self.min_range_km, self.max_range_km, _first, _last
+                ),
+            )
+
+    def get_snr_map(self, meansnr=True, normalise=True, norm_range=50):
+        """ Get the SNR map.
+
+        Args:
+            meansnr (bool): Produce a map of the mean SNR in each bin. Otherwise, the maximum SNR is used.
+            normalise (bool): Normalise SNR values to norm_range.
+            norm_range (float): Normalisation range, in km.
+
+        Returns:
+            np.ndarray: (360, 90) array of SNR values, indexed by bearing and elevation, with MAP_NO_DATA in empty bins.
+        """
+        with self.lock:
+            _count = self.count.copy()
+            if meansnr:
+                _sum = self.norm_sum if normalise else self.snr_sum
+                _map = np.divide(
+                    _sum, _count, out=np.full(MAP_SHAPE, MAP_NO_DATA), where=_count > 0
+                )
+            else:
+                _map = (self.norm_max if normalise else self.snr_max).copy()
+
+        if normalise:
+            _map[_count > 0] -= 20 * np.log10(norm_range)
+
+        return _map
+
+    def get_horizon(self, min_range_km=None, max_range_km=None):
+        """ Get the radio horizon data (last observed position of each flight).
+
+        Args:
+            min_range_km (float): Discard flights last seen closer than this. Defaults to the statistics minimum range.
+            max_range_km (float): Discard flights last seen further away than this. Defaults to the statistics maximum range.
+
+        Returns:
+            dict: 'bearing', 'elevation' and 'range_km' lists.
+        """
+        if min_range_km is None:
+            min_range_km = self.min_range_km
+        if max_range_km is None:
+            max_range_km = self.max_range_km
+
+        _output = {"bearing": [], "elevation": [], "range_km": []}
+
+        with self.lock:
+            for _entry in self.horizon.values():
+                if (_entry["range_km"] > min_range_km) and (_entry["range_km"] < max_range_km):
+                    _output["bearing"].append(_entry["bearing"])
+                    _output["elevation"].append(_entry["elevation"])
+                    _output["range_km"].append(_entry["range_km"])
+
+        return _output
+
+    def to_dict(self, meansnr=True, normalise=True, norm_range=50):
+        """ Get the station statistics in a JSON-serialisable form, for the web interface.
+        The SNR map is returned as a list of bearing rows, with None in bins without data.
+        """
+        _map = np.round(self.get_snr_map(meansnr=meansnr, normalise=normalise, norm_range=norm_range), 1)
+        _map_list = [
+            [None if _v == MAP_NO_DATA else _v for _v in _row] for _row in _map.tolist()
+        ]
+
+        return {
+            "station": list(self.station),
+            "flights": len(self.processed),
+            "points": int(self.count.sum()),
+            "updating": self.updating,
+            "last_update": self.last_update,
+            "snr_map": _map_list,
+            "horizon": self.get_horizon(),
+        }
+
+    def update_in_background(self, workers=None):
+        """ Start an update in a separate thread, if one is not already running.
+
+        Returns:
+            bool: True if an update was started.
+        """
+        if self.updating:
+            return False
+
+        _thread = Thread(target=self.update, kwargs={"workers": workers})
+        _thread.daemon = True
+        _thread.start()
+        return True
+
+
+# Statistics objects, keyed by log directory and station settings.
+_stats = {}
+_stats_lock = Lock()
+
+
+def get_station_stats(log_directory, station, min_range_km=10, max_range_km=1000):
+    """ Get the station statistics for a log directory, creating them if required.
+
+    Args:
+        log_directory (str): Directory containing the log files.
+        station (tuple): Station (lat, lon, alt)
+        min_range_km (float): Discard points closer than this range.
+        max_range_km (float): Discard points further away than this range.
+
+    Returns:
+        StationStats: The statistics for this log directory.
+    """
+    _key = (os.path.abspath(log_directory), tuple(station), min_range_km, max_range_km)
+
+    with _stats_lock:
+        if _key not in _stats:
+            _stats[_key] = StationStats(
+                log_directory, station, min_range_km=min_range_km, max_range_km=max_range_km
+            )
+
+        return _stats[_key]
@@ -16,26 +16,15 @@
 #
 import autorx
 import autorx.config
-import datetime
-import glob
 import logging
-import os.path
-import math
-import time
 
 import numpy as np
 import matplotlib.pyplot as plt
 
-from dateutil.parser import parse
-from autorx.utils import (
-    short_type_lookup,
-    strip_sonde_serial,
-    position_info,
-)
-from autorx.log_files import list_log_files, read_log_by_serial
+from autorx.station_stats import get_station_stats
 
 
-def radio_horizon_plot(log_files, min_range_km=10, max_range_km=1000, save_figure=None):
+def radio_horizon_plot(station_stats, min_range_km=10, max_range_km=1000, save_figure=None):
     """
     Generate an estimated radio horizon plot based on the last
     observed position from each radiosonde in the log directory.
@@ -43,24 +32,15 @@ def radio_horizon_plot(log_files, min_range_km=10, max_range_km=1000, save_figur
 
     _title = autorx.config.global_config['habitat_uploader_callsign'] + " Radio Horizon"
 
-    _bearings = []
-    _elevations = []
-    _ranges = []
+    _horizon = station_stats.get_horizon(min_range_km=min_range_km, max_range_km=max_range_km)
 
-    for _entry in log_files:
-        if 'last' in _entry:
-            if (_entry['last']['range_km'] > min_range_km) and (_entry['last']['range_km'] < max_range_km):
-                _bearings.append(_entry['last']['bearing'])
-                _elevations.append(_entry['last']['elevation'])
-                _ranges.append(_entry['last']['range_km'])
-
-    logging.info(f"Found {len(_bearings)} datapoints for radio horizon plot.")
+    logging.info(f"Found {len(_horizon['bearing'])} datapoints for radio horizon plot.")
 
 
     plt.figure(figsize=(12,4))
 
     # Plot data
-    plt.scatter(_bearings, _elevations, c=_ranges)
+    plt.scatter(_horizon['bearing'], _horizon['elevation'], c=_horizon['range_km'])
     plt.colorbar(label="Range (km)")
 
     # Setup plot
@@ -73,73 +53,12 @@ def radio_horizon_plot(log_files, min_range_km=10, max_range_km=1000, save_figur
     plt.grid()
 
 
-def normalised_snr(log_files, min_range_km=10, max_range_km=1000, maxsnr=False, meansnr=True, normalise=True, norm_range=50):
-    """ Read in ALL log files and store snr data into a set of bins, normalised to 50km range. """
-
-    _norm_range = norm_range # km
-
-    _snr_count = 0
+def normalised_snr(station_stats, maxsnr=False, meansnr=True, normalise=True, norm_range=50):
+    """ Plot the station SNR map, with SNR values stored in bearing/elevation bins, optionally normalised to 50km range. """
 
     _title = autorx.config.global_config['habitat_uploader_callsign'] + " SNR Map"
 
-    # Initialise output array
-    _map = np.ones((360,90))*-100.0
-
-    _station = (
-        autorx.config.global_config['station_lat'],
-        autorx.config.global_config['station_lon'],
-        autorx.config.global_config['station_alt']
-    )
-
-    for _log in log_files:
-
-        if 'has_snr' in _log:
-            if _log['has_snr'] == False:
-                continue
-        
-        # Read in the file.
-        _data = read_log_by_serial(_log['serial'])
-
-        if 'snr' not in _data:
-            # No SNR information, move on.
-            continue
-
-        logging.debug(f"Got SNR data ({len(_data['snr'])}) for {_log['serial']}")
-        for _i in range(len(_data['path'])):
-            _snr = _data['snr'][_i]
-            # Discard obviously sus SNR values
-            if _snr > 40.0 or _snr < 5.0:
-                continue
-
-            _balloon = _data['path'][_i]
-            _pos_info = position_info(_station, _balloon)
-
-            _range = _pos_info['straight_distance']/1000.0
-            _bearing = int(math.floor(_pos_info['bearing']))
-            _elevation = int(math.floor(_pos_info['elevation']))
-
-            if _range < min_range_km or _range > max_range_km:
-                continue
-
-            # Limit elevation data to 0-90
-            if _elevation < 0:
-                _elevation = 0
-            
-            if normalise:
-                _snr =  _snr + 20*np.log10(_range/_norm_range)
-
-            #print(f"{_bearing},{_elevation}: {_range} km, {_snr} dB, {_norm_snr} dB")
-
-            if _map[_bearing,_elevation] < -10.0:
-                _map[_bearing,_elevation] = _snr
-            else:
-                if meansnr:
-                    _map[_bearing,_elevation] = np.mean([_map[_bearing,_elevation],_snr])
-                elif maxsnr:
-                    if _snr > _map[_bearing,_elevation]:
-                        _map[_bearing,_elevation] = _snr
-
-
+    _map = station_stats.get_snr_map(meansnr=(meansnr and not maxsnr), normalise=normalise, norm_range=norm_range)
 
     print(_map)
 
@@ -204,6 +123,19 @@ if __name__ == "__main__":
         help="Normalistion Range (km, default=50)"
     )
 
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Number of worker processes to use when reading log files (default: number of CPUs, up to 4)"
+    )
+    parser.add_argument(
+        "--rebuild",
+        action="store_true",
+        default=False,
+        help="Discard saved statistics and re-read all log files"
+    )
+
     parser.add_argument(
         "-v", "--verbose", help="Enable debug output.", action="store_true"
     )
@@ -225,23 +157,27 @@ if __name__ == "__main__":
     autorx.config.global_config = _temp_cfg
 
 
-    # Read in the log files.
-    logging.info("Quick-Looking Log Files")
-    log_list = list_log_files(quicklook=True, stats_fields=True, custom_log_dir=args.log)
-    logging.info(f"Loaded in {len(log_list)} log files.")
+    # Update the station statistics with any new log files.
+    station_stats = get_station_stats(
+        args.log,
+        (_temp_cfg['station_lat'], _temp_cfg['station_lon'], _temp_cfg['station_alt'])
+    )
+    logging.info("Updating station statistics from log files")
+    station_stats.update(workers=args.workers, rebuild=args.rebuild)
+    logging.info(f"Statistics contain {len(station_stats.processed)} log files.")
 
 
     if args.horizon:
-        radio_horizon_plot(log_list)
+        radio_horizon_plot(station_stats)
 
     if args.snrmap:
-        normalised_snr(log_list, norm_range=args.normrange)
+        normalised_snr(station_stats, norm_range=args.normrange)
     
     if args.snrmapmax:
-        normalised_snr(log_list, meansnr=False, maxsnr=True, normalise=False)
+        normalised_snr(station_stats, meansnr=False, maxsnr=True, normalise=False)
 
     if args.snrmapmaxnorm:
-        normalised_snr(log_list, meansnr=False, maxsnr=True, normalise=True, norm_range=args.normrange)
+        normalised_snr(station_stats, meansnr=False, maxsnr=True, normalise=True, norm_range=args.normrange)
 
     plt.show()
 
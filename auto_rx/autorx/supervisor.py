@@ -0,0 +1,283 @@
+#!/usr/bin/env python
+#
+#   radiosonde_auto_rx - Decoder Subprocess Pipe Supervisor
+#
+#   Released under GNU GPL v3 or later
+#
+#   Handles the output pipes of all running decoder/demodulator subprocesses from a single
+#   selectors-based event loop, so lines are dispatched as soon as they arrive, without
+#   needing a set of reader threads (and polling loops) per decoder.
+#
+import logging
+import os
+import selectors
+import time
+import traceback
+from queue import Queue, Empty
+from threading import Thread, Lock
+
+
+class PipeSupervisor(object):
+    """ Subprocess Pipe Supervisor
+
+    Watches a set of pipes (i.e. subprocess stdout/stderr) from one thread, splits the data read
+    from each into lines, and passes each complete line to a callback registered with the pipe.
+    When a pipe reaches EOF, it is removed from the supervisor and its EOF callback is called.
+
+    Callbacks are run from the supervisor thread, which serves every decoder, so they must not block.
+    A blocking callback stops the output of all decoders being read, and the decoder subprocesses stall once
+    their pipe buffers fill. Callbacks should only do light work (e.g. parsing), and hand anything else
+    (such as passing telemetry to the exporters) off to another thread. Slow callbacks are logged.
+    """
+
+    # Maximum amount of data to read from a pipe in one go.
+    READ_SIZE = 65536
+
+    # Maximum length of a partial line we will buffer before passing it on regardless.
+    MAX_LINE_LENGTH = 1048576
+
+    # Log a warning if a callback takes longer than this (seconds)...
+    SLOW_CALLBACK_TIME = 0.005
+    # ... at most once every SLOW_CALLBACK_LOG_INTERVAL seconds.
+    SLOW_CALLBACK_LOG_INTERVAL = 60
+
+    def __init__(self):
+        """ Initialise and start the pipe supervisor thread. """
+
+        self.selector = selectors.DefaultSelector()
+
+        # Registrations and removals are passed to the event loop via this queue,
+        # and the loop woken up by writing to the wakeup pipe.
+        self.pending = Queue()
+        (self.wakeup_read, self.wakeup_write) = os.pipe()
+        os.set_blocking(self.wakeup_read, False)
+        os.set_blocking(self.wakeup_write, False)
+        self.selector.register(self.wakeup_read, selectors.EVENT_READ, None)
+
+        # Slow callback statistics, since the last warning.
+        self.slow_callbacks = 0
+        self.slowest_callback = (0.0, None)
+        self.last_slow_callback_log = 0
+
+        # Currently registered pipes, keyed by file descriptor.
+        # Each entry contains the pipe object, line and EOF callbacks, and any partial line data.
+        self.pipes = {}
+
+        self.supervisor_running = True
+        self.supervisor_thread = Thread(target=self.supervisor_loop)
+        # Set the thread to be a daemon, so it doesn't hold up python exiting.
+        self.supervisor_thread.daemon = True
+        self.supervisor_thread.start()
+
+        self.log_debug("Started Pipe Supervisor Thread.")
+
+    def wakeup(self):
+        """ Wake the event loop up so it processes any pending registrations. """
+        try:
+            os.write(self.wakeup_write, b"\x00")
+        except BlockingIOError:
+            # Wakeup pipe is already full, so the loop will wake up anyway.
+            pass
+
+    def register(self, pipe, line_callback, eof_callback=None):
+        """ Start watching a pipe.
+
+        Args:
+            pipe (file): File object (or descriptor) to read from, i.e. subprocess.Popen().stdout
+            line_callback (function): Function to pass each complete line (bytes, including the newline) to.
+            eof_callback (function): Optional function to call (with no arguments) once the pipe reaches EOF.
+        """
+        self.pending.put(("register", pipe, line_callback, eof_callback))
+        self.wakeup()
+
+    def unregister(self, pipe):
+        """ Stop watching a pipe. No further callbacks will be made for this pipe once the event loop has processed this.
+
+        Args:
+            pipe (file): File object (or descriptor) previously passed to register.
+        """
+        self.pending.put(("unregister", pipe, None, None))
+        self.wakeup()
+
+    def process_pending(self):
+        """ Apply any pending registrations/removals. Only called from the event loop. """
+        while True:
+            try:
+                (_action, _pipe, _line_callback, _eof_callback) = self.pending.get_nowait()
+            except Empty:
+                return
+
+            try:
+                _fd = _pipe if isinstance(_pipe, int) else _pipe.fileno()
+            except ValueError:
+                # Pipe has already been closed.
+                continue
+
+            if _action == "register":
+                self.pipes[_fd] = {
+                    "pipe": _pipe,
+                    "line_callback": _line_callback,
+                    "eof_callback": _eof_callback,
+                    "buffer": b"",
+                }
+                self.selector.register(_fd, selectors.EVENT_READ, None)
+
+            elif (_action == "unregister") and (_fd in self.pipes):
+                self.remove_pipe(_fd, eof=False)
+
+    def remove_pipe(self, fd, eof=True):
+        """ Stop watching a pipe, and if the pipe has reached EOF, flush any remaining partial line
+        and call the EOF callback. """
+        _entry = self.pipes.pop(fd)
+
+        try:
+            self.selector.unregister(fd)
+        except (KeyError, ValueError):
+            pass
+
+        if eof:
+            if _entry["buffer"] != b"":
+                self.dispatch(_entry["line_callback"], _entry["buffer"])
+
+            if _entry["eof_callback"] is not None:
+                self.dispatch(_entry["eof_callback"])
+
+    def dispatch(self, callback, *args):
+        """ Run a callback, making sure any errors don't take down the event loop, and checking it didn't block. """
+        _start = time.perf_counter()
+
+        try:
+            callback(*args)
+        except Exception as e:
+            traceback.print_exc()
+            self.log_error("Error in pipe callback - %s" % str(e))
+
+        _elapsed = time.perf_counter() - _start
+        if _elapsed > self.SLOW_CALLBACK_TIME:
+            self.slow_callbacks += 1
+            if _elapsed > self.slowest_callback[0]:
+                self.slowest_callback = (_elapsed, callback)
+
+            if time.time() > (self.last_slow_callback_log + self.SLOW_CALLBACK_LOG_INTERVAL):
+                self.log_warning(
+                    "%d pipe callback(s) took longer than %d ms, slowest %.1f ms (%s). Callbacks must not block!"
+                    % (
+                        self.slow_callbacks,
+                        self.SLOW_CALLBACK_TIME * 1000,
+                        self.slowest_callback[0] * 1000,
+                        getattr(self.slowest_callback[1], "__qualname__", str(self.slowest_callback[1])),
+                    )
+                )
+                self.slow_callbacks = 0
+                self.slowest_callback = (0.0, None)
+                self.last_slow_callback_log = time.time()
+
+    def read_pipe(self, fd):
+        """ Read all available data from a pipe, and pass on any complete lines. """
+        _entry = self.pipes[fd]
+
+        try:
+            _data = os.read(fd, self.READ_SIZE)
+        except BlockingIOError:
+            return
+        except OSError as e:
+            self.log_debug("Error reading from pipe %d - %s" % (fd, str(e)))
+            _data = b""
+
+        if _data == b"":
+            # EOF
+            self.remove_pipe(fd, eof=True)
+            return
+
+        _lines = (_entry["buffer"] + _data).split(b"\n")
+        _entry["buffer"] = _lines.pop()
+
+        for _line in _lines:
+            self.dispatch(_entry["line_callback"], _line + b"\n")
+
+            # The callback may have caused this pipe to be removed.
+            if fd not in self.pipes:
+                return
+
+        if len(_entry["buffer"]) > self.MAX_LINE_LENGTH:
+            self.dispatch(_entry["line_callback"], _entry["buffer"])
+            _entry["buffer"] = b""
+
+    def supervisor_loop(self):
+        """ Event loop, dispatching lines from all registered pipes as they arrive. """
+
+        while self.supervisor_running:
+            try:
+                _events = self.selector.select(timeout=1.0)
+            except Exception as e:
+                self.log_error("Error in select - %s" % str(e))
+                _events = []
+
+            for (_key, _mask) in _events:
+                if _key.fd == self.wakeup_read:
+                    # Drain the wakeup pipe.
+                    try:
+                        while os.read(self.wakeup_read, 4096):
+                            pass
+                    except BlockingIOError:
+                        pass
+                elif _key.fd in self.pipes:
+                    self.read_pipe(_key.fd)
+
+            self.process_pending()
+
+        self.log_debug("Stopped Pipe Supervisor Thread.")
+
+    def close(self):
+        """ Stop the event loop. """
+        self.supervisor_running = False
+        self.wakeup()
+
+    def running(self):
+        """ Check if the supervisor thread is running.
+
+        Returns:
+            bool: True if the supervisor thread is running.
+        """
+        return self.supervisor_running
+
+    def log_debug(self, line):
+        """ Helper function to log a debug message with a descriptive heading.
+        Args:
+            line (str): Message to be logged.
+        """
+        logging.debug("Pipe Supervisor - %s" % line)
+
+    def log_warning(self, line):
+        """ Helper function to log a warning message with a descriptive heading.
+        Args:
+            line (str): Message to be logged.
+        """
+        logging.warning("Pipe Supervisor - %s" % line)
+
+    def log_error(self, line):
+        """ Helper function to log an error message with a descriptive heading.
+        Args:
+            line (str): Message to be logged.
+        """
+        logging.error("Pipe Supervisor - %s" % line)
+
+
+# Shared pipe supervisor, started when first needed.
+_supervisor = None
+_supervisor_lock = Lock()
+
+
+def get_pipe_supervisor():
+    """ Get the shared pipe supervisor, starting it if it isn't already running.
+
+    Returns:
+        PipeSupervisor: The shared pipe supervisor.
+    """
+    global _supervisor
+
+    with _supervisor_lock:
+        if (_supervisor is None) or (not _supervisor.running()):
+            _supervisor = PipeSupervisor()
+
+        return _supervisor
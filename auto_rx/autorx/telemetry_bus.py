@@ -0,0 +1,272 @@
+#!/usr/bin/env python
+#
+#   radiosonde_auto_rx - Telemetry Bus
+#
+#   Released under GNU GPL v3 or later
+#
+#   Fans telemetry out from the decoders to the exporters, via a bounded ring buffer per exporter,
+#   so a slow exporter (e.g. an SMTP server or APRS-IS reconnect) can't grow memory without limit
+#   or stall the decoders.
+#
+import logging
+import time
+from collections import deque
+from queue import Empty
+from threading import Condition, Lock
+
+
+class RingBufferQueue(object):
+    """ Bounded ring-buffer queue.
+
+    A drop-in replacement for the queue.Queue objects used as exporter input queues.
+    When the buffer is full, new items are handled according to the overflow policy:
+        "drop_oldest" - Discard the oldest item in the buffer (default, the latest telemetry is usually what matters).
+        "drop_newest" - Discard the new item.
+    Adding an item never waits for space, as items are added from the decoder threads, and a slow consumer
+    must never hold up decoding.
+
+    Items are time-stamped when added, so we can report how far behind the consumer is.
+    """
+
+    POLICIES = ["drop_oldest", "drop_newest"]
+
+    # Log a warning on the first drop, and then every X drops.
+    DROP_LOG_INTERVAL = 100
+
+    # Number of recent queue lag measurements to keep.
+    LAG_SAMPLES = 1000
+
+    def __init__(self, maxsize=1000, policy="drop_oldest", name="Exporter"):
+        """ Initialise a ring buffer queue.
+
+        Args:
+            maxsize (int): Maximum number of items to hold.
+            policy (str): Overflow policy, one of RingBufferQueue.POLICIES.
+            name (str): Name of the consumer, used when logging.
+        """
+        if policy not in self.POLICIES:
+            raise ValueError("Unknown overflow policy %s" % policy)
+
+        self.maxsize = maxsize
+        self.policy = policy
+        self.name = name
+
+        self.buffer = deque()
+        self.lock = Lock()
+        self.not_empty = Condition(self.lock)
+
+        # Statistics
+        self.added = 0
+        self.delivered = 0
+        self.dropped = 0
+        self.max_depth = 0
+        # Time between an item being added and it being taken from the queue, for the last item taken,
+        # and for the last LAG_SAMPLES items taken.
+        self.last_lag = 0.0
+        self.lag_samples = deque(maxlen=self.LAG_SAMPLES)
+
+    def drop_item(self):
+        """ Count a dropped item, and log it (rate limited). Must be called with the lock held. """
+        self.dropped += 1
+        if (self.dropped % self.DROP_LOG_INTERVAL) == 1:
+            logging.warning(
+                "Telemetry Bus - %s input queue full (%d items), %d items dropped so far."
+                % (self.name, self.maxsize, self.dropped)
+            )
+
+    def put(self, item, block=True, timeout=None):
+        """ Add an item to the queue. This never waits for space, and never raises queue.Full.
+        The block and timeout arguments are accepted for compatibility with queue.Queue. """
+        self.put_nowait(item)
+
+    def put_nowait(self, item):
+        """ Add an item to the queue, handling a full queue according to the overflow policy. """
+        with self.lock:
+            self.added += 1
+            if len(self.buffer) >= self.maxsize:
+                self.drop_item()
+                if self.policy == "drop_newest":
+                    return
+                self.buffer.popleft()
+
+            self.buffer.append((time.time(), item))
+            self.max_depth = max(self.max_depth, len(self.buffer))
+            self.not_empty.notify()
+
+    def take(self):
+        """ Remove and return the oldest item. Must be called with the lock held. """
+        (_added_time, _item) = self.buffer.popleft()
+        self.delivered += 1
+        self.last_lag = time.time() - _added_time
+        self.lag_samples.append(self.last_lag)
+        return _item
+
+    def get(self, block=True, timeout=None):
+        """ Remove and return the oldest item in the queue, waiting for one to arrive if requested.
+        Raises queue.Empty if no item is available. """
+        with self.lock:
+            if block:
+                self.not_empty.wait_for(lambda: len(self.buffer) > 0, timeout)
+
+            if len(self.buffer) == 0:
+                raise Empty
+
+            return self.take()
+
+    def get_nowait(self):
+        """ Remove and return the oldest item in the queue, raising queue.Empty if there are none. """
+        return self.get(block=False)
+
+    def get_batch(self, max_items=100, timeout=None):
+        """ Remove and return up to max_items items from the queue, oldest first,
+        waiting up to timeout seconds for at least one item to arrive.
+
+        Returns:
+            list: List of items, which may be empty if the timeout expired.
+        """
+        with self.lock:
+            if timeout is None or timeout > 0:
+                self.not_empty.wait_for(lambda: len(self.buffer) > 0, timeout)
+
+            _batch = []
+            while (len(self.buffer) > 0) and (len(_batch) < max_items):
+                _batch.append(self.take())
+
+            return _batch
+
+    def qsize(self):
+        """ Number of items currently in the queue. """
+        return len(self.buffer)
+
+    def empty(self):
+        """ Check if the queue is empty. """
+        return len(self.buffer) == 0
+
+    def full(self):
+        """ Check if the queue is full. """
+        return len(self.buffer) >= self.maxsize
+
+    def get_lag_samples(self):
+        """ Get the time (in seconds) each of the most recently taken items spent in the queue.
+
+        Returns:
+            list: Up to LAG_SAMPLES queue lag values, oldest first.
+        """
+        with self.lock:
+            return list(self.lag_samples)
+
+    def get_stats(self):
+        """ Get queue statistics.
+
+        Returns:
+            dict: Queue statistics, including the current depth and lag (age of the oldest queued item, in seconds).
+        """
+        with self.lock:
+            if len(self.buffer) > 0:
+                _lag = time.time() - self.buffer[0][0]
+            else:
+                _lag = 0.0
+
+            return {
+                "depth": len(self.buffer),
+                "max_depth": self.max_depth,
+                "maxsize": self.maxsize,
+                "policy": self.policy,
+                "added": self.added,
+                "delivered": self.delivered,
+                "dropped": self.dropped,
+                "lag": _lag,
+                "last_lag": self.last_lag,
+            }
+
+
+class TelemetryBus(object):
+    """ Telemetry Bus
+
+    Keeps track of the exporters which consume telemetry from the decoders. Each exporter's input queue is replaced
+    with a bounded RingBufferQueue, so adding telemetry never blocks the decoder, and a stalled exporter only ever
+    holds a bounded amount of telemetry.
+    """
+
+    def __init__(self, default_maxsize=1000):
+        """ Initialise the telemetry bus.
+
+        Args:
+            default_maxsize (int): Default input queue size for each exporter.
+        """
+        self.default_maxsize = default_maxsize
+
+        # Subscribers, keyed by name. Each entry contains the 'exporter' object, its 'add' function,
+        # and its 'queue' (if it has one).
+        self.subscribers = {}
+
+    def subscribe(self, exporter, name=None, maxsize=None, policy="drop_oldest"):
+        """ Add an exporter to the bus.
+
+        Args:
+            exporter (object): Exporter object, providing an add(telemetry) method, and optionally an input_queue.
+            name (str): Name of the exporter, used in statistics and logging. Defaults to the exporter class name.
+            maxsize (int): Maximum number of telemetry frames to queue for this exporter.
+            policy (str): Queue overflow policy, one of RingBufferQueue.POLICIES.
+
+        Returns:
+            function: The exporter's add function, to be passed on to the decoders.
+        """
+        if name is None:
+            name = exporter.__class__.__name__
+
+        if maxsize is None:
+            maxsize = self.default_maxsize
+
+        _queue = None
+        if hasattr(exporter, "input_queue"):
+            _queue = RingBufferQueue(
+                maxsize=maxsize, policy=policy, name=name
+            )
+            # Move across anything that has already been queued.
+            while not exporter.input_queue.empty():
+                _queue.put_nowait(exporter.input_queue.get_nowait())
+            exporter.input_queue = _queue
+
+        self.subscribers[name] = {
+            "exporter": exporter,
+            "add": exporter.add,
+            "queue": _queue,
+        }
+
+        logging.debug(
+            "Telemetry Bus - Added %s (queue size %s, policy %s)"
+            % (name, maxsize if _queue else "N/A", policy if _queue else "N/A")
+        )
+
+        return exporter.add
+
+    def add_functions(self):
+        """ Get the add functions of all exporters on the bus, i.e. for passing to the decoders. """
+        return [_sub["add"] for _sub in self.subscribers.values()]
+
+    def get_stats(self):
+        """ Get statistics for each exporter queue on the bus.
+
+        Returns:
+            dict: Queue statistics (see RingBufferQueue.get_stats), keyed by exporter name.
+        """
+        _stats = {}
+        for (_name, _sub) in self.subscribers.copy().items():
+            if _sub["queue"] is not None:
+                _stats[_name] = _sub["queue"].get_stats()
+
+        return _stats
+
+    def log_stats(self, lag_threshold=30.0):
+        """ Log a warning for any exporters which are lagging behind.
+
+        Args:
+            lag_threshold (float): Log exporters whose oldest queued item is older than this, in seconds.
+        """
+        for (_name, _stats) in self.get_stats().items():
+            if _stats["lag"] > lag_threshold:
+                logging.warning(
+                    "Telemetry Bus - %s is lagging: %d items queued, oldest %.1f seconds old, %d dropped."
+                    % (_name, _stats["depth"], _stats["lag"], _stats["dropped"])
+                )
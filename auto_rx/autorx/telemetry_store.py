@@ -0,0 +1,273 @@
+#!/usr/bin/env python
+#
+#   radiosonde_auto_rx - Web Interface Telemetry Store
+#
+#   Holds the recent telemetry and flight path of each sonde for the web interface, with a bounded amount
+#   of memory per sonde. New clients fetch a cached, pre-serialised snapshot of the store, and then poll for
+#   changes since the snapshot's sequence number.
+#
+#   Copyright (C) 2018  Mark Jessop <vk5qi@rfhead.net>
+#   Released under MIT License
+#
+import json
+import logging
+import time
+from collections import OrderedDict
+from threading import Lock
+
+import numpy as np
+
+from .geometry import GenericTrack
+
+
+class CompactPath(object):
+    """ Array-backed flight path store.
+
+    Positions are stored at full resolution until the path reaches max_points. After that, the older part
+    of the path (everything except the most recent recent_points positions) is held at a uniform stride: only every
+    stride'th position received is kept. Each time the path fills up, positions which have aged out of the recent
+    part are thinned to the current stride, and the stride only doubles if the older part has grown to more than
+    half of the space available to it. The whole of the older part of the path always has the same resolution,
+    and memory use is bounded.
+    """
+
+    def __init__(self, max_points=2000, recent_points=500):
+        """ Initialise a path store.
+
+        Args:
+            max_points (int): Maximum number of positions to store.
+            recent_points (int): Number of most recent positions which are always held at full resolution.
+        """
+        self.max_points = max_points
+        self.recent_points = min(recent_points, max_points // 2)
+
+        # Positions (lat, lon, alt), and the index of each position within the full path (i.e. the number of
+        # positions added before it).
+        self.positions = np.empty((min(64, max_points), 3))
+        self.indexes = np.empty(min(64, max_points), dtype=np.int64)
+        self.length = 0
+        self.added = 0
+        self.stride = 1
+
+    def __len__(self):
+        return self.length
+
+    def append(self, lat, lon, alt):
+        """ Add a position to the path. """
+        if self.length == self.max_points:
+            self.downsample()
+
+        if self.length == len(self.indexes):
+            # Grow the arrays, up to max_points.
+            _capacity = min(2 * len(self.indexes), self.max_points)
+            self.positions = np.resize(self.positions, (_capacity, 3))
+            self.indexes = np.resize(self.indexes, _capacity)
+
+        self.positions[self.length] = (lat, lon, alt)
+        self.indexes[self.length] = self.added
+        self.length += 1
+        self.added += 1
+
+    def downsample(self):
+        """ Remove the positions in the older part of the path which are not on the stride. This includes positions
+        which have only just left the recent part of the path, so the whole of the older part has the same resolution.
+        If the older part still takes up more than half of its share of the store, the stride is doubled, so we don't
+        need to downsample again for a while. The first position (the launch site) is always kept. """
+        _old = self.length - self.recent_points
+        _old_max = (self.max_points - self.recent_points) // 2
+
+        _old_keep = np.flatnonzero((self.indexes[:_old] % self.stride) == 0)
+        while len(_old_keep) > _old_max:
+            self.stride *= 2
+            _old_keep = _old_keep[(self.indexes[_old_keep] % self.stride) == 0]
+
+        _keep = np.concatenate((_old_keep, np.arange(_old, self.length)))
+
+        self.positions[: len(_keep)] = self.positions[_keep]
+        self.indexes[: len(_keep)] = self.indexes[_keep]
+        self.length = len(_keep)
+
+    def to_list(self):
+        """ Get the path as a list of [lat, lon, alt] lists. """
+        return self.positions[: self.length].tolist()
+
+
+class TelemetryStore(object):
+    """ Telemetry store for the web interface.
+
+    Every change to the store increments a sequence number. Clients load a snapshot of the whole store
+    (which is serialised at most once every snapshot_interval seconds, and shared between clients), and can
+    then request only the changes since the snapshot's sequence number.
+    """
+
+    # Number of removed sondes to remember, so they can be reported in deltas.
+    REMOVED_HISTORY = 100
+
+    def __init__(self, track_length=20, max_points=2000, recent_points=500, snapshot_interval=2.0):
+        """ Initialise the telemetry store.
+
+        Args:
+            track_length (int): Number of positions held in each sonde's GenericTrack, used to calculate
+                ascent rate, heading and speed.
+            max_points (int): Maximum number of flight path positions to hold per sonde.
+            recent_points (int): Number of recent flight path positions to always hold at full resolution.
+            snapshot_interval (float): Minimum time between re-serialising the snapshot, in seconds.
+        """
+        self.track_length = track_length
+        self.max_points = max_points
+        self.recent_points = recent_points
+        self.snapshot_interval = snapshot_interval
+
+        self.lock = Lock()
+        self.seq = 0
+
+        # Sonde data, keyed by sonde ID. Each entry contains:
+        #   'timestamp': time (unix timestamp) the last packet was received.
+        #   'latest_telem': telemetry dictionary.
+        #   'path': CompactPath of the sonde's flight path.
+        #   'track': GenericTrack, used to determine the current ascent/descent rate, heading and speed.
+        #   'seq': sequence number of the latest update.
+        self.sondes = {}
+
+        # Sequence number at which recently removed sondes were removed, keyed by sonde ID.
+        self.removed = OrderedDict()
+
+        # Cached snapshot: (seq, time generated, serialised JSON)
+        self.snapshot = (-1, 0, "{}")
+
+    def add(self, telemetry):
+        """ Add telemetry to the store, and add the calculated ascent rate, speed and heading to it.
+
+        Args:
+            telemetry (dict): Telemetry dictionary. This is modified and stored, so should be a copy.
+
+        Returns:
+            dict: The telemetry dictionary, with 'vel_v', 'vel_h' and 'heading' calculated from the sonde's track, and
+                the 'datetime_dt' field removed.
+        """
+        _id = telemetry["id"]
+
+        with self.lock:
+            self.seq += 1
+
+            if _id not in self.sondes:
+                self.sondes[_id] = {
+                    "timestamp": time.time(),
+                    "latest_telem": telemetry,
+                    "path": CompactPath(max_points=self.max_points, recent_points=self.recent_points),
+                    "track": GenericTrack(max_elements=self.track_length),
+                    "seq": self.seq,
+                }
+                self.removed.pop(_id, None)
+
+            _sonde = self.sondes[_id]
+
+            _sonde["path"].append(telemetry["lat"], telemetry["lon"], telemetry["alt"])
+
+            # Update the sonde's track and extract the current state.
+            _sonde["track"].add_telemetry(
+                {
+                    "time": telemetry["datetime_dt"],
+                    "lat": telemetry["lat"],
+                    "lon": telemetry["lon"],
+                    "alt": telemetry["alt"],
+                }
+            )
+            _state = _sonde["track"].get_latest_state()
+
+            telemetry["vel_v"] = _state["ascent_rate"]
+            telemetry["vel_h"] = _state["speed"]
+            telemetry["heading"] = _state["heading"]
+
+            # Remove the datetime object that is part of the telemetry, if it exists.
+            # (it might not be present in test data)
+            telemetry.pop("datetime_dt", None)
+
+            _sonde["latest_telem"] = telemetry
+            _sonde["timestamp"] = time.time()
+            _sonde["seq"] = self.seq
+
+        return telemetry
+
+    def clean(self, max_age):
+        """ Remove any sondes which have not been heard from in max_age seconds. """
+        _now = time.time()
+
+        with self.lock:
+            for _id in list(self.sondes.keys()):
+                if (_now - self.sondes[_id]["timestamp"]) > max_age:
+                    self.sondes.pop(_id)
+                    self.seq += 1
+                    self.removed[_id] = self.seq
+                    while len(self.removed) > self.REMOVED_HISTORY:
+                        self.removed.popitem(last=False)
+                    logging.debug("WebExporter - Removed Sonde #%s from archive." % _id)
+
+    def sonde_to_dict(self, sonde, include_path=True):
+        """ Convert a sonde entry to a serialisable dictionary. Must be called with the lock held. """
+        _sonde = {
+            "timestamp": sonde["timestamp"],
+            "latest_telem": sonde["latest_telem"],
+        }
+        if include_path:
+            _sonde["path"] = sonde["path"].to_list()
+
+        return _sonde
+
+    def get_snapshot(self):
+        """ Get a serialised snapshot of the whole store.
+
+        The snapshot is only regenerated if the store has changed, and the current snapshot is more than
+        snapshot_interval seconds old, so many clients loading at once share the same snapshot.
+
+        Returns:
+            tuple: (seq, json) - The sequence number of the snapshot, and the store contents as a JSON string of
+                {sonde_id: {'timestamp', 'latest_telem', 'path'}}
+        """
+        with self.lock:
+            (_seq, _time, _json) = self.snapshot
+            if _seq != self.seq and (time.time() - _time) >= self.snapshot_interval:
+                _store = {_id: self.sonde_to_dict(_sonde) for (_id, _sonde) in self.sondes.items()}
+                self.snapshot = (self.seq, time.time(), json.dumps(_store))
+
+            return (self.snapshot[0], self.snapshot[2])
+
+    def get_delta(self, since):
+        """ Get the changes to the store since a sequence number.
+
+        Args:
+            since (int): Sequence number, as provided with a previous snapshot or delta.
+
+        Returns:
+            dict/None: {'seq': current sequence number, 'sondes': {sonde_id: {'timestamp', 'latest_telem'}},
+                'removed': [sonde_id, ...]}. Flight paths are not included, as clients add new positions to their
+                paths as telemetry arrives. Returns None if the changes are not available (i.e. the client needs a
+                new snapshot).
+        """
+        with self.lock:
+            if since > self.seq:
+                # Sequence number from before a restart.
+                return None
+
+            if len(self.removed) == self.REMOVED_HISTORY and since < next(iter(self.removed.values())):
+                # We may have forgotten about sondes removed since then.
+                return None
+
+            return {
+                "seq": self.seq,
+                "sondes": {
+                    _id: self.sonde_to_dict(_sonde, include_path=False)
+                    for (_id, _sonde) in self.sondes.items()
+                    if _sonde["seq"] > since
+                },
+                "removed": [_id for (_id, _seq) in self.removed.items() if _seq > since],
+            }
+
+    def get_sondes(self):
+        """ Get a copy of the current telemetry and full flight path for each sonde.
+
+        Returns:
+            dict: {sonde_id: {'timestamp', 'latest_telem', 'path'}}
+        """
+        with self.lock:
+            return {_id: self.sonde_to_dict(_sonde) for (_id, _sonde) in self.sondes.items()}
@@ -21,7 +21,7 @@ import numpy as np
 import semver
 import shutil
 from dateutil.parser import parse
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from math import radians, degrees, sin, cos, atan2, sqrt, pi
 from queue import Queue
 from . import __version__ as auto_rx_version
@@ -428,6 +428,47 @@ class AsynchronousFileReader(threading.Thread):
             yield self.queue.get()
 
 
+def parse_iso_datetime(datetime_str):
+    """ Parse a timestamp as produced by the decoders (YYYY-MM-DDTHH:MM:SS[.sss]Z).
+
+    The fixed format is parsed directly, which is much faster than dateutil's parser.
+    Any other timestamp format is passed on to dateutil.
+
+    Args:
+        datetime_str (str): Timestamp string.
+
+    Returns:
+        datetime: Timestamp, as a timezone-aware datetime object.
+    """
+    try:
+        if (
+            (len(datetime_str) >= 20)
+            and (datetime_str[4] == "-")
+            and (datetime_str[7] == "-")
+            and (datetime_str[10] == "T")
+            and (datetime_str[13] == ":")
+            and (datetime_str[16] == ":")
+            and (datetime_str[-1] == "Z")
+        ):
+            _seconds = float(datetime_str[17:-1])
+            _whole_seconds = int(_seconds)
+            return datetime(
+                int(datetime_str[0:4]),
+                int(datetime_str[5:7]),
+                int(datetime_str[8:10]),
+                int(datetime_str[11:13]),
+                int(datetime_str[14:16]),
+                _whole_seconds,
+                int(round((_seconds - _whole_seconds) * 1e6)),
+                tzinfo=timezone.utc,
+            )
+    except ValueError:
+        # Something odd about this timestamp (e.g. 60.000 seconds), let dateutil have a go at it.
+        pass
+
+    return parse(datetime_str)
+
+
 #
 #   Peak Search Utilities, used by the sonde scanning functions.
 #
@@ -1085,6 +1126,72 @@ def position_info(listener, balloon):
     }
 
 
+
+def position_info_array(listener, balloon):
+    """
+    Vectorised version of position_info, operating on arrays of positions.
+
+    listener and balloon are (lat, lon, alt) tuples, where each element may be a scalar or an array.
+    Arrays are broadcast against each other, so a single listener position can be compared against
+    a whole flight path, or consecutive points in a path can be compared against each other.
+
+    Returns a dict with numpy arrays of:
+
+     - angle_at_centre
+     - great_circle_distance
+     - straight_distance
+     - bearing (azimuth or initial course)
+     - elevation (altitude)
+
+    Input and output latitudes, longitudes, angles, bearings and elevations are
+    in degrees, and input altitudes and output distances are in meters.
+    """
+
+    # Earth:
+    radius = 6371000.0
+
+    (lat1, lon1, alt1) = [np.asarray(_x, dtype=np.float64) for _x in listener]
+    (lat2, lon2, alt2) = [np.asarray(_x, dtype=np.float64) for _x in balloon]
+
+    lat1 = np.radians(lat1)
+    lat2 = np.radians(lat2)
+    lon1 = np.radians(lon1)
+    lon2 = np.radians(lon2)
+
+    # See position_info for details of these calculations.
+    d_lon = lon2 - lon1
+    sa = np.cos(lat2) * np.sin(d_lon)
+    sb = (np.cos(lat1) * np.sin(lat2)) - (np.sin(lat1) * np.cos(lat2) * np.cos(d_lon))
+    bearing = np.arctan2(sa, sb)
+    aa = np.sqrt((sa ** 2) + (sb ** 2))
+    ab = (np.sin(lat1) * np.sin(lat2)) + (np.cos(lat1) * np.cos(lat2) * np.cos(d_lon))
+    angle_at_centre = np.arctan2(aa, ab)
+    great_circle_distance = angle_at_centre * radius
+
+    ta = radius + alt1
+    tb = radius + alt2
+    ea = (np.cos(angle_at_centre) * tb) - ta
+    eb = np.sin(angle_at_centre) * tb
+    elevation = np.arctan2(ea, eb)
+
+    # Use cosine rule to find unknown side.
+    distance = np.sqrt((ta ** 2) + (tb ** 2) - 2 * tb * ta * np.cos(angle_at_centre))
+
+    # Give a bearing in range 0 <= b < 2pi
+    bearing = np.where(bearing < 0, bearing + 2 * pi, bearing)
+
+    return {
+        "angle_at_centre": np.degrees(angle_at_centre),
+        "angle_at_centre_radians": angle_at_centre,
+        "bearing": np.degrees(bearing),
+        "bearing_radians": bearing,
+        "great_circle_distance": great_circle_distance,
+        "straight_distance": distance,
+        "elevation": np.degrees(elevation),
+        "elevation_radians": elevation,
+    }
+
+
 if __name__ == "__main__":
     import sys
 
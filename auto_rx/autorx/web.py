@@ -6,7 +6,6 @@
 #   Released under MIT License
 #
 import base64
-import copy
 import datetime
 import glob
 import io
@@ -23,7 +22,7 @@ import autorx
 import autorx.config
 import autorx.rotator
 import autorx.scan
-from autorx.geometry import GenericTrack
+import autorx.scheduler
 from autorx.utils import check_autorx_versions
 from autorx.log_files import (
     list_log_files,
@@ -33,6 +32,8 @@ from autorx.log_files import (
     coordinates_to_kml_placemark,
     path_to_kml_placemark
 )
+from autorx.station_stats import get_station_stats
+from autorx.telemetry_store import TelemetryStore
 from autorx.decode import SondeDecoder
 from queue import Queue
 from threading import Thread
@@ -60,14 +61,26 @@ flask_shutdown_key = None
 # SocketIO instance
 socketio = SocketIO(app, async_mode="threading")
 
+# Number of positions held in each sonde's GenericTrack. This only needs to cover the ascent rate averaging window,
+# as the full flight path is stored separately.
+WEB_TRACK_LENGTH = 20
+
+# Maximum number of flight path positions stored for each sonde. Beyond this, the older part of the
+# flight path is downsampled, with the most recent WEB_PATH_RECENT_POINTS positions kept at full resolution.
+WEB_PATH_MAX_POINTS = 2000
+WEB_PATH_RECENT_POINTS = 500
+
+# Minimum time between re-generating the telemetry archive snapshot sent to newly connected clients, in seconds.
+WEB_SNAPSHOT_INTERVAL = 2.0
+
 # Global store of telemetry data, which we will add data to and manage.
-# Under each key (which will be the sonde ID), we will have a dictionary containing:
-#   'latest_timestamp': timestamp (unix timestamp) of when the last packet was received.
-#   'latest_telem': telemetry dictionary.
-#   'path': list of [lat,lon,alt] pairs
-#   'track': A GenericTrack object, which is used to determine the current ascent/descent rate.
-#
-flask_telemetry_store = {}
+# Contains the latest telemetry and flight path for each sonde (see autorx.telemetry_store).
+flask_telemetry_store = TelemetryStore(
+    track_length=WEB_TRACK_LENGTH,
+    max_points=WEB_PATH_MAX_POINTS,
+    recent_points=WEB_PATH_RECENT_POINTS,
+    snapshot_interval=WEB_SNAPSHOT_INTERVAL,
+)
 
 #
 # Globally called 'emit' function
@@ -94,6 +107,12 @@ def flask_historical():
     return flask.render_template("historical.html")
 
 
+@app.route("/stats.html")
+def flask_stats():
+    """ Render station statistics page """
+    return flask.render_template("stats.html")
+
+
 @app.route("/skewt_test.html")
 def flask_skewt_test():
     """ Render main index page """
@@ -145,6 +164,41 @@ def flask_get_task_list():
     return json.dumps(_sdr_list)
 
 
+@app.route("/get_waterfall")
+def flask_get_waterfall():
+    """ Return the recent scan history for the waterfall plot """
+    if autorx.spectrum_accumulator is None:
+        return json.dumps({"freq_start": 0, "freq_stop": 0, "timestamps": [], "rows": []})
+
+    return json.dumps(autorx.spectrum_accumulator.get_waterfall(), separators=(',', ':'))
+
+
+@app.route("/get_sdr_decisions")
+def flask_get_sdr_decisions():
+    """ Return the recent SDR allocation and pre-emption decisions, oldest first """
+    return json.dumps(list(autorx.scheduler.decisions))
+
+
+@app.route("/get_modem_stats")
+def flask_get_modem_stats():
+    """ Return the modem statistics (and SNR/PPM history) of each running decoder, indexed by frequency """
+    _stats = {}
+    for _task in list(autorx.task_list.keys()):
+        if _task == "SCAN":
+            continue
+
+        try:
+            _decoder_stats = autorx.task_list[_task]["task"].get_modem_stats()
+        except Exception as e:
+            logging.debug("Web - Could not get modem stats for %s - %s" % (str(_task), str(e)))
+            continue
+
+        if _decoder_stats is not None:
+            _stats[str(_task)] = _decoder_stats
+
+    return json.dumps(_stats, separators=(',', ':'))
+
+
 @app.route("/rs.kml")
 def flask_get_kml():
     """ Return KML with autorefresh """
@@ -197,12 +251,14 @@ def flask_get_kml_feed():
         icon=flask.request.url_root + "static/img/antenna-green.png"
     ))
 
-    for rs_id in flask_telemetry_store:
+    _sondes = flask_telemetry_store.get_sondes()
+
+    for rs_id in _sondes:
         try:
             coordinates = []
 
-            for tp in flask_telemetry_store[rs_id]["track"].track_history:
-                coordinates.append((tp[1], tp[2], tp[3]))
+            for tp in _sondes[rs_id]["path"]:
+                coordinates.append((tp[0], tp[1], tp[2]))
 
             rs_data = """\
             {type}/{subtype}
@@ -215,7 +271,7 @@ def flask_get_kml_feed():
             Humidity: {humidity:.1f} %
             Pressure: {pressure:.1f} hPa
             """
-            if flask_telemetry_store[rs_id]["latest_telem"]["vel_v"] > -5:
+            if _sondes[rs_id]["latest_telem"]["vel_v"] > -5:
                 icon = flask.request.url_root + "static/img/balloon-green.png"
             else:
                 icon = flask.request.url_root + "static/img/parachute-green.png"
@@ -229,11 +285,11 @@ def flask_get_kml_feed():
 
             # HAB Placemark
             folder.append(coordinates_to_kml_placemark(
-                flask_telemetry_store[rs_id]["latest_telem"]["lat"],
-                flask_telemetry_store[rs_id]["latest_telem"]["lon"],
-                flask_telemetry_store[rs_id]["latest_telem"]["alt"],
+                _sondes[rs_id]["latest_telem"]["lat"],
+                _sondes[rs_id]["latest_telem"]["lon"],
+                _sondes[rs_id]["latest_telem"]["alt"],
                 name=rs_id,
-                description=rs_data.format(**flask_telemetry_store[rs_id]["latest_telem"]),
+                description=rs_data.format(**_sondes[rs_id]["latest_telem"]),
                 absolute=True,
                 icon=icon
             ))
@@ -254,9 +310,9 @@ def flask_get_kml_feed():
                     autorx.config.global_config["station_alt"],
                 ),
                 (
-                    flask_telemetry_store[rs_id]["latest_telem"]["lat"],
-                    flask_telemetry_store[rs_id]["latest_telem"]["lon"],
-                    flask_telemetry_store[rs_id]["latest_telem"]["alt"],
+                    _sondes[rs_id]["latest_telem"]["lat"],
+                    _sondes[rs_id]["latest_telem"]["lon"],
+                    _sondes[rs_id]["latest_telem"]["alt"],
                 ),
             ]
             folder.append(path_to_kml_placemark(
@@ -295,12 +351,37 @@ def flask_get_scan_data():
 @app.route("/get_telemetry_archive")
 def flask_get_telemetry_archive():
     """ Return a copy of the telemetry archive """
-    # Make a copy of the store, and remove the non-serialisable GenericTrack object
-    _temp_store = copy.deepcopy(flask_telemetry_store)
-    for _element in _temp_store:
-        _temp_store[_element].pop("track")
+    (_seq, _snapshot) = flask_telemetry_store.get_snapshot()
+    return _snapshot
 
-    return json.dumps(_temp_store)
+
+@app.route("/get_telemetry_snapshot")
+def flask_get_telemetry_snapshot():
+    """ Return a copy of the telemetry archive, along with its sequence number (for use with /get_telemetry_delta) """
+    (_seq, _snapshot) = flask_telemetry_store.get_snapshot()
+    # The snapshot is already serialised, so just wrap it.
+    return '{"seq": %d, "sondes": %s}' % (_seq, _snapshot)
+
+
+@app.route("/get_telemetry_delta")
+def flask_get_telemetry_delta():
+    """
+    Return changes to the telemetry archive since a sequence number, provided with the 'since' argument.
+    Flight paths are not included, as the page adds new positions to its paths as telemetry arrives.
+    If the changes are not available, a full snapshot is returned instead, with 'full' set to True.
+    """
+    try:
+        _since = int(request.args.get("since", -1))
+    except ValueError:
+        abort(400)
+
+    _delta = flask_telemetry_store.get_delta(_since)
+    if _delta is None:
+        (_seq, _snapshot) = flask_telemetry_store.get_snapshot()
+        return '{"seq": %d, "sondes": %s, "removed": [], "full": true}' % (_seq, _snapshot)
+
+    _delta["full"] = False
+    return json.dumps(_delta)
 
 
 @app.route("/shutdown/<shutdown_key>")
@@ -323,6 +404,49 @@ def flask_get_log_list():
     """ Return a list of log files, as a list of objects """
     return json.dumps(list_log_files(quicklook=True), separators=(',', ':'))
 
+# Minimum time between automatic updates of the station statistics, in seconds.
+STATION_STATS_UPDATE_INTERVAL = 600
+
+@app.route("/get_station_stats")
+def flask_get_station_stats():
+    """
+    Return the station SNR map and radio horizon data.
+    Any new log files are processed in the background, so the response may not include them yet.
+    Optional arguments: mode ('mean' or 'max'), normalise (0 or 1), norm_range (km)
+    """
+    try:
+        _log_dir = autorx.logging_path
+    except (NameError, AttributeError):
+        _log_dir = "./log/"
+
+    _stats = get_station_stats(
+        _log_dir,
+        (
+            autorx.config.global_config["station_lat"],
+            autorx.config.global_config["station_lon"],
+            autorx.config.global_config["station_alt"],
+        ),
+    )
+
+    if (_stats.last_update is None) or (time.time() - _stats.last_update > STATION_STATS_UPDATE_INTERVAL):
+        _stats.update_in_background()
+
+    _meansnr = request.args.get("mode", "mean") != "max"
+    _normalise = request.args.get("normalise", "1") != "0"
+    try:
+        _norm_range = float(request.args.get("norm_range", 50))
+    except ValueError:
+        abort(400)
+
+    if _norm_range <= 0:
+        abort(400)
+
+    return json.dumps(
+        _stats.to_dict(meansnr=_meansnr, normalise=_normalise, norm_range=_norm_range),
+        separators=(',', ':')
+    )
+
+
 def flask_running():
     global flask_shutdown_key
     return flask_shutdown_key is not None
@@ -493,6 +617,7 @@ def flask_start_decoder():
             logging.info("Web - Got decoder start request: %s, %f" % (_type, _freq))
 
             autorx.scan_results.put([[_freq, _type]])
+            autorx.task_events.put(("scan_results", None))
 
             return "OK"
         else:
@@ -592,10 +717,10 @@ def flask_enable_scanner():
         if (request.form["password"] == autorx.config.web_password) and (
             autorx.config.web_password != "none"
         ):
-            # We re-enable the scanner by clearing the scan_inhibit flag.
-            # This makes it start up on the next run of clean_task_list (approx every 2 seconds)
-            # unless one is already running.
+            # We re-enable the scanner by clearing the scan_inhibit flag, and waking up the task manager,
+            # which will start a scanner unless one is already running.
             autorx.scan_inhibit = False
+            autorx.task_events.put(("scan_enable", None))
             return "OK"
         else:
             abort(403)
@@ -791,7 +916,6 @@ class WebExporter(object):
 
     def handle_telemetry(self, telemetry):
         """ Send incoming telemetry to clients, and add it to the telemetry store. """
-        global flask_telemetry_store
 
         if telemetry == None:
             logging.error("WebExporter - Passed NoneType instead of Telemetry.")
@@ -814,57 +938,18 @@ class WebExporter(object):
             # Convert to MHz.
             _telem["freq"] = "%.3f MHz" % (_freq / 1e3)
 
-        # Add the telemetry information to the global telemetry store
-        if _telem["id"] not in flask_telemetry_store:
-            flask_telemetry_store[_telem["id"]] = {
-                "timestamp": time.time(),
-                "latest_telem": _telem,
-                "path": [],
-                "track": GenericTrack(),
-            }
-
-        flask_telemetry_store[_telem["id"]]["path"].append(
-            [_telem["lat"], _telem["lon"], _telem["alt"]]
-        )
-        flask_telemetry_store[_telem["id"]]["latest_telem"] = _telem
-        flask_telemetry_store[_telem["id"]]["timestamp"] = time.time()
-
-        # Update the sonde's track and extract the current state.
-        flask_telemetry_store[_telem["id"]]["track"].add_telemetry(
-            {
-                "time": _telem["datetime_dt"],
-                "lat": _telem["lat"],
-                "lon": _telem["lon"],
-                "alt": _telem["alt"],
-            }
-        )
-        _telem_state = flask_telemetry_store[_telem["id"]]["track"].get_latest_state()
-
-        # Add the calculated vertical and horizontal velocity, and heading to the telemetry dict.
-        _telem["vel_v"] = _telem_state["ascent_rate"]
-        _telem["vel_h"] = _telem_state["speed"]
-        _telem["heading"] = _telem_state["heading"]
-
-        # Remove the datetime object that is part of the telemetry, if it exists.
-        # (it might not be present in test data)
-        if "datetime_dt" in _telem:
-            _telem.pop("datetime_dt")
+        # Add the telemetry information to the global telemetry store. This also adds the
+        # calculated vertical and horizontal velocity, and heading to the telemetry dict.
+        _telem = flask_telemetry_store.add(_telem)
 
         # Pass it on to the client.
         socketio.emit("telemetry_event", _telem, namespace="/update_status")
 
     def clean_telemetry_store(self):
         """ Remove any old data from the telemetry store """
-        global flask_telemetry_store
-
-        _now = time.time()
-        _telem_ids = list(flask_telemetry_store.keys())
-        for _id in _telem_ids:
-            # If the most recently telemetry is older than self.max_age, remove all data for
-            # that sonde from the archive.
-            if (_now - flask_telemetry_store[_id]["timestamp"]) > self.max_age:
-                flask_telemetry_store.pop(_id)
-                logging.debug("WebExporter - Removed Sonde #%s from archive." % _id)
+        # If the most recently telemetry is older than self.max_age, remove all data for
+        # that sonde from the archive.
+        flask_telemetry_store.clean(self.max_age)
 
     def add(self, telemetry):
         # Add it to the queue if we are running.
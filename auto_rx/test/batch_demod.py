@@ -0,0 +1,293 @@
+#!/usr/bin/env python
+#
+#   Run the test_demod.py processing chains over a set of files in parallel.
+#
+#   Each (processing mode, file) combination is run as a separate job in a process pool.
+#   Results are cached, keyed by a hash of the file contents and the processing command, so
+#   re-running a sweep only processes new files, or modes whose commands have changed.
+#
+#   Per-mode results are written to ./results/<mode>.txt in the same format as test_demod.py --batch,
+#   ready for calc_per.py and plot_per.py, along with a CSV table of all results (./results/batch_results.csv)
+#
+#   Copyright (C) 2018  Mark Jessop <vk5qi@rfhead.net>
+#   Released under GNU GPL v3 or later
+#
+#   Refer to the README.md in this directory for instructions on use.
+#
+import argparse
+import csv
+import glob
+import hashlib
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+import subprocess
+
+import numpy as np
+
+from calc_per import calculate_per_thrshold
+from test_demod import processing_type, batch_modes, build_command
+
+
+RESULTS_DIR = "./results"
+
+# Cache of previous results, one JSON object per line.
+CACHE_FILE = os.path.join(RESULTS_DIR, "batch_cache.jsonl")
+
+# Table of results from the last run.
+RESULTS_FILE = os.path.join(RESULTS_DIR, "batch_results.csv")
+
+# Placeholder for the filename in the cached command string, so the same file under a different name still
+# hits the cache.
+FILE_PLACEHOLDER = "<file>"
+
+
+def hash_file(filename, blocksize=1<<20):
+    """ Calculate the SHA256 hash of a file's contents """
+    _hash = hashlib.sha256()
+    with open(filename, 'rb') as _f:
+        for _block in iter(lambda: _f.read(blocksize), b''):
+            _hash.update(_block)
+
+    return _hash.hexdigest()
+
+
+def load_cache(filename=CACHE_FILE):
+    """ Read in cached results, keyed by (file hash, command) """
+    _cache = {}
+
+    if not os.path.exists(filename):
+        return _cache
+
+    with open(filename, 'r') as _f:
+        for _line in _f:
+            try:
+                _result = json.loads(_line)
+                _cache[(_result['file_hash'], _result['command'])] = _result
+            except Exception:
+                # Probably a partial line from an interrupted run.
+                continue
+
+    return _cache
+
+
+def run_job(job):
+    """ Run a single processing command. This runs in a worker process.
+
+    Processing chains which write demodulator statistics to stats.txt are given their own statistics file,
+    so parallel jobs don't overwrite each other's output.
+    """
+    (_mode, _file, _cmd) = job
+
+    (_fd, _stats_file) = tempfile.mkstemp(prefix="stats_", suffix=".txt", dir=RESULTS_DIR)
+    os.close(_fd)
+    _cmd = _cmd.replace("2>stats.txt", "2>%s" % _stats_file)
+
+    _start_cpu = os.times()
+    _start = time.time()
+    try:
+        _output = subprocess.check_output(_cmd, shell=True, stderr=None)
+        _output = _output.decode().strip()
+    except:
+        _output = "error"
+
+    _runtime = time.time() - _start
+    _end_cpu = os.times()
+
+    os.remove(_stats_file)
+
+    # CPU time of the whole shell pipeline (all processes are children of the shell, which we wait for).
+    _cpu_time = (_end_cpu.children_user - _start_cpu.children_user) + (_end_cpu.children_system - _start_cpu.children_system)
+
+    return (_mode, _file, _output, _runtime, _cpu_time)
+
+
+def packet_count(output):
+    """ Get the packet count from a job output, or None if the mode does not output a count """
+    try:
+        return int(output)
+    except ValueError:
+        return None
+
+
+def file_snr(filename):
+    """ Extract the Eb/No from a generated file name (e.g. rs41_96k_float_12.5dB.bin), or None if not present """
+    try:
+        return float(os.path.basename(filename).split('_')[-1].split('dB.bin')[0])
+    except ValueError:
+        return None
+
+
+def run_batch(modes, file_mask=None, shift=0.0, workers=None, use_cache=True, dry_run=False, quick=False):
+    """ Run all the supplied modes over their files, in parallel.
+
+    Returns a dictionary of results, keyed by mode, each a list of result dicts sorted by filename.
+    """
+
+    # Work out the file x mode matrix.
+    _jobs = []
+    for _mode in modes:
+        _mask = file_mask if file_mask is not None else processing_type[_mode]['files']
+        _file_list = sorted(glob.glob(_mask))
+
+        if len(_file_list) == 0:
+            print("%s: No files found matching %s" % (_mode, _mask))
+            continue
+
+        if quick:
+            _file_list = [_file_list[-1]]
+
+        for _file in _file_list:
+            _jobs.append((_mode, _file, build_command(_mode, _file, shift=shift)))
+
+    if dry_run:
+        for (_mode, _file, _cmd) in _jobs:
+            print("Command: %s" % _cmd)
+        return {}
+
+    # Hash each file once, no matter how many modes use it.
+    _hashes = {}
+    for (_mode, _file, _cmd) in _jobs:
+        if _file not in _hashes:
+            _hashes[_file] = hash_file(_file)
+
+    def _cache_key(mode, filename):
+        return (_hashes[filename], build_command(mode, FILE_PLACEHOLDER, shift=shift))
+
+    _cache = load_cache() if use_cache else {}
+
+    _results = {}
+    _pending = []
+    for (_mode, _file, _cmd) in _jobs:
+        _key = _cache_key(_mode, _file)
+        if _key in _cache:
+            _result = dict(_cache[_key])
+            _result['file'] = _file
+            _result['cached'] = True
+            _results.setdefault(_mode, []).append(_result)
+        else:
+            _pending.append((_mode, _file, _cmd))
+
+    print("%d jobs, %d cached, running %d jobs with %d workers." % (len(_jobs), len(_jobs) - len(_pending), len(_pending), workers or multiprocessing.cpu_count()))
+
+    _start = time.time()
+    _cache_file = open(CACHE_FILE, 'a')
+
+    with multiprocessing.Pool(processes=workers) as _pool:
+        for (_mode, _file, _output, _runtime, _cpu_time) in _pool.imap_unordered(run_job, _pending):
+            (_file_hash, _command) = _cache_key(_mode, _file)
+            _result = {
+                'mode': _mode,
+                'file': _file,
+                'output': _output,
+                'runtime': _runtime,
+                'cpu_time': _cpu_time,
+                'file_hash': _file_hash,
+                'command': _command,
+            }
+
+            print("%s: %s, %s, %.3f" % (_mode, os.path.basename(_file), _output, _runtime))
+
+            # Don't cache failures, in case they were due to a missing binary.
+            if _output != "error":
+                _cache_file.write(json.dumps(_result) + '\n')
+                _cache_file.flush()
+
+            _result['cached'] = False
+            _results.setdefault(_mode, []).append(_result)
+
+    _cache_file.close()
+
+    print("Processing took %.1f seconds." % (time.time() - _start))
+
+    for _mode in _results:
+        _results[_mode].sort(key=lambda _r: _r['file'])
+
+    return _results
+
+
+def write_results(results):
+    """ Write out per-mode results files (for calc_per.py and plot_per.py), and a table of all results """
+
+    for _mode in results:
+        with open(os.path.join(RESULTS_DIR, _mode + ".txt"), 'w') as _log:
+            for _result in results[_mode]:
+                _log.write("%s, %s, %.3f\n" % (os.path.basename(_result['file']), _result['output'], _result['runtime']))
+
+    with open(RESULTS_FILE, 'w', newline='') as _f:
+        _writer = csv.writer(_f)
+        _writer.writerow(['mode', 'file', 'snr', 'packets', 'output', 'runtime', 'cpu_time', 'cached'])
+        for _mode in results:
+            for _result in results[_mode]:
+                _writer.writerow([
+                    _mode,
+                    os.path.basename(_result['file']),
+                    file_snr(_result['file']),
+                    packet_count(_result['output']),
+                    _result['output'],
+                    "%.3f" % _result['runtime'],
+                    "%.3f" % _result['cpu_time'],
+                    _result['cached']
+                ])
+
+
+def print_summary(results, threshold=0.5):
+    """ Print the runtime and CPU time used by each mode, and the Eb/No at which the PER crosses the threshold """
+
+    print("mode, files, runtime, cpu_time, per_threshold_ebno")
+    for _mode in sorted(results.keys()):
+        _runtime = sum([_r['runtime'] for _r in results[_mode]])
+        _cpu_time = sum([_r['cpu_time'] for _r in results[_mode]])
+
+        # Only the packet-counting modes, run over the generated low-SNR files, have a PER.
+        _points = [(file_snr(_r['file']), packet_count(_r['output'])) for _r in results[_mode]]
+        _points = [_p for _p in _points if (_p[0] is not None) and (_p[1] is not None)]
+
+        _threshold = "N/A"
+        if len(_points) > 1:
+            _points.sort()
+            _snrs = np.array([_p[0] for _p in _points])
+            _packets = np.array([_p[1] for _p in _points])
+            if np.max(_packets) > 0:
+                # As with plot_per.py, assume the highest packet count is the total number of packets.
+                _snr = calculate_per_thrshold(_snrs, _packets, expected_packets=np.max(_packets), threshold=threshold)
+                if len(_snr) > 0:
+                    _threshold = "%.2f" % _snr[0]
+
+        print("%s, %d, %.1f, %.1f, %s" % (_mode, len(results[_mode]), _runtime, _cpu_time, _threshold))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-m", "--mode", type=str, default=None, help="Comma-separated list of operation modes. Default is the same set of modes as test_demod.py --batch.")
+    parser.add_argument("-f", "--files", type=str, default=None, help="Glob-path to files to run over. Default is each mode's set of files.")
+    parser.add_argument("-w", "--workers", type=int, default=None, help="Number of parallel jobs. Default is the number of CPUs.")
+    parser.add_argument("-d", "--dry-run", action='store_true', default=False, help="Show the commands which would be run.")
+    parser.add_argument("--shift", type=float, default=0.0, help="Shift the signal-under test by x Hz. Default is 0.")
+    parser.add_argument("--no-cache", action='store_true', default=False, help="Re-run all jobs, ignoring any cached results.")
+    parser.add_argument("--quick", action='store_true', default=False, help="Only process the last sample file for each mode (usually the strongest).")
+    parser.add_argument("--threshold", type=float, default=0.5, help="PER Threshold for the summary.")
+    args = parser.parse_args()
+
+    if args.mode is None:
+        _modes = batch_modes
+    else:
+        _modes = args.mode.split(',')
+
+    for _mode in _modes:
+        if _mode not in processing_type:
+            print("Error - invalid operating mode %s." % _mode)
+            print("Valid Modes: %s" % str(processing_type.keys()))
+            sys.exit(1)
+
+    if not os.path.isdir(RESULTS_DIR):
+        os.makedirs(RESULTS_DIR)
+
+    _results = run_batch(_modes, file_mask=args.files, shift=args.shift, workers=args.workers, use_cache=not args.no_cache, dry_run=args.dry_run, quick=args.quick)
+
+    if len(_results) > 0:
+        write_results(_results)
+        print_summary(_results, threshold=args.threshold)
@@ -0,0 +1,419 @@
+#!/usr/bin/env python
+#
+#   Benchmark the dft_detect modes used by the scanner against a directory of recorded captures.
+#
+#   Each capture is converted (once - the converted fixtures are cached) into the sample format used by each
+#   detection mode in autorx.scan.DETECT_MODES, and then run through dft_detect for each of the supplied dwell times,
+#   in parallel. The detection rate, correlation scores, frequency offset estimate error and runtime are reported
+#   for each mode and dwell time, and a table of all results is written to ./results/detect_benchmark.csv
+#
+#   Supported captures:
+#    *.bin - 96 kHz complex float IQ, as used in ./samples/ and produced by generate_lowsnr.py
+#    detect_IQ_<freq>_<rate>_<sdr>.raw - 16-bit IQ, as saved by the scanner when save_detection_audio is enabled.
+#    detect_audio_<freq>_<sdr>.wav - FM audio, as saved by the scanner when save_detection_audio is enabled.
+#
+#   The expected sonde type for each capture is taken from the start of the filename (e.g. rs41_96k_float_10.0dB.bin),
+#   or can be provided in a fixtures.json file within the capture directory, e.g.:
+#   {"detect_IQ_401500000_48000_0.raw": {"type": "RS41", "offset": 1200.0}}
+#   Captures expected to contain no sonde (e.g. noise samples) should have a type of null.
+#
+#   Copyright (C) 2018  Mark Jessop <vk5qi@rfhead.net>
+#   Released under GNU GPL v3 or later
+#
+#   Refer to the README.md in this directory for instructions on use.
+#
+import argparse
+import csv
+import glob
+import json
+import os
+import subprocess
+import sys
+import time
+import wave
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from autorx.scan import DETECT_MODES, get_dft_detect_command, parse_dft_detect_output
+
+
+RESULTS_FILE = "./results/detect_benchmark.csv"
+
+# Converted fixtures are stored in this directory, within the capture directory.
+CACHE_DIR = ".detect_cache"
+
+# Sample rate of the *.bin captures.
+BIN_SAMPLE_RATE = 96000
+
+# Number of input samples to process at a time when converting captures.
+BLOCK_SIZE = 96000
+
+# Expected sonde type (as returned by detect_sonde), based on the start of the capture filename.
+# Longer prefixes need to be listed before shorter prefixes which also match (i.e. imet54 before imet4)
+FILENAME_TYPES = [
+    ('rs41', 'RS41'),
+    ('rs92', 'RS92'),
+    ('rsngp', 'RS92'),
+    ('dfm', 'DFM'),
+    ('m10', 'M10'),
+    ('m20', 'M20'),
+    ('imet54', 'IMET5'),
+    ('imet4', 'IMET'),
+    ('lms6-400', 'LMS6'),
+    ('lms6-1680', 'MK2LMS'),
+    ('mrz', 'MRZ'),
+    ('mts01', 'MTS01'),
+    ('noise', None),
+]
+
+PERCENTILES = [10, 50, 90]
+
+
+def lowpass_taps(cutoff, num_taps=63):
+    """ Windowed-sinc lowpass filter. cutoff is a fraction of the sample rate """
+    _n = np.arange(num_taps) - (num_taps - 1) / 2.0
+    _taps = np.sinc(2 * cutoff * _n) * np.hamming(num_taps)
+    return _taps / np.sum(_taps)
+
+
+class Decimator(object):
+    """ Lowpass filter and decimate a stream of samples, in blocks. """
+
+    def __init__(self, factor, num_taps=63):
+        self.factor = factor
+        self.taps = lowpass_taps(0.45 / factor, num_taps)
+        self.history = None
+        self.phase = 0
+
+    def process(self, samples):
+        if self.factor == 1:
+            return samples
+
+        if self.history is None:
+            self.history = np.zeros(len(self.taps) - 1, dtype=samples.dtype)
+
+        _samples = np.concatenate((self.history, samples))
+        self.history = _samples[-(len(self.taps) - 1):]
+        _filtered = np.convolve(_samples, self.taps, mode='valid')
+
+        # Keep the decimation phase consistent across blocks.
+        _output = _filtered[self.phase::self.factor]
+        self.phase = (self.phase - len(_filtered)) % self.factor
+        return _output
+
+
+def read_capture(filename):
+    """ Memory-map a capture.
+
+    Returns:
+        tuple: (format, sample_rate, samples) where format is 'iq' or 'audio', and samples is a numpy memmap.
+    """
+    _name = os.path.basename(filename)
+
+    if _name.endswith('.bin'):
+        return ('iq', BIN_SAMPLE_RATE, np.memmap(filename, dtype='c8', mode='r'))
+
+    elif _name.startswith('detect_IQ_') and _name.endswith('.raw'):
+        _rate = int(_name.split('_')[3])
+        _samples = np.memmap(filename, dtype='<i2', mode='r')
+        # Interleaved I/Q samples. The complex conversion is done per block, when the capture is converted.
+        return ('iq', _rate, _samples[:len(_samples) - (len(_samples) % 2)])
+
+    elif _name.startswith('detect_audio_') and _name.endswith('.wav'):
+        with wave.open(filename, 'rb') as _wav:
+            _rate = _wav.getframerate()
+            _offset = os.path.getsize(filename) - _wav.getnframes() * _wav.getsampwidth() * _wav.getnchannels()
+        return ('audio', _rate, np.memmap(filename, dtype='<i2', mode='r', offset=_offset))
+
+    return (None, None, None)
+
+
+def iq_blocks(capture_rate, samples):
+    """ Iterate over a memory-mapped IQ capture in blocks of complex samples """
+    if samples.dtype == np.int16:
+        # Interleaved 16-bit I/Q
+        for _i in range(0, len(samples), 2 * BLOCK_SIZE):
+            _block = samples[_i:_i + 2 * BLOCK_SIZE].astype(np.float32) / 32768.0
+            yield _block[0::2] + 1j * _block[1::2]
+    else:
+        for _i in range(0, len(samples), BLOCK_SIZE):
+            yield np.asarray(samples[_i:_i + BLOCK_SIZE])
+
+
+def convert_capture(filename, detect_mode, shift=0.0):
+    """ Convert a capture into the sample format used by a detection mode, caching the result.
+
+    IQ modes are provided with 16-bit IQ at the mode's sample rate. FM modes are provided with FM-demodulated
+    16-bit audio, in a wav file.
+
+    Returns:
+        str: Path to the converted fixture, or None if the capture cannot be used with this mode.
+    """
+    (_format, _rate, _samples) = read_capture(filename)
+    if _format is None:
+        return None
+
+    _mode = DETECT_MODES[detect_mode]
+    _output_rate = _mode['sample_rate']
+
+    if _format == 'audio':
+        # We can only use pre-demodulated audio directly with FM modes.
+        if _mode['mode'] == 'FM' and _rate == _output_rate and shift == 0.0:
+            return filename
+        return None
+
+    # Only integer decimation is supported.
+    if _rate % _output_rate != 0:
+        return None
+
+    _cache_dir = os.path.join(os.path.dirname(filename), CACHE_DIR)
+    if not os.path.isdir(_cache_dir):
+        os.makedirs(_cache_dir)
+
+    _output_name = os.path.join(
+        _cache_dir,
+        "%s_%s_%d_%+.0f.%s" % (os.path.basename(filename), _mode['mode'], _output_rate, shift, 'wav' if _mode['mode'] == 'FM' else 'raw')
+    )
+
+    if os.path.exists(_output_name) and os.path.getmtime(_output_name) >= os.path.getmtime(filename):
+        return _output_name
+
+    _decimator = Decimator(_rate // _output_rate)
+    _sample_index = 0
+    _last_sample = None
+
+    _tmp_name = _output_name + ".tmp"
+
+    if _mode['mode'] == 'FM':
+        _output = wave.open(_tmp_name, 'wb')
+        _output.setnchannels(1)
+        _output.setsampwidth(2)
+        _output.setframerate(_output_rate)
+    else:
+        _output = open(_tmp_name, 'wb')
+
+    for _block in iq_blocks(_rate, _samples):
+        if shift != 0.0:
+            _n = np.arange(_sample_index, _sample_index + len(_block))
+            _block = _block * np.exp(2j * np.pi * shift * _n / _rate)
+        _sample_index += len(_block)
+
+        if _mode['mode'] == 'FM':
+            # Quadrature FM demodulation, at the capture sample rate.
+            if _last_sample is None:
+                _last_sample = _block[0]
+            _audio = np.angle(_block * np.conj(np.concatenate(([_last_sample], _block[:-1]))))
+            _last_sample = _block[-1]
+
+            # Decimate, and remove any DC offset (approximating the scanner's 20 Hz highpass filter).
+            _audio = _decimator.process(_audio)
+            _audio = _audio - np.mean(_audio)
+            _output.writeframes(np.clip(_audio * (32767 / np.pi), -32768, 32767).astype('<i2').tobytes())
+        else:
+            _block = _decimator.process(_block)
+            _iq = np.empty(2 * len(_block), dtype=np.float32)
+            _iq[0::2] = _block.real
+            _iq[1::2] = _block.imag
+            _output.write(np.clip(_iq * 32768, -32768, 32767).astype('<i2').tobytes())
+
+    _output.close()
+    os.rename(_tmp_name, _output_name)
+
+    return _output_name
+
+
+def expected_result(filename, fixtures, shift=0.0):
+    """ Get the expected sonde type and frequency offset for a capture.
+
+    Returns:
+        tuple: (known, type, offset). known is False if the expected type could not be determined.
+    """
+    _name = os.path.basename(filename)
+
+    if _name in fixtures:
+        return (True, fixtures[_name].get('type', None), fixtures[_name].get('offset', 0.0) + shift)
+
+    for (_prefix, _type) in FILENAME_TYPES:
+        if _name.lower().startswith(_prefix):
+            return (True, _type, shift)
+
+    return (False, None, shift)
+
+
+def file_snr(filename):
+    """ Extract the Eb/No from a generated file name (e.g. rs41_96k_float_12.5dB.bin), or None if not present """
+    try:
+        return float(os.path.basename(filename).split('_')[-1].split('dB.bin')[0])
+    except ValueError:
+        return None
+
+
+def run_detect(job):
+    """ Run dft_detect over a converted fixture.
+
+    Returns:
+        dict: The job, updated with the detected sonde type, score and offset estimate, runtime and CPU time.
+    """
+    _cmd = get_dft_detect_command(job['mode'], rs_path=job['rs_path'], dwell_time=job['dwell'])
+
+    _start = time.time()
+    with open(job['fixture'], 'rb') as _input:
+        _process = subprocess.Popen(_cmd, shell=True, stdin=_input, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        _output = _process.stdout.read().decode()
+        # Use wait4 to get the CPU time used by this particular process.
+        (_pid, _status, _rusage) = os.wait4(_process.pid, 0)
+        _process.returncode = os.waitstatus_to_exitcode(_status)
+
+    job['runtime'] = time.time() - _start
+    job['cpu_time'] = _rusage.ru_utime + _rusage.ru_stime
+
+    job['detected'] = None
+    job['score'] = None
+    job['offset'] = None
+
+    # dft_detect returns a code of 1 if no sonde is detected.
+    if _process.returncode >= 2 and _output.strip() != "":
+        (_type, _offset) = parse_dft_detect_output(_output)
+        # Negative types indicate an inverted signal, which the scanner treats as no detection.
+        if _type is not None and not _type.startswith('-'):
+            job['detected'] = _type
+            # dft_detect only provides a frequency offset estimate when operating on IQ.
+            if DETECT_MODES[job['mode']]['mode'] == 'IQ':
+                job['offset'] = _offset
+        try:
+            job['score'] = float(_output.strip().split('\n')[0].split(':')[1].split(',')[0])
+        except (IndexError, ValueError):
+            pass
+
+    return job
+
+
+def summarise(values):
+    """ Format a set of values as 'mean (p10/p50/p90)' """
+    if len(values) == 0:
+        return "N/A"
+
+    _percentiles = np.percentile(values, PERCENTILES)
+    return "%.3f (%s)" % (np.mean(values), "/".join(["%.3f" % _p for _p in _percentiles]))
+
+
+def print_summary(results):
+    """ Print detection statistics for each detection mode and dwell time """
+
+    _groups = {}
+    for _result in results:
+        _groups.setdefault((_result['mode'], _result['dwell']), []).append(_result)
+
+    for (_mode, _dwell) in sorted(_groups.keys()):
+        _results = _groups[(_mode, _dwell)]
+
+        _known = [_r for _r in _results if _r['known']]
+        _sondes = [_r for _r in _known if _r['expected'] is not None]
+        _correct = [_r for _r in _sondes if _r['detected'] == _r['expected']]
+        _wrong = [_r for _r in _known if _r['detected'] is not None and _r['detected'] != _r['expected']]
+
+        print("%s, dwell %d s:" % (_mode, _dwell))
+        print("  Captures: %d (%d with an expected sonde type)" % (len(_results), len(_sondes)))
+        print("  Detections: %d" % len([_r for _r in _results if _r['detected'] is not None]))
+        if len(_sondes) > 0:
+            print("  Detection rate: %.1f%% (%d/%d)" % (100.0 * len(_correct) / len(_sondes), len(_correct), len(_sondes)))
+        print("  Wrong type / false detections: %d" % len(_wrong))
+        print("  Score (correct): %s" % summarise([abs(_r['score']) for _r in _correct if _r['score'] is not None]))
+        print("  Score (wrong): %s" % summarise([abs(_r['score']) for _r in _wrong if _r['score'] is not None]))
+        print("  Offset error (Hz): %s" % summarise([abs(_r['offset'] - _r['expected_offset']) for _r in _correct if _r['offset'] is not None]))
+        print("  Runtime (s): %s, total %.1f" % (summarise([_r['runtime'] for _r in _results]), sum([_r['runtime'] for _r in _results])))
+        print("  CPU time (s): %s, total %.1f" % (summarise([_r['cpu_time'] for _r in _results]), sum([_r['cpu_time'] for _r in _results])))
+
+
+def write_results(results, filename=RESULTS_FILE):
+    """ Write a table of all detection results """
+    with open(filename, 'w', newline='') as _f:
+        _writer = csv.writer(_f)
+        _writer.writerow(['mode', 'dwell', 'file', 'snr', 'expected', 'detected', 'score', 'offset', 'offset_error', 'runtime', 'cpu_time'])
+        for _r in results:
+            _writer.writerow([
+                _r['mode'],
+                _r['dwell'],
+                os.path.basename(_r['file']),
+                file_snr(_r['file']),
+                _r['expected'] if _r['known'] else "?",
+                _r['detected'],
+                _r['score'],
+                _r['offset'],
+                (_r['offset'] - _r['expected_offset']) if _r['offset'] is not None else None,
+                "%.3f" % _r['runtime'],
+                "%.3f" % _r['cpu_time'],
+            ])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-d", "--directory", type=str, default="./generated", help="Directory of captures. Default: ./generated")
+    parser.add_argument("-f", "--files", type=str, default="*", help="Glob of capture filenames within the directory. Default: *")
+    parser.add_argument("-m", "--mode", type=str, default=",".join(DETECT_MODES.keys()), help="Comma-separated list of detection modes. Default: %s" % ",".join(DETECT_MODES.keys()))
+    parser.add_argument("-t", "--dwell", type=str, default="5,10", help="Comma-separated list of dwell times to test, in seconds. Default: 5,10")
+    parser.add_argument("-w", "--workers", type=int, default=os.cpu_count(), help="Number of dft_detect instances to run in parallel. Default: number of CPUs.")
+    parser.add_argument("--shift", type=float, default=0.0, help="Shift IQ captures by x Hz before detection. Default is 0.")
+    parser.add_argument("--rs-path", type=str, default="../", help="Path to dft_detect. Default: ../")
+    args = parser.parse_args()
+
+    _modes = args.mode.split(',')
+    for _mode in _modes:
+        if _mode not in DETECT_MODES:
+            print("Error - invalid detection mode %s." % _mode)
+            print("Valid Modes: %s" % ", ".join(DETECT_MODES.keys()))
+            sys.exit(1)
+
+    _dwells = [int(_d) for _d in args.dwell.split(',')]
+
+    _fixtures = {}
+    _fixtures_file = os.path.join(args.directory, "fixtures.json")
+    if os.path.exists(_fixtures_file):
+        with open(_fixtures_file, 'r') as _f:
+            _fixtures = json.load(_f)
+
+    _files = sorted(glob.glob(os.path.join(args.directory, args.files)))
+
+    # Generate the converted fixtures, and the list of detection jobs.
+    _jobs = []
+    _start = time.time()
+    for _file in _files:
+        (_known, _expected, _expected_offset) = expected_result(_file, _fixtures, args.shift)
+
+        for _mode in _modes:
+            _fixture = convert_capture(_file, _mode, shift=args.shift)
+            if _fixture is None:
+                continue
+
+            for _dwell in _dwells:
+                _jobs.append({
+                    'file': _file,
+                    'fixture': _fixture,
+                    'mode': _mode,
+                    'dwell': _dwell,
+                    'rs_path': args.rs_path,
+                    'known': _known,
+                    'expected': _expected,
+                    'expected_offset': _expected_offset,
+                })
+
+    if len(_jobs) == 0:
+        print("No usable captures found.")
+        sys.exit(1)
+
+    print("Prepared %d fixtures in %.1f seconds, running %d detections with %d workers." % (
+        len(set([_j['fixture'] for _j in _jobs])), time.time() - _start, len(_jobs), args.workers))
+
+    _start = time.time()
+    with ThreadPoolExecutor(max_workers=args.workers) as _pool:
+        _results = list(_pool.map(run_detect, _jobs))
+
+    print("Detection took %.1f seconds.\n" % (time.time() - _start))
+
+    print_summary(_results)
+
+    if not os.path.isdir(os.path.dirname(RESULTS_FILE)):
+        os.makedirs(os.path.dirname(RESULTS_FILE))
+    write_results(_results)
@@ -748,6 +748,33 @@ processing_type['dft_detect_iq_wb'] = {
 }
 
 
+# Modes run by --batch
+#batch_modes = ['dfm_fsk_demod_soft', 'rs41_fsk_demod_soft', 'm10_fsk_demod_soft', 'rs92_fsk_demod_soft', 'rs92ngp_fsk_demod_soft', 'lms6-400_fsk_demod_soft', 'imet4_rtlfm', 'mrz_fsk_demod_soft', 'imet54_fsk_demod_soft']
+batch_modes = ['dfm_fsk_demod_soft_centre', 'rs41_fsk_demod_soft_centre', 'm10_fsk_demod_soft_centre', 'rs92_fsk_demod_soft_centre', 'rs92ngp_fsk_demod_soft_centre', 'lms6-400_fsk_demod_soft_centre', 'imet4_iq', 'mrz_fsk_demod_soft_centre', 'imet54_fsk_demod_soft_centre', 'm20_fsk_demod_soft_centre']
+
+
+def build_command(mode, filename, shift=0.0, show=False):
+    """ Generate the shell command to process a file with a given processing mode """
+
+    _mode = processing_type[mode]
+
+    _cmd = "cat %s "%filename
+
+    # Add in an optional frequency error if supplied.
+    if shift != 0.0:
+        _cmd += "| csdr shift_addition_cc %.5f 2>/dev/null" % (shift/96000.0)
+
+    # Add on the rest of the demodulation and decoding commands.
+    _cmd += _mode['demod'] + _mode['decode'] 
+    
+    if show:
+        _cmd += " | head -n 10"
+    else:
+        _cmd += _mode['post_process']
+
+    return _cmd
+
+
 def run_analysis(mode, file_mask=None, shift=0.0, verbose=False, log_output = None, dry_run = False, quick=False, show=False):
 
 
@@ -772,30 +799,13 @@ def run_analysis(mode, file_mask=None, shift=0.0, verbose=False, log_output = No
 
     _first = True
 
-    # Calculate the frequency offset to apply, if defined.
-    _shiftcmd = "| csdr shift_addition_cc %.5f 2>/dev/null" % (shift/96000.0)
-
     if log_output is not None:
         _log = open(log_output,'w')
 
     # Iterate over the files in the supplied list.
     for _file in _file_list:
 
-        # Generate the command to run.
-        _cmd = "cat %s "%_file 
-
-        # Add in an optional frequency error if supplied.
-        if shift != 0.0:
-            _cmd += _shiftcmd
-
-        # Add on the rest of the demodulation and decoding commands.
-        _cmd += _mode['demod'] + _mode['decode'] 
-        
-        if args.show:
-            _cmd += " | head -n 10"
-        else:
-            _cmd += _mode['post_process']
-
+        _cmd = build_command(mode, _file, shift=shift, show=show)
 
         if _first or dry_run:
             print("Command: %s" % _cmd)
@@ -849,9 +859,6 @@ if __name__ == "__main__":
         sys.exit(1)
 
 
-    #batch_modes = ['dfm_fsk_demod_soft', 'rs41_fsk_demod_soft', 'm10_fsk_demod_soft', 'rs92_fsk_demod_soft', 'rs92ngp_fsk_demod_soft', 'lms6-400_fsk_demod_soft', 'imet4_rtlfm', 'mrz_fsk_demod_soft', 'imet54_fsk_demod_soft']
-    batch_modes = ['dfm_fsk_demod_soft_centre', 'rs41_fsk_demod_soft_centre', 'm10_fsk_demod_soft_centre', 'rs92_fsk_demod_soft_centre', 'rs92ngp_fsk_demod_soft_centre', 'lms6-400_fsk_demod_soft_centre', 'imet4_iq', 'mrz_fsk_demod_soft_centre', 'imet54_fsk_demod_soft_centre', 'm20_fsk_demod_soft_centre']
-
     if args.batch:
         for _mode in batch_modes:
             _log_name = "./results/" + _mode + ".txt"